@@ -186,8 +186,13 @@ function on_message(event) {
     }
     catch(e){
         console.error("Not a valid JSON message : " + e)
+        return
+    }
+    // Several events may be batched into one frame as an array
+    var messages = Array.isArray(message) ? message : [message]
+    for (var i = 0; i < messages.length; i++) {
+        "RemotePolling" !== messages[i].event && parser_json(messages[i])
     }
-    "RemotePolling" !== message.event && parser_json(message)
 }
 
 function on_error(event) {
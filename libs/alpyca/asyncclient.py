@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# asyncclient - asyncio client for ASCOM Alpaca devices
+#
+# Part of the Alpyca application interface package
+#
+# Python Compatibility: Requires Python 3.7 or later
+#
+# -----------------------------------------------------------------------------
+# MIT License
+#
+# Copyright (c) 2022 Ethan Chappel and Bob Denny
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# -----------------------------------------------------------------------------
+# Edit History:
+# 19-Oct-26 Initial Edit. The same members as the blocking classes, e.g.
+#           await cam.get("CCDTemperature"), over one keep-alive pool per
+#           event loop, with a blocking facade running its own loop thread.
+# 19-Oct-26 A keep-alive response without a length is an AlpacaProtocolError
+#           instead of a read until the server closes the connection.
+# -----------------------------------------------------------------------------
+
+import asyncio
+from itertools import count
+import json
+from secrets import randbelow
+import ssl
+import threading
+from typing import Dict, List, Tuple
+from urllib.parse import urlencode
+import weakref
+
+from libs.alpyca.exceptions import NotImplementedException,InvalidValueException,ValueNotSetException,NotConnectedException,ParkedException,SlavedException,InvalidOperationException,ActionNotImplementedException,DriverException,AlpacaRequestException     # Sorry Python purists
+
+API_VERSION = 1
+# Connections kept open per Alpaca server
+POOL_SIZE = 8
+
+_ERRORS = {
+    0x0400: NotImplementedException,
+    0x0401: InvalidValueException,
+    0x0402: ValueNotSetException,
+    0x0407: NotConnectedException,
+    0x0408: ParkedException,
+    0x0409: SlavedException,
+    0x040B: InvalidOperationException,
+    0x040C: ActionNotImplementedException,
+}
+
+_client_id = randbelow(65535)
+# next() of itertools.count is atomic
+_client_trans_ids = count(1)
+
+class AlpacaProtocolError(Exception):
+    """The response of the Alpaca server can not be read, e.g. a keep-alive body without a length"""
+
+def check_alpaca_error(j: dict) -> dict:
+    """Raise the ASCOM exception of an Alpaca JSON response.
+
+    Args:
+        j (dict): Decoded JSON response.
+
+    Returns:
+        The response if ErrorNumber is 0.
+
+    """
+    n = j.get("ErrorNumber", 0)
+    if n != 0:
+        m = j.get("ErrorMessage", "")
+        exception = _ERRORS.get(n)
+        if exception is not None:
+            raise exception(m)
+        # Unassigned numbers are DriverException too, as in Device
+        raise DriverException(n, m)
+    return j
+
+def split_address(address: str) -> Tuple[str, int]:
+    """Split "host:port", "[ipv6]:port" or "host" (port 80)."""
+    if address.startswith('['):
+        host, _sep, rest = address[1:].partition(']')
+        host = host.split('%')[0]
+        port = rest[1:] if rest.startswith(':') else ''
+    elif address.count(':') == 1:
+        host, port = address.split(':')
+    else:
+        host, port = address, ''
+    return host, int(port) if port else 80
+
+class _Connection:
+    """One keep-alive HTTP/1.1 connection"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.requests = 0
+
+    def close(self) -> None:
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+    async def request(self, method: str, host: str, path: str, body: bytes, headers: Dict[str, str]) -> Tuple[int, dict, bytes, bool]:
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {host}", "Connection: keep-alive",
+                 "Accept: application/json", f"Content-Length: {len(body)}"]
+        if body:
+            lines.append("Content-Type: application/x-www-form-urlencoded")
+        lines.extend(f"{k}: {v}" for k, v in headers.items())
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+        self.requests += 1
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Alpaca server closed the connection")
+        parts = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+        version, status = parts[0], parts[1]
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _sep, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0].strip(), 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+            data = b"".join(chunks)
+        elif "content-length" in response_headers:
+            data = await self.reader.readexactly(int(response_headers["content-length"]))
+        elif status in ("204", "304") or status.startswith("1"):
+            data = b""
+        elif version != "HTTP/1.1" or response_headers.get("connection", "").lower() == "close":
+            # The body ends with the connection, as announced
+            data = await self.reader.read()
+        else:
+            # Reading until EOF would wait for the server to drop a keep-alive connection
+            raise AlpacaProtocolError(f"Response {status} without Content-Length or chunked encoding")
+
+        keep_alive = version == "HTTP/1.1" and response_headers.get("connection", "").lower() != "close"
+        return int(status), response_headers, data, keep_alive
+
+class AlpacaPool:
+    """Keep-alive connections shared by all of the devices of an event loop"""
+
+    _shared = weakref.WeakKeyDictionary()
+
+    def __init__(self, size: int = POOL_SIZE):
+        self.size = size
+        self._idle = {}
+        self._limits = {}
+        self.requests = 0
+        self.connections = 0
+        self.errors = 0
+
+    @classmethod
+    def shared(cls) -> "AlpacaPool":
+        """The pool of the running event loop"""
+        loop = asyncio.get_running_loop()
+        pool = cls._shared.get(loop)
+        if pool is None:
+            pool = cls._shared[loop] = cls()
+        return pool
+
+    async def _open(self, key: tuple) -> _Connection:
+        host, port, secure = key
+        context = ssl.create_default_context() if secure else None
+        reader, writer = await asyncio.open_connection(host, port, ssl=context)
+        self.connections += 1
+        return _Connection(reader, writer)
+
+    async def request(self, method: str, address: str, secure: bool, path: str, body: bytes = b"",
+                      headers: Dict[str, str] = None, tmo: float = 5.0) -> Tuple[int, dict, bytes]:
+        """Send a request on an idle connection of the server, or a new one.
+
+        Returns:
+            (status, headers, body)
+
+        """
+        host, port = split_address(address)
+        key = (host, port, secure)
+        limit = self._limits.get(key)
+        if limit is None:
+            limit = self._limits[key] = asyncio.Semaphore(self.size)
+        host_header = address if not address.startswith('[') or address.startswith('[::1]') else f'{address.split("%")[0]}]'
+        async with limit:
+            idle = self._idle.setdefault(key, [])
+            # A reused connection may have been closed by the server, try once more on a new one
+            for attempt in range(2):
+                reused = bool(idle)
+                conn = idle.pop() if reused else await self._open(key)
+                try:
+                    status, response_headers, data, keep_alive = await asyncio.wait_for(
+                        conn.request(method, host_header, path, body, headers or {}), tmo)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    conn.close()
+                    if reused and attempt == 0:
+                        continue
+                    self.errors += 1
+                    raise
+                except BaseException:
+                    # Timeout or cancel, the state of the connection is unknown
+                    conn.close()
+                    self.errors += 1
+                    raise
+                self.requests += 1
+                if keep_alive:
+                    idle.append(conn)
+                else:
+                    conn.close()
+                return status, response_headers, data
+
+    def stats(self) -> dict:
+        """requests / connections is the keep-alive reuse ratio"""
+        return {"requests": self.requests, "connections": self.connections, "errors": self.errors,
+                "idle": sum(len(v) for v in self._idle.values())}
+
+    def close(self) -> None:
+        for idle in self._idle.values():
+            for conn in idle:
+                conn.close()
+        self._idle.clear()
+
+class AsyncDevice:
+    """Common interface members of the Alpaca devices, as coroutines.
+
+    The members are the ones of the blocking classes, addressed by name:
+    ``await dev.get("Connected")``, ``await dev.put("Connected", Connected=True)``.
+
+    """
+
+    device_type = None
+
+    def __init__(self, address: str, device_number: int = 0, protocol: str = "http",
+                 pool: AlpacaPool = None, device_type: str = None):
+        """Initialize AsyncDevice object.
+
+        Attributes:
+            address: Domain name or IP address of Alpaca server, with the port if needed.
+            device_number: Zero based device number as set on the server.
+            protocol: http or https.
+            pool: AlpacaPool, the pool of the running loop by default.
+            device_type: Needed only for AsyncDevice itself, e.g. "camera".
+
+        """
+        self.address = address
+        self.device_number = device_number
+        self.device_type = (device_type or self.device_type).lower()
+        self.secure = protocol == "https"
+        self.pool = pool
+        self.base_path = "/api/v%d/%s/%d" % (API_VERSION, self.device_type, device_number)
+
+    async def _request(self, method: str, attribute: str, tmo: float, data: dict) -> dict:
+        pdata = {
+            "ClientTransactionID": f"{next(_client_trans_ids)}",
+            "ClientID": f"{_client_id}"
+        }
+        pdata.update(data)
+        path = "%s/%s" % (self.base_path, attribute.lower())
+        if method == "GET":
+            path += "?" + urlencode(pdata)
+            body = b""
+        else:
+            body = urlencode(pdata).encode("utf-8")
+        pool = self.pool or AlpacaPool.shared()
+        status, _headers, raw = await pool.request(method, self.address, self.secure, path, body, tmo=tmo)
+        if status not in range(200, 204):
+            raise AlpacaRequestException(status, f"{raw.decode('utf-8', 'replace')} (URL {path})")
+        return check_alpaca_error(json.loads(raw))
+
+    async def get(self, attribute: str, tmo: float = 5.0, **data):
+        """Get a property, e.g. ``await cam.get("CCDTemperature")``.
+
+        Returns:
+            The Value of the response.
+
+        """
+        return (await self._request("GET", attribute, tmo, data))["Value"]
+
+    async def put(self, attribute: str, tmo: float = 5.0, **data) -> dict:
+        """Set a property or call a method, e.g. ``await cam.put("StartExposure", Duration=1, Light=True)``.
+
+        Returns:
+            The decoded response.
+
+        """
+        return await self._request("PUT", attribute, tmo, data)
+
+    async def get_many(self, *attributes: str, tmo: float = 5.0) -> dict:
+        """Get several properties at the same time.
+
+        Returns:
+            {attribute: value}, an exception as the value if that property failed.
+
+        """
+        values = await asyncio.gather(*(self.get(a, tmo) for a in attributes), return_exceptions=True)
+        return dict(zip(attributes, values))
+
+class AsyncCamera(AsyncDevice):
+    device_type = "camera"
+
+class AsyncCoverCalibrator(AsyncDevice):
+    device_type = "covercalibrator"
+
+class AsyncDome(AsyncDevice):
+    device_type = "dome"
+
+class AsyncFilterWheel(AsyncDevice):
+    device_type = "filterwheel"
+
+class AsyncFocuser(AsyncDevice):
+    device_type = "focuser"
+
+class AsyncObservingConditions(AsyncDevice):
+    device_type = "observingconditions"
+
+class AsyncRotator(AsyncDevice):
+    device_type = "rotator"
+
+class AsyncSafetyMonitor(AsyncDevice):
+    device_type = "safetymonitor"
+
+class AsyncSwitch(AsyncDevice):
+    device_type = "switch"
+
+class AsyncTelescope(AsyncDevice):
+    device_type = "telescope"
+
+async def gather(*aws, return_exceptions: bool = False) -> List:
+    """asyncio.gather, so the callers need only this module"""
+    return await asyncio.gather(*aws, return_exceptions=return_exceptions)
+
+class SyncRunner:
+    """Event loop in a background thread for the blocking facade"""
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="alpaca-async", daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def default(cls) -> "SyncRunner":
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def run(self, coro, timeout: float = None):
+        """Run a coroutine on the loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+class SyncDevice:
+    """Blocking facade of an AsyncDevice, all of the facades share the pool of one loop thread.
+
+    ``SyncDevice(AsyncCamera("127.0.0.1:11111", 0)).get_many("CCDTemperature", "CoolerOn")``
+    sends both requests at the same time from the calling thread.
+
+    """
+
+    def __init__(self, device: AsyncDevice, runner: SyncRunner = None):
+        self.device = device
+        self.runner = runner or SyncRunner.default()
+
+    def get(self, attribute: str, tmo: float = 5.0, **data):
+        return self.runner.run(self.device.get(attribute, tmo, **data))
+
+    def put(self, attribute: str, tmo: float = 5.0, **data) -> dict:
+        return self.runner.run(self.device.put(attribute, tmo, **data))
+
+    def get_many(self, *attributes: str, tmo: float = 5.0) -> dict:
+        return self.runner.run(self.device.get_many(*attributes, tmo=tmo))
+
+    def run(self, coro, timeout: float = None):
+        """Run any coroutine, e.g. a gather over several devices."""
+        return self.runner.run(coro, timeout)
@@ -38,6 +38,7 @@
 # 02-May-22 (rbd) Initial Edit
 # 13-May-22 (rbd) 2.0.0-dev1 Project now called "Alpyca" - no logic changes
 # 21-Jul-22 (rbd) 2.0.1 Resolve TODO reviews
+# 19-Oct-26 ImageArray uses the keep-alive session of the device, no global lock
 # -----------------------------------------------------------------------------
 
 from libs.alpyca.device import Device
@@ -45,7 +46,6 @@ from libs.alpyca.telescope import GuideDirections
 from libs.alpyca.exceptions import *
 from libs.alpyca.docenum import DocIntEnum
 from typing import List
-import requests
 import array
 
 class CameraStates(DocIntEnum):
@@ -1572,22 +1572,9 @@ class Camera(Device):
             **data: Data to send with request.
         
         """
-        url = f"{self.base_url}/{attribute}"
-        hdrs = {'accept' : 'application/imagebytes'}
-        # Make Host: header safe for IPv6
-        if(self.address.startswith('[') and not self.address.startswith('[::1]')):
-            hdrs['Host'] = f'{self.address.split("%")[0]}]'
-        pdata = {
-                "ClientTransactionID": f"{Device._client_trans_id}",
-                "ClientID": f"{Device._client_id}" 
-                }
-        pdata.update(data)
-        try:
-            Device._ctid_lock.acquire()
-            response = requests.get("%s/%s" % (self.base_url, attribute), params=pdata, headers=hdrs)
-            Device._client_trans_id += 1
-        finally:
-            Device._ctid_lock.release()
+        # The image can take long to download , use the keep-alive session of the
+        # device without holding any lock
+        response = self._request("GET", attribute, None, data, {'accept' : 'application/imagebytes'})
 
         if response.status_code not in range(200, 204):                 # HTTP level errors 
             raise AlpacaRequestException(response.status_code, 
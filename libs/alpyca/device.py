@@ -41,15 +41,22 @@
 # 17-Jul-22 (rbd) 2.0.1rc1 Speed up by re-using ports via requests.Session().
 # 21-Jul-22 (rbd) 2.0.1 Resolve TODO reviews
 # 21-Aug-22 (rbd) 2.0.2 Fix DriverVersion to return the string GitHub issue #4
+# 19-Oct-26 No global lock around the HTTP round trip, atomic transaction IDs,
+#           tuned per-device connection pools, one JSON decode per response.
 # -----------------------------------------------------------------------------
 
+from itertools import count
 from threading import Lock
+from time import perf_counter
 from typing import List
 import requests
+from requests.adapters import HTTPAdapter
 from secrets import randbelow
 from libs.alpyca.exceptions import NotImplementedException,InvalidValueException,ValueNotSetException,NotConnectedException,ParkedException,SlavedException,InvalidOperationException,ActionNotImplementedException,DriverException,AlpacaRequestException     # Sorry Python purists
 
 API_VERSION = 1
+# Connections kept open per device, enough for a few threads polling one device
+POOL_SIZE = 4
 
 class Device:
     """Common interface members across all ASCOM Alpaca devices."""
@@ -89,15 +96,31 @@ class Device:
             self.device_number
         )
         self.rqs = requests.Session()
+        # Keep-alive connections to this device only , a slow device can not
+        # use up the connections of the others
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+        self.rqs.mount("http://", adapter)
+        self.rqs.mount("https://", adapter)
+        self._adapter = adapter
+        self._stats_lock = Lock()
+        self._requests = 0
+        self._errors = 0
+        self._total_time = 0.0
+        self._max_time = 0.0
 
     # ------------------------------------------------
     # CLASS VARIABLES - SHARED ACROSS DEVICE INSTANCES
     # ------------------------------------------------
     _client_id = randbelow(65535)
-    _client_trans_id = 1
-    _ctid_lock = Lock()
+    # next() of itertools.count is atomic, no lock is needed to allocate an ID
+    _client_trans_ids = count(1)
     # ------------------------------------------------
 
+    @staticmethod
+    def _next_transaction_id() -> int:
+        """Allocate a unique ClientTransactionID"""
+        return next(Device._client_trans_ids)
+
     def Action(self, ActionName: str, *Parameters) -> str:
         """Invoke the specified device-specific custom action
         
@@ -359,6 +382,53 @@ class Device:
 # HTTP/JSON Communications
 # ========================
 
+    def _headers(self) -> dict:
+        """Make Host: header safe for IPv6"""
+        if(self.address.startswith('[') and not self.address.startswith('[::1]')):
+            return {'Host': f'{self.address.split("%")[0]}]'}
+        return {}
+
+    def _request(self, method: str, attribute: str, tmo: float, data: dict, headers: dict = None):
+        """Send an HTTP request with a fresh transaction ID, no lock is held during the round trip.
+
+        Args:
+            method (str): "GET" or "PUT".
+            attribute (str): Attribute of the device.
+            tmo: Timeout for HTTP.
+            data (dict): Data to send with request.
+            headers (dict): Extra headers.
+
+        Returns:
+            The requests.Response.
+
+        """
+        pdata = {
+                "ClientTransactionID": f"{Device._next_transaction_id()}",
+                "ClientID": f"{Device._client_id}" 
+                }
+        pdata.update(data)
+        hdrs = self._headers()
+        if headers:
+            hdrs.update(headers)
+        url = "%s/%s" % (self.base_url, attribute)
+        start = perf_counter()
+        ok = False
+        try:
+            if method == "GET":
+                response = self.rqs.get(url, params=pdata, timeout=tmo, headers=hdrs)
+            else:
+                response = self.rqs.put(url, data=pdata, timeout=tmo, headers=hdrs)
+            ok = True
+        finally:
+            used = perf_counter() - start
+            with self._stats_lock:
+                self._requests += 1
+                self._errors += 0 if ok else 1
+                self._total_time += used
+                if used > self._max_time:
+                    self._max_time = used
+        return response
+
     def _get(self, attribute: str, tmo=5.0, **data) -> str:
         """Send an HTTP GET request to an Alpaca server and check response for errors.
 
@@ -368,26 +438,9 @@ class Device:
             **data: Data to send with request.
                   
         """
-        # Make Host: header safe for IPv6
-        if(self.address.startswith('[') and not self.address.startswith('[::1]')):
-            hdrs = {'Host': f'{self.address.split("%")[0]}]'}
-        else:
-            hdrs = {}
-        pdata = {
-                "ClientTransactionID": f"{Device._client_trans_id}",
-                "ClientID": f"{Device._client_id}" 
-                }
-        pdata.update(data)
         # TODO - Catch and handle connect failures nicely
-        try:
-            Device._ctid_lock.acquire()
-            response = self.rqs.get("%s/%s" % (self.base_url, attribute), 
-                            params=pdata, timeout=tmo, headers=hdrs)
-            Device._client_trans_id += 1
-        finally:
-            Device._ctid_lock.release()
-        self.__check_error(response)
-        return response.json()["Value"]
+        response = self._request("GET", attribute, tmo, data)
+        return self.__check_error(response)["Value"]
 
     def _put(self, attribute: str, tmo=5.0, **data) -> str:
         """Send an HTTP PUT request to an Alpaca server and check response for errors.
@@ -398,33 +451,48 @@ class Device:
             **data: Data to send with request.
         
         """
-        # Make Host: header safe for IPv6
-        if(self.address.startswith('[') and not self.address.startswith('[::1]')):
-            hdrs = {'Host': f'{self.address.split("%")[0]}]'}
-        else:
-            hdrs = {}
-        pdata = {
-                "ClientTransactionID": f"{Device._client_trans_id}",
-                "ClientID": f"{Device._client_id}" 
-                }
-        pdata.update(data)
         # TODO - Catch and handle connect failures nicely
-        try:
-            Device._ctid_lock.acquire()
-            response = self.rqs.put("%s/%s" % (self.base_url, attribute), 
-                            data=pdata, timeout=tmo, headers=hdrs)
-            Device._client_trans_id += 1
-        finally:
-            Device._ctid_lock.release()
-        self.__check_error(response)
-        return response.json()
+        response = self._request("PUT", attribute, tmo, data)
+        return self.__check_error(response)
 
-    def __check_error(self, response) -> None:
+    def transport_stats(self) -> dict:
+        """Counters of the HTTP requests of this device.
+
+        Returns:
+            requests, errors, total_time, avg_time, max_time and, when urllib3
+            exposes them, the connections opened. requests / connections is
+            the keep-alive reuse ratio.
+
+        """
+        with self._stats_lock:
+            stats = {
+                "requests": self._requests,
+                "errors": self._errors,
+                "total_time": self._total_time,
+                "avg_time": self._total_time / self._requests if self._requests else 0.0,
+                "max_time": self._max_time,
+            }
+        connections = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            connections += getattr(pool, "num_connections", 0)
+        stats["connections"] = connections
+        return stats
+
+    def close(self) -> None:
+        """Close the keep-alive connections of this device."""
+        self.rqs.close()
+
+    def __check_error(self, response) -> dict:
         """Alpaca exception handler (ASCOM exception types)
 
         Args:
             response (Response): Response from Alpaca server to check.
 
+        Returns:
+            The decoded JSON body, so the caller does not decode it again.
+
         Notes:
             * Depending on the error number, the appropriate ASCOM exception type
               will be raised. See the ASCOM Alpaca API Reference for the reserved
@@ -460,6 +528,7 @@ class Device:
                     raise DriverException(n, m)
                 else: # unknown 0x400-0x4FF
                     raise DriverException(n, m) # Outside 0x500-0x5FF but agreed on this
+            return j
         else:
             raise AlpacaRequestException(response.status_code, f"{response.text} (URL {response.url})")
 
@@ -37,8 +37,7 @@ Methods provided:
     * printDetails: Prints a detailed description of the object in a formatted output.
 """
 
-from functools import cached_property
-from typing import Generator, List, Tuple, Optional, Union
+from typing import Generator, Iterable, List, Tuple, Optional, Union
 import json
 import numpy as np
 import re
@@ -62,6 +61,16 @@ PATTERNS = {'NGC|IC': r'^((?:NGC|IC)\s?)(\d{1,4})\s?((NED)(\d{1,2})|[A-Z]{1,2})?
             'UGC': r'^(UGC\s?)(\d{1,5})$',
             }
 
+# Columns and tables used to build Dso objects, shared by single and batch queries
+DSO_COLS = ('objects.id, objects.name, objects.type, objTypes.typedesc, ra, dec, const, '
+            'majax, minax, pa, bmag, vmag, jmag, hmag, kmag, sbrightn, hubble, parallax, '
+            'pmra, pmdec, radvel, redshift, cstarumag, cstarbmag, cstarvmag, messier, '
+            'ngc, ic, cstarnames, identifiers, commonnames, nednotes, ongcnotes, notngc')
+DSO_TABLES = 'objects JOIN objTypes ON objects.type = objTypes.type'
+
+# Marker for lazily computed fields which have not been evaluated yet
+_UNSET = object()
+
 
 class Dso(object):
     """Describes a Deep Sky Object from ONGC database.
@@ -94,10 +103,17 @@ class Dso(object):
 
     * __init__: Object constructor.
     * __str__: Returns a basic description of the object.
+    * from_row: Builds an object from an already selected database row.
+    * from_rows: Builds many objects from a single query result.
     * xephemFormat: Returns object data in Xephem format.
 
     """
 
+    __slots__ = ('_id', '_name', '_type', '_ra', '_dec', '_const', '_notngc',
+                 '_majax', '_minax', '_pa', '_bmag', '_vmag', '_jmag', '_hmag', '_kmag',
+                 '_sbrightn', '_hubble', '_parallax', '_pmra', '_pmdec', '_radvel',
+                 '_redshift', '_row', '_coords', '_identifiers', '__weakref__')
+
     def __init__(self, name: str, returndup: bool = False):
         """Object constructor.
 
@@ -115,17 +131,13 @@ class Dso(object):
 
         catalog, objectname = _recognize_name(name.upper())
 
-        cols = ('objects.id, objects.name, objects.type, objTypes.typedesc, ra, dec, const, '
-                'majax, minax, pa, bmag, vmag, jmag, hmag, kmag, sbrightn, hubble, parallax, '
-                'pmra, pmdec, radvel, redshift, cstarumag, cstarbmag, cstarvmag, messier, '
-                'ngc, ic, cstarnames, identifiers, commonnames, nednotes, ongcnotes, notngc')
-        tables = ('objects JOIN objTypes ON objects.type = objTypes.type '
+        tables = (f'{DSO_TABLES} '
                   'JOIN objIdentifiers ON objects.name = objIdentifiers.name')
         if catalog == 'Messier':
             params = f'messier="{objectname}"'
         else:
             params = f'objIdentifiers.identifier="{objectname}"'
-        objectData = _queryFetchOne(cols, tables, params)
+        objectData = _queryFetchOne(DSO_COLS, tables, params)
 
         if objectData is None:
             raise ObjectNotFound(objectname)
@@ -137,9 +149,19 @@ class Dso(object):
             else:
                 objectname = f'IC{objectData[27]}'
             params = f'objIdentifiers.identifier="{objectname}"'
-            objectData = _queryFetchOne(cols, tables, params)
+            objectData = _queryFetchOne(DSO_COLS, tables, params)
+
+        self._load(objectData)
+
+    def _load(self, objectData: tuple) -> None:
+        """Assign object properties from a row selected with `DSO_COLS`.
+
+        Only the fields needed by most callers are unpacked here, cross identifiers,
+        notes and central star data are kept in the raw row and decoded on demand.
 
-        # Assign object properties
+        Args:
+            objectData: a database row with the columns listed in `DSO_COLS`
+        """
         self._id = objectData[0]
         self._name = objectData[1]
         self._type = objectData[3]
@@ -164,17 +186,52 @@ class Dso(object):
         self._pmdec = objectData[19]
         self._radvel = objectData[20]
         self._redshift = objectData[21]
-        self._cstarumag = objectData[22]
-        self._cstarbmag = objectData[23]
-        self._cstarvmag = objectData[24]
-        self._messier = objectData[25]
-        self._ngc = objectData[26]
-        self._ic = objectData[27]
-        self._cstarnames = objectData[28]
-        self._identifiers = objectData[29]
-        self._commonnames = objectData[30]
-        self._nednotes = objectData[31]
-        self._ongcnotes = objectData[32]
+
+        # Rarely used fields, parsed lazily
+        self._row = objectData
+        self._coords = _UNSET
+        self._identifiers = _UNSET
+
+    @classmethod
+    def from_row(cls, objectData: tuple) -> 'Dso':
+        """Build an object from a row selected with `DSO_COLS` without querying the database.
+
+        Duplicated records are not resolved.
+
+        Args:
+            objectData: a database row with the columns listed in `DSO_COLS`
+
+        Returns:
+            A Dso object.
+
+        """
+        obj = cls.__new__(cls)
+        obj._load(objectData)
+        return obj
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple]) -> List['Dso']:
+        """Build many objects from the rows of a single query result.
+
+                >>> from pyongc.ongc import Dso, DSO_COLS, DSO_TABLES, _queryFetchAll
+                >>> rows = _queryFetchAll(DSO_COLS, DSO_TABLES, 'objects.name="NGC0001"')
+                >>> print(Dso.from_rows(rows)[0])
+                NGC0001, Galaxy in Peg
+
+        Args:
+            rows: database rows with the columns listed in `DSO_COLS`
+
+        Returns:
+            A list of Dso objects, in the same order of the rows.
+
+        """
+        new = cls.__new__
+        objects = []
+        for row in rows:
+            obj = new(cls)
+            obj._load(row)
+            objects.append(obj)
+        return objects
 
     def __str__(self) -> str:
         """Returns a basic description of the object.
@@ -187,7 +244,7 @@ class Dso(object):
         """
         return f'{self._name}, {self._type} in {self._const}'
 
-    @cached_property
+    @property
     def cstar_data(self) -> Optional[Tuple[Optional[List[str]], Optional[float],
                                            Optional[float], Optional[float]]]:
         """Data about central star of planetary nebulaes.
@@ -214,14 +271,16 @@ class Dso(object):
         if self._type != 'Planetary Nebula':
             return None
 
-        if self._cstarnames != "":
-            identifiers = list(map(str.strip, self._cstarnames.split(",")))
+        cstarumag, cstarbmag, cstarvmag = self._row[22:25]
+        cstarnames = self._row[28]
+        if cstarnames != "":
+            identifiers = list(map(str.strip, cstarnames.split(",")))
         else:
             identifiers = None
 
-        return identifiers, self._cstarumag, self._cstarbmag, self._cstarvmag
+        return identifiers, cstarumag, cstarbmag, cstarvmag
 
-    @cached_property
+    @property
     def constellation(self) -> str:
         """The constellation where the object is located.
 
@@ -236,7 +295,7 @@ class Dso(object):
         """
         return self._const
 
-    @cached_property
+    @property
     def coords(self) -> Optional[np.ndarray]:
         """Returns object coordinates in HMS and DMS as numpy array or None.
 
@@ -251,7 +310,10 @@ class Dso(object):
             values expressed in HMS and DMS.
 
         """
+        if self._coords is not _UNSET:
+            return self._coords
         if self._ra is None or self._dec is None:
+            self._coords = None
             return None
 
         ra = np.empty(3)
@@ -266,9 +328,10 @@ class Dso(object):
         dec[1] = np.trunc(ms)
         dec[2] = (ms - dec[1]) * 60
         dec[0] = dec[0] * -1 if np.signbit(self._dec) else dec[0]
-        return np.array([ra, dec, ])
+        self._coords = np.array([ra, dec, ])
+        return self._coords
 
-    @cached_property
+    @property
     def dec(self) -> str:
         """Object Declination in a easy to read format as string.
 
@@ -293,7 +356,7 @@ class Dso(object):
         else:
             return 'N/A'
 
-    @cached_property
+    @property
     def dimensions(self) -> Tuple[Optional[float], Optional[float], Optional[int]]:
         """Object axes dimensions and position angle.
 
@@ -310,7 +373,7 @@ class Dso(object):
         """
         return self._majax, self._minax, self._pa
 
-    @cached_property
+    @property
     def hubble(self) -> str:
         """The Hubble classification of a galaxy.
 
@@ -325,7 +388,7 @@ class Dso(object):
         """
         return self._hubble
 
-    @cached_property
+    @property
     def id(self) -> int:
         """The internal database Id of the object.
 
@@ -340,7 +403,7 @@ class Dso(object):
         """
         return self._id
 
-    @cached_property
+    @property
     def identifiers(self) -> Tuple[Optional[str], Optional[List[str]], Optional[List[str]],
                                    Optional[List[str]], Optional[List[str]]]:
         """All the alternative identifiers of the object.
@@ -365,36 +428,41 @@ class Dso(object):
             `('Messier', ['NGC'], ['IC'], ['common names'], ['other'])`
 
         """
-        if self._messier == "":
+        if self._identifiers is not _UNSET:
+            return self._identifiers
+
+        row = self._row
+        if row[25] == "":
             messier = None
         else:
-            messier = f'M{self._messier}'
+            messier = f'M{row[25]}'
 
-        if self._ngc == "":
+        if row[26] == "":
             ngc = None
         else:
-            ngc = list(map(str.strip, self._ngc.split(",")))
+            ngc = list(map(str.strip, row[26].split(",")))
             ngc = list(map(lambda number: f'NGC{number}', ngc))
 
-        if self._ic == "":
+        if row[27] == "":
             ic = None
         else:
-            ic = list(map(str.strip, self._ic.split(",")))
+            ic = list(map(str.strip, row[27].split(",")))
             ic = list(map(lambda number: f'IC{number}', ic))
 
-        if self._commonnames == "":
+        if row[30] == "":
             commonNames = None
         else:
-            commonNames = list(map(str.strip, self._commonnames.split(",")))
+            commonNames = list(map(str.strip, row[30].split(",")))
 
-        if self._identifiers == "":
+        if row[29] == "":
             other = None
         else:
-            other = list(map(str.strip, self._identifiers.split(",")))
+            other = list(map(str.strip, row[29].split(",")))
 
-        return messier, ngc, ic, commonNames, other
+        self._identifiers = (messier, ngc, ic, commonNames, other)
+        return self._identifiers
 
-    @cached_property
+    @property
     def magnitudes(self) -> Tuple[Optional[float], Optional[float], Optional[float],
                                   Optional[float], Optional[float]]:
         """Returns object magnitudes.
@@ -412,7 +480,7 @@ class Dso(object):
         """
         return self._bmag, self._vmag, self._jmag, self._hmag, self._kmag
 
-    @cached_property
+    @property
     def name(self) -> str:
         """The main identifier of the object.
 
@@ -428,7 +496,7 @@ class Dso(object):
         """
         return self._name
 
-    @cached_property
+    @property
     def notes(self) -> Tuple[str, str]:
         """Returns notes from NED and from ONGC.
 
@@ -442,9 +510,9 @@ class Dso(object):
             `('nednotes', 'ongcnotes')`
 
         """
-        return self._nednotes, self._ongcnotes
+        return self._row[31], self._row[32]
 
-    @cached_property
+    @property
     def notngc(self) -> bool:
         """A flag which marks objects not being in the NGC or IC catalog.
 
@@ -461,7 +529,7 @@ class Dso(object):
         """
         return bool(self._notngc)
 
-    @cached_property
+    @property
     def parallax(self) -> Optional[float]:
         """Object's parallax.
 
@@ -476,7 +544,7 @@ class Dso(object):
         """
         return self._parallax
 
-    @cached_property
+    @property
     def pm_dec(self) -> Optional[float]:
         """Proper apparent motion in Dec, expressed in milliarcseconds/year.
 
@@ -491,7 +559,7 @@ class Dso(object):
         """
         return self._pmdec
 
-    @cached_property
+    @property
     def pm_ra(self) -> Optional[float]:
         """Proper apparent motion in RA, expressed in milliarcseconds/year.
 
@@ -506,7 +574,7 @@ class Dso(object):
         """
         return self._pmra
 
-    @cached_property
+    @property
     def ra(self) -> str:
         """Object Right Ascension in a easy to read format as string.
 
@@ -531,7 +599,7 @@ class Dso(object):
         else:
             return 'N/A'
 
-    @cached_property
+    @property
     def rad_coords(self) -> Optional[np.ndarray]:
         """Returns object coordinates in radians as numpy array or None.
 
@@ -550,7 +618,7 @@ class Dso(object):
 
         return np.array([self._ra, self._dec, ])
 
-    @cached_property
+    @property
     def radvel(self) -> Optional[float]:
         """Object's radial velocity.
 
@@ -565,7 +633,7 @@ class Dso(object):
         """
         return self._radvel
 
-    @cached_property
+    @property
     def redshift(self) -> Optional[float]:
         """Object's redshift value.
 
@@ -580,7 +648,7 @@ class Dso(object):
         """
         return self._redshift
 
-    @cached_property
+    @property
     def surface_brightness(self) -> Optional[float]:
         """The surface brightness value of a galaxy.
 
@@ -595,7 +663,7 @@ class Dso(object):
         """
         return self._sbrightn
 
-    @cached_property
+    @property
     def type(self) -> str:
         """Object type.
 
@@ -808,6 +876,32 @@ def _distance(coords1: np.ndarray, coords2: np.ndarray) -> Tuple[float, float, f
     return np.degrees(separation), np.degrees(a2-a1), np.degrees(d2-d1)
 
 
+def _filter_by_distance(coords: np.ndarray, objects: List[Dso],
+                        separation: Union[int, float]) -> List[Tuple[Dso, float]]:
+    """Keep the objects within the search radius, computing all the distances at once.
+
+    Args:
+        coords: R.A. and Dec of the starting point expressed in radians as
+            numpy array with shape(2,)
+        objects: candidate objects, all of them must have registered coordinates
+        separation: maximum distance from the starting point expressed in arcmin
+
+    Returns:
+        A list of tuples with each element composed by the Dso object found and
+        its distance from the starting point, ordered by distance.
+
+    """
+    if not objects:
+        return []
+
+    candidates = np.array([(obj._ra, obj._dec) for obj in objects]).T
+    distances = _distance(coords, candidates)[0]
+
+    neighbors = [(objects[i], float(distances[i]))
+                 for i in np.flatnonzero(distances <= (separation / 60))]
+    return sorted(neighbors, key=lambda neighbor: neighbor[1])
+
+
 def _limiting_coords(coords: np.ndarray, radius: int) -> str:
     """Write query filters for limiting search to specific area of the sky.
 
@@ -956,6 +1050,71 @@ def _queryFetchMany(cols: str, tables: str, params: str,
         db.close()
 
 
+def _queryFetchAll(cols: str, tables: str, params: str, order: str = '') -> List[tuple]:
+    """Search many rows in database and return all of them at once.
+
+    Unlike `_queryFetchMany`, rows are read in a single pass, which is much faster
+    when the whole result is needed anyway.
+
+            >>> from pyongc.ongc import _queryFetchAll
+            >>> cols = 'name'
+            >>> tables = 'objects'
+            >>> params = 'name="NGC0001"'
+            >>> _queryFetchAll(cols, tables, params)
+            [('NGC0001',)]
+
+    Args:
+        cols: the `SELECT` field of the query
+        tables: the `FROM` field of the query
+        params: the `WHERE` field of the query
+        order: the `ORDER` clause of the query
+
+    Returns:
+        Selected rows data from database
+
+    """
+    try:
+        db = sqlite3.connect(f'file:{DBPATH}?mode=ro', uri=True)
+    except sqlite3.Error:
+        raise OSError(f'There was a problem accessing database file at {DBPATH}')
+
+    try:
+        cursor = db.cursor()
+        cursor.execute(f'SELECT {cols} '
+                       f'FROM {tables} '
+                       f'WHERE {params}'
+                       f'{" ORDER BY " + order if order != "" else ""}'
+                       )
+        objectList = cursor.fetchall()
+    except Exception as err:  # pragma: no cover
+        raise err
+    finally:
+        db.close()
+
+    return objectList
+
+
+def _queryFetchObjects(params: str, order: str = '') -> List[Dso]:
+    """Search objects in database and build them from one query result.
+
+    Duplicated records are not resolved.
+
+            >>> from pyongc.ongc import _queryFetchObjects
+            >>> objectList = _queryFetchObjects('objects.name="NGC0001"')
+            >>> print(objectList[0])
+            NGC0001, Galaxy in Peg
+
+    Args:
+        params: the `WHERE` field of the query
+        order: the `ORDER` clause of the query
+
+    Returns:
+        A list of ongc.Dso objects.
+
+    """
+    return Dso.from_rows(_queryFetchAll(DSO_COLS, DSO_TABLES, params, order))
+
+
 def _recognize_name(text: str) -> Tuple[str, str]:
     """Recognize catalog and object id.
 
@@ -1113,22 +1272,13 @@ def getNeighbors(obj: Union[Dso, str], separation: Union[int, float],
     if obj.rad_coords is None:
         raise InvalidCoordinates('Starting object hasn\'t got registered coordinates.')
 
-    cols = 'objects.name'
-    tables = 'objects'
-    params = f'type != "Dup" AND name !="{obj.name}"'
+    params = f'objects.type != "Dup" AND objects.name !="{obj.name}"'
     if catalog.upper() in ["NGC", "IC"]:
-        params += f' AND name LIKE "{catalog.upper()}%"'
+        params += f' AND objects.name LIKE "{catalog.upper()}%"'
 
     params += _limiting_coords(obj.rad_coords, np.ceil(separation / 60))
 
-    neighbors = []
-    for item in _queryFetchMany(cols, tables, params):
-        possibleNeighbor = Dso(item[0])
-        distance = getSeparation(obj, possibleNeighbor)[0]
-        if distance <= (separation / 60):
-            neighbors.append((possibleNeighbor, distance))
-
-    return sorted(neighbors, key=lambda neighbor: neighbor[1])
+    return _filter_by_distance(obj.rad_coords, _queryFetchObjects(params), separation)
 
 
 def getSeparation(obj1: Union[Dso, str], obj2: Union[Dso, str],
@@ -1268,12 +1418,9 @@ def listObjects(**kwargs) -> List[Dso]:
                          'maxdec',
                          'cname',
                          'withname']
-    cols = 'objects.name'
-    tables = 'objects'
-
     if kwargs == {}:
         params = '1'
-        return [Dso(str(item[0]), True) for item in _queryFetchMany(cols, tables, params)]
+        return _queryFetchObjects(params)
     for element in kwargs:
         if element not in available_filters:
             raise ValueError("Wrong filter name.")
@@ -1290,7 +1437,7 @@ def listObjects(**kwargs) -> List[Dso]:
             raise ValueError('Wrong value for catalog filter. [NGC|IC|M]')
     if "type" in kwargs:
         types = [f'"{t}"' for t in kwargs["type"]]
-        paramslist.append(f'type IN ({",".join(types)})')
+        paramslist.append(f'objects.type IN ({",".join(types)})')
 
     if "constellation" in kwargs:
         constellations = [f'"{c.capitalize()}"' for c in kwargs["constellation"]]
@@ -1343,7 +1490,7 @@ def listObjects(**kwargs) -> List[Dso]:
         paramslist.append('commonnames = ""')
 
     params = " AND ".join(paramslist)
-    return [Dso(item[0], True) for item in _queryFetchMany(cols, tables, params, order)]
+    return _queryFetchObjects(params, order)
 
 
 def nearby(coords_string: str, separation: float = 60,
@@ -1393,22 +1540,13 @@ def nearby(coords_string: str, separation: float = 60,
 
     coords = _str_to_coords(coords_string)
 
-    cols = 'objects.name'
-    tables = 'objects'
-    params = 'type != "Dup"'
+    params = 'objects.type != "Dup"'
     if catalog.upper() in ["NGC", "IC"]:
-        params += f' AND name LIKE "{catalog.upper()}%"'
+        params += f' AND objects.name LIKE "{catalog.upper()}%"'
 
     params += _limiting_coords(coords, np.ceil(separation / 60))
 
-    neighbors = []
-    for item in _queryFetchMany(cols, tables, params):
-        possibleNeighbor = Dso(item[0])
-        distance = _distance(coords, possibleNeighbor.rad_coords)[0]
-        if distance <= (separation / 60):
-            neighbors.append((possibleNeighbor, distance))
-
-    return sorted(neighbors, key=lambda neighbor: neighbor[1])
+    return _filter_by_distance(coords, _queryFetchObjects(params), separation)
 
 
 def printDetails(dso: Union[Dso, str]) -> str:
@@ -1,4 +1,3 @@
-import array
 import os
 import struct
 import sys
@@ -26,14 +25,41 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 native_byteorder = sys.byteorder
 
+# Below this size the big integer XOR is faster than setting up the numpy arrays
+NUMPY_MASK_THRESHOLD = 1024
+
 def _mask(mask_value, data_value):
+    """
+    XOR the data with the repeated 4 byte mask.
+    Both arguments are bytes-like objects , no intermediate array.array copies are made.
+    """
     datalen = len(data_value)
+    if numpy is not None and datalen >= NUMPY_MASK_THRESHOLD:
+        return _mask_numpy(mask_value, data_value, datalen)
     data_value = int.from_bytes(data_value, native_byteorder)
     mask_value = int.from_bytes(mask_value * (datalen // 4) + mask_value[: datalen % 4], native_byteorder)
     return (data_value ^ mask_value).to_bytes(datalen, native_byteorder)
 
+def _mask_numpy(mask_value, data_value, datalen):
+    """XOR 8 bytes at a time over a view of the data"""
+    words = datalen // 8
+    result = numpy.empty(datalen, dtype=numpy.uint8)
+    data = numpy.frombuffer(data_value, dtype=numpy.uint8)
+    mask8 = numpy.frombuffer(mask_value * 2, dtype=numpy.uint64)
+    numpy.bitwise_xor(data[:words * 8].view(numpy.uint64), mask8, out=result[:words * 8].view(numpy.uint64))
+    tail = datalen - words * 8
+    if tail:
+        numpy.bitwise_xor(data[words * 8:], numpy.frombuffer(mask_value * 2, dtype=numpy.uint8)[:tail],
+                          out=result[words * 8:])
+    return result.tobytes()
+
 
 __all__ = [
     'ABNF', 'continuous_frame', 'frame_buffer',
@@ -199,6 +225,13 @@ class ABNF:
         """
         Format this object to string(byte array) to send data to server.
         """
+        return b"".join(self.format_parts())
+
+    def format_parts(self) -> tuple:
+        """
+        Format this object to the header and the payload , so they can be sent
+        with a single scatter-gather call without being concatenated.
+        """
         if any(x not in (0, 1) for x in [self.fin, self.rsv1, self.rsv2, self.rsv3]):
             raise ValueError("not 0 or 1")
         if self.opcode not in ABNF.OPCODES:
@@ -220,10 +253,12 @@ class ABNF:
             frame_header += struct.pack("!Q", length)
 
         if not self.mask:
-            return frame_header + self.data
+            return frame_header, self.data
         else:
             mask_key = self.get_mask_key(4)
-            return frame_header + self._get_masked(mask_key)
+            if isinstance(mask_key, str):
+                mask_key = mask_key.encode('utf-8')
+            return frame_header + mask_key, ABNF.mask(mask_key, self.data)
 
     def _get_masked(self, mask_key):
         s = ABNF.mask(mask_key, self.data)
@@ -254,7 +289,7 @@ class ABNF:
         if isinstance(data, str):
             data = data.encode('latin-1')
 
-        return _mask(array.array("B", mask_key), array.array("B", data))
+        return _mask(bytes(mask_key), data)
 
 
 class frame_buffer:
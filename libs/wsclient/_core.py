@@ -264,14 +264,9 @@ class WebSocket:
         """
         if self.get_mask_key:
             frame.get_mask_key = self.get_mask_key
-        data = frame.format()
-        length = len(data)
+        parts = frame.format_parts()
         with self.lock:
-            while data:
-                l = self._send(data)
-                data = data[l:]
-
-        return length
+            return sendmsg(self.sock, parts)
 
     def send_binary(self, payload):
         """
@@ -38,7 +38,7 @@ if hasattr(socket, "TCP_KEEPCNT"):
 _default_timeout = None
 
 __all__ = ["DEFAULT_SOCKET_OPTION", "sock_opt", "setdefaulttimeout", "getdefaulttimeout",
-           "recv", "recv_line", "send"]
+           "recv", "recv_line", "send", "sendmsg"]
 
 
 class sock_opt:
@@ -177,3 +177,43 @@ def send(sock, data):
             raise WebSocketTimeoutException(message)
         else:
             raise
+
+
+def sendmsg(sock, buffers):
+    """
+    Send the buffers in order with scatter-gather calls , so a frame header and
+    its payload are never concatenated. Falls back to send() for SSL sockets.
+    Returns the number of bytes sent.
+    """
+    if not sock:
+        raise WebSocketConnectionClosedException("socket is already closed.")
+
+    views = [memoryview(buf).cast("B") for buf in buffers if len(buf)]
+    total = sum(len(view) for view in views)
+    if not hasattr(sock, "sendmsg") or (HAVE_SSL and isinstance(sock, ssl.SSLSocket)):
+        data = b"".join(views)
+        while data:
+            data = data[send(sock, data):]
+        return total
+
+    while views:
+        try:
+            sent = sock.sendmsg(views)
+        except (BlockingIOError, InterruptedError):
+            sel = selectors.DefaultSelector()
+            sel.register(sock, selectors.EVENT_WRITE)
+            w = sel.select(sock.gettimeout())
+            sel.close()
+            if not w:
+                raise WebSocketTimeoutException("Connection timed out")
+            continue
+        except socket.timeout as e:
+            message = extract_err_message(e)
+            raise WebSocketTimeoutException(message)
+        # Drop what was written , the remaining views are not copied
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if sent:
+            views[0] = views[0][sent:]
+    return total
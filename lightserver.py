@@ -61,6 +61,8 @@ def main():
     parser.add_argument('--host', type=str,help=_("Host the server is listening on"))
     parser.add_argument('--debug', type=bool,help=_("Enable debug output for better debug"))
     parser.add_argument('--threaded', type=bool,help=_("Enable mutiline threading for better performance"))
+    parser.add_argument('--production', action='store_true',help=_("Use the production wsgi server even in debug mode"))
+    parser.add_argument('--threads', type=int,help=_("Number of the worker threads of the production server"))
     # Configuration and version
     parser.add_argument('--config', type=str, help=_("Config file"))
     parser.add_argument('--version', type=bool, help=_("Show current version"))
@@ -108,6 +110,12 @@ def main():
         """Threaded mode"""
         c.config["threaded"] = args.threaded
         logger.log(_("Threaded mode is enabled"))
+    if args.production:
+        c.config["production"] = True
+        logger.log(_("Production server is enabled"))
+    if args.threads:
+        c.config["threads"] = args.threads
+        logger.log(_("Server worker threads : {}").format(args.threads))
     # Change the INDI web manager options if available
     try:
         if args.indihost:
@@ -266,22 +266,34 @@ class BasicCameraAPI(BasicDeviceAPI):
             NOTE : This function should not be called if the camera is not in exposure
         """
 
-    def get_exposure_result(self) -> dict:
+    def get_exposure_result(self, params : dict = None) -> dict:
         """
             Get exposure result function | 获取曝光结果
             Args:
-                None
+                params : dict # optional
+                    raw : bool # also send the whole image data
+                    preview : dict # options of the preview , see utils.preview.make_preview
             Returns : {
                 "status" : int,
                 "message" : str,
                 "params" : {
-                    "image" : Base64 Encode Image Data,
+                    "image" : Base64 Encode Image Data , only if raw,
+                    "preview" : dict # base64 data , format , width and height of the stretched preview,
                     "histogram" : List,
                     "info" : dict
                 }
             }
         """
 
+    def get_image(self):
+        """
+            Get the last image as an array | 获取图像数组
+            Args:
+                None
+            Returns : np.ndarray
+            NOTE : Used by the autofocus , which measures the image on the server
+        """
+
     def start_sequence_exposure(self , params : dict) -> dict:
         """
             Start exposure function | 开始计划曝光
@@ -40,12 +40,15 @@ class BasicFocuserInfo(object):
     _temperature : float
 
     _max_steps : int
+    _backlash = 0 # steps lost when the direction changes
+    _final_direction = 1 # every move ends going outward (1) or inward (-1)
     
     _is_connected = False
     _is_moving = False
     _is_compensation = False
 
     _can_temperature = False
+    _is_absolute = True
 
     def get_dict(self) -> dict:
         """
@@ -66,7 +69,8 @@ class BasicFocuserInfo(object):
                 "temperature" : self._temperature
             },
             "abilitiy" : {
-                "can_temperature" : self._can_temperature
+                "can_temperature" : self._can_temperature,
+                "is_absolute" : self._is_absolute
             },
             "status" : {
                 "is_connected" : self._is_connected,
@@ -74,6 +78,8 @@ class BasicFocuserInfo(object):
             },
             "properties" : {
                 "max_steps" : self._max_steps,
+                "backlash" : self._backlash,
+                "final_direction" : self._final_direction
             },
             "network" : {
                 "ipaddress" : self._ipaddress,
@@ -108,7 +114,9 @@ class BasicFocuserAPI(BasicDeviceAPI):
             Returns : {
                 "status" : int,
                 "message" : str,
-                "params" : None
+                "params" : {
+                    "operation" : int # id of the move , its result is the final position
+                }
             }
         """
 
@@ -122,7 +130,9 @@ class BasicFocuserAPI(BasicDeviceAPI):
             Returns : {
                 "status" : int,
                 "message" : str,
-                "params" : None
+                "params" : {
+                    "operation" : int # id of the move , its result is the final position
+                }
             }
         """
 
@@ -243,6 +243,25 @@ class BasicTelescopeAPI(BasicDeviceAPI):
             NOTE : This function is used to check whether telescope is slewing and return current position
         """
 
+    def get_position(self) -> dict:
+        """
+            Get the position and the motion state in one call , used by the mount stream\n
+            Returns:
+                {
+                    "status" : int
+                    "message" : str
+                    "params" : {
+                        "ra" : float # hours
+                        "dec" : float # degrees
+                        "az" : float # degrees , None if not available
+                        "alt" : float # degrees , None if not available
+                        "slewing" : boolean
+                        "tracking" : boolean
+                        "timestamp" : float # unix time of the sample
+                    }
+                }
+        """
+
     def get_goto_result(self) -> dict:
         """
             Get goto result\n
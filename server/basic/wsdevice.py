@@ -20,11 +20,11 @@ Boston, MA 02110-1301, USA.
 
 from secrets import randbelow
 from libs.websocket.websocket_server import WebsocketServer
+from server.wsmessenger import Messenger
 from utils.webutils import check_port
 from utils.lightlog import lightlog
 log = lightlog(__name__)
 
-import json
 import gettext
 _ = gettext.gettext
 
@@ -56,6 +56,7 @@ class wsdevice(object):
         self.info = basic_ws_info()
         self.ws = None
         self.device = None
+        self.messenger = Messenger()
 
     def __del__(self) -> None:
         """Destructor"""
@@ -90,7 +91,8 @@ class wsdevice(object):
             Returns: None
             NOTE: This function can not be overriden by subclasses.And must call parser_json()
         """
-        self.parser_json(str(message))
+        with self.messenger.request(client):
+            self.parser_json(str(message))
 
     def parser_json(self, message):
         """
@@ -113,12 +115,7 @@ class wsdevice(object):
         if not isinstance(message, dict):
             log.loge(_("Unknown format of message"))
             return False
-        try:
-            self.ws.send_message_to_all(json.dumps(message))
-        except json.JSONDecodeError as exception:
-            log.loge(_(f"Failed to parse message into JSON format , error {exception}"))
-            return False
-        return True 
+        return self.messenger.send(message)
 
     def start_server(self, host : str, port : int, debug = False, ssl = {}) -> dict:
         """
@@ -157,6 +154,7 @@ class wsdevice(object):
             log.logw(_("SSL Mode is still not supported"))
         try:
             self.ws = WebsocketServer(host=host, port=port)
+            self.messenger.server = self.ws
             self.ws.set_fn_new_client(self.on_connect)
             self.ws.set_fn_client_left(self.on_disconnect)
             self.ws.set_fn_message_received(self.on_message)
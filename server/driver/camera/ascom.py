@@ -29,7 +29,9 @@ from server.driver.camera.exception import AscomCameraError as error
 from server.driver.camera.exception import AscomCameraSuccess as success
 from server.driver.camera.exception import AscomCameraWarning as warning
 
+from utils.calibration import KINDS, CalibrationError, CalibrationLibrary, library
 from utils.lightlog import lightlog
+from utils.preview import bayer_pattern, previews
 log = lightlog(__name__)
 
 import gettext
@@ -78,6 +80,7 @@ class AscomCameraAPI(BasicCameraAPI):
     def __init__(self) -> None:
         self.info = BasicCameraInfo()
         self.device = None
+        self.last_image = None
         self.info._is_connected = False
         self.info._percent_complete = 0
 
@@ -652,21 +655,68 @@ class AscomCameraAPI(BasicCameraAPI):
         log.logd(_(f"Get camera exposure status : {status}"))
         return log.return_success(_("Get camera exposure status successfully"),{"status":status})
 
-    def get_exposure_result(self) -> dict:
+    def get_image(self) -> np.ndarray:
+        """
+            Read the last image from the camera as an array | 读取图像数组
+            Args : None
+            Returns : np.ndarray # (width,height) or (width,height,planes)
+            NOTE : Raises the exceptions of the device , get_exposure_result handles them
+        """
+        imgdata = self.device.ImageArray
+        if self.info._depth is None:
+            img_format = self.device.ImageArrayInfo
+            if img_format.ImageElementType == ImageArrayElementTypes.Int32:
+                if self.info._max_adu <= 65535:
+                    self.info._depth = 16
+                else:
+                    self.info._depth = 32
+            elif img_format.ImageElementType == ImageArrayElementTypes.Double:
+                self.info._depth = 64
+            if img_format.Rank == 2:
+                self.info._imgarray = True
+            else:
+                self.info._imgarray = False
+            log.logd(_(f"Camera Image Array : {self.info._imgarray}"))
+        img = None
+        if self.info._depth == 16:
+            img = np.uint16
+        elif self.info._depth == 32:
+            img = np.int32
+        else:
+            img = np.float64
+        
+        if self.info._imgarray:
+            nda = np.array(imgdata, dtype=img).transpose()
+        else:
+            nda = np.array(imgdata, dtype=img).transpose(2,1,0)
+        return nda
+
+    def get_exposure_result(self, params : dict = None) -> dict:
         """
             Get exposure result when exposure successful | 曝光成功后获取图像
-            Args: None
+            Args:
+                params : dict # optional
+                    raw : bool # also send the whole image as text , slow on a large frame
+                    preview : dict # options of utils.preview.make_preview , e.g. max_size , format , quality
             Returns:{
                 "status" : int,
                 "message" : str
                 "params" : {
-                    "image" : Base64 encoded image
+                    "image" : Base64 encoded image , only if raw
+                    "preview" : {
+                        "data" : Base64 encoded jpeg , webp or png
+                        "format" : str
+                        "width" : int
+                        "height" : int
+                        "time" : dict # milliseconds of every step
+                    }
                     "histogram" : List
                     "info" : Image Info
                 }
             }
             NOTE : Format!
         """
+        params = params or {}
         if not self.info._is_connected:
             log.logw(_(f"Cannot get exposure result, camera is not connected"))
             return log.return_error(error.NotConnected.value,{"error": error.NotConnected.value})
@@ -678,45 +728,38 @@ class AscomCameraAPI(BasicCameraAPI):
             base64_encode_img = None
             info = None
 
-            imgdata = self.device.ImageArray
-            if self.info._depth is None:
-                img_format = self.device.ImageArrayInfo
-                if img_format.ImageElementType == ImageArrayElementTypes.Int32:
-                    if self.info._max_adu <= 65535:
-                        self.info._depth = 16
-                    else:
-                        self.info._depth = 32
-                elif img_format.ImageElementType == ImageArrayElementTypes.Double:
-                    self.info._depth = 64
-                if img_format.Rank == 2:
-                    self.info._imgarray = True
-                else:
-                    self.info._imgarray = False
-                log.logd(_(f"Camera Image Array : {self.info._imgarray}"))
-            img = None
-            if self.info._depth == 16:
-                img = np.uint16
-            elif self.info._depth == 32:
-                img = np.int32
-            else:
-                img = np.float64
-            
-            if self.info._imgarray:
-                nda = np.array(imgdata, dtype=img).transpose()
-            else:
-                nda = np.array(imgdata, dtype=img).transpose(2,1,0)
+            nda = self.get_image()
+            # Kept for the calibration library and the previews
+            self.last_image = nda
+            self.info._image_id += 1
+            # The preview is made in the pool while the histogram is computed
+            options = dict(params.get("preview") or {})
+            options.setdefault("pattern",bayer_pattern(self.info._sensor_type,
+                                            self.info._bayer_offset_x,self.info._bayer_offset_y))
+            if "format" in options:
+                options["fmt"] = options.pop("format")
+            preview = previews.submit(self.info._image_id,nda,**options)
             # Create a histogram of the image
             if self.info._depth == 16:
                 hist , bins= np.histogram(nda,bins=[i for i in range(1,256)])
             elif self.info._depth == 32:
                 hist, bins= np.histogram(nda,bins=[i for i in range(1,65536)])
-            # Create a base64 encoded image
-            bytesio = BytesIO()
-            np.savetxt(bytesio, nda)
-            base64_encode_img = b64encode(bytesio.getvalue())
+            # Create a base64 encoded image , only on request since it is very slow
+            if params.get("raw",False):
+                bytesio = BytesIO()
+                np.savetxt(bytesio, nda)
+                base64_encode_img = b64encode(bytesio.getvalue())
+            try:
+                # A copy , the cached result keeps its bytes
+                preview = dict(preview.result())
+                preview["data"] = b64encode(preview["data"]).decode()
+            except (ValueError,TypeError,KeyError,MemoryError) as e:
+                log.logw(_(f"Failed to make the preview , error : {e}"))
+                preview = None
             # Create a image information dict
             info = {
-                "exposure" : self.info._last_exposure
+                "exposure" : self.info._last_exposure,
+                "id" : self.info._image_id
             }
             if self.info._can_save:
                 log.logd(_("Start saving image data in fits"))
@@ -764,8 +807,41 @@ class AscomCameraAPI(BasicCameraAPI):
             log.loge(_(f"Network error while get camera configuration, error : {e}"))
             return log.return_error(error.NetworkError.value,{"error":e})
         
-        return log.return_success(_("Save image successfully"),{"image" : base64_encode_img,"histogram" : hist,"info" : info})
+        return log.return_success(_("Save image successfully"),{"image" : base64_encode_img,"preview" : preview,
+                                                                    "histogram" : hist,"info" : info})
         
+    def calibration_info(self, kind : str, exposure : float = None, gain : int = None,
+                            offset : int = None, binning : int = None) -> dict:
+        """
+            Describe a frame of this camera for the calibration library
+            Args :
+                kind : str # light , dark , flat or offset
+                exposure : float # None for the last exposure
+                gain , offset , binning : None for the current settings
+            Returns : dict
+        """
+        return CalibrationLibrary.make_info(kind,
+                                            getattr(self.info,"_name",None),
+                                            gain if gain is not None else self.info._gain,
+                                            offset if offset is not None else self.info._offset,
+                                            binning if binning is not None else self.info._binning,
+                                            self.info._temperature,
+                                            exposure if exposure is not None else self.info._last_exposure)
+
+    def add_calibration_frame(self, kind : str, exposure : float, gain : int, offset : int, binning : int) -> None:
+        """
+            Add the last image to the calibration library
+            Args :
+                kind : str # dark , flat or offset
+            Returns : None
+        """
+        if self.last_image is None:
+            return
+        try:
+            library.add_frame(self.last_image,self.calibration_info(kind,exposure,gain,offset,binning))
+        except (CalibrationError,OSError) as e:
+            log.loge(_(f"Failed to add the {kind} frame to the calibration library , error : {e}"))
+
     def start_sequence_exposure(self, params: dict) -> dict:
         """
             Start sequence exposure | 启动计划拍摄
@@ -868,7 +944,7 @@ class AscomCameraAPI(BasicCameraAPI):
                         "binning" : binning,
                         "image" : {
                             "is_save" : True,
-                            "is_dark" : False if mode != "dark" else True,
+                            "is_dark" : mode in ("dark","offset"),
                             "name" : name + "_" + str(count) + "_",
                             "type" : "fits"
                         }
@@ -884,6 +960,8 @@ class AscomCameraAPI(BasicCameraAPI):
                         log.loge(_(f"Some error occurred when getting exposure result, error : {res.get('message')}"))
                     elif res.get("status") == 2:
                         log.logw(_(f"Some warning occurred when getting exposure result, warning : {res.get('message')}"))
+                    elif mode in KINDS:
+                        self.add_calibration_frame(mode,exposure,gain,offset,binning)
 
                     count += 1
         except DriverException as e:
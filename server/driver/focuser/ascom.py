@@ -21,6 +21,7 @@ Boston, MA 02110-1301, USA.
 from time import sleep
 from server.basic.focuser import BasicFocuserAPI,BasicFocuserInfo
 from libs.alpyca.focuser import Focuser
+from server.driver.focuser.motion import FocuserMotion
 from libs.alpyca.exceptions import (DriverException,
                                         NotConnectedException,
                                         NotImplementedException,
@@ -28,6 +29,7 @@ from libs.alpyca.exceptions import (DriverException,
                                         InvalidOperationException)
 
 from utils.lightlog import lightlog
+from utils.operations import operations
 log = lightlog(__name__)
 
 import gettext
@@ -44,6 +46,7 @@ class AscomFocuserAPI(BasicFocuserAPI):
     def __init__(self) -> None:
         self.info = BasicFocuserInfo()
         self.device = None
+        self.motion = None
         self.info._is_connected = False
 
     def __del__(self) -> None:
@@ -59,6 +62,8 @@ class AscomFocuserAPI(BasicFocuserAPI):
                 "host": "127.0.0.1",
                 "port": 8888,
                 "device_number" : int # default is 0
+                "backlash" : int # optional , steps lost when the direction changes
+                "final_direction" : int # optional , 1 if every move ends going outward , -1 inward
             }
             Returns:{
                 "status" : int,
@@ -80,6 +85,11 @@ class AscomFocuserAPI(BasicFocuserAPI):
         if host is None or port is None or device_number is None:
             log.logw(_("Host and port must be specified"))
             return log.return_warning(_("Host or port or device_number is None"),{})
+        try:
+            self._set_backlash(params)
+        except (TypeError,ValueError) as e:
+            log.logw(_(f"Invalid backlash settings , error : {e}"))
+            return log.return_warning(_("Invalid backlash settings"),{"error" : str(e)})
         try:
             self.device = Focuser(host + ":" + str(port), device_number)
             self.device.Connected = True
@@ -95,7 +105,9 @@ class AscomFocuserAPI(BasicFocuserAPI):
             return log.return_error(_(f"Failed tp load focuser configuration"),{})
         self.info._is_connected = True
         self.info._type = "ascom"
-        return log.return_success(_("Connect to focuser successfully"),{"info":res.get("info")})
+        self.motion = FocuserMotion(self.device,self.info._backlash,self.info._final_direction,
+                                        self.info._is_absolute,self.info._max_steps)
+        return log.return_success(_("Connect to focuser successfully"),{"info":res.get("params").get("info")})
 
     def disconnect(self) -> dict:
         """
@@ -111,6 +123,8 @@ class AscomFocuserAPI(BasicFocuserAPI):
         if not self.info._is_connected or self.device is None:
             log.logw(_("Focuser is not connected, please do not execute disconnect command"))
             return log.return_warning(_("Focuser is not connected"),{})
+        # Stop a running move before the device is gone
+        operations.cancel_all("focuser")
         try:
             self.device.Connected = False
         except DriverException as e:
@@ -120,6 +134,7 @@ class AscomFocuserAPI(BasicFocuserAPI):
             log.loge(_(f"Network error while disconnecting from focuser, error : {e}"))
             return log.return_error(_(f"Network error while disconnecting from focuser"),{"error" : e})
         self.device = None
+        self.motion = None
         self.info._is_connected = False
         log.log(_("Disconnected from focuser successfully"))
         return log.return_success(_("Disconnect from focuser successfully"),{"params":None})
@@ -207,6 +222,17 @@ class AscomFocuserAPI(BasicFocuserAPI):
             self.info._api_version = self.device.api_version
             log.logd(_(f"Focuser API version : {self.info._api_version}"))
 
+            self.info._is_absolute = self.device.Absolute
+            log.logd(_(f"Focuser is absolute : {self.info._is_absolute}"))
+            self.info._max_steps = self.device.MaxStep
+            log.logd(_(f"Focuser max step : {self.info._max_steps}"))
+            self.info._current_position = self.device.Position if self.info._is_absolute else 0
+            log.logd(_(f"Focuser position : {self.info._current_position}"))
+            try:
+                self.info._step_size = self.device.StepSize
+            except NotImplementedException:
+                self.info._step_size = None
+
             self.info._can_temperature = self.device.TempCompAvailable
             log.logd(_(f"Can focuser get temperature: {self.info._can_temperature}"))
             if self.info._can_temperature:
@@ -229,8 +255,53 @@ class AscomFocuserAPI(BasicFocuserAPI):
         log.log(_("Get focuser configuration successfully"))
         return log.return_success(_("Get focuser configuration successfully"),{"info" : self.info.get_dict()})
 
+    def _set_backlash(self, params : dict) -> None:
+        """
+            Read the backlash settings , the missing ones are not changed
+            Args :
+                params : dict # backlash : int , final_direction : int
+            Returns : None
+            Raises : ValueError , TypeError
+        """
+        backlash = params.get("backlash")
+        final_direction = params.get("final_direction")
+        if backlash is not None:
+            backlash = int(backlash)
+            if backlash < 0:
+                raise ValueError(_("Backlash must not be negative"))
+            self.info._backlash = backlash
+        if final_direction is not None:
+            final_direction = int(final_direction)
+            if final_direction not in (1,-1):
+                raise ValueError(_("Final direction must be 1 or -1"))
+            self.info._final_direction = final_direction
+
     def set_configration(self, params: dict) -> dict:
-        return super().set_configration(params)
+        """
+            Set the backlash compensation of the focuser
+            Args : {
+                "backlash" : int # steps lost when the direction changes
+                "final_direction" : int # 1 if every move ends going outward , -1 inward
+            }
+            Returns : {
+                "status" : int,
+                "message" : str,
+                "params" : {
+                    "info" : dict
+                }
+            }
+            NOTE : The next moves use the new settings , a running move is not changed
+        """
+        try:
+            self._set_backlash(params)
+        except (TypeError,ValueError) as e:
+            log.logw(_(f"Invalid backlash settings , error : {e}"))
+            return log.return_error(_("Invalid backlash settings"),{"error" : str(e)})
+        if self.motion is not None:
+            self.motion.backlash = self.info._backlash
+            self.motion.final_direction = self.info._final_direction
+        log.log(_(f"Focuser backlash {self.info._backlash} , final direction {self.info._final_direction}"))
+        return log.return_success(_("Set focuser configuration successfully"),{"info" : self.info.get_dict()})
 
     def load_configration(self) -> dict:
         return super().load_configration()
@@ -255,4 +326,155 @@ class AscomFocuserAPI(BasicFocuserAPI):
         with open(_path,mode="w+",encoding="utf-8") as file:
             file.write(dumps(self.info.get_dict(),indent=4,ensure_ascii=False))
         log.log(_("Save focuser information successfully"))
-        return log.return_success(_("Save focuser information successfully"),{})
\ No newline at end of file
+        return log.return_success(_("Save focuser information successfully"),{})
+
+    # #################################################################
+    #
+    # Focuser Basic API
+    #
+    # #################################################################
+
+    def _start_move(self, start, name : str) -> dict:
+        """
+            Start a move of the motion engine and return its operation
+            Args :
+                start : callable # starts the move , returns the Operation
+                name : str # name used in the messages
+            Returns : dict
+        """
+        if self.device is None or not self.info._is_connected:
+            log.logw(_("Focuser is not connected"))
+            return log.return_error(_("Focuser is not connected"),{})
+        try:
+            operation = start()
+        except RuntimeError as e:
+            log.loge(_(f"Failed to {name} : {e}"))
+            return log.return_error(str(e),{})
+        except InvalidValueException as e:
+            log.loge(_(f"Invalid position : {e}"))
+            return log.return_error(_("Invalid position"),{"error" : str(e)})
+        except NotConnectedException as e:
+            log.loge(_(f"Focuser is not connected : {e}"))
+            self.info._is_connected = False
+            return log.return_error(_("Focuser is not connected"),{"error" : str(e)})
+        except DriverException as e:
+            log.loge(_(f"Focuser driver error : {e}"))
+            return log.return_error(_("Focuser driver error"),{"error" : str(e)})
+        except ConnectionError as e:
+            log.loge(_(f"Network error while moving focuser , error : {e}"))
+            return log.return_error(_("Network error while moving focuser"),{"error" : str(e)})
+        self.info._is_moving = True
+        log.log(_(f"Focuser started to {name}"))
+        return log.return_success(_("Focuser is moving"),{"operation" : operation.id})
+
+    def move_step(self, params : dict) -> dict:
+        """
+            Move the focuser by a number of steps , positive is outward | 电调移动指定步数
+            Args :
+                params : {
+                    "step" : int
+                }
+            Returns : {
+                "status" : int,
+                "message" : str,
+                "params" : {
+                    "operation" : int # id of the move , its result is the final position
+                }
+            }
+        """
+        try:
+            step = int(params.get("step"))
+        except (TypeError,ValueError):
+            log.loge(_("Invalid step"))
+            return log.return_error(_("Invalid step"),{})
+        return self._start_move(lambda: self.motion.move_step(step,self._moved),"move {} steps".format(step))
+
+    def move_to(self, params : dict) -> dict:
+        """
+            Move the focuser to a position | 移动至指定位置
+            Args :
+                params : {
+                    "position" : int
+                }
+            Returns : {
+                "status" : int,
+                "message" : str,
+                "params" : {
+                    "operation" : int # id of the move , its result is the final position
+                }
+            }
+            NOTE : Moves against the final direction overshoot by the backlash first
+        """
+        try:
+            position = int(params.get("position"))
+        except (TypeError,ValueError):
+            log.loge(_("Invalid position"))
+            return log.return_error(_("Invalid position"),{})
+        return self._start_move(lambda: self.motion.move_to(position,self._moved),"move to {}".format(position))
+
+    def _moved(self, position : int) -> None:
+        """Called by the motion engine as soon as the focuser stopped"""
+        self.info._is_moving = False
+        self.info._current_position = position
+
+    def abort_movement(self) -> dict:
+        """
+            Stop the focuser | 停止
+            Returns : {
+                "status" : int,
+                "message" : str,
+                "params" : None
+            }
+        """
+        if self.device is None or not self.info._is_connected:
+            log.logw(_("Focuser is not connected"))
+            return log.return_error(_("Focuser is not connected"),{})
+        operation = self.motion.operation
+        try:
+            if operation is None or operation.is_finished or not operations.cancel(operation.id):
+                self.device.Halt()
+        except NotImplementedException as e:
+            log.loge(_(f"Focuser can not halt : {e}"))
+            return log.return_error(_("Focuser can not halt"),{"error" : str(e)})
+        except DriverException as e:
+            log.loge(_(f"Focuser driver error : {e}"))
+            return log.return_error(_("Focuser driver error"),{"error" : str(e)})
+        except ConnectionError as e:
+            log.loge(_(f"Network error while stopping focuser , error : {e}"))
+            return log.return_error(_("Network error while stopping focuser"),{"error" : str(e)})
+        self.info._is_moving = False
+        log.log(_("Focuser stopped"))
+        return log.return_success(_("Focuser stopped"),{})
+
+    def get_movement_status(self) -> dict:
+        """
+            Get the position and the moving state in one request
+            Args : None
+            Returns : {
+                "status" : int,
+                "message" : str,
+                "params" : {
+                    "status" : bool # is moving
+                    "position" : int
+                    "motion" : dict # backlash , learned speed and the current move
+                }
+            }
+        """
+        if self.device is None or not self.info._is_connected:
+            log.logw(_("Focuser is not connected"))
+            return log.return_error(_("Focuser is not connected"),{})
+        try:
+            moving , position = self.motion.sample()
+        except NotConnectedException as e:
+            self.info._is_connected = False
+            return log.return_error(_("Focuser is not connected"),{"error" : str(e)})
+        except (DriverException,ConnectionError) as e:
+            log.loge(_(f"Failed to get focuser status : {e}"))
+            return log.return_error(_("Failed to get focuser status"),{"error" : str(e)})
+        self.info._is_moving = moving
+        self.info._current_position = position
+        return log.return_success(_("Get focuser status successfully"),{
+            "status" : moving,
+            "position" : position,
+            "motion" : self.motion.get_dict()
+        })
@@ -0,0 +1,278 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# Focuser motion engine.
+# A move is an operation of utils.operations : Move is sent , then IsMoving
+# and Position are read in one concurrent request until the focuser stops.
+# The next check is planned from the remaining distance and the speed
+# learned from the previous moves , so the end of a move is seen a few
+# tens of milliseconds after it happens without polling all of the time.
+# Backlash is compensated by always finishing a move in the same direction ,
+# a move in the other direction overshoots by the backlash first.
+# The "then" callback of a move runs as soon as the focuser stopped , e.g.
+# to start the next exposure of the autofocus without any dead time.
+# #################################################################
+
+import threading
+from time import monotonic
+
+from libs.alpyca.asyncclient import AsyncFocuser, SyncDevice
+from utils.operations import operations
+
+from utils.lightlog import lightlog
+log = lightlog(__name__)
+
+import gettext
+_ = gettext.gettext
+
+# Bounds of the time between two checks while moving
+MIN_INTERVAL = 0.02
+MAX_INTERVAL = 0.25
+# Speed used before the first move is measured , steps per second
+DEFAULT_SPEED = 500.0
+# Seconds an absolute focuser may take to report IsMoving after Move
+START_GRACE = 0.5
+# Weight of the newest move in the speed estimate
+SPEED_ALPHA = 0.3
+
+class FocuserMotion(object):
+    """
+        Moves of one Alpaca focuser
+    """
+
+    def __init__(self, device, backlash : int = 0, final_direction : int = 1,
+                    absolute : bool = True, max_step : int = None, timeout : float = 60) -> None:
+        """
+            Args :
+                device : libs.alpyca.focuser.Focuser # connected blocking device
+                backlash : int # steps lost when the direction changes
+                final_direction : int # 1 if every move must end going outward , -1 inward
+                absolute : bool # Absolute property of the focuser
+                max_step : int # MaxStep property of the focuser
+                timeout : float # seconds for one move
+        """
+        self.device = device
+        self.batch = SyncDevice(AsyncFocuser(device.address,device.device_number))
+        self.backlash = max(int(backlash),0)
+        self.final_direction = 1 if final_direction >= 0 else -1
+        self.absolute = absolute
+        self.max_step = max_step
+        self.timeout = timeout
+
+        # A relative focuser does not know where it is , count the steps from where it started
+        self.position = None if absolute else 0
+        self.is_moving = False
+        self.speed = DEFAULT_SPEED
+        self.operation = None
+        self._lock = threading.Lock()
+
+    # #################################################################
+    # Sampling
+    # #################################################################
+
+    def sample(self) -> tuple:
+        """
+            Read IsMoving and Position in one round trip
+            Returns : (is_moving , position) # position is None for a relative focuser
+        """
+        if not self.absolute:
+            self.is_moving = bool(self.batch.get("IsMoving"))
+            return self.is_moving , self.position
+        values = self.batch.get_many("IsMoving","Position")
+        for value in values.values():
+            if isinstance(value,Exception):
+                raise value
+        self.is_moving = bool(values["IsMoving"])
+        self.position = int(values["Position"])
+        return self.is_moving , self.position
+
+    def estimate(self, distance : int) -> float:
+        """
+            Seconds needed to move the given number of steps
+        """
+        return abs(distance) / max(self.speed,1.0)
+
+    def _learn(self, steps : int, seconds : float) -> None:
+        """Update the speed with a finished move"""
+        if steps > 0 and seconds > 0.05:
+            self.speed += SPEED_ALPHA * (steps / seconds - self.speed)
+
+    # #################################################################
+    # Moves
+    # #################################################################
+
+    def _clamp(self, position : int) -> int:
+        position = int(position)
+        if not self.absolute:
+            return position
+        position = max(position,0)
+        if self.max_step:
+            position = min(position,self.max_step)
+        return position
+
+    def plan(self, start : int, target : int) -> list:
+        """
+            Positions to move to , with the backlash overshoot if needed
+            Args :
+                start : int # current position
+                target : int
+            Returns : list # one or two positions
+        """
+        direction = 1 if target > start else -1
+        if self.backlash and target != start and direction != self.final_direction:
+            overshoot = self._clamp(target - self.final_direction * self.backlash)
+            if overshoot != target:
+                return [overshoot,target]
+        return [target]
+
+    def move_to(self, target : int, then = None, name : str = "focuser.move"):
+        """
+            Start moving to an absolute position , returns at once
+            Args :
+                target : int
+                then : callable # called with the final position as soon as the focuser stopped
+                name : str # name of the operation
+            Returns : Operation # its result is the final position
+        """
+        with self._lock:
+            if self.operation is not None and not self.operation.is_finished:
+                raise RuntimeError(_("Focuser is moving"))
+            target = self._clamp(target)
+            start = self.position
+            if self.absolute:
+                # Another program may have moved it , start from the real position
+                moving , start = self.sample()
+                if moving:
+                    raise RuntimeError(_("Focuser is moving"))
+            stages = self.plan(start if start is not None else target,target)
+            state = {
+                "stages" : stages,
+                "started" : monotonic(),
+                "stage_started" : monotonic(),
+                "stage_from" : start,
+                "operation" : None,
+            }
+
+            def remaining(position : int) -> int:
+                # Steps left along the planned path
+                points = [position] + state["stages"]
+                return sum(abs(b - a) for a , b in zip(points,points[1:]))
+
+            total = remaining(start) if start is not None else 0
+            self._send(stages[0],start)
+            self.is_moving = True
+
+            def check() -> bool:
+                moving , position = self.sample()
+                operation = state["operation"]
+                elapsed = monotonic() - state["stage_started"]
+                if moving:
+                    # Plan the next check at the predicted end of the move
+                    if operation is not None:
+                        if self.absolute:
+                            left = self.estimate(state["stages"][0] - position)
+                        else:
+                            # A relative focuser only tells where it is when it stops
+                            left = self.estimate(state["stages"][0] - state["stage_from"]) - elapsed
+                        operation.interval = min(max(left * 0.8,MIN_INTERVAL),MAX_INTERVAL)
+                    return False
+                if self.absolute and position != state["stages"][0] and elapsed < START_GRACE:
+                    # Some drivers report IsMoving a little after Move
+                    return False
+                finished = state["stages"].pop(0)
+                if not self.absolute:
+                    # The commanded steps are the only measure of a relative move
+                    position = self.position = finished
+                if state["stage_from"] is not None:
+                    self._learn(abs(position - state["stage_from"]),elapsed)
+                if state["stages"]:
+                    # Backlash overshoot done , come back in the final direction
+                    state["stage_from"] = self.position
+                    state["stage_started"] = monotonic()
+                    self._send(state["stages"][0],state["stage_from"])
+                    if operation is not None:
+                        operation.interval = MIN_INTERVAL
+                    return False
+                return True
+
+            def finish() -> int:
+                log.logd(_("Focuser reached {} in {:.2f}s").format(self.position,monotonic() - state["started"]))
+                if then is not None:
+                    then(self.position)
+                return self.position
+
+            def progress() -> float:
+                if not total or self.position is None or not state["stages"]:
+                    return None
+                return round(min(max(1 - remaining(self.position) / total,0.0),1.0),3)
+
+            operation = operations.submit(name,check,cancel=self.halt,finish=finish,progress=progress,
+                                            timeout=self.timeout,interval=MIN_INTERVAL,owner="focuser")
+            state["operation"] = operation
+            self.operation = operation
+            return operation
+
+    def move_step(self, steps : int, then = None):
+        """
+            Start moving by a number of steps , positive is outward
+            Returns : Operation
+        """
+        if self.position is None and self.absolute:
+            self.sample()
+        current = self.position if self.position is not None else 0
+        return self.move_to(current + int(steps),then,"focuser.move_step")
+
+    def _send(self, position : int, start : int) -> None:
+        """Send Move , relative focusers get the number of steps"""
+        if self.absolute:
+            self.device.Move(position)
+        else:
+            self.device.Move(position - (start or 0))
+
+    def halt(self) -> None:
+        """Stop the focuser"""
+        self.device.Halt()
+        self.is_moving = False
+
+    def wait(self, timeout : float = None) -> int:
+        """
+            Block until the current move is finished
+            Returns : int # final position
+            Raises : RuntimeError if the move failed
+        """
+        operation = self.operation
+        if operation is None:
+            return self.position
+        if not operation.wait(timeout if timeout is not None else self.timeout):
+            raise RuntimeError(_("Focuser move timeout"))
+        if operation.status != "done":
+            raise RuntimeError(_("Focuser move {} : {}").format(operation.status,operation.error or ""))
+        return operation.result
+
+    def get_dict(self) -> dict:
+        return {
+            "position" : self.position,
+            "is_moving" : self.is_moving,
+            "backlash" : self.backlash,
+            "final_direction" : self.final_direction,
+            "speed" : round(self.speed,1),
+            "operation" : self.operation.get_dict() if self.operation is not None else None
+        }
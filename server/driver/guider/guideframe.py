@@ -0,0 +1,285 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# Guide camera frame stream.
+# get_star_image returns the full 16 bits frame in base64 , it is decoded
+# once into a reused numpy buffer , downsampled and stretched to 8 bits ,
+# and only the tiles which changed since the last frame are sent to the
+# subscribers.
+# #################################################################
+
+import base64
+import binascii
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from utils.lightlog import lightlog
+log = lightlog(__name__)
+
+import gettext
+_ = gettext.gettext
+
+# Weight of the new frame in the stretch bounds
+STRETCH_ALPHA = 0.2
+# Black point and minimum white point of the stretch , in noise sigma above the background
+BLACK_SIGMA = 2
+WHITE_SIGMA = 50
+
+class GuideFrameEncoder(object):
+    """
+        Decode the star images and encode the changes between them
+    """
+
+    def __init__(self, binning : int = 2, tile : int = 32, threshold : int = 24,
+                    keyframe_every : int = 50, level : int = 1) -> None:
+        """
+            Args :
+                binning : int # downsample factor of the preview
+                tile : int # size of the tiles in preview pixels
+                threshold : int # a tile is sent if any pixel changed more than this (0-255)
+                keyframe_every : int # send the full frame every N frames
+                level : int # zlib compression level
+        """
+        self.binning = max(int(binning),1)
+        self.tile = tile
+        self.threshold = threshold
+        self.keyframe_every = keyframe_every
+        self.level = level
+
+        self.raw = None # 16 bits frame
+        self.preview = None # 8 bits frame of the last update
+        self._previous = None # 8 bits frame the subscribers have , only the sent tiles are updated
+        self._bounds = None # stretch bounds
+        self._count = 0
+        # The buffers are shared , hold it from decode() until the frame is encoded
+        self.lock = threading.RLock()
+
+    def reset(self) -> None:
+        """The next frame will be a keyframe"""
+        with self.lock:
+            self._previous = None
+
+    def decode(self, pixels : str, width : int, height : int) -> np.ndarray:
+        """
+            Decode the base64 pixels of get_star_image into the reused buffer
+            Args :
+                pixels : str # 16 bits per pixel , row-major order , base64 encoded
+                width : int
+                height : int
+            Returns : numpy.ndarray # uint16 (height , width) , valid until the next call
+        """
+        data = binascii.a2b_base64(pixels)
+        if len(data) != width * height * 2:
+            raise ValueError(_("Star image size {} does not match {}x{}").format(len(data),width,height))
+        with self.lock:
+            if self.raw is None or self.raw.shape != (height,width):
+                self.raw = np.empty((height,width),dtype=np.uint16)
+                self.reset()
+            np.copyto(self.raw,np.frombuffer(data,dtype="<u2").reshape(height,width))
+            return self.raw
+
+    def stretch(self, raw : np.ndarray) -> np.ndarray:
+        """
+            Downsample by block mean and stretch to 8 bits with the percentiles of the frame
+            Args :
+                raw : numpy.ndarray # uint16
+            Returns : numpy.ndarray # uint8
+        """
+        b = self.binning
+        if b > 1:
+            h,w = raw.shape[0] // b * b,raw.shape[1] // b * b
+            frame = raw[:h,:w].reshape(h // b,b,w // b,b).mean(axis=(1,3),dtype=np.float32)
+        else:
+            frame = raw.astype(np.float32)
+        # Background at the bottom , the noise stays in the dark levels so it does not
+        # change the tiles of every frame
+        sample = frame[::2,::2]
+        median = float(np.median(sample))
+        sigma = 1.4826 * float(np.median(np.abs(sample - median)))
+        low = median - BLACK_SIGMA * sigma
+        high = max(float(np.percentile(frame,99.9)),median + WHITE_SIGMA * sigma)
+        # Smooth the stretch , otherwise every pixel changes when the bounds jump
+        if self._bounds is not None and self._previous is not None:
+            low = self._bounds[0] + STRETCH_ALPHA * (low - self._bounds[0])
+            high = self._bounds[1] + STRETCH_ALPHA * (high - self._bounds[1])
+        self._bounds = (low,high)
+        scale = 255.0 / max(high - low,1.0)
+        np.subtract(frame,low,out=frame)
+        np.multiply(frame,scale,out=frame)
+        np.clip(frame,0,255,out=frame)
+        if self.preview is None or self.preview.shape != frame.shape:
+            self.preview = np.empty(frame.shape,dtype=np.uint8)
+            self.reset()
+        np.copyto(self.preview,frame,casting="unsafe")
+        return self.preview
+
+    def _pack(self, data : np.ndarray) -> str:
+        return base64.b64encode(zlib.compress(np.ascontiguousarray(data).tobytes(),self.level)).decode("ascii")
+
+    def encode(self, frame : int, raw : np.ndarray, star_pos = None) -> dict:
+        """
+            Encode the changes of the frame since the last one
+            Args :
+                frame : int # frame number
+                raw : numpy.ndarray # uint16 frame from decode()
+                star_pos : list # star centroid in the raw frame
+            Returns : dict # None if nothing changed
+                frame : int
+                width , height : int # preview size
+                binning : int
+                keyframe : bool
+                tiles : list # [x , y , width , height , zlib + base64 uint8 data]
+        """
+        with self.lock:
+            return self._encode(frame,raw,star_pos)
+
+    def _encode(self, frame : int, raw : np.ndarray, star_pos) -> dict:
+        preview = self.stretch(raw)
+        height,width = preview.shape
+        self._count += 1
+        keyframe = self._previous is None or (self.keyframe_every and self._count % self.keyframe_every == 0)
+        tiles = []
+        if keyframe:
+            tiles.append([0,0,width,height,self._pack(preview)])
+        else:
+            t = self.tile
+            # Largest change of every tile in one pass
+            diff = np.abs(preview.astype(np.int16) - self._previous)
+            th,tw = -(-height // t),-(-width // t)
+            padded = np.zeros((th * t,tw * t),dtype=np.int16)
+            padded[:height,:width] = diff
+            changed = padded.reshape(th,t,tw,t).max(axis=(1,3)) > self.threshold
+            if changed.sum() * 2 > changed.size:
+                # Most of the frame changed , a keyframe is smaller
+                keyframe = True
+                tiles.append([0,0,width,height,self._pack(preview)])
+            else:
+                for ty,tx in zip(*np.nonzero(changed)):
+                    y,x = int(ty) * t,int(tx) * t
+                    block = preview[y:y + t,x:x + t]
+                    tiles.append([x,y,block.shape[1],block.shape[0],self._pack(block)])
+                    # The small changes of the tiles not sent add up until they cross the threshold
+                    self._previous[y:y + t,x:x + t] = block
+        if keyframe:
+            self._previous = preview.copy()
+        if not tiles:
+            return None
+        return {
+            "frame" : frame,
+            "width" : width,
+            "height" : height,
+            "binning" : self.binning,
+            "keyframe" : bool(keyframe),
+            "star_pos" : star_pos,
+            "tiles" : tiles,
+        }
+
+class GuideFrameStream(object):
+    """
+        Fetch the star image after every guide frame and send the changes to the subscribers
+    """
+
+    def __init__(self, fetch, interval : float = 1.0, encoder : GuideFrameEncoder = None) -> None:
+        """
+            Args :
+                fetch : callable # returns (frame , uint16 frame from decode() , star_pos) , or None
+                interval : float # minimum seconds between two frames , usually the guide exposure
+                encoder : GuideFrameEncoder
+        """
+        self.fetch = fetch
+        self.interval = interval
+        self.encoder = encoder or GuideFrameEncoder()
+
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._new_frame = threading.Event()
+        self._thread = None
+        self._last = 0.0
+
+    def subscribe(self, callback) -> None:
+        """
+            Add a subscriber , the stream starts with the first one
+            Args :
+                callback : callable # called with the dict of GuideFrameEncoder.encode
+            Returns : None
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+            # The new subscriber has nothing , start with a keyframe
+            self.encoder.reset()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,name="guide-frame-stream",daemon=True)
+                self._thread.start()
+        self._new_frame.set()
+
+    def unsubscribe(self, callback) -> None:
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+        self._new_frame.set()
+
+    @property
+    def active(self) -> bool:
+        return bool(self._subscribers)
+
+    def notify(self) -> None:
+        """
+            Called when PHD2 finished a frame , must not block
+            Args : None
+            Returns : None
+        """
+        if self._subscribers:
+            self._new_frame.set()
+
+    def _run(self) -> None:
+        while True:
+            self._new_frame.wait()
+            self._new_frame.clear()
+            with self._lock:
+                subscribers = list(self._subscribers)
+                if not subscribers:
+                    self._thread = None
+                    return
+            # Do not fetch faster than the guide cadence
+            delay = self._last + self.interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._last = time.monotonic()
+            try:
+                # Another get_star_image must not decode into the buffer before it is encoded
+                with self.encoder.lock:
+                    image = self.fetch()
+                    if image is None:
+                        continue
+                    message = self.encoder.encode(*image)
+            except Exception as e:
+                log.loge(_("Failed to encode the guide frame : {}").format(str(e)))
+                continue
+            if message is None:
+                continue
+            for callback in subscribers:
+                try:
+                    callback(message)
+                except Exception as e:
+                    log.loge(_("Guide frame subscriber failed : {}").format(str(e)))
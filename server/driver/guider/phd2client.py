@@ -22,14 +22,17 @@ from server.basic.guider import TcpSocket,BasicGuiderAPI,BasicGuiderInfo
 from server.driver.guider.phd2exception import PHD2Success as success
 from server.driver.guider.phd2exception import PHD2Error as error
 from server.driver.guider.phd2exception import PHD2Warning as warning
+from server.driver.guider.settle import SettleDetector
+from server.driver.guider.guideframe import GuideFrameStream
 
-from utils.utility import switch
+from utils.dispatch import Dispatcher, handler
 from utils.lightlog import lightlog
 log = lightlog(__name__)
 
 import gettext
 _ = gettext.gettext
 
+import binascii
 import time
 import json
 import socket
@@ -41,8 +44,8 @@ class SettleParams():
         SETTLE is an object with the following attributes:
     """
     pixels = 1.5 # maximum guide distance for guiding to be considered stable or "in-range"
-    time : 8 # minimum time to be in-range before considering guiding to be stable
-    timeout : 40 # time limit before settling is considered to have failed
+    time = 8 # minimum time to be in-range before considering guiding to be stable
+    timeout = 40 # time limit before settling is considered to have failed
 
     def get_dict(self) -> dict:
         return {
@@ -319,6 +322,18 @@ class PHD2ClientInfo(BasicGuiderInfo):
             "starlost_avgdist" : self.starlost_avgdist,
         }
 
+# Flags of the client changed by each PHD2 application state
+APP_STATES = {
+    "Stopped" : {"_is_calibrating" : False,"_is_looping" : False,"_is_guiding" : False,"_is_settling" : False},
+    "Selected" : {"_is_selected" : True,"_is_looping" : False,"_is_guiding" : False,"_is_settling" : False,
+                    "_is_calibrating" : False},
+    "Calibrating" : {"_is_calibrating" : True,"_is_guiding" : False},
+    "Guiding" : {"_is_guiding" : True,"_is_calibrating" : False},
+    "LostLock" : {"_is_guiding" : True,"_is_starlocklost" : True},
+    "Paused" : {"_is_guiding" : False,"_is_calibrating" : False},
+    "Looping" : {"_is_looping" : True},
+}
+
 class PHD2Client(BasicGuiderAPI):
     """
         PHD2 client based on TCP/IP connection
@@ -332,6 +347,13 @@ class PHD2Client(BasicGuiderAPI):
         self.response = None
         self.lock = threading.Lock()
         self.cond = threading.Condition()
+        # Settle statistics fed by the GuideStep events
+        self.settle = SettleDetector()
+        # Live guide frames , only fetched while someone subscribed
+        self.frames = GuideFrameStream(self._fetch_star_frame,self.info.exposure / 1000)
+        # Routing table of the PHD2 events
+        self.dispatcher = Dispatcher(__name__)
+        self.dispatcher.bind(self)
 
     def __del__(self) -> None:
         if self.info._is_guiding:
@@ -627,88 +649,10 @@ class PHD2Client(BasicGuiderAPI):
         event = params.get('Event')
         message = params
 
-        for case in switch(event):
-            if case("Version"):
-                self._version(message)
-                break
-            if case("LockPositionSet"):
-                self._lock_position_set(message)
-                break
-            if case("Calibrating"):
-                self._calibrating(message)
-                break
-            if case("CalibrationComplete"):
-                self._calibration_completed(message)
-                break
-            if case("StarSelected"):
-                self._star_selected(message)
-                break
-            if case("StartGuiding"):
-                self._start_guiding()
-                break
-            if case("Paused"):
-                self._paused()
-                break
-            if case("StartCalibration"):
-                self._start_calibration(message)
-                break
-            if case("AppState"):
-                self._app_state(message)
-                break
-            if case("CalibrationFailed"):
-                self._calibration_failed(message)
-                break
-            if case("CalibrationDataFlipped"):
-                self._calibration_data_flipped(message)
-                break
-            if case("LockPositionShiftLimitReached"):
-                self._lock_position_shift_limit_reached()
-                break
-            if case("LoopingExposures"):
-                self._looping_exposures(message)
-                break
-            if case("LoopingExposuresStopped"):
-                self._looping_exposures_stopped()
-                break
-            if case("SettleBegin"):
-                self._settle_begin()
-                break
-            if case("Settling"):
-                self.settling(message)
-                break
-            if case("SettleDone"):
-                self._settle_done(message)
-                break
-            if case("StarLost"):
-                self._star_lost(message)
-                break
-            if case("GuidingStopped"):
-                self._guiding_stopped()
-                break
-            if case("Resumed"):
-                self._resumed()
-                break
-            if case("GuideStep"):
-                self._guide_step(message)
-                break
-            if case("GuidingDithered"):
-                self._guiding_dithered(message)
-                break
-            if case("LockPositionLost"):
-                self._lock_position_lost()
-                break
-            if case("Alert"):
-                self._alert(message)
-                break
-            if case("GuideParamChange"):
-                self._guide_param_change(message)
-                break
-            if case("ConfigurationChange"):
-                self._configuration_change()
-                break
+        if not self.dispatcher.dispatch((event,),message):
             log.loge(_(f"Unknown event : {event}"))
-            break
 
+    @handler("Version")
     def _version(self,message : dict) -> None:
         """
             Get PHD2 version
@@ -724,6 +668,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info.msgversion = message.get("MsgVersion")
         log.logd(_(f"PHD2 message version : {self.info.msgversion}"))
 
+    @handler("LockPositionSet")
     def _lock_position_set(self, message : dict) -> None:
         """
             Get lock position set
@@ -736,6 +681,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info._lock_position_y = message.get("Y")
         log.logd(_(f"Star lock position : {[self.info._lock_position_x, self.info._lock_position_y]}"))
 
+    @handler("Calibrating")
     def _calibrating(self,message : dict) -> None:
         """
             Get calibrating state
@@ -759,6 +705,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info.c_status._state = message.get("State")
         log.logd(_(f"Star calibrating state : {self.info.c_status._state}"))
 
+    @handler("CalibrationComplete")
     def _calibration_completed(self,message : dict) -> None:
         """
             Get calibration completed state
@@ -770,6 +717,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info.mount = message.get("Mount")
         log.logd(_(f"Mount : {self.info.mount}"))
 
+    @handler("StarSelected")
     def _star_selected(self,message : dict) -> None:
         """
             Get star selected state
@@ -782,6 +730,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info.star_selected_y = message.get("Y")
         log.logd(_(f"Star selected position : [{self.info.star_selected_x},{self.info.star_selected_y}]"))
     
+    @handler("StartGuiding")
     def _start_guiding(self) -> None:
         """
             Get start guiding state
@@ -793,6 +742,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info._is_guiding = True
         log.logd(_(f"Start guiding"))
 
+    @handler("Paused")
     def _paused(self) -> None:
         """
             Get paused state
@@ -805,6 +755,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info._is_calibrating = False
         log.log(success.Paused.value)
 
+    @handler("StartCalibration")
     def _start_calibration(self, message : dict) -> None:
         """
             Get start calibration state
@@ -818,6 +769,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info._is_guiding = False
         log.log(_("Start calibration"))
 
+    @handler("AppState")
     def _app_state(self, message : dict) -> None:
         """
             Get app state
@@ -827,40 +779,11 @@ class PHD2Client(BasicGuiderAPI):
                 None
         """
         state = message.get("State")
-        for case in switch(state):
-            if case("Stopped"):
-                self.info._is_calibrating = False
-                self.info._is_looping = False
-                self.info._is_guiding = False
-                self.info._is_settling = False
-                break
-            if case("Selected"):
-                self.info._is_selected = True
-                self.info._is_looping = False
-                self.info._is_guiding = False
-                self.info._is_settling = False
-                self.info._is_calibrating = False
-                break
-            if case("Calibrating"):
-                self.info._is_calibrating = True
-                self.info._is_guiding = False
-                break
-            if case("Guiding"):
-                self.info._is_guiding = True
-                self.info._is_calibrating = False
-                break
-            if case("LostLock"):
-                self.info._is_guiding = True
-                self.info._is_starlocklost = True
-                break
-            if case("Paused"):
-                self.info._is_guiding = False
-                self.info._is_calibrating = False
-                break
-            if case("Looping"):
-                self.info._is_looping = True
+        for name,value in APP_STATES.get(state,{}).items():
+            setattr(self.info,name,value)
         log.logd(_(f"App state : {state}"))
 
+    @handler("CalibrationFailed")
     def _calibration_failed(self, message : dict) -> None:
         """
             Get calibration failed state
@@ -874,6 +797,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info._is_calibrated = False
         log.loge(_(f"Calibration failed , error : {self.info.last_error}"))
 
+    @handler("CalibrationDataFlipped")
     def _calibration_data_flipped(self, message : dict) -> None:
         """
             Get calibration data flipping state
@@ -885,6 +809,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info.c_status._flip = True
         log.log(_("Calibration data flipped"))
 
+    @handler("LockPositionShiftLimitReached")
     def _lock_position_shift_limit_reached(self) -> None:
         """
             Get lock position shift limit reached state
@@ -895,6 +820,7 @@ class PHD2Client(BasicGuiderAPI):
         """
         log.logw(_("Star locked position reached the edge of the camera frame"))
 
+    @handler("LoopingExposures")
     def _looping_exposures(self, message : dict) -> None:
         """
             Get looping exposures state
@@ -905,7 +831,9 @@ class PHD2Client(BasicGuiderAPI):
         """
         self.info._is_looping = True
         self.info.frame = message.get("Frame")
+        self.frames.notify()
 
+    @handler("LoopingExposuresStopped")
     def _looping_exposures_stopped(self) -> None:
         """
             Get looping exposures stopped state
@@ -917,6 +845,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info._is_looping = False
         log.log(_("Stop looping exposure"))
 
+    @handler("SettleBegin")
     def _settle_begin(self) -> None:
         """
             Get settle begin state
@@ -928,6 +857,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info._is_settling = True
         log.log(_("Star settle begin ..."))
 
+    @handler("Settling")
     def _settling(self , message : dict) -> None:
         """
             Get settling state
@@ -942,6 +872,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info._is_settling = True
         log.logd(_("Settling status : distance {} time {} star_locked {}").format(self.info._settle_distance,self.info._settle_time,self.info._settle_star_locked))
 
+    @handler("SettleDone")
     def _settle_done(self, message : dict) -> None:
         """
             Get settle done state
@@ -958,7 +889,9 @@ class PHD2Client(BasicGuiderAPI):
             log.log(_(f"Settle failed , error : {message.get('Error')}"))
             self.info._is_settled = False
         self.info._is_settling = False
+        self.settle.finish(status == 0)
 
+    @handler("StarLost")
     def _star_lost(self, message : dict) -> None:
         """
             Get star lost state
@@ -973,7 +906,9 @@ class PHD2Client(BasicGuiderAPI):
         self.info.starlost_avgdist = message.get('AvgDist')
         log.loge(_(f"Star Lost , Frame : {self.info.frame} , SNR : {self.info.starlost_snr} , StarMass : {self.info.starlost_starmass} , AvgDist : {self.info.starlost_avgdist}"))
         self.info._is_starlost = True
+        self.settle.lost()
 
+    @handler("GuidingStopped")
     def _guiding_stopped(self) -> None:
         """
             Get guiding stopped state
@@ -985,6 +920,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info._is_guiding = False
         log.log(_("Guiding Stopped"))
 
+    @handler("Resumed")
     def _resumed(self) -> None:
         """
             Get guiding resumed state
@@ -996,6 +932,7 @@ class PHD2Client(BasicGuiderAPI):
         log.log(_("Guiding Resumed"))
         self.info._is_guiding = True
 
+    @handler("GuideStep")
     def _guide_step(self , message : dict) -> None:
         """
             Get guide step state
@@ -1004,6 +941,8 @@ class PHD2Client(BasicGuiderAPI):
             Returns:
                 None
         """
+        # Stamped here with the clock of the settle detector , the Timestamp of PHD2 may come from another host
+        received = time.monotonic()
         self.info.g_status._frame = message.get("Frame")
         log.logd(_("Guide step frame : {}").format(self.info.g_status._frame))
         self.info.mount = message.get("Mount")
@@ -1045,7 +984,14 @@ class PHD2Client(BasicGuiderAPI):
         log.logd(_("Guide step StarMass : {}").format(self.info.g_status._starmass))
         self.info.g_status._hfd = message.get("HFD")
         log.logd(_("Guide step HFD : {}").format(self.info.g_status._hfd))
+
+        ra = self.info.g_status._ra_raw_distance
+        dec = self.info.g_status._dec_raw_distance
+        if ra is not None and dec is not None:
+            self.settle.update((ra * ra + dec * dec) ** 0.5,received)
+        self.frames.notify()
         
+    @handler("GuidingDithered")
     def _guiding_dithered(self, message : dict) -> None:
         """
             Get guiding dithered state
@@ -1057,6 +1003,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info.dither_dx = message.get("dx")
         self.info.dither_dy = message.get("dy")
 
+    @handler("LockPositionLost")
     def _lock_position_lost(self) -> None:
         """
             Get lock position lost state
@@ -1068,6 +1015,7 @@ class PHD2Client(BasicGuiderAPI):
         self.info._is_starlocklost = True
         log.loge(_(f"Lock Position Lost"))
 
+    @handler("Alert")
     def _alert(self, message : dict) -> None:
         """
             Get alert state
@@ -1078,6 +1026,7 @@ class PHD2Client(BasicGuiderAPI):
         """
         log.loge(_(f"Alert : {message.get('Msg')}"))
 
+    @handler("GuideParamChange")
     def _guide_param_change(self, message : dict) -> None:
         """
             Get guide param change state
@@ -1087,6 +1036,7 @@ class PHD2Client(BasicGuiderAPI):
                 None
         """
     
+    @handler("ConfigurationChange")
     def _configuration_change(self) -> None:
         """
             Get configuration change state
@@ -1131,13 +1081,15 @@ class PHD2Client(BasicGuiderAPI):
                 bool
         """
         r = json.dumps(command,separators=(',', ':'))
-        self.conn.send(r + "\r\n")
-        # wait for response
-        with self.cond:
-            while not self.response:
-                self.cond.wait()
-            response = self.response
-            self.response = None
+        # Only one request can wait for its response at a time
+        with self.lock:
+            self.conn.send(r + "\r\n")
+            # wait for response
+            with self.cond:
+                while not self.response:
+                    self.cond.wait()
+                response = self.response
+                self.response = None
         if "error" in response:
             log.loge(_(f"Guiding Error : {response.get('error').get('message')})"))
         return response
@@ -1257,15 +1209,22 @@ class PHD2Client(BasicGuiderAPI):
         if settle is None:
             settle = SettleParams()
             log.logd(_(f"Settle object not provided, using default value"))
+        elif isinstance(settle,dict):
+            _settle = SettleParams()
+            _settle.pixels = settle.get("pixels",_settle.pixels)
+            _settle.time = settle.get("time",_settle.time)
+            _settle.timeout = settle.get("timeout",_settle.timeout)
+            settle = _settle
         _params = {
             "amount" : amount,
             "raOnly" : raonly,
             "settle" : {
                 "pixels" : settle.pixels,
                 "time" : settle.time,
-                "timeouts" : settle.timeout
+                "timeout" : settle.timeout
             }
         }
+        self.settle.start(amount,settle.pixels)
         command = self.generate_command("dither",_params)
         try:
             res = self.send_command(command)
@@ -1750,6 +1709,7 @@ class PHD2Client(BasicGuiderAPI):
             return log.return_error(_("Get exposure error"),{"error":res.get('error')})
         exposure = res.get('result')
         self.info.exposure = exposure
+        self.frames.interval = exposure / 1000
         log.logd(_(f"Current exposure value : {exposure}"))
         log.log(_("Get exposure successfully"))
         return log.return_success(_("Current exposure value"),{"exposure":exposure})
@@ -2061,7 +2021,7 @@ class PHD2Client(BasicGuiderAPI):
                 "message" : str,
                 "params" : dict
             }
-            NOTE : This function returns full image !
+            NOTE : This function returns full image ! Use subscribe_frames() for a live view
         """
         if not self.info._is_connected:
             log.loge(error.NotConnected.value)
@@ -2093,10 +2053,45 @@ class PHD2Client(BasicGuiderAPI):
         log.logd(_("Current image height : {self.info.image._height}"))
         self.info.image._star_pos = image.get('star_pos')
         log.logd(_("Current star position of the image : {self.info.image._star_pos}"))
-        self.info.image._pixels = image.get('pixels')
+        # Decoded once into the buffer reused by every frame
+        try:
+            self.info.image._pixels = self.frames.encoder.decode(image.get('pixels'),self.info.image._width,self.info.image._height)
+        except (ValueError,TypeError,binascii.Error) as e:
+            log.loge(_(f"Failed to decode star image : {e}"))
+            return log.return_error(_("Failed to decode star image"),{"error":e})
 
         return log.return_success(_("Get star image"),{"image":image})
 
+    def _fetch_star_frame(self):
+        """
+            Fetch the star image for the frame stream
+            Args : None
+            Returns : (frame , numpy.ndarray , star_pos) or None
+        """
+        res = self._get_star_image()
+        if res.get("status") != 0:
+            return None
+        return self.info.image._frame,self.info.image._pixels,self.info.image._star_pos
+
+    def subscribe_frames(self, callback) -> None:
+        """
+            Receive the changed tiles of the guide frames | 订阅导星图像
+            Args :
+                callback : callable # called with a dict , see GuideFrameEncoder.encode
+            Returns : None
+            NOTE : The first message is a keyframe , the stream stops with the last subscriber
+        """
+        self.frames.subscribe(callback)
+
+    def unsubscribe_frames(self, callback) -> None:
+        """
+            Stop receiving the guide frames | 取消订阅导星图像
+            Args :
+                callback : callable
+            Returns : None
+        """
+        self.frames.unsubscribe(callback)
+
     def _get_use_subframes(self) -> dict:
         """
             Get the use subframes | 获取是否使用子画幅
@@ -2160,10 +2155,11 @@ class PHD2Client(BasicGuiderAPI):
         if roi is None:
             roi = [0,0,self.info._width,self.info._height]
         _params = {
-            "settle" : settle,
+            "settle" : settle.get_dict(),
             "recalibrate" : recalibrate,
             "roi" : roi
         }
+        self.settle.start(0,settle.pixels)
         command = self.generate_command("guide",_params)
         try:
             res = self.send_command(command)
@@ -2799,10 +2795,20 @@ class PHD2Client(BasicGuiderAPI):
                 "status" : int,
                 "message" : str,
                 "params" : {
-                    "status" : int,
+                    "status" : dict # settled , moving statistics and predicted seconds to settle
                 }
             }
         """
+        return log.return_success(_("Get dither status successfully"),{"status" : self.settle.get_dict()})
+
+    def wait_settled(self, timeout : float = None) -> bool:
+        """
+            Block until guiding is stable , the next exposure can start at once after it
+            Args :
+                timeout : float # seconds , None to wait forever
+            Returns : bool # False if timeout
+        """
+        return self.settle.wait(timeout)
 
     def get_dither_result(self) -> dict:
         """
@@ -0,0 +1,229 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# Settle detector fed by the GuideStep events.
+# PHD2 only reports SettleDone after the error stayed under the limit for
+# the whole settle time , which is often much longer than needed.
+# Here the guide error is tracked with an exponentially weighted mean and
+# variance , guiding is settled as soon as mean + k * std stays under the
+# limit for a few frames. SettleDone is still the upper bound.
+# The settle durations of the recent dithers are kept to predict how long
+# the next dither will take.
+# All of the times are time.monotonic() , the GuideSteps are stamped when
+# they are received so the clock of the PHD2 host does not matter.
+# #################################################################
+
+from collections import deque
+import math
+import threading
+import time
+
+from utils.lightlog import lightlog
+log = lightlog(__name__)
+
+import gettext
+_ = gettext.gettext
+
+class SettleDetector(object):
+    """
+        Streaming statistics of the guide error after a dither
+    """
+
+    def __init__(self, pixels : float = 1.5, alpha : float = 0.3,
+                    sigma : float = 1.0, min_frames : int = 3, history : int = 20) -> None:
+        """
+            Args :
+                pixels : float # the guide error limit in pixels
+                alpha : float # weight of the newest frame in the moving statistics
+                sigma : float # mean + sigma * std must be under the limit
+                min_frames : int # frames in range before guiding is considered stable
+                history : int # number of the dithers used for the prediction
+        """
+        self.pixels = pixels
+        self.alpha = alpha
+        self.sigma = sigma
+        self.min_frames = min_frames
+
+        self._cond = threading.Condition()
+        self._history = deque(maxlen=history)
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the statistics of the current dither"""
+        with self._cond:
+            self.mean = None
+            self.variance = 0.0
+            self.frames = 0
+            self.in_range_frames = 0
+            self.in_range_since = None
+            self.dither_amount = 0.0
+            self.dither_time = None
+            self.settled = False
+            self.settled_time = None
+            self.last_distance = None
+
+    def start(self, amount : float = 0.0, pixels : float = None) -> None:
+        """
+            Called when a dither or a guide command is sent
+            Args :
+                amount : float # dither amount in pixels
+                pixels : float # the settle limit of this command
+            Returns : None
+        """
+        self.reset()
+        with self._cond:
+            if pixels is not None:
+                self.pixels = pixels
+            self.dither_amount = amount
+            self.dither_time = time.monotonic()
+
+    def update(self, distance : float, timestamp : float = None) -> bool:
+        """
+            Add the guide error of a frame
+            Args :
+                distance : float # the guide error in pixels
+                timestamp : float # time.monotonic() when the frame was received , now by default
+            Returns : bool # whether guiding is settled
+        """
+        if distance is None:
+            return self.settled
+        timestamp = timestamp if timestamp is not None else time.monotonic()
+        with self._cond:
+            self.frames += 1
+            self.last_distance = distance
+            if self.mean is None:
+                self.mean = distance
+                self.variance = 0.0
+            else:
+                # Exponentially weighted mean and variance in one pass
+                diff = distance - self.mean
+                increment = self.alpha * diff
+                self.mean += increment
+                self.variance = (1 - self.alpha) * (self.variance + diff * increment)
+
+            if distance <= self.pixels and self.upper_bound() <= self.pixels:
+                if self.in_range_since is None:
+                    self.in_range_since = timestamp
+                self.in_range_frames += 1
+            else:
+                self.in_range_since = None
+                self.in_range_frames = 0
+                if self.settled:
+                    log.logw(_("Guiding is not stable anymore , error {:.2f} pixels").format(distance))
+                self.settled = False
+
+            if not self.settled and self.in_range_frames >= self.min_frames:
+                self._mark_settled(timestamp)
+            return self.settled
+
+    def upper_bound(self) -> float:
+        """mean + sigma * std of the guide error"""
+        if self.mean is None:
+            return math.inf
+        return self.mean + self.sigma * math.sqrt(max(self.variance,0.0))
+
+    def _mark_settled(self, timestamp : float) -> None:
+        self.settled = True
+        self.settled_time = timestamp
+        if self.dither_time is not None:
+            duration = max(timestamp - self.dither_time,0.0)
+            self._history.append((self.dither_amount,duration))
+            log.log(_("Guiding settled in {:.1f}s after dither of {} pixels").format(duration,self.dither_amount))
+        self._cond.notify_all()
+
+    def finish(self, success : bool) -> None:
+        """
+            Called with the SettleDone event of PHD2
+            Args :
+                success : bool
+            Returns : None
+        """
+        with self._cond:
+            if success and not self.settled:
+                self._mark_settled(time.monotonic())
+            self.dither_time = None
+            self._cond.notify_all()
+
+    def lost(self) -> None:
+        """The guide star is lost , nothing is stable"""
+        with self._cond:
+            self.in_range_since = None
+            self.in_range_frames = 0
+            self.settled = False
+
+    def wait(self, timeout : float = None) -> bool:
+        """
+            Block until guiding is settled
+            Args :
+                timeout : float # seconds , None to wait forever
+            Returns : bool # False if timeout
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.settled,timeout)
+
+    def predict(self, amount : float = None) -> float:
+        """
+            Predict the settle duration of a dither from the recent dithers
+            Args :
+                amount : float # dither amount , the current one by default
+            Returns : float # seconds , None if there is no history
+        """
+        with self._cond:
+            history = list(self._history)
+            amount = self.dither_amount if amount is None else amount
+        if not history:
+            return None
+        durations = [duration for _amount,duration in history]
+        amounts = [dither for dither,_duration in history]
+        mean_duration = sum(durations) / len(durations)
+        mean_amount = sum(amounts) / len(amounts)
+        # Bigger dithers take longer , scale with a least squares slope if the amounts vary
+        spread = sum((a - mean_amount) ** 2 for a in amounts)
+        if spread <= 0:
+            return mean_duration
+        slope = sum((a - mean_amount) * (d - mean_duration) for a,d in history) / spread
+        return max(mean_duration + slope * (amount - mean_amount),0.0)
+
+    def remaining(self) -> float:
+        """
+            Predicted seconds until guiding is settled
+            Args : None
+            Returns : float # 0 if settled , None if unknown
+        """
+        if self.settled:
+            return 0.0
+        predicted = self.predict()
+        if predicted is None or self.dither_time is None:
+            return None
+        return max(predicted - (time.monotonic() - self.dither_time),0.0)
+
+    def get_dict(self) -> dict:
+        return {
+            "settled" : self.settled,
+            "mean" : self.mean,
+            "std" : math.sqrt(max(self.variance,0.0)),
+            "frames" : self.frames,
+            "in_range_frames" : self.in_range_frames,
+            "last_distance" : self.last_distance,
+            "pixels" : self.pixels,
+            "predicted" : self.predict(),
+            "remaining" : self.remaining(),
+        }
@@ -18,14 +18,17 @@ Boston, MA 02110-1301, USA.
 
 """
 
+import asyncio
 from json import JSONDecodeError, dumps
 from os import getcwd, mkdir, path
-from re import match
 import socket
+import time
 from time import sleep
 
+from libs.alpyca.asyncclient import AsyncTelescope, SyncDevice
 from libs.alpyca.telescope import Telescope,TelescopeAxes,EquatorialCoordinateType
-from libs.alpyca.exceptions import (DriverException,
+from libs.alpyca.exceptions import (AlpacaRequestException,
+                                        DriverException,
                                         ParkedException,
                                         SlavedException,
                                         NotConnectedException,
@@ -35,10 +38,15 @@ from libs.alpyca.exceptions import (DriverException,
 
 from server.basic.telescope import BasicTelescopeAPI,BasicTelescopeInfo
 
+from utils.coordinates import format_dec, format_ra, j2000_to_jnow, parse_dec, parse_ra, parse_sexagesimal, separation
 from utils.i18n import _
+from utils.operations import operations
 from utils.lightlog import lightlog
 logger = lightlog(__name__)
 
+# A goto to a target closer than this (degrees) is not needed
+GOTO_TOLERANCE = 10 / 3600
+
 class AscomTelescopeAPI(BasicTelescopeAPI):
     """
         ASCOM Telescope API Interface based on Alpyca.\n
@@ -53,6 +61,8 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
         """
         self.info = BasicTelescopeInfo()
         self.device = None
+        # Async twin of the device , reads several properties in one concurrent batch
+        self._batch = None
 
     def __del__(self) -> None:
         """
@@ -133,6 +143,8 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
             if res.get("status") != 0:
                 logger.loge(res.get("message"))
                 return logger.return_error(res.get("message"),{"error":res.get("params",{}).get("error")})
+        # The operations can not be tracked without the connection
+        operations.cancel_all("telescope")
         # Trying to disconnect from the server , however this just destroys the connection not the server
         try:
             self.device.Connected = False
@@ -144,6 +156,7 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
             return logger.return_error(_("Network error while disconnecting from telescope"),{"error":str(e)})
         # If disconnecting from the server succeeded, clear the variables
         self.device = None
+        self._batch = None
         self.info._is_connected = False
         logger.log(_("Disconnected from server successfully"))
         return logger.return_success(_("Disconnected from server successfully"),{})
@@ -501,43 +514,55 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
                 logger.loge(_("AZ/ALT mode is not available"))
                 return logger.return_error(_("AZ/ALT mode is not available"),{})
             # Check if the coordinates provided are valid
-            if not isinstance(_az,str) or not isinstance(_alt,str) or not match("\d{2}:\d{2}:\d{2}",_az) or not match("\d{2}:\d{2}:\d{2}",_alt):
+            try:
+                _target_az = parse_sexagesimal(_az) % 360.0
+                _target_alt = parse_sexagesimal(_alt)
+                if not -90 <= _target_alt <= 90:
+                    raise ValueError(_alt)
+            except ValueError:
                 logger.loge(_("Invalid AZ or Alt coordinate value"))
                 return logger.return_error(_("Invalid AZ or Alt coordinate value"),{})
             az_alt_flag = True
         # This means GEM or CEM telescope
         if _ra and _dec:
-            if not isinstance(_ra,str) or not isinstance(_dec,str) or not match("\d{2}:\d{2}:\d{2}",_az) or not match("\d{2}:\d{2}:\d{2}",_dec):
+            try:
+                _target_ra = parse_ra(_ra)
+                _target_dec = parse_dec(_dec)
+            except ValueError:
                 logger.loge(_("Invalid RA or Dec coordinate value"))
                 return logger.return_error(_("Invalid RA or Dec coordinate value"),{})
+        elif not az_alt_flag:
+            logger.loge(_("No coordinates provided"))
+            return logger.return_error(_("No coordinates provided"),{})
         # If all of the parameters are provided , how can we choose , so just return an error
         if _az and _alt and _ra and _dec:
             logger.loge(_("Please specify RA/DEC or AZ/ALT mode in one time"))
             return logger.return_error(_("Please specify RA/DEC or AZ/ALT mode in one time"),{})
 
-        if az_alt_flag:
-            _ra = _az
-            _dec = _alt
         # If the telescope is using JNow format of the coordinates system
         # and the coordinates provided are in the J2000 format
-        if self.info.coord_system == EquatorialCoordinateType.equTopocentric and _j2000:
-            # TODO There need a coordinate convert
-            pass
-        
-        _ra_h,_ra_m,_ra_s = map(int , _ra.split(":"))
-        _dec_h,_dec_m,_dec_s = map(int, _dec.split(":"))
-
-        # Format the RA and DEC values , for 
-        _format_ra = _ra_h  + " " + _ra_m / 60 + " " + _ra_s / 3600
-        _format_dec = _dec_h + " " + _dec_m /60 + " " + _dec_s / 3600
-        # CHeck if the current RA and DEC are the same as target RA and DEC
-        if self.device.RightAscension == _format_ra and self.device.Declination == _format_dec:
-            logger.loge(_("Telescope is already targeted the right position"))
-            return logger.return_error(_("Telescope is already targeted the right position"),{})
-
-        # Trying to start goto operation
+        if not az_alt_flag and self.info.coord_system == EquatorialCoordinateType.equTopocentric and _j2000:
+            _target_ra , _target_dec = map(float,j2000_to_jnow(_target_ra,_target_dec))
+            logger.logd(_("Converted J2000 coordinates into JNow : {} {}").format(format_ra(_target_ra),format_dec(_target_dec)))
+
+        # Check if the telescope is already pointing at the target , within the precision of a goto
         try:
-            self.device.SlewToCoordinatesAsync(_format_ra,_format_dec)
+            if az_alt_flag:
+                _distance = separation(self.device.Azimuth,self.device.Altitude,_target_az,_target_alt)
+            else:
+                _distance = separation(self.device.RightAscension * 15,self.device.Declination,_target_ra,_target_dec)
+            if _distance <= GOTO_TOLERANCE:
+                logger.loge(_("Telescope is already targeted the right position"))
+                return logger.return_error(_("Telescope is already targeted the right position"),{})
+        except (NotImplementedException,DriverException) as e:
+            logger.logw(_("Failed to get the current position of the telescope : {}").format(str(e)))
+
+        # Trying to start goto operation , ASCOM wants RA in hours
+        try:
+            if az_alt_flag:
+                self.device.SlewToAltAzAsync(_target_az,_target_alt)
+            else:
+                self.device.SlewToCoordinatesAsync(_target_ra / 15,_target_dec)
         except ParkedException as e:
             logger.loge(_("Telescope is parked : {}").format(str(e)))
             return logger.return_error(_("Telescope is parked"),{"error": str(e)})
@@ -570,10 +595,7 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
                 status : int
                 message : str
                 params : dict
-                    ra : str # the current RA when aborting the goto operation
-                    dec : str # the current DEC when aborting the goto operation
-                    az : str # If is theodolite
-                    alt : str # If is theodolite
+                    operation : int # id of the operation , its result is the position where the telescope stopped
         """
         # Check if the telescope is connected
         if not self.device.Connected:
@@ -603,33 +625,20 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
         except ConnectionError as e:
             logger.loge(_("Network error: {}").format(str(e)))
             return logger.return_error(_("Network error"),{"error": str(e)})
-        
-        sleep(0.1)
-        if not self.device.Slewing:
+
+        def stopped() -> dict:
+            # The position where the telescope stopped is the result of the operation
             self.info._is_slewing = False
-            logger.log(_("Aborting goto operation successfully"))
-        else:
-            logger.log(_("Aborting goto operation failed"))
-            return logger.return_error(_("Aborting goto operation failed"),{})
-        
-        # Though I don't think after such a few time the telescope will lose connection , just be careful
-        try:
             current_ra = self.device.RightAscension
             current_dec = None
             if self.info._can_dec_axis:
                 current_dec = self.device.Declination
-        except NotConnectedException as e:
-            logger.loge(_("Telescope is not connected : {}").format(str(e)))
-            self.info._is_connected = False
-            return logger.return_error(_("Telescope is not connected"),{"error": str(e)})
-        except DriverException as e:
-            logger.loge(_("Telescope driver error : {}").format(str(e)))
-            return logger.return_error(_("Telescope driver error"),{"error": str(e)})
-        except ConnectionError as e:
-            logger.loge(_("Network error: {}").format(str(e)))
-            return logger.return_error(_("Network error"),{"error": str(e)})
+            return {"ra":current_ra,"dec":current_dec}
 
-        return logger.return_success(_("Aborted goto operation successfully"),{"ra":current_ra,"dec":current_dec})
+        operation = operations.submit("telescope.abort_goto",lambda: not self.device.Slewing,
+                                        finish=stopped,timeout=self.info.timeout,owner="telescope")
+        logger.log(_("Aborting goto operation"))
+        return logger.return_success(_("Aborting goto operation"),{"operation":operation.id})
 
     def get_goto_status(self) -> dict:
         """
@@ -647,12 +656,42 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
         if self.info._is_parked:
             logger.loge(_("Telescope is parked"))
             return logger.return_error(_("Telescope is parked"),{})
+        res = self.get_position()
+        if res.get("status") != 0:
+            return res
+        position = res.get("params")
+        status , ra , dec = position["slewing"] , position["ra"] , position["dec"]
+        logger.logd(_("Telescope slewing status : {} , Current RA : {} , Current DEC : {}").format(status,ra,dec))
+        return logger.return_success(_("Refresh telescope status successfully"),{"status":status,"ra":ra,"dec":dec})
+
+    def get_position(self) -> dict:
+        """
+            Get the position and the motion state in one concurrent batch of requests\n
+            Args : None
+            Returns :
+                status : int
+                message : str
+                params : dict
+                    ra : float # hours
+                    dec : float # degrees
+                    az : float # degrees , None if not available
+                    alt : float # degrees , None if not available
+                    slewing : bool
+                    tracking : bool
+                    timestamp : float # unix time of the sample
+        """
+        if not self.info._is_connected or self.device is None:
+            logger.loge(_("Telescope is not connected"))
+            return logger.return_error(_("Telescope is not connected"),{})
+        if self._batch is None:
+            self._batch = SyncDevice(AsyncTelescope(self.device.address,self.device.device_number))
+        start = time.time()
         try:
-            status = self.device.Slewing
-            ra = self.device.RightAscension
-            dec = None
-            if self.info._can_dec_axis:
-                dec = self.device.Declination
+            values = self._batch.get_many("Slewing","Tracking","RightAscension","Declination","Azimuth","Altitude")
+            # Position and slewing are needed , alt/az and tracking are optional
+            for name in ("Slewing","RightAscension","Declination"):
+                if isinstance(values[name],Exception):
+                    raise values[name]
         except NotImplementedException as e:
             logger.loge(_("Telescope is not support slewing : {}").format(str(e)))
             return logger.return_error(_("Telescope is not support slewing"),{"error": str(e)})
@@ -663,12 +702,27 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
         except DriverException as e:
             logger.loge(_("Telescope driver error : {}").format(str(e)))
             return logger.return_error(_("Telescope driver error"),{"error": str(e)})
-        except ConnectionError as e:
+        except (AlpacaRequestException,OSError,asyncio.TimeoutError) as e:
             logger.loge(_("Network error: {}").format(str(e)))
             return logger.return_error(_("Network error"),{"error": str(e)})
-        
-        logger.logd(_("Telescope slewing status : {} , Current RA : {} , Current DEC : {}").format(status,ra,dec))
-        return logger.return_success(_("Refresh telescope status successfully"),{"status":status,"ra":ra,"dec":dec})
+
+        def optional(name : str):
+            value = values[name]
+            return None if isinstance(value,Exception) else value
+
+        self.info._is_slewing = bool(values["Slewing"])
+        if optional("Tracking") is not None:
+            self.info._is_tracking = bool(values["Tracking"])
+        return logger.return_success(_("Get telescope position successfully"),{
+            "ra" : values["RightAscension"],
+            "dec" : values["Declination"],
+            "az" : optional("Azimuth"),
+            "alt" : optional("Altitude"),
+            "slewing" : self.info._is_slewing,
+            "tracking" : optional("Tracking"),
+            # The middle of the round trip is the best guess of the time the values were read
+            "timestamp" : (start + time.time()) / 2
+        })
 
     def get_goto_result(self) -> dict:
         """
@@ -690,7 +744,7 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
             logger.loge(_("Telescope is parked"))
             return logger.return_error(_("Telescope is parked"),{})
         # Check if the telescope is slewing
-        if not self.info._is_slewing:
+        if self.info._is_slewing:
             logger.loge(_("Telescope is slewing"))
             return logger.return_error(_("Telescope is slewing"),{})
         try:
@@ -721,7 +775,8 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
             Returns: dict
                 status : int
                 message : str
-                params : None
+                params : dict
+                    operation : int # id of the operation , finished when the telescope is parked
             NOTE : Just like the parent class
         """
         if not self.info._is_connected:
@@ -737,6 +792,9 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
 
         try:
             self.device.Park()
+            operation = operations.submit("telescope.park",lambda: self.device.AtPark,
+                                            cancel=self.device.AbortSlew,finish=self._parked,
+                                            timeout=self.info.timeout,owner="telescope")
         except NotImplementedException as e:
             logger.loge(_("Telescope does not support park function"))
             return logger.return_error(_("Telescope does not support park function"),{})
@@ -754,11 +812,13 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
             logger.loge(_("Network error: {}").format(str(e)))
             return logger.return_error(_("Network error"),{"error": str(e)})
         
-        logger.loge(_("Telescope started parking successfully"))
+        logger.log(_("Telescope started parking successfully"))
+        return logger.return_success(_("Telescope started parking"),{"operation":operation.id})
 
+    def _parked(self) -> None:
+        """Called when the telescope reached the parking position"""
         self.info._is_parked = True
-
-        return logger.return_success(_("Telescope parked successfully"),{})
+        self.info._is_slewing = False
 
     def unpark(self) -> dict:
         """
@@ -830,8 +890,7 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
                 status : int
                 message : str
                 params : dict
-                    ra : str # RA of the parking position
-                    dec : str # DEC of the parking position
+                    operation : int # id of the operation , the park position is set when it is finished
             NOTE : This function may need telescope supported
         """
         # Regular check the telescope status
@@ -846,17 +905,15 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
         ra = params.get('ra')
         dec = params.get('dec')
 
-        if ra is not None and isinstance(ra,str) and match("\d{2}:\d{2}:\d{2}",ra):
-            ra_h , ra_m , ra_s = map(int,ra.split(":"))
-            self.info.park_ra = ra_h + ra_m / 60 + ra_s / 3600
-        else:
+        try:
+            self.info.park_ra = parse_ra(ra) / 15
+        except ValueError:
             logger.logw(_("Unknown type of the RA value are specified , just use the current RA value instead"))
             self.info.park_ra = self.device.RightAscension
 
-        if dec is not None and isinstance(dec,str) and match("\d{2}:\d{2}:\d{2}",dec):
-            dec_h , dec_m , dec_s = map(int, dec.split(':'))
-            self.info.park_dec = dec_h + dec_m / 60 + dec_s / 3600
-        else:
+        try:
+            self.info.park_dec = parse_dec(dec)
+        except ValueError:
             logger.logw(_("Unknown type of the DEC value are specified , just use the current DEC value instead"))
             self.info.park_dec = self.device.Declination
 
@@ -865,15 +922,10 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
             # Here is a Alpyca limitation , we can just let the telescope move to the wanted position
             # Then we can set the position of the park operation
             self.device.SlewToCoordinatesAsync(self.info.park_ra,self.info.park_dec)
-            used_time = 0
-            while used_time <= self.info.timeout:
-                if not self.device.Slewing:
-                    break
-                used_time += 1
-                sleep(1)
-            
-            self.device.SetPark()
-
+            # SetPark is sent by the operation when the slew is over
+            operation = operations.submit("telescope.set_park_position",lambda: not self.device.Slewing,
+                                            cancel=self.device.AbortSlew,finish=self.device.SetPark,
+                                            timeout=self.info.timeout,owner="telescope")
         except NotImplementedException as e:
             logger.loge(_("Telescope is not supported to set parking position").format(str(e)))
             self.info._can_set_park_postion = False
@@ -892,8 +944,8 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
             logger.loge(_("Network error : {}").format(str(e)))
             return logger.return_error(_("Network error"),{"error" : str(e)})
 
-        logger.log(_("Set park position successfully"))
-        return logger.return_success(_("Set park position successfully"),{})
+        logger.log(_("Slewing to the new park position"))
+        return logger.return_success(_("Slewing to the new park position"),{"operation":operation.id})
 
     def home(self) -> dict:
         """
@@ -902,7 +954,8 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
             Returns : 
                 status : int
                 message : str
-                params : None
+                params : dict
+                    operation : int # id of the operation , finished when the telescope is at home
             NOTE : This function may need telescope supported
         """
         if not self.info._is_connected:
@@ -919,24 +972,23 @@ class AscomTelescopeAPI(BasicTelescopeAPI):
         
         try:
             self.device.FindHome()
-
-            used_time = 0
-            flag = False
-            while used_time <= self.info.timeout:
-                if self.device.AtHome:
-                    flag = True
-                    break
-                sleep(1)
-                used_time += 1
-
-            if not flag:
-                logger.loge(_("Timeout waiting for telescope move to home position"))
-                return logger.return_error(_("Timeout waiting for telescope move to home position"),{})
-
+            operation = operations.submit("telescope.home",lambda: self.device.AtHome,
+                                            cancel=self.device.AbortSlew,
+                                            timeout=self.info.timeout,owner="telescope")
         except NotImplementedException as e:
             logger.loge(_("Telescope is not support home function"))
             self.info._can_home = False
-            return logger.return_error(_("Telescope is not support home function"),{"error": e})
+            return logger.return_error(_("Telescope is not support home function"),{"error": str(e)})
         except NotConnectedException as e:
-            logger.loge(_("Telescope is not connected"))
-            
+            logger.loge(_("Telescope is not connected : {}").format(str(e)))
+            self.info._is_connected = False
+            return logger.return_error(_("Telescope is not connected"),{"error": str(e)})
+        except DriverException as e:
+            logger.loge(_("Telescope driver error : {}").format(str(e)))
+            return logger.return_error(_("Telescope driver error"),{"error": str(e)})
+        except ConnectionError as e:
+            logger.loge(_("Network error: {}").format(str(e)))
+            return logger.return_error(_("Network error"),{"error": str(e)})
+
+        logger.log(_("Telescope is moving to home position"))
+        return logger.return_success(_("Telescope is moving to home position"),{"operation":operation.id})
@@ -0,0 +1,181 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# Mount state stream.
+# The position and the slewing state are sampled in one batch by the driver ,
+# a few times per second while slewing and every few seconds otherwise.
+# Every state carries the velocity of the axes and the time of the sample ,
+# so the client can extrapolate the position at its own frame rate :
+#     ra(t) = ra + velocity.ra * (t - timestamp)
+# #################################################################
+
+import threading
+import time
+
+from utils.i18n import _
+from utils.lightlog import lightlog
+logger = lightlog(__name__)
+
+# Seconds between two samples while slewing and while tracking or idle
+FAST_INTERVAL = 0.25
+SLOW_INTERVAL = 2.0
+# Periods of the axes , used to take the shortest way when differencing
+AXIS_PERIODS = {"ra" : 24.0, "dec" : None, "az" : 360.0, "alt" : None}
+
+def axis_velocity(current : dict, previous : dict, dt : float) -> dict:
+    """
+        Velocity of every axis between two samples
+        Args :
+            current : dict # the newest state
+            previous : dict # the state before
+            dt : float # seconds between the two samples
+        Returns : dict # units per second , None if the axis is not available
+    """
+    velocity = {}
+    for axis , period in AXIS_PERIODS.items():
+        a , b = current.get(axis) , previous.get(axis)
+        if a is None or b is None or dt <= 0:
+            velocity[axis] = None
+            continue
+        delta = a - b
+        if period is not None:
+            # 23.99h -> 0.01h is a small step , not a full turn
+            delta = (delta + period / 2) % period - period / 2
+        velocity[axis] = delta / dt
+    return velocity
+
+class MountStream(object):
+    """
+        Sample the mount at an adaptive rate and send the state to the subscribers
+    """
+
+    def __init__(self, sample, fast_interval : float = FAST_INTERVAL, slow_interval : float = SLOW_INTERVAL) -> None:
+        """
+            Args :
+                sample : callable # returns the state dict of the driver (get_position params) , or None
+                fast_interval : float # seconds between two samples while slewing
+                slow_interval : float # seconds between two samples while tracking or idle
+        """
+        self.sample = sample
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+
+        self.state = None
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+        # Sample fast until this time , even if the mount does not report slewing yet
+        self._fast_until = 0.0
+
+    def subscribe(self, callback) -> None:
+        """
+            Add a subscriber , the stream starts with the first one
+            Args :
+                callback : callable # called with the state dict
+            Returns : None
+        """
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+            # Also keeps alive a thread stopped just before , which has not seen the stop yet
+            self._running = True
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,name="mount-stream",daemon=True)
+                self._thread.start()
+                return
+        # The new subscriber gets a state now instead of after the slow interval
+        self._wakeup.set()
+
+    def unsubscribe(self, callback) -> None:
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        """Stop sampling , for example when the telescope is disconnected"""
+        with self._lock:
+            self._subscribers.clear()
+            self._running = False
+        self._wakeup.set()
+
+    def poke(self, fast_for : float = 3.0) -> None:
+        """
+            Sample now and keep the fast rate for a while , called after a goto is started
+            because some mounts report slewing a little later
+            Args :
+                fast_for : float # seconds
+            Returns : None
+        """
+        self._fast_until = time.monotonic() + fast_for
+        self._wakeup.set()
+
+    def interval(self) -> float:
+        """Seconds until the next sample"""
+        if (self.state is not None and self.state.get("slewing")) or time.monotonic() < self._fast_until:
+            return self.fast_interval
+        return self.slow_interval
+
+    def _update(self, state : dict) -> dict:
+        """
+            Add the extrapolation hints to a new sample
+            Args :
+                state : dict # ra (hours) , dec , az , alt (degrees) , slewing , tracking , timestamp
+            Returns : dict
+        """
+        previous = self.state
+        state = dict(state)
+        state.setdefault("timestamp",time.time())
+        if previous is None or previous.get("slewing") != state.get("slewing") \
+                or state["timestamp"] - previous["timestamp"] > 3 * self.slow_interval:
+            # The motion changed , the last velocity would overshoot
+            state["velocity"] = {axis : None if state.get(axis) is None else 0.0 for axis in AXIS_PERIODS}
+        else:
+            state["velocity"] = axis_velocity(state,previous,state["timestamp"] - previous["timestamp"])
+        self.state = state
+        state["interval"] = self.interval()
+        return state
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                subscribers = list(self._subscribers)
+                if not self._running or not subscribers:
+                    if self._thread is threading.current_thread():
+                        self._thread = None
+                    return
+            # Cleared before the sample , a poke or a subscribe coming from now on wakes the next wait
+            self._wakeup.clear()
+            try:
+                state = self.sample()
+            except Exception as e:
+                logger.loge(_("Failed to sample the mount : {}").format(str(e)))
+                state = None
+            if state is not None:
+                state = self._update(state)
+                for callback in subscribers:
+                    try:
+                        callback(state)
+                    except Exception as e:
+                        logger.loge(_("Mount state subscriber failed : {}").format(str(e)))
+            self._wakeup.wait(self.interval())
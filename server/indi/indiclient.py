@@ -0,0 +1,483 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# ##############################################################
+#
+# Persistent INDI protocol client
+# One socket to indiserver , the messages are parsed incrementally and
+# kept in a live property tree , so gets are served from memory
+#
+# ##############################################################
+
+import socket
+import threading
+import time
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+from utils.lightlog import lightlog
+log = lightlog(__name__)
+
+# Vector types of INDI , defXXXVector / setXXXVector / newXXXVector
+VECTOR_TYPES = ("Text", "Number", "Switch", "Light", "BLOB")
+
+# Size of the socket reads
+BUF_SIZE = 65536
+
+class IndiProperty(object):
+    """A property (vector) of an INDI device"""
+
+    __slots__ = ("device", "name", "type", "label", "group", "state", "perm", "rule",
+                 "timeout", "timestamp", "elements", "labels", "pending")
+
+    def __init__(self, device : str, name : str, vtype : str) -> None:
+        self.device = device
+        self.name = name
+        self.type = vtype
+        self.label = name
+        self.group = ""
+        self.state = "Idle"
+        self.perm = "rw"
+        self.rule = ""
+        self.timeout = 0
+        self.timestamp = ""
+        self.elements = {}
+        self.labels = {}
+        # (previous state , deadline) while a new value is sent and not answered yet
+        self.pending = None
+
+    def get_dict(self) -> dict:
+        """Return dictionary"""
+        return {
+            "device" : self.device,
+            "name" : self.name,
+            "type" : self.type,
+            "label" : self.label,
+            "group" : self.group,
+            "state" : self.state,
+            "perm" : self.perm,
+            "elements" : dict(self.elements)
+        }
+
+class IndiStreamParser(object):
+    """
+        Incremental parser of the INDI XML stream.
+        INDI messages are top level elements without a document root , so a fake root is fed first.
+        The callback is called with every complete message as soon as it arrives.
+    """
+
+    def __init__(self, callback) -> None:
+        """
+            Initialize the parser
+            Args :
+                callback : callable # called with each xml.etree.ElementTree.Element message
+        """
+        self._callback = callback
+        self.reset()
+
+    def reset(self) -> None:
+        """Drop all of the pending data and start a new stream"""
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._parser.feed("<indi>")
+        self._depth = 0
+        self._root = None
+
+    def feed(self, data : bytes) -> None:
+        """
+            Feed the data received from the server
+            Args :
+                data : bytes
+            Returns : None
+        """
+        self._parser.feed(data)
+        for event, elem in self._parser.read_events():
+            if event == "start":
+                self._depth += 1
+                if self._root is None:
+                    self._root = elem
+                continue
+            self._depth -= 1
+            if self._depth == 1:
+                # Do not keep the messages in the fake document
+                self._root.remove(elem)
+                self._callback(elem)
+
+class IndiClient(object):
+    """
+        INDI protocol client.\n
+        Usage :
+            client = IndiClient("127.0.0.1",7624)
+            client.connect()
+            client.get_prop("Telescope Simulator","CONNECTION","CONNECT")
+            client.set_prop("Telescope Simulator","CONNECTION","CONNECT","On")
+    """
+
+    def __init__(self, host : str = "127.0.0.1", port : int = 7624, timeout : float = 5) -> None:
+        """
+            Initialize the client , the connection is not established
+            Args :
+                host : str # host of the INDI server
+                port : int # port of the INDI server
+                timeout : float # default timeout waiting for the properties
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._sock = None
+        self._thread = None
+        self._send_lock = threading.Lock()
+        # Property tree : {device : {property : IndiProperty}}
+        self._devices = {}
+        self._cond = threading.Condition()
+        self._parser = IndiStreamParser(self._on_message)
+        self._listeners = []
+        self.messages = []
+
+    def __del__(self) -> None:
+        self.disconnect()
+
+    @property
+    def connected(self) -> bool:
+        """Whether the socket is connected"""
+        return self._sock is not None
+
+    def connect(self) -> bool:
+        """
+            Connect to the INDI server and ask for all of the properties
+            Args : None
+            Returns : bool
+        """
+        if self._sock is not None:
+            return True
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError as e:
+            log.loge("Failed to connect to INDI server %s:%d : %s" % (self.host, self.port, e))
+            return False
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self._cond:
+            self._devices = {}
+        self._parser.reset()
+        self._sock = sock
+        self._thread = threading.Thread(target=self._reader, args=(sock,), daemon=True)
+        self._thread.start()
+        self._send('<getProperties version="1.7"/>')
+        log.log("Connected to INDI server %s:%d" % (self.host, self.port))
+        return True
+
+    def disconnect(self) -> None:
+        """
+            Close the connection with the server
+            Args : None
+            Returns : None
+        """
+        sock, self._sock = self._sock, None
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+        with self._cond:
+            self._cond.notify_all()
+
+    def add_listener(self, func) -> None:
+        """
+            Register a function called with every updated property
+            Args :
+                func : callable # func(IndiProperty)
+        """
+        self._listeners.append(func)
+
+    # ##############################################################
+    # Reading
+    # ##############################################################
+
+    def _reader(self, sock : socket.socket) -> None:
+        """Read the socket until it is closed"""
+        while True:
+            try:
+                data = sock.recv(BUF_SIZE)
+            except OSError:
+                break
+            if not data:
+                break
+            try:
+                self._parser.feed(data)
+            except ET.ParseError as e:
+                log.loge("Invalid INDI message : %s" % e)
+                self._parser.reset()
+        if self._sock is sock:
+            log.logw("Connection with INDI server was closed")
+            self._sock = None
+            with self._cond:
+                self._cond.notify_all()
+
+    def _on_message(self, elem : ET.Element) -> None:
+        """Update the property tree with a message"""
+        tag = elem.tag
+        device = elem.get("device", "")
+        if tag.startswith("def") and tag.endswith("Vector"):
+            vtype = tag[3:-6]
+            prop = IndiProperty(device, elem.get("name", ""), vtype)
+            prop.label = elem.get("label", prop.name)
+            prop.group = elem.get("group", "")
+            prop.perm = elem.get("perm", "ro" if vtype == "Light" else "rw")
+            prop.rule = elem.get("rule", "")
+            self._update(prop, elem)
+            for child in elem:
+                prop.labels[child.get("name", "")] = child.get("label", "")
+            with self._cond:
+                self._devices.setdefault(device, {})[prop.name] = prop
+                self._cond.notify_all()
+            self._notify(prop)
+        elif tag.startswith("set") and tag.endswith("Vector"):
+            with self._cond:
+                prop = self._devices.get(device, {}).get(elem.get("name", ""))
+                if prop is None:
+                    return
+                self._update(prop, elem)
+                self._cond.notify_all()
+            self._notify(prop)
+        elif tag == "delProperty":
+            with self._cond:
+                name = elem.get("name")
+                if name is None:
+                    self._devices.pop(device, None)
+                else:
+                    self._devices.get(device, {}).pop(name, None)
+                self._cond.notify_all()
+        elif tag == "message":
+            message = elem.get("message")
+            if message:
+                # Only keep the latest messages
+                self.messages = self.messages[-99:] + [(device, elem.get("timestamp", ""), message)]
+                log.logd("INDI message from %s : %s" % (device or "server", message))
+
+    @staticmethod
+    def _update(prop : IndiProperty, elem : ET.Element) -> None:
+        """Update the values and the state of a property"""
+        # Any message of the server answers the pending set
+        prop.pending = None
+        prop.state = elem.get("state", prop.state)
+        prop.timestamp = elem.get("timestamp", prop.timestamp)
+        try:
+            prop.timeout = float(elem.get("timeout", prop.timeout))
+        except ValueError:
+            pass
+        for child in elem:
+            name = child.get("name")
+            if name is not None:
+                prop.elements[name] = (child.text or "").strip()
+
+    def _notify(self, prop : IndiProperty) -> None:
+        """Call the listeners"""
+        for func in self._listeners:
+            try:
+                func(prop)
+            except Exception as e:
+                log.loge("INDI listener error : %s" % e)
+
+    # ##############################################################
+    # Property tree
+    # ##############################################################
+
+    def wait_property(self, dev : str, prop : str, timeout : float = None) -> IndiProperty | None:
+        """
+            Get a property , wait for its definition if it is not received yet
+            Args :
+                dev : str # name of the device , '*' returns the first device having the property
+                prop : str # name of the property
+                timeout : float # seconds , default is the timeout of the client
+            Returns : IndiProperty | None
+        """
+        if not self.connect():
+            return None
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._cond:
+            while True:
+                if dev == "*":
+                    found = next((props[prop] for props in self._devices.values() if prop in props), None)
+                else:
+                    found = self._devices.get(dev, {}).get(prop)
+                remaining = deadline - time.monotonic()
+                if found is not None or remaining <= 0 or self._sock is None:
+                    return found
+                self._cond.wait(remaining)
+
+    def get_devices(self) -> list:
+        """
+            Get the names of the devices
+            Args : None
+            Returns : list
+        """
+        with self._cond:
+            return list(self._devices.keys())
+
+    def get_properties(self, dev : str) -> dict:
+        """
+            Get all of the properties of a device
+            Args :
+                dev : str # name of the device
+            Returns : dict # {name : IndiProperty.get_dict()}
+        """
+        with self._cond:
+            return {name : prop.get_dict() for name, prop in self._devices.get(dev, {}).items()}
+
+    def find(self, dev : str, prop : str) -> list:
+        """
+            Find properties , the device can be '*' just like indi_getprop
+            Args :
+                dev : str # name of the device or '*'
+                prop : str # name of the property
+            Returns : list of IndiProperty
+        """
+        with self._cond:
+            if dev == "*":
+                return [props[prop] for props in self._devices.values() if prop in props]
+            found = self._devices.get(dev, {}).get(prop)
+            return [found] if found is not None else []
+
+    def get_prop(self, dev : str, prop : str, element : str, timeout : float = None) -> str | None:
+        """
+            Get the value of an element , '_STATE' returns the state of the property
+            Args :
+                dev : str # name of the device
+                prop : str # name of the property
+                element : str # name of the element
+                timeout : float # seconds waiting for the definition of the property
+            Returns : str | None
+        """
+        found = self.wait_property(dev, prop, timeout)
+        if found is None:
+            return None
+        with self._cond:
+            if element == "_STATE":
+                self._expire(found)
+                return found.state
+            return found.elements.get(element)
+
+    def get_state(self, dev : str, prop : str, timeout : float = None) -> str | None:
+        """
+            Get the state of a property
+            Args :
+                dev : str # name of the device
+                prop : str # name of the property
+                timeout : float # seconds waiting for the definition of the property
+            Returns : str | None # Idle , Ok , Busy or Alert
+        """
+        return self.get_prop(dev, prop, "_STATE", timeout)
+
+    # ##############################################################
+    # Writing
+    # ##############################################################
+
+    @staticmethod
+    def _expire(prop : IndiProperty) -> None:
+        """Give up a set never answered by the server , the property gets its previous state back"""
+        if prop.pending is not None and time.monotonic() >= prop.pending[1]:
+            log.logw("No reply of INDI server for %s.%s" % (prop.device, prop.name))
+            prop.state, prop.pending = prop.pending[0], None
+
+    def _send(self, message : str) -> bool:
+        """Send a message without waiting for the reply"""
+        sock = self._sock
+        if sock is None:
+            return False
+        try:
+            with self._send_lock:
+                sock.sendall(message.encode("utf-8"))
+        except OSError as e:
+            log.loge("Failed to send message to INDI server : %s" % e)
+            self.disconnect()
+            return False
+        return True
+
+    def set_props(self, dev : str, prop : str, values : dict, timeout : float = None) -> bool:
+        """
+            Set many elements of a property in one message , the reply is not waited
+            Args :
+                dev : str # name of the device
+                prop : str # name of the property
+                values : dict # {element : value}
+                timeout : float # seconds waiting for the definition of the property
+            Returns : bool # whether the message was sent
+        """
+        found = self.wait_property(dev, prop, timeout)
+        if found is None:
+            log.loge("Property %s.%s is not defined" % (dev, prop))
+            return False
+        vtype = found.type
+        elements = "".join('<one%s name=%s>%s</one%s>' % (vtype, quoteattr(name), escape(str(value)), vtype)
+                            for name, value in values.items())
+        message = '<new%sVector device=%s name=%s>%s</new%sVector>' % (
+            vtype, quoteattr(dev), quoteattr(prop), elements, vtype)
+        # Mark the property busy before sending , so the reply of the server can not be overwritten.
+        # The mark expires after the timeout of the property , or of the client , without any reply.
+        expires = time.monotonic() + max(found.timeout, self.timeout if timeout is None else timeout)
+        with self._cond:
+            state = found.pending[0] if found.pending is not None else found.state
+            found.state, found.pending = "Busy", (state, expires)
+        if not self._send(message):
+            with self._cond:
+                found.state, found.pending = state, None
+            return False
+        return True
+
+    def set_prop(self, dev : str, prop : str, element : str, value : str, timeout : float = None) -> bool:
+        """
+            Set an element of a property , the reply is not waited so many sets can be pipelined
+            Args :
+                dev : str # name of the device
+                prop : str # name of the property
+                element : str # name of the element
+                value : str # value of the element
+                timeout : float # seconds waiting for the definition of the property
+            Returns : bool # whether the message was sent
+        """
+        return self.set_props(dev, prop, {element : value}, timeout)
+
+    def wait_state(self, dev : str, prop : str, timeout : float = None) -> str | None:
+        """
+            Wait until the property is not busy
+            Args :
+                dev : str # name of the device
+                prop : str # name of the property
+                timeout : float # seconds
+            Returns : str | None # the final state
+        """
+        found = self.wait_property(dev, prop, timeout)
+        if found is None:
+            return None
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._cond:
+            while True:
+                self._expire(found)
+                if found.state != "Busy" or self._sock is None:
+                    break
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                # Wake up when the mark expires too
+                expires = found.pending[1] if found.pending is not None else deadline
+                self._cond.wait(max(min(deadline, expires) - now, 0))
+            return found.state
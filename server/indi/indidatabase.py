@@ -20,7 +20,10 @@ Boston, MA 02110-1301, USA.
 
 import os
 import errno
+import atexit
 import sqlite3
+import threading
+from contextlib import contextmanager
 
 __version__ = '0.1.7'
 
@@ -33,8 +36,22 @@ def dict_factory(cursor, row):
         d[col[0]] = row[idx]
     return d
 
+def _copy(result):
+    """Copy a cached result , so the callers can not modify the cache"""
+    if result is None:
+        return None
+    if isinstance(result, list):
+        return [dict(row) for row in result]
+    return dict(result)
+
 class Database(object):
-    def __init__(self, filename):
+    def __init__(self, filename, commit_delay = 0.05):
+        """
+            Open the profile database
+            Args :
+                filename : str # path to the sqlite file
+                commit_delay : float # seconds the writes are grouped before committing , 0 commits every write
+        """
         # create the directory if it does not exist
         db_dir = os.path.dirname(filename)
         try:
@@ -47,11 +64,90 @@ class Database(object):
 
         self.__conn = sqlite3.connect(filename, check_same_thread=False)
         self.__conn.row_factory = dict_factory
+        # WAL makes a commit a single sequential append instead of rewriting the journal
+        try:
+            self.__conn.execute('PRAGMA journal_mode=WAL')
+            self.__conn.execute('PRAGMA synchronous=NORMAL')
+        except sqlite3.Error as e:
+            log.logw("Failed to enable WAL mode : %s" % e)
+
+        # The connection is shared by all of the web server threads
+        self.__lock = threading.RLock()
+        self.__cache = {}
+        self.__commit_delay = commit_delay
+        self.__timer = None
 
         # update table for version and any schema updates
         self.update()
         # create new tables if they doesn't exist
         self.create(filename)
+        atexit.register(self.flush)
+
+    def _read(self, sql, params = (), one = False):
+        """
+            Run a query , the result is cached until the next write
+            Args :
+                sql : str
+                params : tuple
+                one : bool # only fetch the first row
+            Returns : dict | list | None
+        """
+        key = (sql, params, one)
+        with self.__lock:
+            if key not in self.__cache:
+                cursor = self.__conn.execute(sql, params)
+                self.__cache[key] = cursor.fetchone() if one else cursor.fetchall()
+            return _copy(self.__cache[key])
+
+    @contextmanager
+    def _write(self):
+        """
+            Get a cursor for writing , the changes are committed together with the other
+            writes of the next commit_delay seconds
+        """
+        with self.__lock:
+            c = self.__conn.cursor()
+            try:
+                yield c
+            finally:
+                c.close()
+                self.__cache.clear()
+                self._schedule_commit()
+
+    def _schedule_commit(self) -> None:
+        """Commit now or start the group commit timer"""
+        if self.__commit_delay <= 0:
+            self.__conn.commit()
+        elif self.__timer is None:
+            self.__timer = threading.Timer(self.__commit_delay, self.flush)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    def flush(self) -> None:
+        """
+            Commit the pending writes immediately
+            Args : None
+            Returns : None
+        """
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+            try:
+                self.__conn.commit()
+            except sqlite3.ProgrammingError:
+                # Already closed
+                pass
+
+    def close(self) -> None:
+        """
+            Commit the pending writes and close the database
+            Args : None
+            Returns : None
+        """
+        self.flush()
+        with self.__lock:
+            self.__conn.close()
 
     def update(self):
         c = self.__conn.cursor()
@@ -114,110 +210,93 @@ class Database(object):
     def get_autoprofile(self):
         """Get auto start profile"""
 
-        cursor = self.__conn.execute('SELECT profile FROM autostart')
-        result = cursor.fetchone()
+        result = self._read('SELECT profile FROM autostart', one=True)
         return result['profile'] if result else ''
 
     def get_profiles(self):
         """Get all profiles from database"""
 
-        cursor = self.__conn.execute('SELECT * FROM profile')
-        return cursor.fetchall()
+        return self._read('SELECT * FROM profile')
 
     def get_custom_drivers(self):
         """Get all custom drivers from database"""
 
-        cursor = self.__conn.execute('SELECT * FROM custom')
-        return cursor.fetchall()
+        return self._read('SELECT * FROM custom')
 
     def get_profile_drivers_labels(self, name):
         """Get all drivers labels for a specific profile from database"""
 
-        cursor = self.__conn.execute(
+        return self._read(
             'SELECT label FROM driver '
             'WHERE profile=(SELECT id FROM profile WHERE name=?)', (name,))
-        return cursor.fetchall()
 
     def get_profile_remote_drivers(self, name):
         """Get remote drivers list for a specific profile"""
 
-        cursor = self.__conn.execute(
+        return self._read(
             'SELECT drivers FROM remote '
-            'WHERE profile=(SELECT id FROM profile WHERE name=?)', (name,))
-        return cursor.fetchone()
+            'WHERE profile=(SELECT id FROM profile WHERE name=?)', (name,), one=True)
 
     def delete_profile(self, name):
         """Delete Profile"""
 
-        c = self.__conn.cursor()
-        c.execute('DELETE FROM driver WHERE profile='
-                  '(SELECT id FROM profile WHERE name=?)', (name,))
-        c.execute('DELETE FROM profile WHERE name=?', (name,))
-        self.__conn.commit()
-        c.close()
+        with self._write() as c:
+            c.execute('DELETE FROM driver WHERE profile='
+                      '(SELECT id FROM profile WHERE name=?)', (name,))
+            c.execute('DELETE FROM profile WHERE name=?', (name,))
 
     def add_profile(self, name):
         """Add Profile"""
 
-        c = self.__conn.cursor()
-        try:
-            c.execute('INSERT INTO profile (name) VALUES(?)', (name,))
-        except sqlite3.IntegrityError:
-            log.logw("Profile name %s already exists."% name)
-        return c.lastrowid
+        with self._write() as c:
+            try:
+                c.execute('INSERT INTO profile (name) VALUES(?)', (name,))
+            except sqlite3.IntegrityError:
+                log.logw("Profile name %s already exists."% name)
+            return c.lastrowid
 
     def get_profile(self, name):
         """Get profile info"""
 
-        cursor = self.__conn.execute('SELECT * FROM profile WHERE name=?',
-                                     (name,))
-        return cursor.fetchone()
+        return self._read('SELECT * FROM profile WHERE name=?', (name,), one=True)
 
     def update_profile(self, name, port, autostart=False, autoconnect=False):
         """Update profile info"""
 
-        c = self.__conn.cursor()
-        if autostart:
-            # If we have a profile with autostart=1, reset everyone else to 0
-            c.execute('UPDATE profile SET autostart=0')
-        c.execute('UPDATE profile SET port=?, autostart=?, autoconnect=? WHERE name=?',
-                  (port, autostart, autoconnect, name))
-        self.__conn.commit()
-        c.close()
+        with self._write() as c:
+            if autostart:
+                # If we have a profile with autostart=1, reset everyone else to 0
+                c.execute('UPDATE profile SET autostart=0')
+            c.execute('UPDATE profile SET port=?, autostart=?, autoconnect=? WHERE name=?',
+                      (port, autostart, autoconnect, name))
 
     def save_profile_drivers(self, name, drivers):
         """Save profile drivers"""
 
-        c = self.__conn.cursor()
-        c.execute('SELECT id FROM profile WHERE name=?', (name,))
-        result = c.fetchone()
-        if result:
-            pid = result['id']
-        else:
-            pid = self.add_profile(name)
-
-        c.execute('DELETE FROM driver WHERE profile=?', (pid,))
-        c.execute('DELETE FROM remote WHERE profile=?', (pid,))
-
-        for driver in drivers:
-            if 'label' in driver:
-                c.execute('INSERT INTO driver (label, profile) VALUES(?, ?)',
-                          (driver['label'], pid))
-            elif 'remote' in driver:
-                c.execute('INSERT INTO remote (drivers, profile) VALUES(?, ?)',
-                          (driver['remote'], pid))
-        self.__conn.commit()
-        c.close()
+        with self._write() as c:
+            c.execute('SELECT id FROM profile WHERE name=?', (name,))
+            result = c.fetchone()
+            if result:
+                pid = result['id']
+            else:
+                pid = self.add_profile(name)
+
+            c.execute('DELETE FROM driver WHERE profile=?', (pid,))
+            c.execute('DELETE FROM remote WHERE profile=?', (pid,))
+
+            c.executemany('INSERT INTO driver (label, profile) VALUES(?, ?)',
+                          [(driver['label'], pid) for driver in drivers if 'label' in driver])
+            c.executemany('INSERT INTO remote (drivers, profile) VALUES(?, ?)',
+                          [(driver['remote'], pid) for driver in drivers
+                           if 'label' not in driver and 'remote' in driver])
 
     def save_profile_custom_driver(self, driver):
         """Save custom profile driver"""
 
-        c = self.__conn.cursor()
-        try:
-            c.execute('INSERT INTO custom (label, name, family, exec, version)'
-                      ' VALUES(?, ?, ?, ?, ?)',
-                      (driver['Label'], driver['Name'], driver['Family'], driver['Exec'], driver['Version']))
-            self.__conn.commit()
-        except sqlite3.Error:
-            pass
-        c.close()
+        with self._write() as c:
+            try:
+                c.execute('INSERT INTO custom (label, name, family, exec, version)'
+                          ' VALUES(?, ?, ?, ?, ?)',
+                          (driver['Label'], driver['Name'], driver['Family'], driver['Exec'], driver['Version']))
+            except sqlite3.Error:
+                pass
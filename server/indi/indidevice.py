@@ -18,8 +18,7 @@ Boston, MA 02110-1301, USA.
 
 """
 
-import re
-from subprocess import check_output
+from server.indi.indiclient import IndiClient
 
 from utils.lightlog import lightlog
 log = lightlog(__name__)
@@ -27,30 +26,25 @@ log = lightlog(__name__)
 class Device:
     """A collection of device"""
 
-    def __init__(self):
+    def __init__(self, client : IndiClient = None):
         """
             Initialize the device object
+            Args:
+                client : IndiClient # shared connection with the INDI server
         """
         self.host = "localhost"
         self.port = 7624
+        self.client = client if client is not None else IndiClient(self.host, self.port)
 
-    @staticmethod
-    def get_devices() -> list:
+    def get_devices(self) -> list:
         """
             Get a list of devices
             Args: None
             Returns:
                 list: A list of devices
         """
-        cmd = ['indi_getprop', '*.CONNECTION.CONNECT']
-        try:
-            output = check_output(cmd).decode('utf_8')
-            lines = re.split(r'[\n=]', output)
-            output = {lines[i]: lines[i + 1] for i in range(0, len(lines) - 1, 2)}
-            devices = []
-            for key, val in output.items():
-                device_name = re.match("[^.]*", key)
-                devices.append({"device": device_name.group(), "connected": val == "On"})
-            return devices
-        except Exception as e:
-            log.loge(e)
+        if not self.client.connect():
+            return []
+        self.client.wait_property("*", "CONNECTION", timeout=1)
+        return [{"device": prop.device, "connected": prop.elements.get("CONNECT") == "On"}
+                for prop in self.client.find("*", "CONNECTION")]
@@ -19,6 +19,7 @@ Boston, MA 02110-1301, USA.
 """
 
 import os
+import pickle
 import xml.etree.ElementTree as ET
 
 import server.config as c
@@ -26,6 +27,10 @@ import server.config as c
 from utils.lightlog import lightlog
 log = lightlog(__name__)
 
+# Bump the version if the layout of the cached records is changed
+CACHE_VERSION = 1
+CACHE_PATH = os.path.join("config", "indiweb", "drivers.cache")
+
 class DeviceDriver:
     """Device driver container"""
 
@@ -38,59 +43,130 @@ class DeviceDriver:
         self.family = family
         self.custom = custom
 
+def iter_driver_file(fname : str):
+    """
+        Stream the device definitions of a driver file , the elements are released once used
+        so big files never stay in memory as a whole tree
+        Args:
+            fname : str # path to the xml file
+        Yields : (name , label , version , binary , family , skel)
+    """
+    family = None
+    for event, elem in ET.iterparse(fname, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "devGroup":
+                family = elem.attrib["group"]
+            continue
+        if elem.tag == "device":
+            drv = elem.find("driver")
+            yield (drv.attrib["name"], elem.attrib["label"], elem.findtext("version", "0.0"),
+                   drv.text, family, elem.attrib.get("skel", None))
+            elem.clear()
+        elif elem.tag == "devGroup":
+            elem.clear()
 
 class DriverCollection:
     """A collection of drivers"""
 
-    def __init__(self, path = c.config["indiweb"]["data"]) -> None:
+    def __init__(self, path = c.config["indiweb"]["data"], cache = CACHE_PATH) -> None:
         """
             Initialize the driver collection
             Args:
                 path : str # The path to the INDi data directory
+                cache : str # The path to the index of the parsed files , None to disable it
             Retruns : None
         """
         self.path = path
+        self.cache = cache
         self.drivers = []
         self.files = []
         self.parse_drivers()
 
+    def _load_cache(self) -> dict:
+        """
+            Load the index of the parsed driver files
+            Args: None
+            Returns : dict # {fname : (mtime_ns , size , records)}
+        """
+        if not self.cache or not os.path.isfile(self.cache):
+            return {}
+        try:
+            with open(self.cache, "rb") as f:
+                data = pickle.load(f)
+            if data.get("version") == CACHE_VERSION and data.get("path") == self.path:
+                return data["files"]
+        except Exception as e:
+            log.logw("Failed to load the driver cache %s : %s" % (self.cache, e))
+        return {}
+
+    def _save_cache(self, files : dict) -> None:
+        """
+            Save the index of the parsed driver files , the file is replaced atomically
+            Args:
+                files : dict # {fname : (mtime_ns , size , records)}
+            Returns : None
+        """
+        if not self.cache:
+            return
+        tmp = self.cache + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.cache) or ".", exist_ok=True)
+            with open(tmp, "wb") as f:
+                pickle.dump({"version": CACHE_VERSION, "path": self.path, "files": files}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.cache)
+        except OSError as e:
+            log.logw("Failed to save the driver cache %s : %s" % (self.cache, e))
+
     def parse_drivers(self) -> None:
         """
-            Parse the INDI drivers
+            Parse the INDI drivers , only the files changed since the last run are parsed again
             Args:
                 None
             Retruns : None
         """
-        for fname in os.listdir(self.path):
-            # Skip Skeleton files
-            if fname.endswith('.xml') and '_sk' not in fname:
-                self.files.append(os.path.join(self.path, fname))
+        cached = self._load_cache()
+        files = {}
+        changed = False
+        try:
+            entries = sorted(os.scandir(self.path), key=lambda entry: entry.name)
+        except OSError as e:
+            log.loge("Failed to list the INDI drivers in %s : %s" % (self.path, e))
+            entries = []
 
-        for fname in self.files:
+        for entry in entries:
+            # Skip Skeleton files
+            if not entry.name.endswith('.xml') or '_sk' in entry.name:
+                continue
+            fname = entry.path
+            self.files.append(fname)
             try:
-                tree = ET.parse(fname)
-                root = tree.getroot()
-
-                for group in root.findall('devGroup'):
-                    family = group.attrib['group']
-
-                    for device in group.findall('device'):
-                        label = device.attrib['label']
-                        skel = device.attrib.get('skel', None)
-                        drv = device.find('driver')
-                        name = drv.attrib['name']
-                        binary = drv.text
-                        version = device.findtext('version', '0.0')
-
-                        skel_file = os.path.join(self.path, skel) if skel else None
-                        driver = DeviceDriver(name, label, version,
-                                              binary, family, skel_file)
-                        self.drivers.append(driver)
-
+                stat = entry.stat()
+            except OSError:
+                continue
+            old = cached.get(fname)
+            if old is not None and old[0] == stat.st_mtime_ns and old[1] == stat.st_size:
+                files[fname] = old
+                continue
+            changed = True
+            records = []
+            try:
+                # Keep the devices defined before an error , just like a partial tree
+                for record in iter_driver_file(fname):
+                    records.append(record)
             except KeyError as e:
                 log.loge("Error in file %s: attribute %s not found" % (fname, e))
-            except ET.ParseError as e:
+            except (AttributeError, ET.ParseError) as e:
                 log.loge("Error in file %s: %s" % (fname, e))
+            files[fname] = (stat.st_mtime_ns, stat.st_size, records)
+
+        if changed or len(files) != len(cached):
+            self._save_cache(files)
+
+        for fname, (_mtime, _size, records) in files.items():
+            for name, label, version, binary, family, skel in records:
+                skel_file = os.path.join(self.path, skel) if skel else None
+                self.drivers.append(DeviceDriver(name, label, version, binary, family, skel_file))
 
         # Sort all drivers by label
         self.drivers.sort(key=lambda x: x.label)
@@ -1,8 +1,9 @@
 #!/usr/bin/python
 
-from subprocess import getoutput, call, check_output
+from subprocess import getoutput, call
 
 import server.config as c
+from server.indi.indiclient import IndiClient
 
 from utils.lightlog import lightlog
 log = lightlog(__name__)
@@ -10,7 +11,9 @@ log = lightlog(__name__)
 class IndiServer(object):
     def __init__(self, fifo = c.config["indiweb"]["fifo"]):
         self.__fifo = fifo
-        self.__running_drivers = {}        
+        self.__running_drivers = {}
+        # Persistent connection used by all of the property accesses
+        self.client = IndiClient(c.config["indiweb"].get("host", "127.0.0.1"), c.config["indiweb"]["port"])
 
     def start(self, port = c.config["indiweb"]["port"], drivers = []) -> None:
         """
@@ -23,6 +26,8 @@ class IndiServer(object):
         # If there is a INDI server running , just kill it
         if self.is_running():
             self.stop()
+        self.client.disconnect()
+        self.client.port = port
         # Clear the old fifo pipe and create a new one
         log.log("Deleting fifo %s" % self.__fifo)
         call(['rm', '-f', self.__fifo])
@@ -43,6 +48,7 @@ class IndiServer(object):
             Args : None
             Returns : None
         """
+        self.client.disconnect()
         cmd = "killall indiserver >/dev/null 2>&1"
         ret = call(cmd, shell=True)
         if ret == 0:
@@ -88,41 +94,38 @@ class IndiServer(object):
         call(full_cmd, shell=True)
         del self.__running_drivers[driver.label]
 
-    def set_prop(self, dev : str, prop : str, element : str, value : str) -> None:
+    def set_prop(self, dev : str, prop : str, element : str, value : str) -> bool:
         """
-            Set a property of a device
+            Set a property of a device , the reply of the server is not waited
             Args : 
                 dev : str # name of the device
                 prop : str # name of the property
                 element : str # name of the element
                 value : str # value of the property
-            Returns : None
+            Returns : bool # whether the command was sent
         """
-        cmd = ['indi_setprop', '%s.%s.%s=%s' % (dev, prop, element, value)]
-        call(cmd)
+        return self.client.set_prop(dev, prop, element, value)
 
-    def get_prop(self, dev : str, prop : str, element : str) -> bytes:
+    def get_prop(self, dev : str, prop : str, element : str) -> str | None:
         """
-            Get a property of a device
+            Get a property of a device from the live property tree
             Args : 
                 dev : str # name of the device
                 prop : str # name of the property
                 element : str # name of the element
-            Returns : bytes
+            Returns : str | None
         """
-        cmd = ['indi_getprop', '%s.%s.%s' % (dev, prop, element)]
-        output = check_output(cmd)
-        return output.split('=')[1].strip()
+        return self.client.get_prop(dev, prop, element)
 
-    def get_state(self, dev : str, prop : str) -> bytes:
+    def get_state(self, dev : str, prop : str) -> str | None:
         """
-            Get a property of a device
+            Get the state of a property of a device
             Args : 
                 dev : str # name of the device
                 prop : str # name of the property
-            Returns : bytes
+            Returns : str | None
         """
-        return self.get_prop(dev, prop, '_STATE')
+        return self.client.get_state(dev, prop)
 
     def auto_connect(self) -> None:
         """
@@ -130,19 +133,14 @@ class IndiServer(object):
             Args : None
             Returns : None
         """
-        cmd = ['indi_getprop', '*.CONNECTION.CONNECT']
-        output = ""
-        try:
-            output = check_output(cmd).decode('utf_8')
-        except Exception as e:
-            log.loge(e)
-
-        output = output.replace("Off", "On")
-
-        for dev in output.splitlines():
-            command = ['indi_setprop', dev]
-            log.log(command)
-            call(command)
+        if not self.client.connect():
+            return
+        # Wait a moment for the definitions of the drivers started just now
+        self.client.wait_property("*", "CONNECTION", timeout=1)
+        for prop in self.client.find("*", "CONNECTION"):
+            if prop.elements.get("CONNECT") != "On":
+                log.log("Auto connecting %s" % prop.device)
+                self.client.set_prop(prop.device, "CONNECTION", "CONNECT", "On")
 
     def get_running_drivers(self) -> dict:
         """
@@ -32,7 +32,7 @@ import server.config as c
 
 collection = DriverCollection(c.config["indiweb"]["data"])
 indi_server = IndiServer(c.config["indiweb"]["fifo"])
-indi_device = Device()
+indi_device = Device(indi_server.client)
 db_path = os.path.join("config", 'indiweb','profiles.db')
 db = Database(db_path)
 collection.parse_custom_drivers(db.get_custom_drivers())
@@ -18,9 +18,15 @@ Boston, MA 02110-1301, USA.
 
 """
 
+from datetime import date
+
 from flask import render_template,request,Flask
 from flask_login import login_required
 
+import server.config as c
+from utils.i18n import _
+from utils.planning import Site,planner
+
 def create_search_template(app : Flask , csrf):
     """
         Create a search template
@@ -35,4 +41,39 @@ def create_search_template(app : Flask , csrf):
             Args:
                 target_id : str # Like 'm1' or 'M1'
             Returns:
-        """
\ No newline at end of file
+        """
+    @app.route('/search/api/visible',methods=['GET'])
+    @app.route('/search/api/visible/',methods=['GET'])
+    @login_required
+    def search_visible():
+        """
+            Search the objects visible tonight from the site location
+            Args (query string):
+                date : str # local date of the evening , like '2023-01-15' , default is today
+                min_alt : float # minimum altitude in degrees , default is 30
+                min_minutes : float # minimum time above min_alt in minutes , default is 60
+                max_mag : float # only objects brighter than this magnitude
+                limit : int # maximum number of objects , default is 100
+            Returns:
+                dusk : float # unix timestamp
+                dawn : float # unix timestamp
+                objects : list
+        """
+        location = c.config.get("location")
+        if not location:
+            return {"error" : _("Site location is not available")}
+        try:
+            site = Site(location.get("latitude"),location.get("longitude"),location.get("horizon"))
+            night = date.fromisoformat(request.args["date"]) if request.args.get("date") else date.today()
+            plan = planner.plan(site,night,min_alt = request.args.get("min_alt",30.0,type=float))
+        except (TypeError,ValueError) as e:
+            return {"error" : str(e)}
+        except OSError as e:
+            return {"error" : _("Failed to load the catalog : {}").format(str(e))}
+        return {
+            "dusk" : plan.dusk,
+            "dawn" : plan.dawn,
+            "objects" : plan.visible(request.args.get("min_minutes",60.0,type=float),
+                                        request.args.get("limit",100,type=int),
+                                        request.args.get("max_mag",None,type=float))
+        }
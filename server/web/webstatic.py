@@ -0,0 +1,199 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# Static files with content hashes , long-lived cache headers and
+# pre-compressed variants built by tools/build_static.py
+# #################################################################
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from flask import Flask,abort,request,send_file
+from jinja2 import FileSystemLoader
+from werkzeug.utils import safe_join
+
+from utils.lightlog import lightlog
+log = lightlog(__name__)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = "static-manifest.json"
+# Only text like files are worth compressing , images and woff are already compressed
+COMPRESSIBLE = {".js",".css",".json",".svg",".html",".txt",".map",".xml",".ttf",".eot",".otf"}
+MIN_COMPRESS_SIZE = 1024
+# A versioned url never changes its content
+IMMUTABLE_AGE = 365 * 24 * 3600
+
+STATIC_URL = re.compile(r"""(?P<prefix>["'(])/static/(?P<path>[^"'?#)\s]+)(?=["')])""")
+
+def file_hash(path : str) -> str:
+    """
+        Get the short content hash of a file
+        Args :
+            path : str
+        Returns : str
+    """
+    digest = hashlib.sha1()
+    with open(path,"rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024),b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+def iter_static_files(folder : str):
+    """
+        Walk the static folder , the generated files are skipped
+        Yields : (relative path with / , absolute path)
+    """
+    for root,_dirs,files in os.walk(folder):
+        for name in files:
+            if name == MANIFEST or name.endswith((".gz",".br")):
+                continue
+            path = os.path.join(root,name)
+            yield os.path.relpath(path,folder).replace(os.sep,"/"),path
+
+def build_static(folder : str) -> dict:
+    """
+        Hash every static file and write the gzip and brotli variants next to them ,
+        the manifest is saved into the folder
+        Args :
+            folder : str # the static folder
+        Returns : dict # the manifest
+    """
+    manifest = {}
+    for name,path in iter_static_files(folder):
+        entry = {"hash" : file_hash(path),"mtime" : os.path.getmtime(path)}
+        if os.path.splitext(name)[1].lower() in COMPRESSIBLE and os.path.getsize(path) >= MIN_COMPRESS_SIZE:
+            with open(path,"rb") as f:
+                data = f.read()
+            variants = [("gzip",".gz",lambda raw: gzip.compress(raw,9,mtime=0))]
+            if brotli is not None:
+                variants.append(("br",".br",lambda raw: brotli.compress(raw,quality=11)))
+            for encoding,suffix,compress in variants:
+                compressed = compress(data)
+                # Keep the variant only if it really saves something
+                if len(compressed) < len(data) * 0.9:
+                    with open(path + suffix,"wb") as f:
+                        f.write(compressed)
+                    entry[encoding] = True
+                elif os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        manifest[name] = entry
+    with open(os.path.join(folder,MANIFEST),"w",encoding="utf-8") as f:
+        json.dump(manifest,f,indent=0,sort_keys=True)
+    return manifest
+
+def load_manifest(folder : str) -> dict:
+    """
+        Load the manifest built by build_static , without it the hashes are computed now
+        and the files are served uncompressed
+        Args :
+            folder : str
+        Returns : dict
+    """
+    manifest = {}
+    try:
+        with open(os.path.join(folder,MANIFEST),"r",encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        log.logw("Static manifest not found , run python -m tools.build_static to pre-compress the files")
+    except (OSError,json.JSONDecodeError) as e:
+        log.logw("Failed to load the static manifest : {}".format(str(e)))
+
+    for name,path in iter_static_files(folder):
+        entry = manifest.get(name)
+        mtime = os.path.getmtime(path)
+        # The file was changed after the build , the compressed variants are stale
+        if entry is None or entry.get("mtime") != mtime:
+            manifest[name] = {"hash" : file_hash(path),"mtime" : mtime}
+    # Files removed since the build
+    for name in [name for name in manifest if not os.path.isfile(os.path.join(folder,name))]:
+        manifest.pop(name)
+    return manifest
+
+class VersionedLoader(FileSystemLoader):
+    """
+        Append the content hash to every /static/ url of the templates.
+        The rewrite happens when a template is loaded , jinja caches the result
+        so there is no cost per request.
+    """
+
+    def __init__(self, searchpath, manifest : dict):
+        super().__init__(searchpath)
+        self.manifest = manifest
+
+    def get_source(self, environment, template):
+        source,filename,uptodate = super().get_source(environment, template)
+        return STATIC_URL.sub(self._versioned,source),filename,uptodate
+
+    def _versioned(self, match) -> str:
+        entry = self.manifest.get(match.group("path"))
+        if entry is None:
+            return match.group(0)
+        return "{}/static/{}?v={}".format(match.group("prefix"),match.group("path"),entry["hash"])
+
+def create_static_cache(app : Flask) -> None:
+    """
+        Serve the static files with content hashes and pre-compressed variants
+        Args :
+            app : Flask application object
+        Returns :
+            None
+    """
+    folder = app.static_folder
+    manifest = load_manifest(folder)
+    app.jinja_loader = VersionedLoader(app.template_folder,manifest)
+
+    def static(filename):
+        path = safe_join(folder,filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        entry = manifest.get(filename,{})
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+        encoding = None
+        for name,suffix in (("br",".br"),("gzip",".gz")):
+            if entry.get(name) and name in request.accept_encodings:
+                encoding,path = name,path + suffix
+                break
+
+        version = entry.get("hash")
+        response = send_file(path,mimetype=mimetype,conditional=True,
+                                etag="{}-{}".format(version,encoding) if version else True)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        if version is not None and request.args.get("v") == version:
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_AGE
+            response.cache_control.immutable = True
+        else:
+            # Unversioned url , the browser has to revalidate with the etag
+            response.cache_control.no_cache = True
+        return response
+
+    app.view_functions["static"] = static
@@ -20,17 +20,19 @@ Boston, MA 02110-1301, USA.
 
 import datetime
 from flask_login import login_required
-from flask import Flask,render_template
+from flask import Flask,render_template,request
 import psutil
 import os 
 
+from utils.sysinfo import sampler
+
 def create_web_sysinfo(app : Flask):
 
     @app.route('/system', methods=['GET'])
     @login_required
     def web_sysinfo():
         """
-            Web system information build on psutil and os
+            Web system information , the status is read from the background sampler
             Args : None
             Returns : Template
         """
@@ -49,45 +51,8 @@ def create_web_sysinfo(app : Flask):
         # Get the CPU cores count
         cpu_count = psutil.cpu_count()
 
-        # Get the status of memory
-        memory = psutil.virtual_memory()
-
-        # Get the disk usage and information
-        disk = psutil.disk_partitions()
-        disk_list = []
-
-        for physical_disk_partition in disk:
-            physical_disk_usage = psutil.disk_usage(physical_disk_partition.mountpoint)
-            physical_disk = {
-                'device': physical_disk_partition.device,
-                'mount_point': physical_disk_partition.mountpoint,
-                'type': physical_disk_partition.fstype,
-                'options': physical_disk_partition.opts,
-                'space_total': physical_disk_usage.total,
-                'space_used': physical_disk_usage.used,
-                'used_percent': physical_disk_usage.percent,
-                'space_free': physical_disk_usage.free
-            }
-            disk_list.append(physical_disk)
-
-        # Get the process infomation
-
-        processes = []
-        for p in psutil.process_iter():
-            process_info = {
-                'name': p.name(),
-                'pid': p.pid,
-                'username': p.username(),
-                'cpu': p.cpu_percent(),
-                'memory': p.memory_percent(),
-                'memory_rss': p.memory_info().rss,
-                'memory_vms': p.memory_info().vms,
-                'status': p.status(),
-                'created_time': p.create_time(),
-                'cmdline': ' '.join(p.cmdline())
-            }
-            processes.append(process_info)
-            processes.sort(key=lambda proc: proc.get('cpu'),reverse=True)
+        # Memory , disks and the busiest processes are sampled in the background
+        status = sampler.snapshot()
 
         return render_template("system.html", 
                             sys_name = sysname,
@@ -98,9 +63,9 @@ def create_web_sysinfo(app : Flask):
                             now_time = now_time,
                             boot_time = boot_time,
                             cpu_count = cpu_count,
-                            memory = memory,
-                            disk_list = disk_list,
-                            processes = processes)
+                            memory = status["memory"],
+                            disk_list = status["disks"],
+                            processes = status["processes"])
 
     @app.route("/system/api/memory", methods=["GET"])
     @login_required
@@ -108,7 +73,7 @@ def create_web_sysinfo(app : Flask):
         """
             System Refresh Memory API method
         """
-        return {"used" : psutil.virtual_memory().percent}
+        return {"used" : sampler.snapshot()["memory"].percent}
 
     @app.route("/system/api/cpu", methods=["GET"])
     @login_required
@@ -116,4 +81,15 @@ def create_web_sysinfo(app : Flask):
         """
             System Refresh CPU Usage API method
         """
-        return {"used" : psutil.cpu_percent()}
+        return {"used" : sampler.snapshot()["cpu"]}
+
+    @app.route("/system/api/history", methods=["GET"])
+    @login_required
+    def system_api_history():
+        """
+            History of the CPU and memory usage for the charts
+            Args :
+                seconds : float # only the last N seconds , all of the kept samples by default
+        """
+        seconds = request.args.get("seconds",type=float)
+        return sampler.history(seconds)
@@ -269,6 +269,8 @@ from server.web.webdevice import create_indimanager_html
 create_indimanager_html(app,csrf)
 from server.web.websearch import create_search_template
 create_search_template(app,csrf)
+from server.web.webstatic import create_static_cache
+create_static_cache(app)
 
 def run_server() -> None:
     """
@@ -277,7 +279,7 @@ def run_server() -> None:
         Return: None
         NOTE : All of the c.configuration parameters are already defined before starting the server
     """
-    if c.config.get("debug") is True:
+    if c.config.get("debug") is True and not c.config.get("production"):
         log.log(_("Running debug web server on {}:{}").format(c.config.get('host'),c.config.get('port')))
         app.run(host=c.config.get("host"), port=c.config.get("port"),threaded=c.config.get("threaded"),debug=c.config.get("debug"))
     else:
@@ -285,9 +287,16 @@ def run_server() -> None:
         try:
             # We hope to use waitress as a high performance wsgi server
             from waitress import serve
-            log.log(_("Using waitress as wsgi server"))
-            serve(app,host = c.config.get("host"),port=c.config.get("port"))
         except ImportError as e:
-            logger.logw(_("Failed to import waitress as wsgi server , use default server"))
+            log.logw(_("Failed to import waitress as wsgi server , use default server"))
             app.run(host=c.config.get("host"),port=c.config.get("port"),threaded=True)
+            return
+        threads = int(c.config.get("threads",8))
+        log.log(_("Using waitress as wsgi server with {} threads").format(threads))
+        serve(app,host = c.config.get("host"),port=c.config.get("port"),
+                threads = threads,
+                connection_limit = int(c.config.get("connection_limit",100)),
+                channel_timeout = int(c.config.get("channel_timeout",120)),
+                backlog = int(c.config.get("backlog",1024)),
+                ident = None)
         
\ No newline at end of file
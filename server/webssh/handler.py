@@ -7,7 +7,6 @@ import weakref
 import paramiko
 import tornado.web
 
-from concurrent.futures import ThreadPoolExecutor
 from tornado.ioloop import IOLoop
 from tornado.options import options
 from tornado.process import cpu_count
@@ -17,6 +16,7 @@ from server.webssh.utils import (
     is_valid_encoding
 )
 from server.webssh.worker import Worker, recycle_worker, clients
+from server.webssh.manager import ConnectionManager, ConnectionQueueFull
 
 from json.decoder import JSONDecodeError
 
@@ -37,6 +37,21 @@ class InvalidValueError(Exception):
 
 class SSHClient(paramiko.SSHClient):
 
+    # Set when the transport is shared with other terminals
+    release = None
+
+    def use_transport(self, transport, release):
+        self._transport = transport
+        self.release = release
+
+    def close(self):
+        if self.release is None:
+            return super(SSHClient, self).close()
+        release, self.release = self.release, None
+        # Only give the shared transport back , the other terminals still use it
+        self._transport = None
+        release()
+
     def handler(self, title, instructions, prompt_list):
         answers = []
         for prompt_, _ in prompt_list:
@@ -309,7 +324,16 @@ class NotFoundHandler(MixinHandler, tornado.web.ErrorHandler):
 
 class IndexHandler(MixinHandler, tornado.web.RequestHandler):
 
-    executor = ThreadPoolExecutor(max_workers=cpu_count()*5)
+    manager = None
+
+    @classmethod
+    def get_manager(cls):
+        if cls.manager is None:
+            cls.manager = ConnectionManager(
+                options.maxhandshakes or cpu_count(), options.maxpending,
+                options.dnsttl, options.idletimeout
+            )
+        return cls.manager
 
     def initialize(self, loop, policy, host_keys_settings):
         super(IndexHandler, self).initialize(loop)
@@ -441,28 +465,44 @@ class IndexHandler(MixinHandler, tornado.web.RequestHandler):
         logger.warning('Could not detect the default encoding.')
         return 'utf-8'
 
-    def ssh_connect(self, args):
+    def ssh_connect(self, args, src_ip):
         ssh = self.ssh_client
+        manager = self.get_manager()
         dst_addr = args[:2]
-        logger.info('Connecting to {}:{}'.format(*dst_addr))
+        # A transport authenticated with a one-time code is never shared
+        key = None if ssh.totp else manager.transport_key(src_ip, *args)
+        transport, encoding = manager.acquire(key) if key else (None, None)
 
-        try:
-            ssh.connect(*args, timeout=options.timeout)
-        except socket.error:
-            raise ValueError('Unable to connect to {}:{}'.format(*dst_addr))
-        except paramiko.BadAuthenticationType:
-            raise ValueError('Bad authentication type.')
-        except paramiko.AuthenticationException:
-            raise ValueError('Authentication failed.')
-        except paramiko.BadHostKeyException:
-            raise ValueError('Bad host key.')
+        if transport is not None:
+            logger.info('Reusing transport to {}:{}'.format(*dst_addr))
+            ssh.use_transport(transport, lambda: manager.release(key))
+        else:
+            logger.info('Connecting to {}:{}'.format(*dst_addr))
+            try:
+                sock = manager.open_socket(args[0], args[1], options.timeout)
+                ssh.connect(*args, timeout=options.timeout, sock=sock)
+            except socket.error:
+                raise ValueError('Unable to connect to {}:{}'.format(*dst_addr))
+            except paramiko.BadAuthenticationType:
+                raise ValueError('Bad authentication type.')
+            except paramiko.AuthenticationException:
+                raise ValueError('Authentication failed.')
+            except paramiko.BadHostKeyException:
+                raise ValueError('Bad host key.')
+            encoding = options.encoding if options.encoding else \
+                self.get_default_encoding(ssh)
+            if key and manager.register(key, ssh.get_transport(), encoding):
+                ssh.release = lambda: manager.release(key)
 
         term = self.get_argument('term', u'') or u'xterm'
-        chan = ssh.invoke_shell(term=term)
+        try:
+            chan = ssh.invoke_shell(term=term)
+        except paramiko.SSHException:
+            ssh.close()
+            raise
         chan.setblocking(0)
         worker = Worker(self.loop, ssh, chan, dst_addr)
-        worker.encoding = options.encoding if options.encoding else \
-            self.get_default_encoding(ssh)
+        worker.encoding = encoding
         return worker
 
     def check_origin(self):
@@ -503,7 +543,10 @@ class IndexHandler(MixinHandler, tornado.web.RequestHandler):
         except InvalidValueError as exc:
             raise tornado.web.HTTPError(400, str(exc))
 
-        future = self.executor.submit(self.ssh_connect, args)
+        try:
+            future = self.get_manager().submit(self.ssh_connect, args, ip)
+        except ConnectionQueueFull as exc:
+            raise tornado.web.HTTPError(503, str(exc))
 
         try:
             worker = yield future
@@ -521,6 +564,12 @@ class IndexHandler(MixinHandler, tornado.web.RequestHandler):
         self.write(self.result)
 
 
+class StatsHandler(MixinHandler, tornado.web.RequestHandler):
+
+    def get(self):
+        self.write(IndexHandler.get_manager().get_stats())
+
+
 class WsockHandler(MixinHandler, tornado.websocket.WebSocketHandler):
 
     def initialize(self, loop):
@@ -585,8 +634,7 @@ class WsockHandler(MixinHandler, tornado.websocket.WebSocketHandler):
 
         data = msg.get('data')
         if data and isinstance(data, UnicodeType):
-            worker.data_to_dst.append(data)
-            worker.on_write()
+            worker.write(data)
 
     def on_close(self):
         logger.info('Disconnected from {}:{}'.format(*self.src_addr))
@@ -0,0 +1,182 @@
+import hashlib
+import socket
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.lightlog import new_lightlog
+logger = new_lightlog(__name__)
+
+
+class ConnectionQueueFull(Exception):
+    pass
+
+
+class ConnectionManager(object):
+    """
+        Run the blocking ssh handshakes on a bounded pool.
+        Resolved addresses are cached and authenticated transports are shared by
+        the terminals opened to the same host with the same credentials.
+    """
+
+    def __init__(self, max_handshakes, max_pending=64, dns_ttl=300,
+                 idle_timeout=30):
+        self.max_handshakes = max_handshakes
+        self.max_pending = max_pending
+        self.dns_ttl = dns_ttl
+        self.idle_timeout = idle_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_handshakes)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.active = 0
+        self.handshakes = 0
+        self.failures = 0
+        self.reused = 0
+        self.last_latency = 0.0
+        self.avg_latency = 0.0
+        self.max_latency = 0.0
+        self.dns_cache = {}     # {(hostname, port): (expire, [sockaddr])}
+        self.transports = {}    # {key: [transport, refs, encoding, idle_timer]}
+
+    # Queue
+
+    def submit(self, fn, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise ConnectionQueueFull('Too many pending connections.')
+            self.pending += 1
+        return self.executor.submit(self._run, fn, *args)
+
+    def _run(self, fn, *args):
+        with self.lock:
+            self.pending -= 1
+            self.active += 1
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = fn(*args)
+            ok = True
+            return result
+        finally:
+            latency = time.perf_counter() - start
+            with self.lock:
+                self.active -= 1
+                if ok:
+                    self.handshakes += 1
+                    self.last_latency = latency
+                    self.max_latency = max(self.max_latency, latency)
+                    # Exponential moving average , recent handshakes matter most
+                    self.avg_latency = latency if self.handshakes == 1 else \
+                        self.avg_latency * 0.9 + latency * 0.1
+                else:
+                    self.failures += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(
+                pending=self.pending, active=self.active,
+                max_handshakes=self.max_handshakes,
+                handshakes=self.handshakes, failures=self.failures,
+                reused=self.reused, transports=len(self.transports),
+                last_latency=round(self.last_latency, 4),
+                avg_latency=round(self.avg_latency, 4),
+                max_latency=round(self.max_latency, 4)
+            )
+
+    # DNS
+
+    def resolve(self, hostname, port):
+        key = (hostname, port)
+        now = time.monotonic()
+        with self.lock:
+            cached = self.dns_cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+        addrs = [info[4] for info in socket.getaddrinfo(
+            hostname, port, 0, socket.SOCK_STREAM)]
+        with self.lock:
+            self.dns_cache[key] = (now + self.dns_ttl, addrs)
+        return addrs
+
+    def open_socket(self, hostname, port, timeout):
+        """Connect to the first reachable address of the host"""
+        error = None
+        for addr in self.resolve(hostname, port):
+            try:
+                return socket.create_connection(addr[:2], timeout=timeout)
+            except socket.error as e:
+                error = e
+        # The address may have changed , resolve it again next time
+        with self.lock:
+            self.dns_cache.pop((hostname, port), None)
+        raise error or socket.error('No address found for {}'.format(hostname))
+
+    # Transports
+
+    @staticmethod
+    def transport_key(src_ip, hostname, port, username, password, pkey):
+        """
+            Only the same browser address with exactly the same credentials
+            may share a transport
+        """
+        digest = hashlib.sha256()
+        for item in (src_ip, hostname, str(port), username, password or ''):
+            digest.update(item.encode('utf-8'))
+            digest.update(b'\0')
+        if pkey is not None:
+            digest.update(pkey.asbytes())
+        return digest.hexdigest()
+
+    def acquire(self, key):
+        """
+            Get a live authenticated transport
+            Returns : (transport, encoding) or (None, None)
+        """
+        with self.lock:
+            entry = self.transports.get(key)
+            if entry is None:
+                return None, None
+            transport, refs, encoding, timer = entry
+            if not transport.is_active():
+                self.transports.pop(key)
+                return None, None
+            if timer is not None:
+                timer.cancel()
+            entry[1] = refs + 1
+            entry[3] = None
+            self.reused += 1
+            return transport, encoding
+
+    def register(self, key, transport, encoding):
+        with self.lock:
+            old = self.transports.get(key)
+            if old is not None and old[0].is_active():
+                # Two handshakes to the same host raced , keep the first one
+                return False
+            self.transports[key] = [transport, 1, encoding, None]
+            return True
+
+    def release(self, key):
+        with self.lock:
+            entry = self.transports.get(key)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            # Keep it for a while , a reconnecting browser will reuse it
+            timer = threading.Timer(self.idle_timeout, self._expire,
+                                    args=(key, entry[0]))
+            timer.daemon = True
+            entry[3] = timer
+            timer.start()
+
+    def _expire(self, key, transport):
+        with self.lock:
+            entry = self.transports.get(key)
+            if entry is None or entry[0] is not transport or entry[1] > 0:
+                return
+            self.transports.pop(key)
+        logger.info('Closing idle ssh transport')
+        transport.close()
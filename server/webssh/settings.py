@@ -43,6 +43,13 @@ define('timeout', type=float, default=3, help='SSH connection timeout')
 define('delay', type=float, default=3, help='The delay to call recycle_worker')
 define('maxconn', type=int, default=20,
        help='Maximum live connections (ssh sessions) per client')
+define('maxhandshakes', type=int, default=0,
+       help='Maximum concurrent ssh handshakes, 0 means the number of cpus')
+define('maxpending', type=int, default=64,
+       help='Maximum ssh connections waiting for a handshake slot')
+define('dnsttl', type=float, default=300, help='Seconds a resolved hostname is cached')
+define('idletimeout', type=float, default=30,
+       help='Seconds an unused authenticated transport is kept for reuse')
 define('font', default='', help='custom font filename')
 define('encoding', default='',
        help='''The default character encoding of ssh servers.
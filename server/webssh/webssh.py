@@ -4,7 +4,9 @@ import tornado.ioloop
 
 from tornado.options import options
 from server.webssh import handler
-from server.webssh.handler import IndexHandler, WsockHandler, NotFoundHandler
+from server.webssh.handler import (
+    IndexHandler, WsockHandler, NotFoundHandler, StatsHandler
+)
 from server.webssh.settings import (
     get_app_settings,  get_host_keys_settings, get_policy_setting,
     get_ssl_context, get_server_settings, check_encoding_setting
@@ -20,7 +22,8 @@ def make_handlers(loop, options):
     handlers = [
         (r'/', IndexHandler, dict(loop=loop, policy=policy,
                                   host_keys_settings=host_keys_settings)),
-        (r'/ws', WsockHandler, dict(loop=loop))
+        (r'/ws', WsockHandler, dict(loop=loop)),
+        (r'/stats', StatsHandler)
     ]
     return handlers
 
@@ -12,6 +12,14 @@ from utils.lightlog import new_lightlog
 logger = new_lightlog(__name__)
 
 BUF_SIZE = 32 * 1024
+# Output of the terminal is gathered for this many seconds before it is sent as one frame
+FLUSH_DELAY = 0.005
+# Stop reading from the channel while more than HIGH_WATER bytes are not delivered to the browser ,
+# resume once it falls below LOW_WATER
+HIGH_WATER = 1024 * 1024
+LOW_WATER = 256 * 1024
+# Retry interval while the SSH window is full , the fd of a channel never signals writability
+SEND_RETRY = 0.01
 clients = {}  # {ip: {id: worker}}
 
 def clear_worker(worker, clients):
@@ -40,9 +48,17 @@ class Worker(object):
         self.dst_addr = dst_addr
         self.fd = chan.fileno()
         self.id = self.gen_id()
-        self.data_to_dst = []
+        # Bytes waiting for the ssh channel
+        self.data_to_dst = bytearray()
+        # Bytes read from the channel and not yet sent to the websocket
+        self.data_to_src = bytearray()
+        # Bytes handed to the websocket and not yet flushed to the socket
+        self.pending = 0
         self.handler = None
         self.mode = IOLoop.READ
+        self.paused = False
+        self.flush_scheduled = False
+        self.retry_scheduled = False
         self.closed = False
 
     def __call__(self, fd, events):
@@ -65,53 +81,94 @@ class Worker(object):
         if self.mode != mode:
             self.loop.update_handler(self.fd, mode)
             self.mode = mode
-        if mode == IOLoop.WRITE:
-            self.loop.call_later(0.1, self, self.fd, IOLoop.WRITE)
 
     def on_read(self):
-        logger.debug(_('worker {} on read').format(self.id))
-        try:
-            data = self.chan.recv(BUF_SIZE)
-        except (OSError, IOError) as e:
-            logger.error(e)
-            if self.chan.closed or errno_from_exception(e) in _ERRNO_CONNRESET:
-                self.close(reason=_('chan error on reading'))
-        else:
-            logger.debug('{!r} from {}:{}'.format(data, *self.dst_addr))
+        # Drain everything the channel already has , bounded by the high water mark
+        while len(self.data_to_src) < HIGH_WATER:
+            try:
+                data = self.chan.recv(BUF_SIZE)
+            except (OSError, IOError) as e:
+                if self.chan.closed or errno_from_exception(e) in _ERRNO_CONNRESET:
+                    logger.error(e)
+                    self.close(reason=_('chan error on reading'))
+                    return
+                # Nothing more to read for now
+                break
             if not data:
+                self.flush()
                 self.close(reason=_('chan closed'))
                 return
+            self.data_to_src += data
+            if not self.chan.recv_ready():
+                break
+
+        if len(self.data_to_src) >= BUF_SIZE:
+            self.flush()
+        elif self.data_to_src and not self.flush_scheduled:
+            # Coalesce the small pieces , like the echo of the keys , into one frame
+            self.flush_scheduled = True
+            self.loop.call_later(FLUSH_DELAY, self.flush)
+
+    def flush(self):
+        """Send the gathered output to the browser as a single frame"""
+        self.flush_scheduled = False
+        if self.closed or not self.data_to_src or not self.handler:
+            return
+        data = bytes(self.data_to_src)
+        self.data_to_src.clear()
+        try:
+            future = self.handler.write_message(data, binary=True)
+        except tornado.websocket.WebSocketClosedError:
+            self.close(reason=_('websocket closed'))
+            return
+        size = len(data)
+        self.pending += size
+        future.add_done_callback(lambda _future: self.on_delivered(size))
+        if self.pending >= HIGH_WATER and not self.paused:
+            # The browser can not keep up , stop reading until the socket drains
+            self.paused = True
+            self.loop.remove_handler(self.fd)
 
-            logger.debug(_('{!r} to {}:{}').format(data, *self.handler.src_addr))
-            try:
-                self.handler.write_message(data, binary=True)
-            except tornado.websocket.WebSocketClosedError:
-                self.close(reason=_('websocket closed'))
+    def on_delivered(self, size):
+        self.pending -= size
+        if self.paused and self.pending <= LOW_WATER and not self.closed:
+            self.paused = False
+            self.loop.add_handler(self.fd, self, self.mode)
+
+    def write(self, data):
+        """
+            Queue the input of the browser for the channel
+            Args :
+                data : str
+        """
+        self.data_to_dst += data.encode('utf-8')
+        self.on_write()
+
+    def retry_write(self):
+        self.retry_scheduled = False
+        self.on_write()
 
     def on_write(self):
-        logger.debug(_('worker {} on write').format(self.id))
-        if not self.data_to_dst:
+        if not self.data_to_dst or self.closed:
             return
 
-        data = ''.join(self.data_to_dst)
-        logger.debug(_('{!r} to {}:{}').format(data, *self.dst_addr))
-
         try:
-            sent = self.chan.send(data)
+            sent = self.chan.send(bytes(self.data_to_dst[:BUF_SIZE]))
         except (OSError, IOError) as e:
-            logger.error(e)
             if self.chan.closed or errno_from_exception(e) in _ERRNO_CONNRESET:
+                logger.error(e)
                 self.close(reason=_('chan error on writing'))
+                return
+            sent = 0
+
+        del self.data_to_dst[:sent]
+        if self.data_to_dst and not self.retry_scheduled:
+            self.retry_scheduled = True
+            if sent:
+                # There is still room in the window , go on at the next iteration
+                self.loop.add_callback(self.retry_write)
             else:
-                self.update_handler(IOLoop.WRITE)
-        else:
-            self.data_to_dst = []
-            data = data[sent:]
-            if data:
-                self.data_to_dst.append(data)
-                self.update_handler(IOLoop.WRITE)
-            else:
-                self.update_handler(IOLoop.READ)
+                self.loop.call_later(SEND_RETRY, self.retry_write)
 
     def close(self, reason=None):
         if self.closed:
@@ -122,7 +179,9 @@ class Worker(object):
             _('Closing worker {} with reason: {}').format(self.id, reason)
         )
         if self.handler:
-            self.loop.remove_handler(self.fd)
+            # A paused fd is already removed from the loop
+            if not self.paused:
+                self.loop.remove_handler(self.fd)
             self.handler.close(reason=reason)
         self.chan.close()
         self.ssh.close()
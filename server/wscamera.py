@@ -19,18 +19,22 @@ Boston, MA 02110-1301, USA.
 """
 
 # System Library
+from base64 import b64encode
 import datetime
-from json import JSONDecodeError, dumps
 from secrets import randbelow
+import threading
 # Third Party Library
 
 # Built-in Library
 from server.basic.camera import BasicCameraAPI,BasicCameraInfo
 
-import server.config as c
-
+from utils.calibration import KINDS, CalibrationError, library
+from utils.livestack import LiveStack
+from utils.preview import bayer_pattern, make_preview
 from utils.i18n import _
 from utils.utility import switch
+from utils.dispatch import handler
+from server.wsmessenger import messenger
 from utils.lightlog import lightlog
 logger = lightlog(__name__)
 
@@ -47,6 +51,10 @@ class WsCameraInterface():
         """
         self.info = BasicCameraInfo()
         self.device = None
+        self.livestack = None
+        self._stacking = threading.Lock()
+        # Id of the last image given to the live stack , the same result may be asked twice
+        self._stacked_image = None
 
     def __del__(self) -> None:
         """
@@ -74,13 +82,9 @@ class WsCameraInterface():
         if not isinstance(message, dict) or message.get("status") is None or message.get("message") is None:
             logger.loge(_("Unknown format of message"))
             return False
-        try:
-            c.ws.send_message_to_all(dumps(message))
-        except JSONDecodeError as exception:
-            logger.loge(_(f"Failed to parse message into JSON format , error {exception}"))
-            return False
-        return True 
+        return messenger.send(message)
 
+    @handler("RemoteConnect")
     def remote_connect(self,params : dict) -> None:
         """
             Connect to the camera
@@ -155,6 +159,7 @@ class WsCameraInterface():
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing connect command"))
 
+    @handler("RemoteDisconnect")
     def remote_disconnect(self):
         """
             Disconnect from the camera
@@ -195,6 +200,7 @@ class WsCameraInterface():
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing disconnect command"))
 
+    @handler("RemoteReconnect")
     def remote_reconnect(self) -> None:
         """
             Reconnect to the camera
@@ -231,6 +237,7 @@ class WsCameraInterface():
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing reconnect command"))
 
+    @handler("RemoteScanning")
     def remote_scanning(self) -> None:
         """
             Scannings from the camera
@@ -265,6 +272,7 @@ class WsCameraInterface():
             r["params"]["list"] = res.get("params").get("list")
             logger.log(_("Scanning camera successfully, found {} camera").format(len(r["params"]["list"])))
 
+    @handler("RemotePolling")
     def remote_polling(self) -> None:
         """
             Polling newest message from the camera
@@ -307,6 +315,7 @@ class WsCameraInterface():
     #
     # #################################################################
 
+    @handler("RemoteStartExposure")
     def remote_start_exposure(self , params : dict) -> None:
         """
             Start the exposure of the camera
@@ -437,6 +446,7 @@ class WsCameraInterface():
         if self.on_send(r) is False:
             logger.loge(_(f"Failed to send message while executing exposure command"))
 
+    @handler("RemoteAbortExposure")
     def remote_abort_exposure(self) -> None:
         """
             Abort exposure | 停止曝光
@@ -478,6 +488,7 @@ class WsCameraInterface():
         if self.on_send(r) is False:
             logger.loge(_(f"Failed to send message while executing aborting exposure command"))
 
+    @handler("RemoteGetExposureStatus")
     def remote_get_exposure_status(self) -> None:
         """
             Get exposure status | 停止曝光
@@ -521,10 +532,14 @@ class WsCameraInterface():
         if self.on_send(r) is False:
             logger.loge(_(f"Failed to send message while executing get_exposure_status command"))
 
-    def remote_get_exposure_result(self) -> None:
+    @handler("RemoteGetExposureResult")
+    def remote_get_exposure_result(self, params : dict = None) -> None:
         """
             Get exposure result | 获取曝光结果
-            Args : None
+            Args :
+                params : dict # optional
+                    raw : bool # also send the whole image , slow on a large frame
+                    preview : dict # max_size , format , quality , linked and debayer of the preview
             Returns : None
             ClientReturn:
                 event : str # name of the event
@@ -548,7 +563,7 @@ class WsCameraInterface():
                 logger.loge(_(f"Failed to send message while executing get_exposure_result command"))
             return
         # Trying to get the result of exposure
-        res = self.device.get_exposure_result()
+        res = self.device.get_exposure_result(params)
         if res.get("status")!= 0:
             r["message"] = res.get("message")
             try:
@@ -559,13 +574,17 @@ class WsCameraInterface():
             r["message"] = res.get("message")
             # Get the base64 encoded image data
             r["params"]["image"] = res.get("params").get("image")
+            # Get the stretched preview of the image
+            r["params"]["preview"] = res.get("params").get("preview")
             # Get the histogram of the image
             r["params"]["histogram"] = res.get("params").get("histogram")
             # Get the infomation of the image
             r["params"]["info"] = res.get("params").get("info")
+            self.feed_live_stack()
         if self.on_send(r) is False:
             logger.loge(_(f"Failed to send message while executing get_exposure_result command"))
 
+    @handler("RemoteStartSequenceExposure")
     def remote_start_sequence_exposure(self,params : dict) -> None:
         """
             Start exposure sequence
@@ -583,3 +602,248 @@ class WsCameraInterface():
                 params : dict # default is None
             NOTE : This function's parameters should be thinked carefully
         """
+
+    # #################################################################
+    # Calibration library
+    # #################################################################
+
+    @handler("RemoteGetCalibrationLibrary")
+    def remote_get_calibration_library(self) -> None:
+        """
+            Get the calibration frames and masters | 获取校准帧库
+            Args : None
+            Returns : None
+            ClientReturn:
+                params : dict
+                    frames : list # camera , gain , offset , binning , temperature , exposure of every frame
+                    masters : list
+        """
+        r = {
+            "event" : "RemoteGetCalibrationLibrary",
+            "id" : randbelow(1000),
+            "status" : 0,
+            "message" : _("Get calibration library successfully"),
+            "params" : library.list()
+        }
+        if self.on_send(r) is False:
+            logger.loge(_("Failed to send message while executing get_calibration_library command"))
+
+    @handler("RemoteBuildCalibrationMaster")
+    def remote_build_calibration_master(self, params : dict) -> None:
+        """
+            Build a master from the frames of the library | 生成校准主帧
+            Args :
+                params : dict
+                    kind : str # dark , flat or offset
+                    camera : str # None for the connected camera
+                    gain , offset , binning , temperature , exposure # None for the current settings
+                    sigma : float # rejection threshold , default is 3
+            Returns : None
+            ClientReturn:
+                RemoteBuildCalibrationMaster is sent when the master is built , with the index entry as params
+            NOTE : This is a non-blocking function , building a master may take a while
+        """
+        r = {
+            "event" : "RemoteBuildCalibrationMaster",
+            "id" : randbelow(1000),
+            "status" : 1,
+            "message" : "",
+            "params" : {}
+        }
+        params = params or {}
+        kind = params.get("kind")
+        if kind not in KINDS:
+            r["message"] = _("Unknown frame type {}").format(kind)
+            if self.on_send(r) is False:
+                logger.loge(_("Failed to send message while executing build_calibration_master command"))
+            return
+        info = {key : params.get(key) for key in ("camera","gain","offset","binning","temperature","exposure")}
+        if self.device is not None and self.info._is_connected and hasattr(self.device,"calibration_info"):
+            current = self.device.calibration_info(kind)
+            info = {key : current.get(key) if value is None else value for key , value in info.items()}
+
+        def build() -> None:
+            try:
+                r["params"] = library.build_master(kind,info,float(params.get("sigma",3.0)))
+                r["status"] = 0
+                r["message"] = _("Build {} master successfully").format(kind)
+            except (CalibrationError,OSError,ValueError) as e:
+                logger.loge(_("Failed to build the {} master : {}").format(kind,str(e)))
+                r["message"] = str(e)
+            if self.on_send(r) is False:
+                logger.loge(_("Failed to send message while executing build_calibration_master command"))
+
+        threading.Thread(target=build,name="calibration-master",daemon=True).start()
+
+    # #################################################################
+    # Live stacking
+    # #################################################################
+
+    def feed_live_stack(self) -> None:
+        """
+            Stack the last image in the background if a live stack is running
+            NOTE : A frame arriving while the previous one is still stacked is skipped , nothing is queued
+        """
+        stack = self.livestack
+        image = getattr(self.device,"last_image",None)
+        if stack is None or image is None:
+            return
+        image_id = getattr(self.device.info,"_image_id",None)
+        if image_id is not None and image_id == self._stacked_image:
+            logger.logd(_("Image {} is already stacked").format(image_id))
+            return
+        if not self._stacking.acquire(blocking=False):
+            logger.logw(_("Live stack is busy , frame skipped"))
+            return
+        self._stacked_image = image_id
+        info = self.device.calibration_info("light") if hasattr(self.device,"calibration_info") else None
+
+        def run() -> None:
+            try:
+                stats = stack.add(image,info)
+                r = {"status" : 0, "message" : "", "params" : stats}
+            # Whatever happens the client must get the update , the thread would die silently
+            except Exception as e:
+                logger.loge(_("Failed to stack the frame : {}").format(str(e)))
+                r = {"status" : 1, "message" : str(e), "params" : None}
+            finally:
+                self._stacking.release()
+            r["event"] = "RemoteLiveStackUpdate"
+            r["id"] = randbelow(1000)
+            if self.on_send(r) is False:
+                logger.loge(_("Failed to send message while stacking a frame"))
+
+        threading.Thread(target=run,name="livestack",daemon=True).start()
+
+    @handler("RemoteStartLiveStack")
+    def remote_start_live_stack(self, params : dict) -> None:
+        """
+            Start a live stack , the next exposure results are stacked | 开始实时叠加
+            Args :
+                params : dict
+                    calibrate : bool # calibrate with the masters of the library , default is True
+                    sigma : float # pixel rejection threshold , 0 to disable
+                    max_shift : float # pixels , frames moved more are not stacked
+                    debayer : str # superpixel or bilinear , for a colour camera
+            Returns : None
+            ClientReturn:
+                RemoteLiveStackUpdate is sent after every frame , with the shift and the time used
+            NOTE : The frames of a colour camera are debayered before they are aligned and stacked
+        """
+        params = params or {}
+        pattern = None
+        if self.device is not None:
+            device_info = self.device.info
+            pattern = bayer_pattern(getattr(device_info,"_sensor_type",None),getattr(device_info,"_bayer_offset_x",0),
+                                    getattr(device_info,"_bayer_offset_y",0))
+
+        def calibrate(image , info : dict):
+            if info is None:
+                return image.astype("float32")
+            return library.calibrate(image,info)
+
+        try:
+            stack = LiveStack(calibrate=calibrate if params.get("calibrate",True) else None,
+                                sigma=float(params.get("sigma",3.0)),
+                                max_shift=params.get("max_shift"),
+                                pattern=pattern,debayer=params.get("debayer","superpixel"))
+        except (TypeError,ValueError) as e:
+            logger.loge(_("Failed to start the live stack : {}").format(str(e)))
+            r = {
+                "event" : "RemoteStartLiveStack",
+                "id" : randbelow(1000),
+                "status" : 1,
+                "message" : str(e),
+                "params" : None
+            }
+            if self.on_send(r) is False:
+                logger.loge(_("Failed to send message while executing start_live_stack command"))
+            return
+        self.livestack = stack
+        # A result asked again after the start is a new frame for this stack
+        self._stacked_image = None
+        r = {
+            "event" : "RemoteStartLiveStack",
+            "id" : randbelow(1000),
+            "status" : 0,
+            "message" : _("Live stack started"),
+            "params" : {"pattern" : pattern}
+        }
+        if self.on_send(r) is False:
+            logger.loge(_("Failed to send message while executing start_live_stack command"))
+
+    @handler("RemoteStopLiveStack")
+    def remote_stop_live_stack(self) -> None:
+        """
+            Stop the live stack , its buffers are freed | 停止实时叠加
+            Args : None
+            Returns : None
+        """
+        stack , self.livestack = self.livestack , None
+        r = {
+            "event" : "RemoteStopLiveStack",
+            "id" : randbelow(1000),
+            "status" : 0 if stack is not None else 1,
+            "message" : _("Live stack stopped") if stack is not None else _("No live stack is running"),
+            "params" : stack.get_dict() if stack is not None else None
+        }
+        if self.on_send(r) is False:
+            logger.loge(_("Failed to send message while executing stop_live_stack command"))
+
+    @handler("RemoteGetLiveStackPreview")
+    def remote_get_live_stack_preview(self, params : dict = None) -> None:
+        """
+            Get the stretched preview of the live stack | 获取实时叠加预览
+            Args :
+                params : dict # optional , max_size , format , quality and linked , see make_preview
+            Returns : None
+            ClientReturn:
+                params : dict # base64 data , format , width , height and time of the preview
+            NOTE : The stack of a colour camera is already debayered , pattern and debayer are refused
+        """
+        stack = self.livestack
+        r = {
+            "event" : "RemoteGetLiveStackPreview",
+            "id" : randbelow(1000),
+            "status" : 1,
+            "message" : "",
+            "params" : None
+        }
+        image = stack.image() if stack is not None else None
+        options = dict(params or {})
+        if image is None:
+            r["message"] = _("No live stack is running")
+        elif "pattern" in options or "debayer" in options:
+            r["message"] = _("The live stack is already debayered")
+        else:
+            if "format" in options:
+                options["fmt"] = options.pop("format")
+            try:
+                preview = make_preview(image,**options)
+                preview["data"] = b64encode(preview["data"]).decode()
+                r["status"] , r["params"] = 0 , preview
+            except (ValueError,TypeError) as e:
+                logger.loge(_("Failed to make the preview of the live stack : {}").format(str(e)))
+                r["message"] = str(e)
+        if self.on_send(r) is False:
+            logger.loge(_("Failed to send message while executing get_live_stack_preview command"))
+
+    @handler("RemoteGetLiveStack")
+    def remote_get_live_stack(self) -> None:
+        """
+            Get the statistics of the live stack | 获取实时叠加状态
+            Args : None
+            Returns : None
+            ClientReturn:
+                params : dict # frames , rejected frames , memory and the average time per frame
+        """
+        stack = self.livestack
+        r = {
+            "event" : "RemoteGetLiveStack",
+            "id" : randbelow(1000),
+            "status" : 0 if stack is not None else 1,
+            "message" : "" if stack is not None else _("No live stack is running"),
+            "params" : stack.get_dict() if stack is not None else None
+        }
+        if self.on_send(r) is False:
+            logger.loge(_("Failed to send message while executing get_live_stack command"))
@@ -0,0 +1,245 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# System Library
+from secrets import randbelow
+# Built-in Library
+from utils.i18n import _
+from utils.dispatch import handler
+from server.wsmessenger import messenger
+from utils.lightlog import lightlog
+logger = lightlog(__name__)
+
+class WsFocuserInterface(object):
+    """
+        Websocket Focuser Interface.\n
+        Needed Focuser API:
+            connect(params : dict) -> dict
+                params :
+                    host : str
+                    port : int
+                    device_number : int
+                    backlash : int
+                    final_direction : int
+            disconnect() -> dict \n
+            move_to(params : dict) -> dict
+                params :
+                    position : int
+            move_step(params : dict) -> dict
+                params :
+                    step : int
+            abort_movement() -> dict \n
+            get_movement_status() -> dict \n
+            set_configration(params : dict) -> dict \n
+            motion : server.driver.focuser.motion.FocuserMotion # used by the autofocus of the sessions
+
+        Working methods:
+            The moves are operations of utils.operations , remote_move_to() returns the id of the
+            operation at once and the server broadcasts its progress and its result.
+    """
+
+    def __init__(self) -> None:
+        """
+            Initialize the websocket focuser interface object
+            Args : None
+            Returns : None
+        """
+        self.device = None
+
+    def __str__(self) -> str:
+        """
+            Return the string representation of the websocket focuser interface object
+            Args : None
+            Returns : Focuser string
+        """
+        return """
+            Basic websocket focuser interface
+            version : 1.0.0 indev
+        """
+
+    def on_send(self, message : dict) -> bool:
+        """
+            Send message to client | 将信息发送至客户端
+            Args:
+                message: dict
+            Returns: True if message was sent successfully
+        """
+        if not isinstance(message, dict) or message.get("status") is None or message.get("message") is None:
+            logger.loge(_("Unknown format of message"))
+            return False
+        return messenger.send(message)
+
+    def reply(self, event : str, res : dict = None, message : str = None) -> None:
+        """
+            Send the result of a driver call to the client
+            Args :
+                event : str # event name
+                res : dict # result of the driver , None if the command was not executed
+                message : str # error message used when res is None
+            Returns : None
+        """
+        r = {
+            "event" : event,
+            "id" : randbelow(1000),
+            "status" : 1,
+            "message" : message or "",
+            "params" : {}
+        }
+        if res is not None:
+            r["status"] = res.get("status",1)
+            r["message"] = res.get("message") or ""
+            r["params"] = res.get("params") or {}
+        if self.on_send(r) is False:
+            logger.loge(_("Failed to send message while executing {} command").format(event))
+
+    def is_connected(self, event : str) -> bool:
+        """Reply with an error if the focuser is not connected"""
+        if self.device is None or not self.device.info._is_connected:
+            logger.loge(_("Focuser is not connected"))
+            self.reply(event,message=_("Focuser is not connected"))
+            return False
+        return True
+
+    @handler("RemoteConnect")
+    def remote_connect(self, params : dict) -> None:
+        """
+            Connect to the focuser | 连接电调
+            Args :
+                params :
+                    "host" : str # default is "localhost"
+                    "port" : int # port of the ASCOM remote server , default is 11111
+                    "type" : str # only "ascom" is supported
+                    "device_number" : int # default is 0
+                    "backlash" : int # optional , steps lost when the direction changes
+                    "final_direction" : int # optional , 1 if every move ends going outward , -1 inward
+            Returns : None
+            ClientReturn:
+                event : str # event name
+                status : int # status of the connection
+                id : int # just a random number
+                message : str # message of the connection
+                params : info : BasicFocuserInfo object
+        """
+        if params is None:
+            self.reply("RemoteConnect",message=_("No parameters provided"))
+            return
+        if self.device is not None and self.device.info._is_connected:
+            logger.logw(_("Focuser is connected"))
+            self.reply("RemoteConnect",{"status" : 2,"message" : _("Focuser is connected"),
+                                        "params" : {"info" : self.device.info.get_dict()}})
+            return
+        _type = params.get("type","ascom")
+        if _type != "ascom":
+            logger.loge(_("Unknown type {}").format(_type))
+            self.reply("RemoteConnect",message=_("Unknown type"))
+            return
+        from server.driver.focuser.ascom import AscomFocuserAPI as ascom_focuser
+        self.device = ascom_focuser()
+        res = self.device.connect({
+            "host" : params.get("host","localhost"),
+            "port" : int(params.get("port",11111)),
+            "device_number" : int(params.get("device_number",0)),
+            "backlash" : params.get("backlash"),
+            "final_direction" : params.get("final_direction")
+        })
+        if res.get("status") != 0:
+            logger.loge(_("Failed to connect to the focuser : {}").format(res.get("message")))
+            self.device = None
+        self.reply("RemoteConnect",res)
+
+    @handler("RemoteDisconnect")
+    def remote_disconnect(self) -> None:
+        """
+            Disconnect from the focuser , a running move is stopped
+            Args : None
+            Returns : None
+        """
+        if not self.is_connected("RemoteDisconnect"):
+            return
+        res = self.device.disconnect()
+        if res.get("status") == 0:
+            self.device = None
+        self.reply("RemoteDisconnect",res)
+
+    @handler("RemoteMoveTo")
+    def remote_move_to(self, params : dict) -> None:
+        """
+            Move the focuser to a position
+            Args :
+                params :
+                    "position" : int
+            Returns : None
+            ClientReturn:
+                params : operation : int # id of the move , its result is the final position
+        """
+        if self.is_connected("RemoteMoveTo"):
+            self.reply("RemoteMoveTo",self.device.move_to(params or {}))
+
+    @handler("RemoteMoveStep")
+    def remote_move_step(self, params : dict) -> None:
+        """
+            Move the focuser by a number of steps , positive is outward
+            Args :
+                params :
+                    "step" : int
+            Returns : None
+            ClientReturn:
+                params : operation : int # id of the move
+        """
+        if self.is_connected("RemoteMoveStep"):
+            self.reply("RemoteMoveStep",self.device.move_step(params or {}))
+
+    @handler("RemoteAbortMovement")
+    def remote_abort_movement(self) -> None:
+        """
+            Stop the focuser
+            Args : None
+            Returns : None
+        """
+        if self.is_connected("RemoteAbortMovement"):
+            self.reply("RemoteAbortMovement",self.device.abort_movement())
+
+    @handler("RemoteGetMovementStatus")
+    def remote_get_movement_status(self) -> None:
+        """
+            Get the position and the moving state of the focuser
+            Args : None
+            Returns : None
+            ClientReturn:
+                params :
+                    status : bool # is moving
+                    position : int
+                    motion : dict
+        """
+        if self.is_connected("RemoteGetMovementStatus"):
+            self.reply("RemoteGetMovementStatus",self.device.get_movement_status())
+
+    @handler("RemoteSetConfigration")
+    def remote_set_configration(self, params : dict) -> None:
+        """
+            Set the backlash compensation of the focuser
+            Args :
+                params :
+                    "backlash" : int
+                    "final_direction" : int
+            Returns : None
+        """
+        if self.is_connected("RemoteSetConfigration"):
+            self.reply("RemoteSetConfigration",self.device.set_configration(params or {}))
@@ -0,0 +1,223 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# Outgoing websocket messages.
+# A reply sent while a request is handled goes only to the client who
+# made the request , with the "uid" of the request attached.
+# Everything else is an event for all of the clients , the events of a
+# short window are encoded once and sent as a single frame (a JSON array
+# if there is more than one message).
+# #################################################################
+
+from contextlib import contextmanager
+import json
+import threading
+
+import server.config as c
+
+from utils.i18n import _
+from utils.lightlog import lightlog
+logger = lightlog(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Seconds the events are held before they are sent
+BATCH_WINDOW = 0.02
+# Send at once if this many events are waiting
+BATCH_SIZE = 64
+
+def json_encoder(message) -> str:
+    """Default encoder , compact separators save a few bytes per message"""
+    return json.dumps(message,separators=(",",":"))
+
+def orjson_encoder(message) -> str:
+    """orjson is several times faster , fall back to json for what it can not encode"""
+    try:
+        return orjson.dumps(message).decode("utf-8")
+    except TypeError:
+        return json_encoder(message)
+
+class Messenger(object):
+    """
+        Send the messages of a websocket server
+    """
+
+    def __init__(self, server = None, window : float = BATCH_WINDOW, encoder = None) -> None:
+        """
+            Args :
+                server : WebsocketServer # None to use the global server c.ws
+                window : float # seconds the events are batched , 0 to send at once
+                encoder : callable # dict -> str , orjson is used if it is installed
+        """
+        self.server = server
+        self.window = window
+        self.encoder = encoder or (orjson_encoder if orjson is not None else json_encoder)
+
+        self._context = threading.local()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+
+        self.replies = 0
+        self.events = 0
+        self.frames = 0
+
+    def set_encoder(self, encoder) -> None:
+        """
+            Replace the JSON encoder
+            Args :
+                encoder : callable # dict -> str
+            Returns : None
+        """
+        self.encoder = encoder
+
+    def get_server(self):
+        return self.server if self.server is not None else c.ws
+
+    @contextmanager
+    def request(self, client : dict, uid = None):
+        """
+            Mark the messages sent by the current thread as the replies to a client
+            Args :
+                client : dict # the client of the WebsocketServer
+                uid : any # copied into the replies , can be set later with correlate()
+        """
+        previous = getattr(self._context,"request",None)
+        self._context.request = [client,uid]
+        try:
+            yield
+        finally:
+            self._context.request = previous
+
+    def correlate(self, uid) -> None:
+        """
+            Set the "uid" of the request handled by the current thread
+            Args :
+                uid : any
+            Returns : None
+        """
+        request = getattr(self._context,"request",None)
+        if request is not None:
+            request[1] = uid
+
+    def send(self, message : dict) -> bool:
+        """
+            Send a message , a reply goes to the requester and an event to everyone
+            Args :
+                message : dict
+            Returns : bool # False if the message can not be encoded
+        """
+        request = getattr(self._context,"request",None)
+        if request is None:
+            return self.broadcast(message)
+        client,uid = request
+        if uid is not None:
+            message["uid"] = uid
+        try:
+            text = self.encoder(message)
+        except (TypeError,ValueError) as exception:
+            logger.loge(_("Failed to parse message into JSON format , error {}").format(exception))
+            return False
+        # The events queued before must not arrive after this reply
+        self.flush()
+        try:
+            client["handler"].send_message(text)
+        except OSError as exception:
+            logger.logw(_("Failed to send message to client {} : {}").format(client.get("id"),exception))
+            return False
+        self.replies += 1
+        return True
+
+    def broadcast(self, message : dict) -> bool:
+        """
+            Queue an event for all of the clients
+            Args :
+                message : dict
+            Returns : bool # False if the message can not be encoded
+        """
+        try:
+            text = self.encoder(message)
+        except (TypeError,ValueError) as exception:
+            logger.loge(_("Failed to parse message into JSON format , error {}").format(exception))
+            return False
+        if self.window <= 0:
+            self._send_to_all(text)
+            self.events += 1
+            return True
+        with self._lock:
+            self._pending.append(text)
+            self.events += 1
+            if len(self._pending) >= BATCH_SIZE:
+                flush_now = True
+            else:
+                flush_now = False
+                if self._timer is None:
+                    self._timer = threading.Timer(self.window,self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if flush_now:
+            self.flush()
+        return True
+
+    def flush(self) -> None:
+        """
+            Send the queued events now
+            Args : None
+            Returns : None
+        """
+        with self._lock:
+            pending,self._pending = self._pending,[]
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not pending:
+                return
+            # Sent under the lock so two flushes can not reorder the events
+            self._send_to_all(pending[0] if len(pending) == 1 else "[" + ",".join(pending) + "]")
+
+    def _send_to_all(self, text : str) -> None:
+        server = self.get_server()
+        if server is None:
+            return
+        for client in list(server.clients):
+            try:
+                client["handler"].send_message(text)
+            except OSError as exception:
+                logger.logw(_("Failed to send message to client {} : {}").format(client.get("id"),exception))
+        self.frames += 1
+
+    def get_stats(self) -> dict:
+        """
+            Get the counters of the messages
+            Args : None
+            Returns : dict
+        """
+        return {
+            "replies" : self.replies,
+            "events" : self.events,
+            "frames" : self.frames,
+            "encoder" : getattr(self.encoder,"__name__",str(self.encoder)),
+        }
+
+messenger = Messenger()
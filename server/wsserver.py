@@ -18,19 +18,22 @@ Boston, MA 02110-1301, USA.
 
 """
 # System Library
-from json import JSONDecodeError,dumps, loads
+from json import JSONDecodeError, loads
 import os
 from secrets import randbelow
 import threading
 from time import sleep
-import asyncio
 # Third party libraries
 from libs.websocket.websocket_server import WebsocketServer
 # Built-in libraries
 from server.wscamera import WsCameraInterface
+from server.wsfocuser import WsFocuserInterface
 from server.wstelescope import WsTelescopeInterface
-from utils.utility import switch
+from server.wsmessenger import messenger
+from server.wssession import WsSessionInterface
+from utils.dispatch import Dispatcher, handler
 from utils.i18n import _
+from utils.operations import operations
 from utils.lightlog import lightlog
 logger = lightlog(__name__)
 
@@ -79,6 +82,18 @@ class ws_server(object):
         # Initialize the devices object
         self.camera = WsCameraInterface()
         self.telescope = WsTelescopeInterface()
+        self.focuser = WsFocuserInterface()
+        # Multi-device sessions built on the interfaces above
+        self.session = WsSessionInterface(self.camera,self.telescope,self.focuser)
+        # Build the message routing table once
+        self.dispatcher = Dispatcher(__name__)
+        self.dispatcher.bind(self.camera,("camera",))
+        self.dispatcher.bind(self.telescope,("telescope",))
+        self.dispatcher.bind(self.focuser,("focuser",))
+        self.dispatcher.bind(self.session,("session",))
+        self.dispatcher.bind(self)
+        # Progress and results of the long device operations
+        operations.subscribe(self.on_operation)
 
     def __del__(self) -> None:
         """
@@ -217,8 +232,9 @@ class ws_server(object):
             Returns: None
             NOTE: This function can not be overriden by subclasses.And must call parser_json()
         """
-        asyncio.run(self.parser_json(str(message)))
-        #self.parser_json(str(message))
+        # The replies sent while the message is handled only go to this client
+        with messenger.request(client):
+            self.parser_json(str(message))
 
     def on_send(self, message : dict) -> bool:
         """
@@ -234,12 +250,7 @@ class ws_server(object):
         if not isinstance(message, dict) or message.get("status") is None or message.get("message") is None:
             logger.loge(_("Unknown format of message"))
             return False
-        try:
-            c.ws.send_message_to_all(dumps(message))
-        except JSONDecodeError as exception:
-            logger.loge(_(f"Failed to parse message into JSON format , error {exception}"))
-            return False
-        return True 
+        return messenger.send(message)
 
     def generate_message(self, event : str,status : int,message : str,params : dict) -> dict:
         """
@@ -263,7 +274,7 @@ class ws_server(object):
             "params" : params
         }
 
-    async def parser_json(self, message : str) -> None:
+    def parser_json(self, message : str) -> None:
         """
             Parser JSON Message | 解析JSON字符串\n
             This function likes a manager of all other functions.
@@ -279,123 +290,18 @@ class ws_server(object):
             logger.loge(_("Failed to parse JSON message : {}").format(str(e)))
             self.on_send({"status" : 1 , "message" : _("Failed to parse JSON message")})
             return
+        messenger.correlate(_message.get("uid"))
         event = _message.get('event')
         event_type = _message.get('type')
         if event is None or event_type is None:
             logger.loge(_("No event found in message , {}").format(message.replace("\n","")))
             self.on_send({"status" : 1 , "message" : _("No event found in message")})
             return
-        for case in switch(event_type):
-            # Camera event
-            if case("camera"):
-                for _case in switch(event):
-                    if _case("RemoteConnect"):
-                        self.camera.remote_connect(_message.get("params"))
-                        break
-                    if _case("RemoteDisconnect"):
-                        self.camera.remote_disconnect()
-                        break
-                    if _case("RemoteReconnect"):
-                        self.camera.remote_reconnect()
-                        break
-                    if _case("RemoteScanning"):
-                        self.camera.remote_scanning()
-                        break
-                    if _case("RemotePolling"):
-                        self.camera.remote_polling()
-                        break
-                    if _case("RemoteStartExposure"):
-                        self.camera.remote_start_exposure(_message.get("params"))
-                        break
-                    if _case("RemoteAbortExposure"):
-                        self.camera.remote_abort_exposure()
-                        break
-                    if _case("RemoteGetExposureStatus"):
-                        self.camera.remote_get_exposure_status()
-                        break
-                    if _case("RemoteGetExposureResult"):
-                        self.camera.remote_get_exposure_result()
-                        break
-                    if _case("RemoteStartSequenceExposure"):
-                        self.camera.remote_start_sequence_exposure(_message.get("params"))
-                        break
-                    if _case("RemoteAbortSequenceExposure"):
-                        self.camera.remote_abort_sequence_exposure()
-                        break
-                    if _case("RemotePauseSequenceExposure"):
-                        self.camera.remote_pause_sequence_exposure()
-                        break
-                    if _case("RemoteContinueSequenceExposure"):
-                        self.camera.remote_continue_sequence_exposure()
-                        break
-                    if _case("RemoteGetSequenceExposureStatus"):
-                        self.camera.remote_get_sequence_exposure_status()
-                        break
-                    if _case("RemoteGetSequenceExposureResults"):
-                        self.camera.remote_get_sequence_exposure_results()
-                        break
-                    if _case("RemoteCooling"):
-                        self.camera.remote_cooling(_message.get("params"))
-                        break
-                    if _case("RemoteCoolingTo"):
-                        self.camera.remote_cooling_to(_message.get("params"))
-                        break
-                    if _case("RemoteGetCoolingStatus"):
-                        self.camera.remote_get_cooling_status()
-                        break
-                    if _case("RemoteGetConfiguration"):
-                        self.camera.remote_get_configuration(_message.get("params"))
-                        break
-                    if _case("RemoteSetConfiguration"):
-                        self.camera.remote_set_configuration(_message.get("params"))
-                        break
-                    logger.loge(_("Unknown camera event received from remote client"))
-                    break
-                break
-            # All of the telescope events
-            if case("telescope"):
-                for _case in switch(event):
-                    if _case("RemoteConnect"):
-                        self.telescope.remote_connect(_message.get("params"))
-                        break
-                    if _case("RemoteDisconnect"):
-                        self.telescope.remote_disconnect()
-                        break
-                    if _case("RemoteReconnect"):
-                        self.telescope.remote_reconnect()
-                        break
-                    if _case("RemoteScanning"):
-                        self.telescope.remote_scanning()
-                        break
-                    if _case("RemotePolling"):
-                        self.telescope.remote_polling()
-                        break
-                    if _case("RemoteGoto"):
-                        self.telescope.remote_goto(_message.get("params"))
-                        break
-                    if _case("RemoteAbortGoto"):
-                        self.telescope.remote_abort_goto()
-                        break
-                    if _case("RemotePark"):
-                        self.telescope.remote_park()
-                        break
-                    if _case("RemoteUnpark"):
-                        self.telescope.remote_unpack()
-                        break
-                    if _case("RemoteHome"):
-                        self.telescope.remote_home()
-                        break
-                    logger.loge(_("Unknown telescope event received from remote client"))
-                    break
-                break
-            if case("server"):
-                for _case in switch(event):
-                    if _case("RemoteDashboardSetup"):
-                        self.remote_dashboard_setup()
-                    break
-                break
-            break
-        
+        try:
+            if not self.dispatcher.dispatch((event_type,event),_message.get("params")):
+                logger.loge(_("Unknown {} event received from remote client : {}").format(event_type,event))
+        except Exception as e:
+            logger.loge(_("Error while executing {} event {} : {}").format(event_type,event,str(e)))
 
     # #################################################################
     # 
@@ -407,6 +313,7 @@ class ws_server(object):
     # Server Events
     # #################################################################
 
+    @handler("server","RemoteDashboardSetup")
     def remote_dashboard_setup(self) -> None:
         """
             Remote dashboard setup function | 初始化连接
@@ -423,6 +330,89 @@ class ws_server(object):
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing start_server command"))
 
+    @handler("server","RemoteGetDispatchMetrics")
+    def remote_get_dispatch_metrics(self) -> None:
+        """
+            Remote get the calls , errors and latency of every message handler | 获取消息处理统计
+            Args : None
+            Returns : None
+        """
+        r = {
+            "event" : "RemoteGetDispatchMetrics",
+            "id" : randbelow(1000),
+            "status" : 0,
+            "message" : "",
+            "params" : dict(self.dispatcher.get_metrics(),messages = messenger.get_stats())
+        }
+        if self.on_send(r) is False:
+            logger.loge(_("Failed to send message while executing get_dispatch_metrics command"))
+
+    def on_operation(self, event : str, operation : dict) -> None:
+        """
+            Send the events of the long device operations to all of the clients
+            Args :
+                event : str # started , progress , done , failed , cancelled or timeout
+                operation : dict # Operation.get_dict()
+            Returns : None
+        """
+        self.on_send({
+            "event" : "RemoteOperationUpdate",
+            "id" : randbelow(1000),
+            "status" : 0 if event in ("started","progress","done") else 1,
+            "message" : event,
+            "params" : operation
+        })
+
+    @handler("server","RemoteGetOperations")
+    def remote_get_operations(self, params : dict = None) -> None:
+        """
+            Remote get the running operations | 获取正在执行的操作
+            Args :
+                params : dict
+                    owner : str # only the operations of this device , optional
+                    finished : bool # include the recently finished operations , default is False
+            Returns : None
+        """
+        params = params or {}
+        r = {
+            "event" : "RemoteGetOperations",
+            "id" : randbelow(1000),
+            "status" : 0,
+            "message" : "",
+            "params" : [op.get_dict() for op in operations.list(params.get("owner"),bool(params.get("finished")))]
+        }
+        if self.on_send(r) is False:
+            logger.loge(_("Failed to send message while executing get_operations command"))
+
+    @handler("server","RemoteCancelOperation")
+    def remote_cancel_operation(self, params : dict) -> None:
+        """
+            Remote cancel a running operation | 取消操作
+            Args :
+                params : dict
+                    operation : int # id of the operation
+            Returns : None
+        """
+        r = {
+            "event" : "RemoteCancelOperation",
+            "id" : randbelow(1000),
+            "status" : 1,
+            "message" : "",
+            "params" : None
+        }
+        try:
+            operation_id = int((params or {}).get("operation"))
+        except (TypeError,ValueError):
+            r["message"] = _("No operation provided")
+        else:
+            if operations.cancel(operation_id):
+                r["status"] = 0
+                r["message"] = _("Operation cancelled")
+            else:
+                r["message"] = _("Operation is not running or can not be cancelled")
+        if self.on_send(r) is False:
+            logger.loge(_("Failed to send message while executing cancel_operation command"))
+
     def remote_start_server(self , params : dict) -> None:
         """
             Remote Start Server Event | 服务器启动
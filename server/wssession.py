@@ -0,0 +1,352 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# System Library
+from secrets import randbelow
+import threading
+# Built-in Library
+from server.wsmessenger import messenger
+from utils.dispatch import handler
+from utils.autofocus import AutoFocus
+from utils.i18n import _
+from utils.operations import DONE, operations
+from utils.session import Session, SessionError, Step
+from utils.lightlog import lightlog
+logger = lightlog(__name__)
+
+def check_result(res : dict) -> dict:
+    """
+        Raise if a device API call failed
+        Args :
+            res : dict # {"status" : int , "message" : str , "params" : dict}
+        Returns : dict # the params of the result
+    """
+    if not isinstance(res,dict):
+        raise RuntimeError(_("Device returned nothing"))
+    if res.get("status") != 0:
+        raise RuntimeError(res.get("message") or _("Device error"))
+    return res.get("params") or {}
+
+def wait_operation(ctx, params : dict, interval : float = 0.5):
+    """
+        Wait for the background operation started by a device API call
+        Args :
+            ctx : StepContext
+            params : dict # params of the result , without an operation id there is nothing to wait
+            interval : float # seconds between two checks
+        Returns : any # the result of the operation
+        NOTE : The motion is cancelled if the step is aborted or timeout
+    """
+    operation = operations.get(params.get("operation")) if params.get("operation") is not None else None
+    if operation is None:
+        return None
+    try:
+        ctx.wait_until(lambda: operation.is_finished,interval)
+    except BaseException:
+        operations.cancel(operation.id)
+        raise
+    if operation.status != DONE:
+        raise RuntimeError(_("Operation {} is {} : {}").format(operation.name,operation.status,operation.error or ""))
+    return operation.result
+
+class WsSessionInterface(object):
+    """
+        Websocket session interface.
+        The client sends the whole plan of a target once , e.g.
+            slew + cool camera -> (after slew) solve -> (after solve and cool) sequence
+        and the server runs the steps with their requirements and timeouts.
+    """
+
+    def __init__(self, camera, telescope, focuser = None) -> None:
+        """
+            Args :
+                camera : WsCameraInterface
+                telescope : WsTelescopeInterface
+                focuser : WsFocuserInterface , None if there is no focuser
+        """
+        self.camera = camera
+        self.telescope = telescope
+        self.focuser = focuser
+        self.session = None
+        # Held while a start request checks and replaces the session
+        self._session_lock = threading.Lock()
+        self.actions = {
+            "delay" : self.action_delay,
+            "telescope.goto" : self.action_goto,
+            "telescope.park" : self.action_park,
+            "telescope.unpark" : self.action_unpark,
+            "camera.cooling" : self.action_cooling,
+            "camera.exposure" : self.action_exposure,
+            "focuser.autofocus" : self.action_autofocus,
+        }
+
+    def register_action(self, name : str, action) -> None:
+        """
+            Add an action which can be used by the steps
+            Args :
+                name : str # e.g. "guider.dither"
+                action : callable # called with a StepContext
+            Returns : None
+        """
+        self.actions[name] = action
+
+    def on_send(self, message : dict) -> bool:
+        """
+            Send message to client | 将信息发送至客户端
+            Args:
+                message: dict
+            Returns: True if message was sent successfully
+        """
+        if not isinstance(message, dict) or message.get("status") is None or message.get("message") is None:
+            logger.loge(_("Unknown format of message"))
+            return False
+        return messenger.send(message)
+
+    def on_step(self, session : Session, step : Step) -> None:
+        """Broadcast the progress of the steps"""
+        self.on_send({
+            "event" : "RemoteSessionStep",
+            "id" : randbelow(1000),
+            "status" : 0,
+            "message" : "",
+            "params" : step.get_dict(session.start_time or 0)
+        })
+
+    def run_session(self, session : Session) -> None:
+        """Run the session and send the timing trace when it is finished"""
+        status = session.run()
+        self.on_send({
+            "event" : "RemoteSessionFinished",
+            "id" : randbelow(1000),
+            "status" : 0 if status == "done" else 1,
+            "message" : _("Session {} is {}").format(session.name,status),
+            "params" : session.get_trace()
+        })
+
+    # #################################################################
+    # Session Events
+    # #################################################################
+
+    @handler("RemoteStartSession")
+    def remote_start_session(self, params : dict) -> None:
+        """
+            Start a session | 开始拍摄流程
+            Args :
+                params : dict
+                    name : str
+                    max_workers : int # steps running at the same time , default is 4
+                    steps : list
+                        name : str
+                        action : str # e.g. telescope.goto
+                        params : dict # passed to the action
+                        requires : list # names of the steps which must be done before
+                        timeout : float # seconds
+            Returns : None
+            NOTE : This is a non-blocking function , the progress is sent with RemoteSessionStep
+        """
+        r = {
+            "event" : "RemoteStartSession",
+            "id" : randbelow(1000),
+            "status" : 1,
+            "message" : "",
+            "params" : {}
+        }
+        params = params or {}
+        with self._session_lock:
+            self._start_session(params,r)
+        if self.on_send(r) is False:
+            logger.loge(_("Failed to send message while executing start_session command"))
+
+    def _start_session(self, params : dict, r : dict) -> None:
+        """Build and start the session , the result is written in r"""
+        # Not finished rather than running , the thread of a session just started may not have run it yet
+        if self.session is not None and not self.session.is_finished:
+            r["message"] = _("Session {} is running").format(self.session.name)
+        else:
+            try:
+                steps = []
+                for item in params.get("steps") or []:
+                    action = self.actions.get(item.get("action"))
+                    if action is None:
+                        raise SessionError(_("Unknown action {}").format(item.get("action")))
+                    steps.append(Step(item["name"],action,item.get("params"),item.get("requires",()),item.get("timeout")))
+                if not steps:
+                    raise SessionError(_("No steps provided"))
+                session = Session(params.get("name","session"),steps,params.get("max_workers",4),self.on_step)
+            except (SessionError,KeyError,TypeError) as e:
+                logger.loge(_("Invalid session : {}").format(str(e)))
+                r["message"] = _("Invalid session : {}").format(str(e))
+            else:
+                self.session = session
+                threading.Thread(target=self.run_session,args=(session,),daemon=True).start()
+                r["status"] = 0
+                r["message"] = _("Session started")
+                r["params"] = {"order" : session.validate()}
+
+    @handler("RemoteAbortSession")
+    def remote_abort_session(self) -> None:
+        """
+            Abort the running session | 停止拍摄流程
+            Args : None
+            Returns : None
+        """
+        r = {
+            "event" : "RemoteAbortSession",
+            "id" : randbelow(1000),
+            "status" : 1,
+            "message" : "",
+            "params" : None
+        }
+        session = self.session
+        if session is None or session.is_finished:
+            r["message"] = _("No session is running")
+        else:
+            # A session aborted before its thread runs it aborts all of its steps
+            session.abort()
+            r["status"] = 0
+            r["message"] = _("Session is aborting")
+        if self.on_send(r) is False:
+            logger.loge(_("Failed to send message while executing abort_session command"))
+
+    @handler("RemoteGetSessionStatus")
+    def remote_get_session_status(self) -> None:
+        """
+            Get the status and the timing trace of the last session | 获取拍摄流程状态
+            Args : None
+            Returns : None
+        """
+        r = {
+            "event" : "RemoteGetSessionStatus",
+            "id" : randbelow(1000),
+            "status" : 1,
+            "message" : "",
+            "params" : None
+        }
+        if self.session is None:
+            r["message"] = _("No session")
+        else:
+            r["status"] = 0
+            r["params"] = self.session.get_trace()
+        if self.on_send(r) is False:
+            logger.loge(_("Failed to send message while executing get_session_status command"))
+
+    # #################################################################
+    # Actions , called in the worker threads of the session
+    # #################################################################
+
+    def get_device(self, interface, name : str):
+        device = interface.device
+        if device is None or not device.info._is_connected:
+            raise RuntimeError(_("{} is not connected").format(name))
+        return device
+
+    def action_delay(self, ctx) -> None:
+        """Wait for params.seconds"""
+        ctx.wait(float(ctx.params.get("seconds",0)))
+
+    def action_goto(self, ctx) -> dict:
+        """Slew the telescope and wait until it stops"""
+        device = self.get_device(self.telescope,_("Telescope"))
+        check_result(device.goto(ctx.params))
+        ctx.wait_until(lambda: not check_result(device.get_goto_status()).get("status"),ctx.params.get("interval",0.5))
+        return check_result(device.get_goto_result())
+
+    def action_park(self, ctx) -> None:
+        """Park the telescope and wait until it is parked"""
+        res = check_result(self.get_device(self.telescope,_("Telescope")).park())
+        wait_operation(ctx,res,ctx.params.get("interval",0.5))
+
+    def action_unpark(self, ctx) -> None:
+        """Unpark the telescope"""
+        res = check_result(self.get_device(self.telescope,_("Telescope")).unpark())
+        # Unpark is synchronous in the drivers now , but wait if one starts an operation
+        wait_operation(ctx,res,ctx.params.get("interval",0.5))
+
+    def action_cooling(self, ctx) -> float:
+        """Cool the camera and wait until the temperature is within params.tolerance"""
+        device = self.get_device(self.camera,_("Camera"))
+        target = float(ctx.params["temperature"])
+        tolerance = float(ctx.params.get("tolerance",1.0))
+        check_result(device.cooling_to({"temperature" : target}))
+
+        def reached() -> bool:
+            device.get_cooling_status()
+            return abs(device.info._temperature - target) <= tolerance
+
+        ctx.wait_until(reached,ctx.params.get("interval",2))
+        return device.info._temperature
+
+    def action_exposure(self, ctx) -> dict:
+        """Take an exposure and wait for the image"""
+        device = self.get_device(self.camera,_("Camera"))
+        check_result(device.start_exposure(ctx.params))
+        # Nothing to poll before the exposure time is over
+        ctx.wait(float(ctx.params.get("exposure",0)))
+
+        def finished() -> bool:
+            device.get_exposure_status()
+            return device.info._is_imageready or not device.info._is_exposure
+
+        ctx.wait_until(finished,ctx.params.get("interval",0.5))
+        result = check_result(device.get_exposure_result())
+        # The image and its preview are too big for the trace
+        return {key : value for key,value in result.items() if key not in ("image","preview")}
+
+    def action_autofocus(self, ctx) -> dict:
+        """
+            Run a V-curve autofocus and leave the focuser at the best position
+            params : step , points , exposure , tolerance , center , camera (gain , offset , binning)
+        """
+        camera = self.get_device(self.camera,_("Camera"))
+        if self.focuser is None:
+            raise RuntimeError(_("{} is not connected").format(_("Focuser")))
+        focuser = self.get_device(self.focuser,_("Focuser"))
+        settings = dict(ctx.params.get("camera") or {})
+        settings["image"] = {"is_save" : False}
+
+        def expose(seconds : float):
+            settings["exposure"] = seconds
+            res = camera.start_exposure(settings)
+            if isinstance(res,dict):
+                check_result(res)
+
+            def finished() -> bool:
+                camera.get_exposure_status()
+                return camera.info._is_imageready or not camera.info._is_exposure
+
+            ctx.wait_until(finished,0.1)
+            return camera.get_image()
+
+        def on_point(curve : dict) -> None:
+            self.on_send({
+                "event" : "RemoteAutoFocusPoint",
+                "id" : randbelow(1000),
+                "status" : 0,
+                "message" : "",
+                "params" : curve
+            })
+
+        autofocus = AutoFocus(focuser.motion,expose,
+                                step=ctx.params.get("step",100),
+                                points=ctx.params.get("points",9),
+                                exposure=float(ctx.params.get("exposure",2.0)),
+                                tolerance=float(ctx.params.get("tolerance",0.5)),
+                                check=ctx.check,on_point=on_point)
+        return autofocus.run(ctx.params.get("center"))
@@ -20,10 +20,8 @@ Boston, MA 02110-1301, USA.
 
 # System Library
 import datetime
-from json import JSONDecodeError, dumps
 from secrets import randbelow
-import threading
-from time import sleep
+from time import monotonic
 # Third Party Library
 
 # Built-in Library
@@ -32,9 +30,15 @@ import server.config as c
 
 from utils.i18n import _
 from utils.utility import switch
+from utils.dispatch import handler
+from server.wsmessenger import messenger
+from server.driver.telescope.mountstream import MountStream
 from utils.lightlog import lightlog
 logger = lightlog(__name__)
 
+# Seconds a mount may take to report slewing after a goto
+GOTO_START_DELAY = 3.0
+
 class WsTelescopeInterface(object):
     """
         Websocket Telescope Interface.\n
@@ -64,6 +68,8 @@ class WsTelescopeInterface(object):
             set_track_mode() -> dict \n
             set_track_rate() -> dict \n
             get_location() -> dict \n
+            get_position() -> dict \n
+                NOTE : Position and slewing state in one call , sampled by the mount stream
             update_config() -> dict \n
                 NOTE : This function need to get all of the settings of the telescope
 
@@ -72,9 +78,13 @@ class WsTelescopeInterface(object):
             the function will return immediately.For example, when you try to execute goto command,
             You should call goto() first and then you need to call get_goto_status() while goto process.
 
-            client -> remote_goto() -> goto() -> goto_thread() 
+            client -> remote_goto() -> goto() -> stream.poke()
                                                     |
-                                                    -> remote_get_goto_status() -> get_goto_status()
+                                                    -> on_mount_state() -> RemoteMountState
+                                                                        -> remote_get_goto_result() when the slew is over
+
+            The mount stream samples get_position() fast while slewing and slowly while tracking ,
+            every RemoteMountState carries the velocity of the axes so the client can interpolate.
 
         Pay attention to that we must make sure that the command give to telescope is supported.
         Though most of the telescopes support functions like goto,park and home,there are still some
@@ -88,7 +98,10 @@ class WsTelescopeInterface(object):
             Returns : None
         """
         self.device = None
-        self.thread = None
+        self.stream = None
+        # Monotonic time of the last goto , None if no goto is running
+        self._goto_started = None
+        self._goto_seen_slewing = False
 
     def __del__(self) -> None:
         """
@@ -126,13 +139,9 @@ class WsTelescopeInterface(object):
         if not isinstance(message, dict) or message.get("status") is None or message.get("message") is None:
             logger.loge(_("Unknown format of message"))
             return False
-        try:
-            c.ws.send_message_to_all(dumps(message))
-        except JSONDecodeError as exception:
-            logger.loge(_(f"Failed to parse message into JSON format , error {exception}"))
-            return False
-        return True 
+        return messenger.send(message)
 
+    @handler("RemoteConnect")
     def remote_connect(self,params : dict) -> None:
         """
             Connect to the telescope | 连接望远镜,在成功后获取望远镜信息并返回客户端
@@ -206,6 +215,7 @@ class WsTelescopeInterface(object):
             else:
                 r["status"] = 0
                 r["params"]["info"] = res.get("params").get("info")
+                self.start_stream()
             r['message'] = res.get("message")
         # Unkown type of the telescope
         else:
@@ -214,6 +224,7 @@ class WsTelescopeInterface(object):
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing connect command"))
 
+    @handler("RemoteDisconnect")
     def remote_disconnect(self):
         """
             Disconnect from the telescope
@@ -246,11 +257,14 @@ class WsTelescopeInterface(object):
                     pass
             else:
                 r["status"] = 0
+                if self.stream is not None:
+                    self.stream.stop()
                 logger.log(_("Disconnected from telescope successfully"))
             r["message"] = res.get('message')
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing disconnect command"))
 
+    @handler("RemoteReconnect")
     def remote_reconnect(self) -> None:
         """
             Reconnect to the telescope
@@ -289,6 +303,7 @@ class WsTelescopeInterface(object):
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing reconnect command"))
 
+    @handler("RemoteScanning")
     def remote_scanning(self) -> None:
         """
             Scannings from the telescope
@@ -325,6 +340,7 @@ class WsTelescopeInterface(object):
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing scan command"))
 
+    @handler("RemotePolling")
     def remote_polling(self) -> None:
         """
             Polling newest message from the telescope
@@ -367,6 +383,7 @@ class WsTelescopeInterface(object):
     #
     # #################################################################
 
+    @handler("RemoteGoto")
     def remote_goto(self,params : dict) -> dict:
         """
             Goto telescope
@@ -411,10 +428,9 @@ class WsTelescopeInterface(object):
             logger.loge(_("Telescope is parked"))
             r["message"] = _("Telescope is parked, please unpark telescope before continuing")
         else:
-            # If J2000 coordinates are provided , convert them to JNow coordinates
-            if _j2000:
-                pass
+            # If J2000 coordinates are provided , the driver converts them to the coordinate system of the mount
             param = {
+                "j2000" : _j2000,
                 "ra" : _ra,
                 "dec" : _dec,
                 "az" : _az,
@@ -429,27 +445,72 @@ class WsTelescopeInterface(object):
                     pass
             else:
                 r["status"] = 0
-                self.thread = threading.Thread(target=self.goto_thread)
-                self.thread.daemon = True
-                self.thread.start()
+                self._goto_started = monotonic()
+                self._goto_seen_slewing = False
+                self.start_stream()
+                self.stream.poke(GOTO_START_DELAY)
             r["message"] = res.get('message')    
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing remote goto command"))
 
-    def goto_thread(self) -> None:
+    # #################################################################
+    # Mount state stream
+    # #################################################################
+
+    def start_stream(self) -> None:
         """
-            Continue getting goto status and return to client
+            Start sampling the mount , it is started after connecting
             Args : None
             Returns : None
         """
-        if not self.device.info._is_slewing:
-            logger.loge(_("Telescope is not slewing , why will the goto thread start"))
+        if self.stream is None:
+            self.stream = MountStream(self.sample_position)
+        self.stream.subscribe(self.on_mount_state)
+
+    def sample_position(self) -> dict:
+        """
+            Called by the stream , None if the driver could not read the position
+        """
+        if self.device is None or not self.device.info._is_connected:
+            return None
+        res = self.device.get_position()
+        if not isinstance(res,dict) or res.get("status") != 0:
+            return None
+        return res.get("params")
+
+    def on_mount_state(self, state : dict) -> None:
+        """
+            Send the new mount state to all of the clients and finish the goto when the slew is over
+            Args :
+                state : dict # see MountStream
+            Returns : None
+            ClientReturn:
+                event : str # RemoteMountState
+                params : dict
+                    ra : float # hours
+                    dec , az , alt : float # degrees
+                    slewing , tracking : bool
+                    timestamp : float # unix time of the sample
+                    velocity : dict # ra (hours per second) , dec , az , alt (degrees per second)
+                    interval : float # seconds until the next state
+        """
+        self.on_send({
+            "event" : "RemoteMountState",
+            "id" : randbelow(1000),
+            "status" : 0,
+            "message" : "",
+            "params" : state
+        })
+        if self._goto_started is None:
             return
-        used_time = 0
-        while used_time <= self.device.info.timeout:
-            self.remote_get_goto_status()
-            sleep(0.5)
+        if state.get("slewing"):
+            self._goto_seen_slewing = True
+        # Some mounts report slewing a little after the command , wait for it before deciding
+        elif self._goto_seen_slewing or monotonic() - self._goto_started > GOTO_START_DELAY:
+            self._goto_started = None
+            self.remote_get_goto_result()
 
+    @handler("RemoteAbortGoto")
     def remote_abort_goto(self) -> None:
         """
             Remote abort goto operation
@@ -488,8 +549,11 @@ class WsTelescopeInterface(object):
                         pass
                 else:
                     r["status"] = 0
-                    r["message"] = _("Aborted goto operation successfully")
-                    logger.log(_("Aborted goto operation successfully"))
+                    r["message"] = _("Aborting goto operation")
+                    r["params"]["operation"] = res.get('params').get('operation')
+                    # The position where it stopped is the result of the operation
+                    self._goto_started = None
+                    logger.log(_("Aborting goto operation"))
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing abort goto command"))
 
@@ -580,6 +644,7 @@ class WsTelescopeInterface(object):
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing get goto result command"))
 
+    @handler("RemotePark")
     def remote_park(self) -> None:
         """
             Remote park
@@ -616,11 +681,13 @@ class WsTelescopeInterface(object):
                     pass
             else:
                 r["status"] = 0
-                self.device.info._is_parked = True
+                # The telescope is parked when the operation is finished
+                r["params"]["operation"] = res.get('params').get('operation')
             r["message"] = res.get('message')
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing park command"))
 
+    @handler("RemoteUnpark")
     def remote_unpack(self) -> None:
         """
             Remote unpack
@@ -661,6 +728,7 @@ class WsTelescopeInterface(object):
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing unpark command"))
 
+    @handler("RemoteHome")
     def remote_home(self) -> None:
         """
             Remote let telescope go to home position
@@ -690,13 +758,14 @@ class WsTelescopeInterface(object):
         else:
             res = self.device.home()
             if res.get('status')!= 0:
-                logger.loge(_(f"Failed to park"))
+                logger.loge(_(f"Failed to home"))
                 try:
                     r["params"]["error"] = res.get('params').get('error')
                 except:
                     pass
             else:
                 r["status"] = 0
+                r["params"]["operation"] = res.get('params').get('operation')
             r["message"] = res.get('message')
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing home command"))
@@ -737,6 +806,7 @@ class WsTelescopeInterface(object):
                     pass
             else:
                 r["status"] = 0
+                r["params"]["operation"] = res.get('params').get('operation')
             r["message"] = res.get('message')
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing set park position command"))
@@ -953,7 +1023,14 @@ class WsTelescopeInterface(object):
                 try:
                     r["params"]["lat"] = res.get('params').get('lat')
                     r["params"]["lon"] = res.get('params').get('lon')
+                    # Share the site location with the night planner
+                    c.config["location"] = {
+                        "latitude" : float(r["params"]["lat"]),
+                        "longitude" : float(r["params"]["lon"])
+                    }
                 except KeyError:
                     logger.loge(_("No location coordinates found"))
+                except (TypeError,ValueError):
+                    logger.logw(_("Invalid location coordinates , night planner will not use them"))
         if self.on_send(r) is False:
             logger.loge(_("Failed to send message while executing get_location command"))
\ No newline at end of file
@@ -0,0 +1,251 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# ##############################################################
+#
+# Fake Alpaca server for the tests of the Alpaca clients
+# It listens on a free local port and serves one simulated
+# focuser , the bodies are sent with Content-Length , chunked
+# or without any length to check the HTTP client
+#
+# ##############################################################
+
+import json
+import socket
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+DEVICE_PATH = "/api/v1/focuser/0/"
+
+class SimulatedFocuser(object):
+    """
+        Focuser moving at a constant speed , IsMoving is reported start_delay seconds after Move
+    """
+
+    def __init__(self, position : int = 10000, speed : float = 2000.0, absolute : bool = True,
+                    start_delay : float = 0.0) -> None:
+        self.absolute = absolute
+        self.speed = speed
+        self.start_delay = start_delay
+        self.moves = []
+        self._position = float(position)
+        self._from = float(position)
+        self._target = float(position)
+        self._started = 0.0
+        self._lock = threading.Lock()
+
+    def _update(self) -> float:
+        elapsed = time.monotonic() - self._started
+        distance = self._target - self._from
+        travelled = min(abs(distance),elapsed * self.speed)
+        self._position = self._from + (travelled if distance >= 0 else -travelled)
+        return elapsed
+
+    def move(self, value : int) -> None:
+        """Move of the Alpaca API , a position or a number of steps for a relative focuser"""
+        with self._lock:
+            self._update()
+            self.moves.append(int(value))
+            self._from = self._position
+            self._target = float(value) if self.absolute else self._position + int(value)
+            self._started = time.monotonic()
+
+    def halt(self) -> None:
+        with self._lock:
+            self._update()
+            self._from = self._target = self._position
+
+    @property
+    def position(self) -> int:
+        with self._lock:
+            self._update()
+            return int(round(self._position))
+
+    @property
+    def is_moving(self) -> bool:
+        with self._lock:
+            elapsed = self._update()
+            return self._position != self._target and elapsed >= self.start_delay
+
+class FakeAlpacaServer(object):
+    """
+        Fake Alpaca server.\n
+        Usage :
+            server = FakeAlpacaServer(mode="chunked")
+            server.start()
+            ... AsyncFocuser(server.address,0) ...
+            server.stop()
+    """
+
+    def __init__(self, focuser : SimulatedFocuser = None, mode : str = "length",
+                    close_after : int = 0, announce_close : bool = True, delay : float = 0.0) -> None:
+        """
+            Initialize the server
+            Args :
+                focuser : SimulatedFocuser
+                mode : str # "length" , "chunked" or "nolength" , how the bodies are sent
+                close_after : int # close a connection after this number of requests , 0 keeps it open
+                announce_close : bool # send Connection: close with the last response , False drops the connection silently
+                delay : float # seconds before every answer
+        """
+        self.focuser = focuser or SimulatedFocuser()
+        self.mode = mode
+        self.close_after = close_after
+        self.announce_close = announce_close
+        self.delay = delay
+        # Attribute -> (ErrorNumber , ErrorMessage) , or an HTTP status for a request error
+        self.errors = {}
+        self.requests = []
+        self.connections = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(16)
+        self.address = "127.0.0.1:%d" % self._sock.getsockname()[1]
+        self._clients = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def stop(self) -> None:
+        self._sock.close()
+        with self._lock:
+            for conn in self._clients:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                conn.close()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._clients.append(conn)
+                self.connections += 1
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn : socket.socket) -> None:
+        stream = conn.makefile("rb")
+        served = 0
+        while True:
+            try:
+                request_line = stream.readline()
+                if not request_line:
+                    return
+                headers = {}
+                while True:
+                    line = stream.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _sep, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = stream.read(int(headers.get("content-length", 0)))
+            except OSError:
+                return
+            method, target, _version = request_line.decode("latin-1").split(" ", 2)
+            url = urlsplit(target)
+            data = dict(parse_qsl(url.query if method == "GET" else body.decode("utf-8")))
+            self.requests.append((method, url.path, data))
+            if self.delay:
+                time.sleep(self.delay)
+            status, payload = self._handle(method, url.path, data)
+            served += 1
+            close = bool(self.close_after) and served >= self.close_after
+            try:
+                self._respond(conn, status, payload, close)
+            except OSError:
+                return
+            if close:
+                conn.close()
+                return
+
+    def _handle(self, method : str, path : str, data : dict) -> tuple:
+        """Returns : (HTTP status , body)"""
+        if not path.startswith(DEVICE_PATH):
+            return 400, b"Unknown device"
+        attribute = path[len(DEVICE_PATH):]
+        reply = {
+            "ClientTransactionID": int(data.get("ClientTransactionID", 0)),
+            "ServerTransactionID": len(self.requests),
+            "ErrorNumber": 0,
+            "ErrorMessage": ""
+        }
+        error = self.errors.get(attribute)
+        if isinstance(error, int):
+            return error, ("Bad request for %s" % attribute).encode()
+        if error is not None:
+            reply["ErrorNumber"], reply["ErrorMessage"] = error
+        elif method == "GET":
+            values = {
+                "ismoving": lambda: self.focuser.is_moving,
+                "position": lambda: self.focuser.position,
+                "absolute": lambda: self.focuser.absolute,
+                "name": lambda: "Focuser Simulator",
+            }
+            if attribute not in values:
+                return 400, ("Unknown property %s" % attribute).encode()
+            reply["Value"] = values[attribute]()
+        elif attribute == "move":
+            self.focuser.move(int(data["Position"]))
+        elif attribute == "halt":
+            self.focuser.halt()
+        else:
+            return 400, ("Unknown method %s" % attribute).encode()
+        return 200, json.dumps(reply).encode()
+
+    def _respond(self, conn : socket.socket, status : int, payload : bytes, close : bool) -> None:
+        lines = ["HTTP/1.1 %d %s" % (status, "OK" if status == 200 else "Bad Request"),
+                 "Content-Type: application/json"]
+        if close and self.announce_close:
+            lines.append("Connection: close")
+        if self.mode == "chunked":
+            lines.append("Transfer-Encoding: chunked")
+            # Several chunks , the last one with an extension
+            half = len(payload) // 2
+            body = b"%x\r\n%s\r\n%x;ext=1\r\n%s\r\n0\r\n\r\n" % (half, payload[:half], len(payload) - half, payload[half:])
+        elif self.mode == "nolength":
+            body = payload
+        else:
+            lines.append("Content-Length: %d" % len(payload))
+            body = payload
+        conn.sendall(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+
+class AlpacaFocuser(object):
+    """
+        Blocking focuser with the members used by FocuserMotion , sent to the fake server
+    """
+
+    def __init__(self, address : str, device_number : int = 0) -> None:
+        from libs.alpyca.asyncclient import AsyncFocuser, SyncDevice
+        self.address = address
+        self.device_number = device_number
+        self._device = SyncDevice(AsyncFocuser(address, device_number))
+
+    def Move(self, Position : int) -> None:
+        self._device.put("Move", Position=Position)
+
+    def Halt(self) -> None:
+        self._device.put("Halt")
@@ -0,0 +1,149 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# ##############################################################
+#
+# Fake indiserver for the tests of the INDI client
+# It listens on a free local port , defines a few properties on
+# getProperties and answers the new vectors like a driver would
+#
+# ##############################################################
+
+import socket
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+DEVICE = "Telescope Simulator"
+
+DEFINITIONS = (
+    '<defSwitchVector device="Telescope Simulator" name="CONNECTION" label="Connection" group="Main Control"'
+    ' state="Idle" perm="rw" rule="OneOfMany" timeout="60">'
+    '<defSwitch name="CONNECT" label="Connect">Off</defSwitch>'
+    '<defSwitch name="DISCONNECT" label="Disconnect">On</defSwitch>'
+    '</defSwitchVector>'
+    '<defNumberVector device="Telescope Simulator" name="EQUATORIAL_EOD_COORD" label="Eq. Coordinates"'
+    ' group="Main Control" state="Idle" perm="rw" timeout="0">'
+    '<defNumber name="RA" label="RA (hh:mm:ss)" format="%010.6m" min="0" max="24" step="0">\n 0.5\n</defNumber>'
+    '<defNumber name="DEC" label="DEC (dd:mm:ss)" format="%010.6m" min="-90" max="90" step="0">\n 89.5\n</defNumber>'
+    '</defNumberVector>'
+    '<defTextVector device="Telescope Simulator" name="DRIVER_INFO" label="Driver Info" group="General Info"'
+    ' state="Idle" perm="ro" timeout="0">'
+    '<defText name="DRIVER_NAME" label="Name">Telescope &amp; Simulator</defText>'
+    '</defTextVector>'
+)
+
+class FakeIndiServer(object):
+    """
+        Fake indiserver.\n
+        Usage :
+            server = FakeIndiServer(chunk=7)
+            server.start()
+            ... IndiClient("127.0.0.1",server.port) ...
+            server.stop()
+    """
+
+    def __init__(self, chunk : int = 0, delay : float = 0.05, reply : bool = True) -> None:
+        """
+            Initialize the server
+            Args :
+                chunk : int # send the messages in pieces of this size , 0 sends them at once
+                delay : float # seconds before a new vector is answered with Ok
+                reply : bool # False never answers the new vectors , like a hung driver
+        """
+        self.chunk = chunk
+        self.delay = delay
+        self.reply = reply
+        self.received = []
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(4)
+        self.port = self._sock.getsockname()[1]
+        self._clients = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def stop(self) -> None:
+        self._sock.close()
+        with self._lock:
+            for conn in self._clients:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                conn.close()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._clients.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _send(self, conn : socket.socket, message : str) -> None:
+        """Send a message , in small pieces to check the incremental parsing"""
+        data = message.encode("utf-8")
+        step = self.chunk or len(data)
+        with self._lock:
+            for i in range(0, len(data), step):
+                conn.sendall(data[i:i + step])
+                if self.chunk:
+                    time.sleep(0.001)
+
+    def _serve(self, conn : socket.socket) -> None:
+        parser = ET.XMLPullParser(events=("end",))
+        parser.feed("<indi>")
+        depth = 0
+        while True:
+            try:
+                data = conn.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            parser.feed(data)
+            for _, elem in parser.read_events():
+                # Only the top level messages , their children come first
+                if elem.tag.startswith("one"):
+                    continue
+                self.received.append(elem)
+                if elem.tag == "getProperties":
+                    self._send(conn, DEFINITIONS)
+                elif elem.tag.startswith("new") and self.reply:
+                    threading.Thread(target=self._answer, args=(conn, elem), daemon=True).start()
+
+    def _answer(self, conn : socket.socket, elem : ET.Element) -> None:
+        """Answer a new vector , Busy first and then Ok after the delay"""
+        vtype = elem.tag[3:-6]
+        elements = "".join('<one%s name="%s">%s</one%s>' % (vtype, child.get("name"), child.text, vtype)
+                            for child in elem)
+        for state in ("Busy", "Ok"):
+            try:
+                self._send(conn, '<set%sVector device="%s" name="%s" state="%s">%s</set%sVector>' % (
+                    vtype, elem.get("device"), elem.get("name"), state, elements, vtype))
+            except OSError:
+                return
+            time.sleep(self.delay)
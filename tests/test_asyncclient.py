@@ -0,0 +1,140 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from libs.alpyca.asyncclient import (AlpacaPool, AlpacaProtocolError, AsyncFocuser, SyncDevice, SyncRunner,
+                                        split_address)
+from libs.alpyca.exceptions import (AlpacaRequestException, DriverException, InvalidValueException,
+                                        NotConnectedException)
+from tests.fake_alpaca import FakeAlpacaServer, SimulatedFocuser
+
+@pytest.fixture
+def make_device():
+    servers , runners = [] , []
+
+    def make(**options) -> tuple:
+        server = FakeAlpacaServer(SimulatedFocuser(position=1234),**options)
+        server.start()
+        # A loop of its own , so the pool and its statistics belong to this test
+        runner = SyncRunner()
+        servers.append(server)
+        runners.append(runner)
+        return server , SyncDevice(AsyncFocuser(server.address,0),runner)
+
+    yield make
+    for server in servers:
+        server.stop()
+    for runner in runners:
+        runner.stop()
+
+def pool_stats(device : SyncDevice) -> dict:
+    async def stats() -> dict:
+        return AlpacaPool.shared().stats()
+    return device.run(stats())
+
+def test_split_address():
+    assert split_address("127.0.0.1:11111") == ("127.0.0.1",11111)
+    assert split_address("alpaca.local") == ("alpaca.local",80)
+    assert split_address("[fe80::1%eth0]:32323") == ("fe80::1",32323)
+
+@pytest.mark.parametrize("mode",["length","chunked"])
+def test_bodies(make_device , mode):
+    server , device = make_device(mode=mode)
+    assert device.get("Position") == 1234
+    assert device.get("Name") == "Focuser Simulator"
+    assert device.get("IsMoving") is False
+    reply = device.put("Move",Position=1300)
+    assert reply["ErrorNumber"] == 0
+    method , path , data = server.requests[-1]
+    assert (method , path , data["Position"]) == ("PUT","/api/v1/focuser/0/move","1300")
+    assert int(data["ClientTransactionID"]) == reply["ClientTransactionID"]
+
+def test_keep_alive_reuse(make_device):
+    server , device = make_device()
+    for _ in range(10):
+        device.get("Position")
+    assert server.connections == 1
+    stats = pool_stats(device)
+    assert stats["requests"] == 10 and stats["connections"] == 1 and stats["idle"] == 1
+
+def test_announced_close(make_device):
+    server , device = make_device(close_after=1)
+    for _ in range(3):
+        assert device.get("Position") == 1234
+    assert server.connections == 3
+    assert pool_stats(device)["idle"] == 0
+
+def test_silently_dropped_connection_is_retried(make_device):
+    server , device = make_device(close_after=2,announce_close=False)
+    for _ in range(5):
+        assert device.get("Position") == 1234
+    assert server.connections == 3
+    assert pool_stats(device)["errors"] == 0
+
+def test_body_until_close(make_device):
+    _ , device = make_device(mode="nolength",close_after=1)
+    assert device.get("Position") == 1234
+
+def test_keep_alive_body_without_length(make_device):
+    _ , device = make_device(mode="nolength")
+    started = time.monotonic()
+    with pytest.raises(AlpacaProtocolError):
+        device.get("Position",tmo=3)
+    # Refused at once , not after waiting for the end of the connection
+    assert time.monotonic() - started < 1
+    assert pool_stats(device)["errors"] == 1
+
+def test_alpaca_errors(make_device):
+    server , device = make_device()
+    server.errors["position"] = (0x0407,"Focuser is not connected")
+    server.errors["move"] = (0x0401,"Position out of range")
+    server.errors["halt"] = (0x0500,"Motor stalled")
+    server.errors["name"] = 400
+    with pytest.raises(NotConnectedException , match="not connected"):
+        device.get("Position")
+    with pytest.raises(InvalidValueException):
+        device.put("Move",Position=-5)
+    with pytest.raises(DriverException , match="stalled"):
+        device.put("Halt")
+    with pytest.raises(AlpacaRequestException , match="Bad request"):
+        device.get("Name")
+    # The errors are answers , the connection is still good
+    assert device.get("IsMoving") is False
+    assert server.connections == 1
+
+def test_timeout(make_device):
+    _ , device = make_device(delay=0.5)
+    with pytest.raises(asyncio.TimeoutError):
+        device.get("Position",tmo=0.1)
+    assert pool_stats(device)["errors"] == 1
+
+def test_get_many_partial_failure(make_device):
+    server , device = make_device(delay=0.1)
+    server.errors["position"] = (0x0407,"Focuser is not connected")
+    started = time.monotonic()
+    values = device.get_many("IsMoving","Position","Name")
+    # The requests are sent at the same time
+    assert time.monotonic() - started < 0.25
+    assert values["IsMoving"] is False and values["Name"] == "Focuser Simulator"
+    assert isinstance(values["Position"],NotConnectedException)
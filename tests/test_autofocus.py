@@ -0,0 +1,133 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+import numpy as np
+import pytest
+
+from tools.benchmark_autofocus import SimulatedCamera, SimulatedFocuser
+from utils.autofocus import AutoFocus, AutoFocusAborted, AutoFocusError, FocusCurve
+
+def hyperbola(position , best : float = 10000.0, minimum : float = 2.0, slope : float = 0.02) -> float:
+    return float(np.hypot(minimum,(position - best) * slope))
+
+def make_curve(positions , best : float = 10000.0, noise : float = 0.0, seed : int = 0) -> FocusCurve:
+    rng = np.random.default_rng(seed)
+    curve = FocusCurve(reference=positions[len(positions) // 2],scale=50)
+    for position in positions:
+        curve.add(position,hyperbola(position,best) + rng.normal(0,noise))
+    return curve
+
+def test_fit_finds_the_minimum():
+    curve = make_curve(range(9750,10300,50),best=10020,noise=0.02)
+    fit = curve.fit()
+    assert fit is not None
+    assert fit["position"] == pytest.approx(10020,abs=10)
+    assert fit["hfd"] == pytest.approx(2.0,abs=0.2)
+    assert fit["sigma"] < 20
+    assert curve.is_bracketed(fit)
+
+def test_exact_hyperbola_is_recovered():
+    fit = make_curve(range(9700,10350,50),best=10010).fit()
+    assert fit["position"] == pytest.approx(10010,abs=1)
+    assert fit["rms"] < 0.05
+
+def test_one_sided_curve_is_not_bracketed():
+    # Every point is above the best focus , the minimum is not surrounded
+    curve = make_curve(range(10100,10400,50),best=10000)
+    fit = curve.fit()
+    assert not curve.is_bracketed(fit)
+    below , above = curve.sides(fit)
+    assert not (below and above)
+
+def test_flattened_far_points_are_excluded():
+    positions = list(range(9800,10250,50))
+    curve = make_curve(positions,best=10000)
+    # Far from focus the measured HFD saturates at the size of the box
+    curve.add(9000,9.0)
+    curve.add(11000,9.0)
+    fit = curve.fit()
+    assert fit["used"] == len(positions)
+    assert fit["position"] == pytest.approx(10000,abs=5)
+
+def test_too_few_points():
+    curve = FocusCurve()
+    curve.add(0,3.0)
+    curve.add(100,2.0)
+    assert curve.fit() is None
+    assert not curve.is_bracketed(None)
+
+def make_autofocus(best : int, seed : int = 0, **options) -> tuple:
+    """Autofocus on the simulated focuser and camera of the benchmark , measured in this thread"""
+    focuser = SimulatedFocuser(10000)
+    camera = SimulatedCamera(focuser,best,seed)
+    options.setdefault("points",9)
+    autofocus = AutoFocus(focuser,camera.expose,step=50,exposure=0,radius=15,workers=0,**options)
+    return focuser , autofocus
+
+def test_run_stops_early():
+    focuser , autofocus = make_autofocus(10030)
+    result = autofocus.run()
+    assert result["early"]
+    assert result["frames"] < 9
+    assert abs(result["position"] - 10030) <= 15
+    assert focuser.position == result["position"]
+
+def test_run_extends_past_the_end_of_the_sweep():
+    # The sweep covers 9800 to 10200 , the best focus is past its end
+    focuser , autofocus = make_autofocus(10230)
+    result = autofocus.run()
+    assert result["frames"] > 9
+    assert max(point["position"] for point in result["curve"]["points"]) > 10200
+    assert abs(result["position"] - 10230) <= 20
+    assert focuser.position == result["position"]
+
+def test_run_goes_back_when_the_minimum_is_not_found():
+    focuser , autofocus = make_autofocus(12000,max_extend=1)
+    with pytest.raises(AutoFocusError):
+        autofocus.run()
+    assert focuser.position == 10000
+
+def test_run_goes_back_when_aborted():
+    focuser , autofocus = make_autofocus(10000,tolerance=0)
+    measured = []
+
+    def on_point(curve : dict) -> None:
+        measured.append(curve)
+        if len(measured) == 3:
+            autofocus.abort()
+
+    autofocus.on_point = on_point
+    with pytest.raises(AutoFocusAborted):
+        autofocus.run()
+    assert autofocus.frames == 3
+    assert focuser.position == 10000
+
+def test_run_goes_back_when_the_check_fails():
+    calls = []
+
+    def check() -> None:
+        calls.append(1)
+        if len(calls) > 4:
+            raise RuntimeError("session aborted")
+
+    focuser , autofocus = make_autofocus(10000,check=check)
+    with pytest.raises(RuntimeError):
+        autofocus.run()
+    assert focuser.position == 10000
@@ -0,0 +1,91 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+import numpy as np
+import pytest
+
+from utils.calibration import CalibrationError, CalibrationLibrary, sigma_clipped_median
+
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(0)
+    stack = [rng.normal(1000,10,(64,48)).astype(np.float32) for _ in range(7)]
+    # A satellite trail and a hot pixel in single frames
+    stack[2][10,:] += 5000
+    stack[5][30,20] = 65535
+    return stack
+
+def reference_median(frames , sigma : float = 3.0) -> np.ndarray:
+    """Plain sigma clipped median of the whole stack at once"""
+    data = np.stack(frames).astype(np.float64)
+    median = np.median(data,axis=0)
+    deviation = 1.4826 * np.median(np.abs(data - median),axis=0)
+    data[(np.abs(data - median) > sigma * deviation) & (deviation > 0)] = np.nan
+    return np.nanmedian(data,axis=0)
+
+def test_outliers_are_rejected(frames):
+    master = sigma_clipped_median(frames)
+    assert master.dtype == np.float32
+    assert np.abs(master[10] - 1000).max() < 30
+    assert abs(master[30,20] - 1000) < 30
+    np.testing.assert_allclose(master,reference_median(frames),atol=1e-3)
+
+def test_blocks_do_not_change_the_result(frames):
+    whole = sigma_clipped_median(frames)
+    # A few rows per block , the last block is partial
+    blocks = sigma_clipped_median(frames,block_memory=4 * 7 * 48 * 5)
+    np.testing.assert_array_equal(whole,blocks)
+
+def test_memmap_frames(frames , tmp_path):
+    paths = []
+    for i , frame in enumerate(frames):
+        path = tmp_path / "{}.npy".format(i)
+        np.save(path,frame)
+        paths.append(np.load(path,mmap_mode="r"))
+    np.testing.assert_array_equal(sigma_clipped_median(paths),sigma_clipped_median(frames))
+
+def test_bias_and_scales():
+    rng = np.random.default_rng(1)
+    bias = np.full((16,16),100,dtype=np.float32)
+    flats = [(100 + level * (1 + rng.normal(0,0.01,(16,16)))).astype(np.float32) for level in (1000,2000,4000)]
+    master = sigma_clipped_median(flats,scales=[1 / 1000,1 / 2000,1 / 4000],bias=bias)
+    assert np.abs(master - 1).max() < 0.05
+
+def test_two_frames_are_averaged():
+    master = sigma_clipped_median([np.zeros((4,4)),np.full((4,4),2.0)])
+    np.testing.assert_array_equal(master,np.ones((4,4)))
+
+def test_invalid_frames():
+    with pytest.raises(CalibrationError):
+        sigma_clipped_median([])
+    with pytest.raises(CalibrationError):
+        sigma_clipped_median([np.zeros((4,4)),np.zeros((4,5))])
+
+def test_darks_of_different_exposures_are_not_mixed(tmp_path):
+    library = CalibrationLibrary(str(tmp_path))
+    for exposure in (1,1,1,5,5,5):
+        library.add_frame(np.full((8,8),exposure * 10,np.uint16),
+                            CalibrationLibrary.make_info("dark","camera",100,10,1,-10,exposure))
+    info = CalibrationLibrary.make_info("dark","camera",100,10,1,-10,None)
+    with pytest.raises(CalibrationError):
+        library.build_master("dark",info)
+    master = library.build_master("dark",dict(info,exposure=5.0))
+    assert master["exposure"] == 5.0 and master["frames"] == 3
+    assert float(library.get_master("dark",dict(info,exposure=5.0)).mean()) == pytest.approx(50)
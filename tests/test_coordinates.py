@@ -0,0 +1,101 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+import numpy as np
+import pytest
+
+from utils.coordinates import (J2000, altaz, format_dec, format_ra, gmst, horizontal_to_equatorial,
+                                j2000_to_jnow, jnow_to_j2000, julian_date, parse_dec, parse_many,
+                                parse_ra, parse_sexagesimal, separation, equatorial_to_horizontal)
+
+# 2025-01-01 00:00 UTC
+JD_2025 = 2460676.5
+
+def test_parse_sexagesimal():
+    assert parse_sexagesimal("12:30:45") == pytest.approx(12.5125)
+    assert parse_sexagesimal("12h30m45s") == pytest.approx(12.5125)
+    assert parse_sexagesimal("-05 30 00") == pytest.approx(-5.5)
+    assert parse_sexagesimal("-00:30:00") == pytest.approx(-0.5)
+    assert parse_sexagesimal("41°16'09\"") == pytest.approx(41 + 16 / 60 + 9 / 3600)
+    assert parse_sexagesimal(3.25) == 3.25
+    for value in ("12:61:00","12:-3:00","a:b","1 2 3 4",None):
+        with pytest.raises(ValueError):
+            parse_sexagesimal(value)
+
+def test_parse_ra_dec():
+    assert parse_ra("05:35:17.3") == pytest.approx((5 + 35 / 60 + 17.3 / 3600) * 15)
+    assert parse_dec("-05:23:28") == pytest.approx(-(5 + 23 / 60 + 28 / 3600))
+    with pytest.raises(ValueError):
+        parse_ra("25:00:00")
+    with pytest.raises(ValueError):
+        parse_dec("91:00:00")
+    values = parse_many(["01:00:00","bad",2.0],hours=True)
+    assert values[0] == pytest.approx(15.0) and np.isnan(values[1]) and values[2] == pytest.approx(30.0)
+
+def test_format_round_trip():
+    ra , dec = 83.82208 , -5.39111
+    assert parse_ra(format_ra(ra)) == pytest.approx(ra,abs=1e-4)
+    assert parse_dec(format_dec(dec)) == pytest.approx(dec,abs=1e-4)
+
+def test_sidereal_time():
+    # GMST at J2000.0
+    assert float(gmst(J2000)) == pytest.approx(280.46061837)
+    assert float(julian_date(946728000.0)) == pytest.approx(J2000)
+
+def test_separation():
+    assert float(separation(0,0,90,0)) == pytest.approx(90)
+    assert float(separation(10,89,190,89)) == pytest.approx(2)
+    # Accurate for very small distances too
+    assert float(separation(10,20,10,20 + 1e-7)) == pytest.approx(1e-7,rel=1e-3)
+
+def test_precession():
+    # Annual precession at (0,0) is about 46.1" in RA and 20.0" in declination
+    ra , dec = j2000_to_jnow(0.0,0.0,JD_2025,aberration=False)
+    years = (JD_2025 - J2000) / 365.25
+    assert float(ra) == pytest.approx(46.1 * years / 3600,abs=0.01)
+    assert float(dec) == pytest.approx(20.04 * years / 3600,abs=0.01)
+
+def test_round_trip_and_vectorized():
+    rng = np.random.default_rng(0)
+    ra = rng.uniform(0,360,100)
+    dec = np.degrees(np.arcsin(rng.uniform(-1,1,100)))
+    jd = JD_2025 + rng.uniform(0,3650,100)
+    ra_now , dec_now = j2000_to_jnow(ra,dec,jd)
+    back_ra , back_dec = jnow_to_j2000(ra_now,dec_now,jd)
+    assert np.max(separation(ra,dec,back_ra,back_dec)) < 1e-6
+    # Same result one by one
+    single = j2000_to_jnow(float(ra[3]),float(dec[3]),float(jd[3]))
+    assert float(single[0]) == pytest.approx(ra_now[3]) and float(single[1]) == pytest.approx(dec_now[3])
+
+def test_altaz():
+    # The pole is at the altitude of the latitude , due north
+    alt , az = altaz(np.array([0.0]),np.array([90.0]),np.array([123.0]),45.0)
+    assert alt[0] == pytest.approx(45.0) and az[0] % 360 == pytest.approx(0.0,abs=1e-6)
+    # A star on the meridian culminates at 90 - |lat - dec|
+    alt , az = altaz(np.array([100.0]),np.array([20.0]),np.array([100.0]),45.0)
+    assert alt[0] == pytest.approx(65.0) and az[0] == pytest.approx(180.0)
+    # (objects , times) grid in one call
+    alt , az = altaz(np.array([0.0,90.0])[:,None],np.array([0.0,10.0])[:,None],np.linspace(0,360,5)[None,:],30.0)
+    assert alt.shape == (2,5)
+
+def test_horizontal_round_trip():
+    alt , az = equatorial_to_horizontal(np.array([10.0,200.0]),np.array([30.0,-10.0]),48.0,2.0,JD_2025,refract=True)
+    ra , dec = horizontal_to_equatorial(alt,az,48.0,2.0,JD_2025,refract=True)
+    assert np.max(separation([10.0,200.0],[30.0,-10.0],ra,dec)) < 1e-3
@@ -0,0 +1,80 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+import pytest
+
+from utils.dispatch import Dispatcher, handler
+
+class Device(object):
+
+    def __init__(self) -> None:
+        self.calls = []
+
+    @handler("RemoteConnect")
+    def connect(self, params) -> None:
+        self.calls.append(("connect",params))
+
+    @handler("RemoteDisconnect")
+    @handler("RemoteReset")
+    def disconnect(self) -> None:
+        self.calls.append(("disconnect",None))
+
+    @handler("RemoteFail")
+    def fail(self) -> None:
+        raise RuntimeError("failed")
+
+    def not_a_handler(self) -> None:
+        pass
+
+def test_bind_with_prefix():
+    device = Device()
+    dispatcher = Dispatcher("test")
+    dispatcher.bind(device,("camera",))
+    assert ("camera","RemoteConnect") in dispatcher
+    assert ("camera","RemoteReset") in dispatcher
+    assert ("RemoteConnect",) not in dispatcher
+    assert dispatcher.dispatch(("camera","RemoteConnect"),{"host" : "127.0.0.1"})
+    # A handler without an argument is called without the params
+    assert dispatcher.dispatch(("camera","RemoteReset"),{"ignored" : True})
+    assert device.calls == [("connect",{"host" : "127.0.0.1"}),("disconnect",None)]
+
+def test_unknown_key():
+    dispatcher = Dispatcher("test")
+    dispatcher.bind(Device())
+    assert not dispatcher.dispatch(("RemoteUnknown",))
+    assert dispatcher.get_metrics()["unknown"] == 1
+
+def test_errors_are_counted_and_raised():
+    dispatcher = Dispatcher("test")
+    dispatcher.bind(Device())
+    with pytest.raises(RuntimeError):
+        dispatcher.dispatch(("RemoteFail",))
+    dispatcher.dispatch(("RemoteDisconnect",))
+    metrics = dispatcher.get_metrics()["handlers"]
+    assert metrics["RemoteFail"]["calls"] == 1 and metrics["RemoteFail"]["errors"] == 1
+    assert metrics["RemoteDisconnect"]["calls"] == 1 and metrics["RemoteDisconnect"]["errors"] == 0
+    assert metrics["RemoteDisconnect"]["max_time"] >= metrics["RemoteDisconnect"]["avg_time"] >= 0
+
+def test_add_function():
+    received = []
+    dispatcher = Dispatcher("test")
+    dispatcher.add(("server","RemoteDashboardSetup"),received.append)
+    assert dispatcher.dispatch(("server","RemoteDashboardSetup"),42)
+    assert received == [42]
@@ -0,0 +1,114 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+from time import monotonic
+
+import pytest
+
+from server.driver.focuser.motion import START_GRACE, DEFAULT_SPEED, FocuserMotion
+from tests.fake_alpaca import AlpacaFocuser, FakeAlpacaServer, SimulatedFocuser
+
+@pytest.fixture
+def make_motion():
+    servers = []
+
+    def make(backlash : int = 0, final_direction : int = 1, max_step : int = 20000, **options) -> tuple:
+        focuser = SimulatedFocuser(**options)
+        server = FakeAlpacaServer(focuser)
+        server.start()
+        servers.append(server)
+        motion = FocuserMotion(AlpacaFocuser(server.address),backlash,final_direction,
+                                focuser.absolute,max_step if focuser.absolute else None,timeout=5)
+        return focuser , motion
+
+    yield make
+    for server in servers:
+        server.stop()
+
+def test_plan_overshoots_against_the_final_direction(make_motion):
+    _ , motion = make_motion(backlash=100)
+    assert motion.plan(1000,500) == [400,500]
+    assert motion.plan(500,1000) == [1000]
+    assert motion.plan(1000,1000) == [1000]
+    # The overshoot stays in the range of the focuser
+    assert motion.plan(150,50) == [0,50]
+    assert motion.plan(100,0) == [0]
+    motion.final_direction = -1
+    assert motion.plan(500,1000) == [1100,1000]
+    assert motion.plan(19950,19990) == [20000,19990]
+    assert motion.plan(1000,500) == [500]
+
+def test_move_to_then_runs_once_at_the_end(make_motion):
+    focuser , motion = make_motion(position=1000,backlash=100)
+    reached = []
+    operation = motion.move_to(500,reached.append)
+    assert motion.wait() == 500
+    assert operation.status == "done" and operation.result == 500
+    # The overshoot and the move back in the final direction , then called only when both are over
+    assert focuser.moves == [400,500]
+    assert reached == [500]
+    assert focuser.position == 500 and not motion.is_moving
+
+def test_move_is_refused_while_moving(make_motion):
+    _ , motion = make_motion(position=1000,speed=500)
+    motion.move_to(1200)
+    with pytest.raises(RuntimeError):
+        motion.move_to(1300)
+    motion.wait()
+
+def test_late_is_moving_is_waited_for(make_motion):
+    # The driver reports IsMoving a while after Move , the move must not end at once
+    focuser , motion = make_motion(position=1000,start_delay=0.1)
+    assert motion.move_to(1200) is not None
+    assert motion.wait() == 1200
+    assert focuser.position == 1200
+
+def test_speed_is_learned(make_motion):
+    _ , motion = make_motion(position=1000,speed=2000)
+    motion.move_to(1600)
+    motion.wait()
+    assert motion.speed > DEFAULT_SPEED
+
+def test_relative_focuser(make_motion):
+    focuser , motion = make_motion(absolute=False,speed=2000,backlash=50)
+    reached = []
+    started = monotonic()
+    motion.move_to(200,reached.append)
+    assert motion.wait() == 200
+    # No start grace for a relative focuser , the move takes 0.1s
+    assert monotonic() - started < START_GRACE
+    # The speed is learned from the commanded steps
+    assert motion.speed > DEFAULT_SPEED
+    motion.move_step(-300)
+    assert motion.wait() == -100
+    # Relative moves are step counts , the inward move overshoots by the backlash
+    assert focuser.moves == [200,-350,50]
+    assert reached == [200]
+    assert focuser.position == 10000 - 100
+
+def test_cancel_halts_the_focuser(make_motion):
+    from utils.operations import operations
+    focuser , motion = make_motion(position=1000,speed=200)
+    operation = motion.move_to(2000)
+    assert operations.cancel(operation.id)
+    assert operation.status == "cancelled"
+    stopped = focuser.position
+    assert 1000 <= stopped < 2000
+    assert not focuser.is_moving
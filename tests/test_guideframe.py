@@ -0,0 +1,91 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+import base64
+import zlib
+
+import numpy as np
+import pytest
+
+from server.driver.guider.guideframe import GuideFrameEncoder
+
+H , W = 240 , 320
+
+def star_frame(x : float, y : float = 120.0) -> np.ndarray:
+    yy , xx = np.mgrid[0:H,0:W]
+    return (1000 + 20000 * np.exp(-((yy - y) ** 2 + (xx - x) ** 2) / (2 * 2.5 ** 2))).astype(np.uint16)
+
+class Client(object):
+    """Rebuild the preview from the messages like the web page does"""
+
+    def __init__(self) -> None:
+        self.view = None
+
+    def apply(self, message : dict) -> None:
+        if message is None:
+            return
+        if message["keyframe"]:
+            self.view = np.zeros((message["height"],message["width"]),dtype=np.uint8)
+        for x , y , w , h , data in message["tiles"]:
+            self.view[y:y + h,x:x + w] = np.frombuffer(zlib.decompress(base64.b64decode(data)),np.uint8).reshape(h,w)
+
+def test_decode():
+    encoder = GuideFrameEncoder()
+    raw = star_frame(100)
+    pixels = base64.b64encode(raw.astype("<u2").tobytes()).decode()
+    decoded = encoder.decode(pixels,W,H)
+    np.testing.assert_array_equal(decoded,raw)
+    # The buffer is reused
+    assert encoder.decode(pixels,W,H) is decoded
+    with pytest.raises(ValueError):
+        encoder.decode(pixels,W + 1,H)
+
+def test_keyframe_then_nothing():
+    encoder = GuideFrameEncoder(binning=2)
+    raw = star_frame(100)
+    first = encoder.encode(1,raw)
+    assert first["keyframe"] and len(first["tiles"]) == 1
+    assert (first["width"] , first["height"]) == (W // 2,H // 2)
+    # The same frame has no change to send
+    assert encoder.encode(2,raw) is None
+    encoder.reset()
+    assert encoder.encode(3,raw)["keyframe"]
+
+def test_only_the_changed_tiles_are_sent():
+    encoder = GuideFrameEncoder(binning=1,tile=32)
+    client = Client()
+    client.apply(encoder.encode(1,star_frame(100)))
+    message = encoder.encode(2,star_frame(200))
+    assert not message["keyframe"]
+    # The old and the new position of the star
+    assert 2 <= len(message["tiles"]) <= 8
+    client.apply(message)
+    # The small changes of the tiles not sent stay under the threshold
+    assert np.abs(client.view.astype(int) - encoder.preview.astype(int)).max() <= encoder.threshold
+
+def test_slow_drift_reaches_the_client():
+    # Every frame changes less than the threshold , the changes must add up and be sent
+    encoder = GuideFrameEncoder(binning=1,keyframe_every=0)
+    client = Client()
+    worst = 0
+    for i in range(100):
+        client.apply(encoder.encode(i,star_frame(100 + 0.1 * i)))
+        worst = max(worst,int(np.abs(client.view.astype(int) - encoder.preview.astype(int)).max()))
+    assert worst <= encoder.threshold
@@ -0,0 +1,102 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+import time
+
+import pytest
+
+from server.indi.indiclient import IndiClient, IndiStreamParser
+from tests.fake_indiserver import DEVICE, FakeIndiServer
+
+@pytest.fixture
+def make_client():
+    servers, clients = [], []
+
+    def make(**options) -> tuple:
+        server = FakeIndiServer(**options)
+        server.start()
+        client = IndiClient("127.0.0.1", server.port, timeout=2)
+        assert client.connect()
+        servers.append(server)
+        clients.append(client)
+        return server, client
+
+    yield make
+    for client in clients:
+        client.disconnect()
+    for server in servers:
+        server.stop()
+
+def test_parser_splits_messages_at_any_byte():
+    messages = []
+    parser = IndiStreamParser(messages.append)
+    data = (b'<setNumberVector device="d" name="p" state="Ok"><oneNumber name="a">1</oneNumber></setNumberVector>'
+            b'<message device="d" message="hello"/>')
+    for i in range(len(data)):
+        parser.feed(data[i:i + 1])
+    assert [elem.tag for elem in messages] == ["setNumberVector", "message"]
+    assert messages[0][0].text == "1"
+
+def test_chunked_get(make_client):
+    _, client = make_client(chunk=7)
+    assert client.get_prop(DEVICE, "EQUATORIAL_EOD_COORD", "DEC") == "89.5"
+    assert client.get_prop(DEVICE, "DRIVER_INFO", "DRIVER_NAME") == "Telescope & Simulator"
+    assert client.get_state(DEVICE, "CONNECTION") == "Idle"
+    # The wildcard device of indi_getprop
+    assert client.get_prop("*", "CONNECTION", "CONNECT") == "Off"
+    assert client.get_prop(DEVICE, "NOT_DEFINED", "X", timeout=0.1) is None
+
+def test_set_and_wait_state(make_client):
+    server, client = make_client(delay=0.1)
+    assert client.set_props(DEVICE, "EQUATORIAL_EOD_COORD", {"RA" : 1.5, "DEC" : -20})
+    # Busy until the server answers , never the stale Idle
+    assert client.get_state(DEVICE, "EQUATORIAL_EOD_COORD") == "Busy"
+    assert client.wait_state(DEVICE, "EQUATORIAL_EOD_COORD", timeout=2) == "Ok"
+    assert client.get_prop(DEVICE, "EQUATORIAL_EOD_COORD", "RA") == "1.5"
+    new = [elem for elem in server.received if elem.tag == "newNumberVector"]
+    assert len(new) == 1 and {child.get("name") for child in new[0]} == {"RA", "DEC"}
+
+def test_set_switch(make_client):
+    _, client = make_client(delay=0.01)
+    assert client.set_prop(DEVICE, "CONNECTION", "CONNECT", "On")
+    assert client.wait_state(DEVICE, "CONNECTION", timeout=2) == "Ok"
+    assert client.get_prop(DEVICE, "CONNECTION", "CONNECT") == "On"
+
+def test_set_without_reply_expires(make_client):
+    _, client = make_client(reply=False)
+    assert client.set_prop(DEVICE, "EQUATORIAL_EOD_COORD", "RA", 3, timeout=0.2)
+    started = time.monotonic()
+    # The busy mark is dropped after the timeout of the set , the previous state comes back
+    assert client.wait_state(DEVICE, "EQUATORIAL_EOD_COORD", timeout=2) == "Idle"
+    assert time.monotonic() - started < 1
+    assert client.get_state(DEVICE, "EQUATORIAL_EOD_COORD") == "Idle"
+
+def test_wait_state_timeout(make_client):
+    _, client = make_client(reply=False)
+    assert client.set_prop(DEVICE, "EQUATORIAL_EOD_COORD", "RA", 3, timeout=5)
+    assert client.wait_state(DEVICE, "EQUATORIAL_EOD_COORD", timeout=0.2) == "Busy"
+
+def test_disconnect_wakes_waiters(make_client):
+    server, client = make_client(reply=False)
+    assert client.set_prop(DEVICE, "EQUATORIAL_EOD_COORD", "RA", 3, timeout=5)
+    started = time.monotonic()
+    server.stop()
+    client.wait_state(DEVICE, "EQUATORIAL_EOD_COORD", timeout=3)
+    assert time.monotonic() - started < 1
@@ -0,0 +1,127 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+import numpy as np
+import pytest
+
+from utils.livestack import LiveStack, _prepare, phase_correlation
+
+H , W = 256 , 320
+
+def star_field(dy : float = 0.0, dx : float = 0.0, seed : int = 0, noise : float = 5.0,
+                h : int = H, w : int = W, colour : bool = False) -> np.ndarray:
+    """Gaussian stars on a noisy background , moved by (dy , dx)"""
+    rng = np.random.default_rng(seed)
+    stars = np.random.default_rng(42)
+    yy , xx = np.mgrid[0:h,0:w].astype(np.float32)
+    image = np.full((h,w),100.0,dtype=np.float32)
+    for _ in range(60):
+        y , x = stars.uniform(10,h - 10) + dy , stars.uniform(10,w - 10) + dx
+        image += stars.uniform(300,3000) * np.exp(-((yy - y) ** 2 + (xx - x) ** 2) / (2 * 1.8 ** 2))
+    if colour:
+        image = np.stack((image,image * 0.8,image * 0.6),axis=2)
+    return image + rng.normal(0,noise,image.shape).astype(np.float32)
+
+def mosaic(rgb : np.ndarray) -> np.ndarray:
+    """RGGB mosaic of an RGB image"""
+    raw = rgb[...,1].copy()
+    raw[0::2,0::2] = rgb[0::2,0::2,0]
+    raw[1::2,1::2] = rgb[1::2,1::2,2]
+    return raw
+
+@pytest.mark.parametrize("shift",[(0.0,0.0),(3.3,-5.7),(-10.45,7.2)])
+def test_phase_correlation(shift):
+    reference = np.conj(np.fft.rfft2(_prepare(star_field(seed=1))))
+    dy , dx , peak = phase_correlation(reference,_prepare(star_field(*shift,seed=2)))
+    assert dy == pytest.approx(shift[0],abs=0.05)
+    assert dx == pytest.approx(shift[1],abs=0.05)
+    assert peak > 0.1
+
+def test_mono_frames_are_aligned():
+    stack = LiveStack()
+    stack.add(star_field(seed=1))
+    for seed , (dy , dx) in enumerate(((2.25,-3.6),(-7.8,11.4),(15.3,0.5)),2):
+        stats = stack.add(star_field(dy,dx,seed=seed))
+        assert stats["stacked"]
+        assert stats["dy"] == pytest.approx(dy,abs=0.05)
+        assert stats["dx"] == pytest.approx(dx,abs=0.05)
+    assert stack.frames == 4
+    # The stars of the stack are as sharp as in one frame
+    reference = star_field(noise=0)
+    assert np.abs(stack.image() - reference)[20:-20,20:-20].max() < 0.1 * reference.max()
+
+def test_colour_frames_are_debayered_and_aligned():
+    stack = LiveStack(pattern="RGGB")
+    stack.add(mosaic(star_field(seed=1,colour=True)))
+    # A superpixel is two pixels of the sensor
+    stats = stack.add(mosaic(star_field(6.6,-4.2,seed=2,colour=True)))
+    assert stack.image().shape == (H // 2,W // 2,3)
+    assert stats["dy"] == pytest.approx(3.3,abs=0.05)
+    assert stats["dx"] == pytest.approx(-2.1,abs=0.05)
+    bilinear = LiveStack(pattern="RGGB",debayer="bilinear")
+    bilinear.add(mosaic(star_field(seed=1,colour=True)))
+    stats = bilinear.add(mosaic(star_field(6.6,-4.2,seed=2,colour=True)))
+    assert bilinear.image().shape == (H,W,3)
+    assert stats["dy"] == pytest.approx(6.6,abs=0.05)
+    assert stats["dx"] == pytest.approx(-4.2,abs=0.05)
+    with pytest.raises(ValueError):
+        LiveStack(debayer="vng")
+
+def test_noise_frame_is_not_stacked():
+    stack = LiveStack()
+    stack.add(star_field(seed=1))
+    rng = np.random.default_rng(5)
+    for i in range(5):
+        stats = stack.add(rng.normal(100,5,(H,W)).astype(np.float32))
+        assert not stats["stacked"]
+    assert stack.frames == 1 and stack.rejected_frames == 5
+
+def test_satellite_trail_is_rejected():
+    stack = LiveStack()
+    for seed in range(3):
+        assert stack.add(star_field(seed=seed))["rejected_pixels"] == 0
+    trail = star_field(seed=3)
+    trail[100:103,:] += 2000
+    stats = stack.add(trail)
+    assert stats["stacked"]
+    assert 0 < stats["rejected_pixels"] < 0.05
+    # The trail is not in the stack
+    assert np.abs(stack.image()[100:103,20:-20] - star_field(noise=0)[100:103,20:-20]).max() < 50
+
+def test_memory_is_constant():
+    stack = LiveStack()
+    stack.add(star_field(seed=0))
+    stack.add(star_field(1.5,1.5,seed=1))
+    memory = stack.get_dict()["memory"]
+    for seed in range(2,10):
+        stack.add(star_field(seed % 3,-(seed % 2),seed=seed))
+    info = stack.get_dict()
+    assert info["frames"] == 10
+    assert info["memory"] == memory
+    # Mean , M2 , weight and the shift buffer
+    assert memory <= 4 * H * W * 4
+
+def test_shape_change_is_refused():
+    stack = LiveStack()
+    stack.add(star_field())
+    with pytest.raises(ValueError):
+        stack.add(star_field(h=128))
+    stack.reset()
+    assert stack.add(star_field(h=128))["stacked"]
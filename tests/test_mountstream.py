@@ -0,0 +1,143 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+import threading
+import time
+
+import pytest
+
+from server.driver.telescope.mountstream import MountStream, axis_velocity
+
+def test_axis_velocity_wraps_ra_and_az():
+    velocity = axis_velocity({"ra" : 0.01, "dec" : 10.0, "az" : 0.5, "alt" : None},
+                                {"ra" : 23.99, "dec" : 9.0, "az" : 359.5, "alt" : 40.0},2.0)
+    assert velocity["ra"] == pytest.approx(0.01)
+    assert velocity["dec"] == pytest.approx(0.5)
+    assert velocity["az"] == pytest.approx(0.5)
+    assert velocity["alt"] is None
+    backward = axis_velocity({"ra" : 23.9},{"ra" : 0.1},1.0)
+    assert backward["ra"] == pytest.approx(-0.2)
+    assert axis_velocity({"ra" : 1.0},{"ra" : 0.0},0)["ra"] is None
+
+def test_velocity_reset_when_slewing_changes():
+    stream = MountStream(lambda: None,slow_interval=1.0)
+    first = stream._update({"ra" : 1.0, "dec" : 10.0, "slewing" : True, "timestamp" : 100.0})
+    assert first["velocity"]["ra"] == 0.0 and first["velocity"]["az"] is None
+    moving = stream._update({"ra" : 1.5, "dec" : 12.0, "slewing" : True, "timestamp" : 101.0})
+    assert moving["velocity"]["ra"] == pytest.approx(0.5)
+    assert moving["velocity"]["dec"] == pytest.approx(2.0)
+    # The slew is over , the slew velocity would overshoot
+    stopped = stream._update({"ra" : 1.6, "dec" : 12.1, "slewing" : False, "timestamp" : 101.5})
+    assert stopped["velocity"]["ra"] == 0.0 and stopped["velocity"]["dec"] == 0.0
+    # Too long since the previous sample
+    late = stream._update({"ra" : 1.7, "dec" : 12.1, "slewing" : False, "timestamp" : 110.0})
+    assert late["velocity"]["ra"] == 0.0
+
+def test_fast_and_slow_interval():
+    stream = MountStream(lambda: None,fast_interval=0.1,slow_interval=2.0)
+    assert stream.interval() == 2.0
+    assert stream._update({"slewing" : True, "timestamp" : 1.0})["interval"] == 0.1
+    assert stream._update({"slewing" : False, "timestamp" : 2.0})["interval"] == 2.0
+    stream.poke(0.2)
+    assert stream.interval() == 0.1
+    time.sleep(0.25)
+    assert stream.interval() == 2.0
+
+class FakeMount(object):
+    """Slews for a while , then tracks"""
+
+    def __init__(self, slew : float) -> None:
+        self.slew_until = time.monotonic() + slew
+        self.samples = []
+
+    def sample(self) -> dict:
+        now = time.monotonic()
+        self.samples.append(now)
+        return {"ra" : 1.0, "dec" : 2.0, "slewing" : now < self.slew_until, "timestamp" : time.time()}
+
+def test_stream_rate_follows_the_slew():
+    mount = FakeMount(0.3)
+    stream = MountStream(mount.sample,fast_interval=0.03,slow_interval=0.5)
+    states = []
+    stream.subscribe(states.append)
+    time.sleep(1.2)
+    stream.stop()
+    slewing = [s for s in states if s["slewing"]]
+    # About ten samples while slewing , then two or three slow ones
+    assert 6 <= len(slewing) <= 12
+    assert 2 <= len(states) - len(slewing) <= 4
+    assert all(s["interval"] == 0.03 for s in slewing)
+    assert states[-1]["interval"] == 0.5
+
+def test_poke_during_a_sample_is_not_lost():
+    poked = threading.Event()
+    stream = None
+
+    def sample() -> dict:
+        if not poked.is_set():
+            # A goto starts while the first sample is read
+            poked.set()
+            stream.poke(0.05)
+        return mount.sample()
+
+    mount = FakeMount(0)
+    stream = MountStream(sample,fast_interval=0.02,slow_interval=5.0)
+    stream.subscribe(lambda state: None)
+    time.sleep(0.3)
+    stream.stop()
+    # Sampled again at once and fast until the end of the poke , not after the slow interval
+    assert len(mount.samples) >= 3
+    assert mount.samples[2] - mount.samples[0] < 0.2
+
+def test_poke_right_after_the_wait_is_not_lost():
+    mount = FakeMount(0)
+    stream = MountStream(mount.sample,fast_interval=0.02,slow_interval=5.0)
+    waits = []
+
+    class Wakeup(threading.Event):
+        def wait(self, timeout : float = None) -> bool:
+            woken = super().wait(timeout)
+            waits.append(timeout)
+            if len(waits) == 1:
+                # The poke of a goto comes just as the wait returns
+                stream.poke(0.1)
+            return woken
+
+    stream._wakeup = Wakeup()
+    stream.subscribe(lambda state: None)
+    while not mount.samples:
+        time.sleep(0.005)
+    # Wake up the first wait , the second one must be short
+    stream._wakeup.set()
+    time.sleep(0.3)
+    stream.stop()
+    assert len(waits) >= 3 and waits[1] == 0.02
+
+def test_new_subscriber_is_served_at_once():
+    mount = FakeMount(0)
+    stream = MountStream(mount.sample,slow_interval=5.0)
+    stream.subscribe(lambda state: None)
+    time.sleep(0.1)
+    second = threading.Event()
+    stream.subscribe(lambda state: second.set())
+    assert second.wait(1)
+    stream.stop()
+    time.sleep(0.05)
+    assert stream._thread is None
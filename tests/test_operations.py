@@ -0,0 +1,147 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+import threading
+import time
+
+import pytest
+
+from utils.operations import CANCELLED, DONE, FAILED, TIMEOUT, OperationManager
+
+@pytest.fixture
+def manager():
+    manager = OperationManager(history=3)
+    events = []
+    manager.subscribe(lambda event , info: events.append((event,info)))
+    manager.events = events
+    return manager
+
+def final_events(manager : OperationManager, id : int, timeout : float = 1.0) -> list:
+    """The final events of an operation , they are sent just after its waiters are woken up"""
+    deadline = time.monotonic() + timeout
+    while True:
+        events = [event for event , info in manager.events if info["id"] == id and event not in ("started","progress")]
+        if events or time.monotonic() > deadline:
+            # A second one would come right after the first
+            time.sleep(0.05)
+            return [event for event , info in manager.events if info["id"] == id and event not in ("started","progress")]
+        time.sleep(0.01)
+
+def test_done_after_finish(manager):
+    calls = []
+
+    def check() -> bool:
+        calls.append("check")
+        return len(calls) >= 3
+
+    def finish() -> int:
+        calls.append("finish")
+        # The subscribers have not been told yet
+        assert final_events(manager,operation.id,0) == []
+        return 42
+
+    operation = manager.submit("test.move",check,finish=finish,interval=0.01)
+    assert operation.wait(2)
+    assert calls == ["check","check","check","finish"]
+    assert operation.status == DONE and operation.result == 42
+    assert final_events(manager,operation.id) == [DONE]
+    assert [event for event , _info in manager.events] == ["started",DONE]
+    # The result is in the event
+    assert manager.events[-1][1]["result"] == 42
+
+def test_failed_check(manager):
+    def check() -> bool:
+        raise ConnectionError("lost")
+
+    operation = manager.submit("test.move",check,interval=0.01)
+    assert operation.wait(2)
+    assert operation.status == FAILED and operation.error == "lost"
+
+def test_timeout_cancels(manager):
+    cancelled = []
+    operation = manager.submit("test.move",lambda: False,cancel=lambda: cancelled.append(1),
+                                timeout=0.1,interval=0.02)
+    assert operation.wait(2)
+    assert operation.status == TIMEOUT
+    assert cancelled == [1]
+    assert final_events(manager,operation.id) == [TIMEOUT]
+
+def test_cancel_during_check(manager):
+    checking = threading.Event()
+    release = threading.Event()
+    finished = []
+
+    def check() -> bool:
+        checking.set()
+        release.wait(2)
+        return True
+
+    operation = manager.submit("test.move",check,cancel=lambda: None,finish=lambda: finished.append(1))
+    assert checking.wait(2)
+    assert manager.cancel(operation.id)
+    release.set()
+    assert operation.wait(2)
+    # The check said it is over , but the cancel came first
+    assert operation.status == CANCELLED
+    assert final_events(manager,operation.id) == [CANCELLED]
+    assert finished == []
+
+def test_cancel_during_finish(manager):
+    finishing = threading.Event()
+    release = threading.Event()
+    cancelled = []
+
+    def finish() -> str:
+        finishing.set()
+        release.wait(2)
+        return "there"
+
+    operation = manager.submit("test.move",lambda: True,cancel=lambda: cancelled.append(1),finish=finish)
+    assert finishing.wait(2)
+    # Too late , the motion is over
+    assert not manager.cancel(operation.id)
+    release.set()
+    assert operation.wait(2)
+    assert operation.status == DONE and operation.result == "there"
+    assert cancelled == []
+    assert final_events(manager,operation.id) == [DONE]
+
+def test_failed_cancel_keeps_checking(manager):
+    done = threading.Event()
+
+    def cancel() -> None:
+        raise RuntimeError("busy")
+
+    operation = manager.submit("test.move",done.is_set,cancel=cancel,interval=0.01)
+    assert not manager.cancel(operation.id)
+    assert not operation.is_finished
+    done.set()
+    assert operation.wait(2)
+    assert operation.status == DONE
+
+def test_history_is_trimmed(manager):
+    operations = [manager.submit("test.{}".format(i),lambda: True) for i in range(5)]
+    for operation in operations:
+        assert operation.wait(2)
+    kept = manager.list(finished=True)
+    assert sorted(op.id for op in kept) == [op.id for op in operations[2:]]
+    assert manager.get(operations[0].id) is None
+    assert manager.get(operations[4].id) is operations[4]
+    assert manager.list() == []
@@ -0,0 +1,159 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+import threading
+import time
+import zlib
+
+import numpy as np
+import pytest
+
+from utils.preview import (PATTERNS, PreviewGenerator, bayer_pattern, bin_image, debayer_bilinear,
+                            debayer_superpixel, make_preview)
+
+RED , GREEN , BLUE = 1000.0 , 2000.0 , 4000.0
+
+def mosaic(pattern : str, rgb : np.ndarray) -> np.ndarray:
+    """Bayer mosaic of an RGB image"""
+    ry , rx = PATTERNS[pattern]
+    raw = rgb[...,1].copy()
+    raw[ry::2,rx::2] = rgb[ry::2,rx::2,0]
+    raw[1 - ry::2,1 - rx::2] = rgb[1 - ry::2,1 - rx::2,2]
+    return raw
+
+def flat(h : int = 8, w : int = 10) -> np.ndarray:
+    rgb = np.empty((h,w,3),dtype=np.float32)
+    rgb[...] = (RED,GREEN,BLUE)
+    return rgb
+
+def test_bayer_pattern():
+    assert bayer_pattern("Monochrome") is None
+    assert bayer_pattern(None) is None
+    assert bayer_pattern("rggb") == "RGGB"
+    assert bayer_pattern("RGGB",1,0) == "GRBG"
+    assert bayer_pattern("RGGB",0,1) == "GBRG"
+    assert bayer_pattern("RGGB",1,1) == "BGGR"
+    assert bayer_pattern("RGGB",3,2) == "GRBG"
+
+@pytest.mark.parametrize("offset",[(0,0),(1,0),(0,1),(1,1)])
+def test_bayer_offset_of_a_subframe(offset):
+    # A frame read from (x , y) of the sensor is debayered with the pattern of the offset
+    rgb = np.random.default_rng(0).uniform(0,1000,(16,16,3)).astype(np.float32)
+    sensor = mosaic("RGGB",rgb)
+    x , y = offset
+    pattern = bayer_pattern("RGGB",x,y)
+    frame = sensor[y:y + 8,x:x + 8]
+    expected = debayer_superpixel(mosaic(pattern,rgb[y:y + 8,x:x + 8]),pattern)
+    np.testing.assert_array_equal(debayer_superpixel(frame,pattern),expected)
+    ry , rx = PATTERNS[pattern]
+    np.testing.assert_array_equal(frame[ry::2,rx::2],rgb[y + ry:y + 8:2,x + rx:x + 8:2,0])
+
+@pytest.mark.parametrize("pattern",sorted(PATTERNS))
+def test_debayer_flat_colour(pattern):
+    raw = mosaic(pattern,flat())
+    superpixel = debayer_superpixel(raw,pattern)
+    assert superpixel.shape == (4,5,3) and superpixel.dtype == np.float32
+    np.testing.assert_array_equal(superpixel,flat(4,5))
+    # Every pixel , the borders too
+    np.testing.assert_array_equal(debayer_bilinear(raw,pattern),flat())
+
+def test_debayer_superpixel_cell():
+    # R , the two greens and B of one RGGB cell
+    raw = np.tile(np.array([[1,2],[4,8]],dtype=np.uint16),(4,4))
+    np.testing.assert_array_equal(debayer_superpixel(raw,"RGGB")[0,0],[1,3,8])
+    np.testing.assert_array_equal(debayer_superpixel(raw,"BGGR")[0,0],[8,3,1])
+    binned = debayer_superpixel(raw,"RGGB",2)
+    assert binned.shape == (2,2,3)
+    np.testing.assert_array_equal(binned[1,1],[1,3,8])
+
+def test_debayer_bilinear_gradient():
+    # A linear ramp is interpolated exactly away from the borders
+    yy , xx = np.mgrid[0:12,0:12].astype(np.float32)
+    rgb = np.stack((10 * xx,5 * yy + xx,20 * yy),axis=2)
+    out = debayer_bilinear(mosaic("GRBG",rgb),"GRBG")
+    np.testing.assert_allclose(out[1:-1,1:-1],rgb[1:-1,1:-1],rtol=0,atol=1e-3)
+
+def test_unknown_pattern():
+    with pytest.raises(ValueError):
+        debayer_superpixel(np.zeros((4,4)),"RGBG")
+
+def test_bin_image():
+    image = np.arange(25,dtype=np.uint16).reshape(5,5)
+    assert bin_image(image,1).dtype == np.float32
+    binned = bin_image(image,2)
+    # The last row and column do not fill a block
+    np.testing.assert_array_equal(binned,[[3,5],[13,15]])
+    rgb = np.stack((image,image * 2,image * 3),axis=2)
+    np.testing.assert_array_equal(bin_image(rgb,2)[...,2],binned * 3)
+
+def test_make_preview_size():
+    raw = mosaic("RGGB",np.random.default_rng(1).uniform(100,200,(400,600,3)).astype(np.float32))
+    preview = make_preview(raw,"RGGB",max_size=150,fmt="png")
+    assert (preview["width"] , preview["height"]) == (150,100)
+    assert preview["data"].startswith(b"\x89PNG")
+    # Bilinear when the preview is more than half of the frame
+    assert make_preview(raw,"RGGB",max_size=600,fmt="png")["width"] == 600
+    mono = make_preview(raw,max_size=200,fmt="png")
+    assert (mono["width"] , mono["height"]) == (200,133)
+
+def test_png_pixels():
+    image = np.arange(12,dtype=np.uint8).reshape(3,4)
+    preview = make_preview(image,max_size=4,fmt="png")
+    data = preview["data"]
+    idat = data[data.index(b"IDAT") + 4:data.index(b"IEND") - 8]
+    rows = np.frombuffer(zlib.decompress(idat),np.uint8).reshape(3,5)
+    assert (rows[:,0] == 0).all()
+    # The stretch keeps the order of the pixels
+    assert (np.diff(rows[:,1:].ravel().astype(int)) >= 0).all()
+
+def test_preview_generator_cache():
+    generator = PreviewGenerator(workers=1,cache_size=2)
+    image = np.random.default_rng(2).uniform(0,1000,(64,64)).astype(np.float32)
+    first = generator.submit(1,image,fmt="png")
+    assert generator.submit(1,image,fmt="png") is first
+    assert first.result(5)["format"] == "png"
+    other = generator.submit(1,image,fmt="png",max_size=32)
+    assert other is not first and other.result(5)["width"] == 32
+    # The oldest preview leaves the cache
+    generator.submit(2,image,fmt="png").result(5)
+    assert generator.submit(1,image,fmt="png") is not first
+    generator.forget(1)
+    assert generator.submit(1,image,fmt="png",max_size=32) is not other
+
+def test_preview_generator_drops_failed_previews():
+    generator = PreviewGenerator(workers=1)
+    release = threading.Event()
+    # The pool is busy , the failing preview is still pending when it is asked again
+    generator._pool.submit(release.wait,5)
+    image = np.zeros((8,8),dtype=np.float32)
+    failed = generator.submit(1,image,pattern="XXXX")
+    assert generator.submit(1,image,pattern="XXXX") is failed
+    release.set()
+    with pytest.raises(ValueError):
+        failed.result(5)
+    # The callback dropping it runs just after the result is set
+    deadline = time.monotonic() + 2
+    again = generator.submit(1,image,pattern="XXXX")
+    while again is failed and time.monotonic() < deadline:
+        time.sleep(0.01)
+        again = generator.submit(1,image,pattern="XXXX")
+    assert again is not failed
+    with pytest.raises(ValueError):
+        again.result(5)
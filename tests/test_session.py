@@ -0,0 +1,126 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+import threading
+import time
+
+import pytest
+
+from utils.session import (ABORTED, DONE, FAILED, SKIPPED, TIMEOUT,
+                            Session, SessionError, Step)
+
+def noop(ctx):
+    return ctx.step.name
+
+def test_topological_order():
+    session = Session("order",[
+        Step("sequence",noop,requires=["solve","cool"]),
+        Step("solve",noop,requires=["slew"]),
+        Step("slew",noop),
+        Step("cool",noop),
+    ])
+    order = session.validate()
+    assert sorted(order) == ["cool","sequence","slew","solve"]
+    for step in session.steps.values():
+        for name in step.requires:
+            assert order.index(name) < order.index(step.name)
+
+def test_cycle_is_rejected():
+    with pytest.raises(SessionError):
+        Session("cycle",[Step("a",noop,requires=["c"]),Step("b",noop,requires=["a"]),
+                            Step("c",noop,requires=["b"]),Step("d",noop)])
+
+def test_unknown_requirement_and_duplicate():
+    with pytest.raises(SessionError):
+        Session("unknown",[Step("a",noop,requires=["missing"])])
+    with pytest.raises(SessionError):
+        Session("duplicate",[Step("a",noop),Step("a",noop)])
+
+def test_requirements_are_respected_and_parallel():
+    finished = {}
+
+    def sleep(ctx):
+        time.sleep(0.2)
+        finished[ctx.step.name] = time.monotonic()
+
+    def after(ctx):
+        # The requirements are done before the step starts
+        assert all(name in finished for name in ctx.step.requires)
+        return ctx.result("slew")
+
+    session = Session("parallel",[Step("slew",lambda ctx: sleep(ctx) or "slewed"),Step("cool",sleep),
+                                    Step("sequence",after,requires=["slew","cool"])])
+    assert session.run() == DONE
+    assert session.steps["sequence"].result == "slewed"
+    trace = session.get_trace()
+    # slew and cool ran at the same time
+    assert trace["total"] < trace["serial"] - 0.1
+
+def test_timeout_skips_the_dependents():
+    def slow(ctx):
+        ctx.wait(5)
+
+    session = Session("timeout",[Step("slow",slow,timeout=0.2),Step("next",noop,requires=["slow"]),
+                                    Step("other",noop)])
+    started = time.monotonic()
+    assert session.run() == FAILED
+    assert time.monotonic() - started < 2
+    assert session.steps["slow"].status == TIMEOUT
+    assert session.steps["next"].status == SKIPPED
+    assert session.steps["other"].status == DONE
+
+def test_stuck_action_does_not_block_the_session():
+    release = threading.Event()
+    session = Session("stuck",[Step("stuck",lambda ctx: release.wait(5),timeout=0.2)])
+    started = time.monotonic()
+    session.run()
+    release.set()
+    assert time.monotonic() - started < 2
+    assert session.steps["stuck"].status == TIMEOUT
+
+def test_failure_skips_the_whole_branch():
+    def fail(ctx):
+        raise RuntimeError("broken")
+
+    session = Session("fail",[Step("a",fail),Step("b",noop,requires=["a"]),Step("c",noop,requires=["b"])])
+    assert session.run() == FAILED
+    assert session.steps["a"].status == FAILED and session.steps["a"].error == "broken"
+    assert session.steps["b"].status == SKIPPED
+    assert session.steps["c"].status == SKIPPED
+
+def test_abort():
+    session = Session("abort",[Step("wait",lambda ctx: ctx.wait(5)),Step("next",noop,requires=["wait"])])
+    session.start()
+    time.sleep(0.1)
+    assert session.is_running and not session.is_finished
+    session.abort()
+    session.join(2)
+    assert session.status == ABORTED
+    assert session.steps["wait"].status == ABORTED
+    # Never started , skipped since its requirement was aborted
+    assert session.steps["next"].status in (ABORTED,SKIPPED)
+    assert session.steps["next"].result is None
+
+def test_abort_before_run():
+    session = Session("early",[Step("a",noop)])
+    assert not session.is_finished
+    session.abort()
+    session.run()
+    assert session.steps["a"].status == ABORTED
@@ -0,0 +1,117 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+import threading
+import time
+
+import pytest
+
+from server.driver.guider.settle import SettleDetector
+
+def test_moving_mean_and_variance():
+    detector = SettleDetector(alpha=0.5)
+    detector.update(1.0)
+    assert detector.mean == 1.0 and detector.variance == 0.0
+    detector.update(3.0)
+    assert detector.mean == pytest.approx(2.0)
+    assert detector.variance == pytest.approx(1.0)
+    detector.update(2.0)
+    assert detector.mean == pytest.approx(2.0)
+    assert detector.variance == pytest.approx(0.5)
+    assert detector.upper_bound() == pytest.approx(2.0 + 0.5 ** 0.5)
+
+def test_settled_after_min_frames():
+    detector = SettleDetector(pixels=1.0,min_frames=3)
+    detector.start(5.0)
+    assert not detector.update(3.0)
+    # The mean and the spread come down with the small errors
+    results , bounds = [] , []
+    for _ in range(20):
+        results.append(detector.update(0.2))
+        bounds.append(detector.upper_bound())
+    in_range = next(i for i , bound in enumerate(bounds) if bound <= 1.0)
+    assert in_range > 0
+    # Settled on the third frame in range , not before
+    assert results == [False] * (in_range + 2) + [True] * (18 - in_range)
+    # A jump is not stable anymore , the count starts again
+    assert not detector.update(2.0)
+    assert detector.in_range_frames == 0
+
+def test_constant_error_under_the_limit():
+    detector = SettleDetector(pixels=1.0,min_frames=3)
+    assert [detector.update(0.5) for _ in range(3)] == [False,False,True]
+    # A missing distance changes nothing
+    assert detector.update(None)
+
+def test_lost_star():
+    detector = SettleDetector(min_frames=1)
+    assert detector.update(0.1)
+    detector.lost()
+    assert not detector.settled and detector.in_range_frames == 0
+
+def settle(detector : SettleDetector, amount : float, seconds : float) -> None:
+    detector.start(amount)
+    detector.update(0.1,detector.dither_time + seconds)
+    assert detector.settled
+
+def test_predict():
+    detector = SettleDetector(pixels=1.0,min_frames=1)
+    assert detector.predict() is None
+    for amount , seconds in ((1.0,2.0),(2.0,4.0),(3.0,6.0)):
+        settle(detector,amount,seconds)
+    assert detector.predict(4.0) == pytest.approx(8.0)
+    assert detector.predict(0.0) == pytest.approx(0.0)
+
+def test_predict_same_amount():
+    detector = SettleDetector(pixels=1.0,min_frames=1,history=2)
+    for seconds in (10.0,3.0,5.0):
+        settle(detector,2.0,seconds)
+    # Only the last two dithers are kept
+    assert detector.predict() == pytest.approx(4.0)
+
+def test_remaining():
+    detector = SettleDetector(pixels=1.0,min_frames=1)
+    assert detector.remaining() is None
+    settle(detector,1.0,100.0)
+    detector.start(1.0)
+    assert 99.0 < detector.remaining() <= 100.0
+    detector.update(0.1)
+    assert detector.remaining() == 0.0
+
+def test_settle_done_is_the_upper_bound():
+    detector = SettleDetector(pixels=1.0,min_frames=5)
+    detector.start(3.0)
+    detector.update(0.5)
+    detector.finish(True)
+    assert detector.settled
+    assert detector.predict() is not None and detector.dither_time is None
+    failed = SettleDetector()
+    failed.start(3.0)
+    failed.finish(False)
+    assert not failed.settled and failed.predict() is None
+
+def test_wait():
+    detector = SettleDetector(pixels=1.0,min_frames=1)
+    detector.start(1.0)
+    started = time.monotonic()
+    assert not detector.wait(0.1)
+    assert time.monotonic() - started >= 0.1
+    threading.Timer(0.05,detector.update,(0.2,)).start()
+    assert detector.wait(2)
@@ -0,0 +1,145 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+"""
+    Benchmark of the Alpaca transport with several devices polled at the same time.
+    A local fake Alpaca server answers every request after a delay , device 0
+    is a slow one. The old behaviour (one lock held for the whole round trip)
+    is simulated with a subclass and compared with the current transport.
+    Usage (from the root of the project):
+        python -m tools.benchmark_alpaca [--devices 4] [--requests 50] [--delay 0.01] [--slow 0.5]
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+from libs.alpyca.device import Device
+
+class FakeAlpacaHandler(BaseHTTPRequestHandler):
+    """Answer every Alpaca request with a Value after the delay of the device"""
+
+    protocol_version = "HTTP/1.1"
+    delays = {}
+    default_delay = 0.01
+    server_transaction = 0
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _reply(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        # /api/v1/<type>/<number>/<attribute>
+        parts = self.path.split("?")[0].strip("/").split("/")
+        number = int(parts[3]) if len(parts) > 3 and parts[3].isdigit() else 0
+        time.sleep(self.delays.get(number,self.default_delay))
+        FakeAlpacaHandler.server_transaction += 1
+        body = json.dumps({
+            "Value" : True,
+            "ClientTransactionID" : 0,
+            "ServerTransactionID" : FakeAlpacaHandler.server_transaction,
+            "ErrorNumber" : 0,
+            "ErrorMessage" : "",
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Length",str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _reply
+    do_PUT = _reply
+
+class LockedDevice(Device):
+    """The transport before the change , one class level lock around every round trip"""
+
+    _global_lock = threading.Lock()
+
+    def _request(self, *args, **kwargs):
+        with LockedDevice._global_lock:
+            return super()._request(*args, **kwargs)
+
+def run(device_class, address : str, devices : int, requests : int) -> dict:
+    """
+        Poll every device from its own thread
+        Returns : dict # wall time , latency of the fast devices and the transport counters
+    """
+    instances = [device_class(address,"camera",n,"http") for n in range(devices)]
+    latencies = {n : [] for n in range(devices)}
+
+    def poll(n : int) -> None:
+        device = instances[n]
+        # The slow device only sends a few requests , enough to block the others
+        count = max(requests // 10,1) if n == 0 else requests
+        for _ in range(count):
+            start = time.perf_counter()
+            device._get("connected")
+            latencies[n].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=poll,args=(n,)) for n in range(devices)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    fast = sorted(t for n in range(1,devices) for t in latencies[n])
+    stats = [device.transport_stats() for device in instances]
+    for device in instances:
+        device.close()
+    return {
+        "wall" : wall,
+        "p50" : fast[len(fast) // 2] if fast else 0.0,
+        "p99" : fast[min(int(len(fast) * 0.99),len(fast) - 1)] if fast else 0.0,
+        "requests" : sum(s["requests"] for s in stats),
+        "connections" : sum(s["connections"] for s in stats),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Alpaca multi-device concurrency benchmark")
+    parser.add_argument("--devices",type=int,default=4,help="number of devices , device 0 is the slow one")
+    parser.add_argument("--requests",type=int,default=50,help="requests per fast device")
+    parser.add_argument("--delay",type=float,default=0.01,help="response delay of the fast devices in seconds")
+    parser.add_argument("--slow",type=float,default=0.5,help="response delay of device 0 in seconds")
+    args = parser.parse_args()
+
+    FakeAlpacaHandler.default_delay = args.delay
+    FakeAlpacaHandler.delays = {0 : args.slow}
+    server = ThreadingHTTPServer(("127.0.0.1",0),FakeAlpacaHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    address = "127.0.0.1:{}".format(server.server_address[1])
+
+    print("{} devices , {} requests per fast device , delay {}s , slow device {}s".format(
+        args.devices,args.requests,args.delay,args.slow))
+    print("{:<12}{:>10}{:>12}{:>12}{:>10}{:>13}".format("transport","wall(s)","p50(ms)","p99(ms)","requests","connections"))
+    for name,device_class in (("global lock",LockedDevice),("per device",Device)):
+        result = run(device_class,address,args.devices,args.requests)
+        print("{:<12}{:>10.3f}{:>12.2f}{:>12.2f}{:>10}{:>13}".format(
+            name,result["wall"],result["p50"] * 1000,result["p99"] * 1000,result["requests"],result["connections"]))
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+"""
+    Benchmark of the autofocus on a simulated focuser and camera.
+    Compare a fixed full sweep measured in the same thread against the
+    early termination with the measures in a worker process.
+    Usage (from the root of the project):
+        python -m tools.benchmark_autofocus [trials]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from utils.autofocus import AutoFocus, shutdown
+
+# Simulated hardware
+EXPOSURE = 1.0
+STEP = 50
+POINTS = 11
+FOCUSER_SPEED = 1000.0
+CRITICAL_FOCUS = 60.0
+
+class SimulatedFocuser(object):
+    """Moves at FOCUSER_SPEED steps per second , like FocuserMotion with one final direction"""
+
+    final_direction = 1
+
+    def __init__(self, position : int) -> None:
+        self.position = position
+        self._target = position
+
+    def sample(self) -> tuple:
+        return False , self.position
+
+    def move_to(self, target : int, then = None) -> None:
+        self._target = int(target)
+
+    def wait(self, timeout : float = None) -> int:
+        time.sleep(abs(self._target - self.position) / FOCUSER_SPEED)
+        self.position = self._target
+        return self.position
+
+class SimulatedCamera(object):
+    """Stars whose size follows a hyperbola around the best focus"""
+
+    def __init__(self, focuser : SimulatedFocuser, best : int, seed : int) -> None:
+        self.focuser = focuser
+        self.best = best
+        self.rng = np.random.default_rng(seed)
+        self.stars = [(self.rng.uniform(30,570),self.rng.uniform(30,770),self.rng.uniform(1500,6000)) for _ in range(40)]
+        self.offsets = np.arange(-25,25)
+
+    def expose(self, seconds : float) -> np.ndarray:
+        started = time.perf_counter()
+        sigma = np.hypot(1.2,(self.focuser.position - self.best) / CRITICAL_FOCUS)
+        image = self.rng.normal(1000,10,(600,800)).astype(np.float32)
+        for y , x , amplitude in self.stars:
+            rows , cols = int(y) + self.offsets , int(x) + self.offsets
+            profile_y = np.exp(-(rows - y) ** 2 / (2 * sigma * sigma))
+            profile_x = np.exp(-(cols - x) ** 2 / (2 * sigma * sigma))
+            image[rows[0]:rows[-1] + 1,cols[0]:cols[-1] + 1] += amplitude * np.outer(profile_y,profile_x)
+        # The rest of the exposure time
+        time.sleep(max(seconds - (time.perf_counter() - started),0))
+        return image
+
+def run(best : int, seed : int, full : bool) -> dict:
+    focuser = SimulatedFocuser(10000)
+    camera = SimulatedCamera(focuser,best,seed)
+    autofocus = AutoFocus(focuser,camera.expose,step=STEP,points=POINTS,exposure=EXPOSURE,radius=15,
+                            # A tolerance of 0 never stops early
+                            tolerance=0 if full else 0.5,workers=0 if full else 1)
+    started = time.perf_counter()
+    result = autofocus.run()
+    result["elapsed"] = time.perf_counter() - started
+    result["error"] = result["position"] - best
+    return result
+
+def main():
+    trials = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    rng = np.random.default_rng(0)
+    bests = [int(x) for x in rng.integers(9850,10150,trials)]
+    for name , full in (("full sweep",True),("early termination",False)):
+        results = [run(best,seed,full) for seed , best in enumerate(bests)]
+        frames = np.mean([r["frames"] for r in results])
+        elapsed = np.mean([r["elapsed"] for r in results])
+        error = np.mean([abs(r["error"]) for r in results])
+        print(f"{name:18} : {frames:.1f} frames , {elapsed:.2f}s per autofocus , mean error {error:.1f} steps")
+    shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+"""
+    Benchmark of the message routing.
+    Compare the switch() case chain used before against the dispatch table ,
+    for the first , a middle and the last of the PHD2 events.
+    The old websocket server also created an event loop with asyncio.run() for every message.
+    Usage (from the root of the project):
+        python -m tools.benchmark_dispatch
+"""
+
+import asyncio
+import timeit
+
+from utils.dispatch import Dispatcher, handler
+from utils.utility import switch
+
+EVENTS = ["Version","LockPositionSet","Calibrating","CalibrationComplete","StarSelected","StartGuiding",
+          "Paused","StartCalibration","AppState","CalibrationFailed","CalibrationDataFlipped",
+          "LockPositionShiftLimitReached","LoopingExposures","LoopingExposuresStopped","SettleBegin",
+          "Settling","SettleDone","StarLost","GuidingStopped","Resumed","GuideStep","GuidingDithered",
+          "LockPositionLost","Alert","GuideParamChange","ConfigurationChange"]
+
+class Handlers(object):
+    """One handler per event , they only count the calls"""
+    calls = 0
+
+def _make_handler(event : str):
+    @handler(event)
+    def func(self, message : dict) -> None:
+        self.calls += 1
+    return func
+
+for _event in EVENTS:
+    setattr(Handlers,"_" + _event.lower(),_make_handler(_event))
+
+def switch_dispatch(obj : Handlers, event : str, message : dict) -> None:
+    """The case chain , written out like the old parser_json"""
+    for case in switch(event):
+        for name in EVENTS:
+            if case(name):
+                getattr(obj,"_" + name.lower())(message)
+                break
+        break
+
+def main():
+    obj = Handlers()
+    dispatcher = Dispatcher("benchmark")
+    dispatcher.bind(obj)
+    number = 20000
+    print(f"{'event':32} {'switch':>10} {'table':>10} {'speedup':>8}  (us/message)")
+    for event in (EVENTS[0],EVENTS[len(EVENTS) // 2],EVENTS[-1]):
+        message = {"Event" : event}
+        old = timeit.timeit(lambda: switch_dispatch(obj,event,message),number=number) / number * 1e6
+        new = timeit.timeit(lambda: dispatcher.dispatch((event,),message),number=number) / number * 1e6
+        print(f"{event:32} {old:>10.2f} {new:>10.2f} {old / new:>7.1f}x")
+
+    async def parse(event : str) -> None:
+        switch_dispatch(obj,event,{})
+    old = timeit.timeit(lambda: asyncio.run(parse(EVENTS[-1])),number=2000) / 2000 * 1e6
+    new = timeit.timeit(lambda: dispatcher.dispatch((EVENTS[-1],),{}),number=number) / number * 1e6
+    print(f"{'asyncio.run + switch vs table':32} {old:>10.2f} {new:>10.2f} {old / new:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
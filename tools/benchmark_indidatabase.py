@@ -0,0 +1,83 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+"""
+    Benchmark of the INDI profile database under several concurrent web clients.
+    Compare committing every write against the group commit.
+    Usage (from the root of the project):
+        python -m tools.benchmark_indidatabase [clients] [operations per client]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+
+from server.indi.indidatabase import Database
+
+DRIVERS = [{"label": "Driver %d" % i} for i in range(20)] + [{"remote": "Remote@localhost"}]
+
+def client(db : Database, index : int, count : int) -> None:
+    """
+        Simulate a web client , mostly reading the profiles and sometimes saving one
+        Args:
+            db : Database
+            index : int # index of the client , each client edits its own profile
+            count : int # number of the operations
+    """
+    name = "Profile %d" % index
+    db.add_profile(name)
+    for i in range(count):
+        if i % 10 == 0:
+            db.save_profile_drivers(name, DRIVERS)
+        elif i % 10 == 1:
+            db.update_profile(name, 7624 + i % 100, False, bool(i % 2))
+        else:
+            db.get_profiles()
+            db.get_profile(name)
+            db.get_profile_drivers_labels(name)
+
+def run(commit_delay : float, clients : int, count : int) -> float:
+    """
+        Run the clients against a new database
+        Returns : float # operations per second
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "profiles.db"), commit_delay)
+        threads = [threading.Thread(target=client, args=(db, i, count)) for i in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        db.flush()
+        used_time = time.perf_counter() - start
+        db.close()
+    return clients * count / used_time
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    for name, delay in (("commit every write", 0), ("group commit 50ms", 0.05)):
+        print(f"{name:20} : {run(delay, clients, count):.0f} ops/s ({clients} clients x {count} ops)")
+
+if __name__ == "__main__":
+    main()
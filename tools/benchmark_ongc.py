@@ -0,0 +1,70 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+"""
+    Benchmark of the materialization of the whole NGC/IC catalog.
+    Compare building every Dso with its own query against the batch constructor.
+    Usage (from the root of the project , data/database/stardata.db is needed):
+        python -m tools.benchmark_ongc
+"""
+
+import gc
+import time
+import tracemalloc
+
+from libs.pyongc.ongc import Dso, _queryFetchMany, listObjects
+
+def measure(func) -> tuple:
+    """
+        Run the function and measure the time and the memory used by its result
+        Args:
+            func : callable # must return the list of the objects
+        Returns : (seconds , bytes , number of objects)
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    objects = func()
+    used_time = time.perf_counter() - start
+    used_memory , _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return used_time , used_memory , len(objects)
+
+def one_query_per_object() -> list:
+    """
+        The old way : select all of the names and then query each object
+    """
+    return [Dso(str(item[0]), True) for item in _queryFetchMany("objects.name", "objects", "1")]
+
+def batch() -> list:
+    """
+        The new way : build all of the objects from a single query result
+    """
+    return listObjects()
+
+def main():
+    for name , func in (("one query per object",one_query_per_object),("batch",batch)):
+        used_time , used_memory , count = measure(func)
+        print(f"{name:22} : {count} objects in {used_time:.3f}s "
+                f"({count / used_time:.0f} objects/s) , {used_memory / 1024 / 1024:.2f} MiB "
+                f"({used_memory / max(count,1):.0f} bytes/object)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+"""
+    Benchmark of the websocket client framing.
+    Compare the old array.array masking and header concatenation against the
+    current masking and the scatter-gather send.
+    Usage (from the root of the project):
+        python -m tools.benchmark_wsclient
+"""
+
+import array
+import os
+import socket
+import sys
+import threading
+import time
+
+from libs.wsclient._abnf import ABNF
+from libs.wsclient._socket import sendmsg
+
+SIZES = (16, 128, 1024, 64 * 1024, 4 * 1024 * 1024)
+
+def old_mask(mask_key : bytes, data : bytes) -> bytes:
+    """The previous implementation of ABNF.mask"""
+    mask_value = array.array("B", mask_key)
+    data_value = array.array("B", data)
+    datalen = len(data_value)
+    data_value = int.from_bytes(data_value, sys.byteorder)
+    mask_value = int.from_bytes(mask_value * (datalen // 4) + mask_value[: datalen % 4], sys.byteorder)
+    return (data_value ^ mask_value).to_bytes(datalen, sys.byteorder)
+
+def old_format(frame : ABNF) -> bytes:
+    """The previous ABNF.format , header and masked payload concatenated"""
+    header, _payload = frame.format_parts()
+    return header + old_mask(header[-4:], frame.data)
+
+def rate(func, size : int) -> float:
+    """
+        Call the function repeatedly for about 0.3 seconds
+        Returns : float # MiB/s
+    """
+    count = 0
+    start = time.perf_counter()
+    while True:
+        func()
+        count += 1
+        used_time = time.perf_counter() - start
+        if used_time > 0.3:
+            return count * size / used_time / 1024 / 1024
+
+def drain(sock : socket.socket) -> None:
+    while sock.recv(1024 * 1024):
+        pass
+
+def main():
+    mask_key = os.urandom(4)
+    sender, receiver = socket.socketpair()
+    threading.Thread(target=drain, args=(receiver,), daemon=True).start()
+
+    print(f"{'size':>10} {'old mask':>12} {'new mask':>12} {'old send':>12} {'new send':>12}  (MiB/s)")
+    for size in SIZES:
+        data = os.urandom(size)
+        frame = ABNF.create_frame(data, ABNF.OPCODE_BINARY)
+        frame.get_mask_key = lambda n: mask_key
+        results = (
+            rate(lambda: old_mask(mask_key, data), size),
+            rate(lambda: ABNF.mask(mask_key, data), size),
+            rate(lambda: sender.sendall(old_format(frame)), size),
+            rate(lambda: sendmsg(sender, frame.format_parts()), size),
+        )
+        print(f"{size:>10} " + " ".join(f"{value:>12.1f}" for value in results))
+    sender.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+"""
+    Hash and pre-compress the static files of the web client (gzip , and brotli if installed).
+    Run it after the files in client/static are changed.
+    Usage (from the root of the project):
+        python -m tools.build_static [static folder]
+"""
+
+import os
+import sys
+import time
+
+from server.web.webstatic import build_static
+
+def main():
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.getcwd(),"client","static")
+    start = time.perf_counter()
+    manifest = build_static(folder)
+    compressed = sum(1 for entry in manifest.values() if entry.get("gzip") or entry.get("br"))
+    print(f"{len(manifest)} files hashed , {compressed} compressed in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
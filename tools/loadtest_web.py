@@ -0,0 +1,118 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+"""
+    Load test of the web client , measure the requests per second of the dashboard pages
+    and of the static files they reference.
+    The server must be running , the pages which need a login are fetched after logging in.
+    Usage (from the root of the project):
+        python -m tools.loadtest_web [--url http://127.0.0.1:8000] [--clients 8] [--duration 10]
+"""
+
+import argparse
+import re
+import threading
+import time
+
+import requests
+
+PAGES = ["/", "/desktop", "/camera", "/telescope", "/focuser", "/indiweb"]
+STATIC = re.compile(r"""["'](/static/[^"']+)["']""")
+
+def login(session : requests.Session, url : str, username : str, password : str) -> None:
+    """Log in with the form , the csrf token is taken from the login page"""
+    page = session.get(url + "/login").text
+    token = re.search(r'name="csrf_token"[^>]*value="([^"]+)"', page)
+    data = {"username": username, "password": password}
+    if token:
+        data["csrf_token"] = token.group(1)
+    session.post(url + "/login", data=data)
+
+def worker(url : str, paths : list, deadline : float, args, stats : dict, lock : threading.Lock) -> None:
+    session = requests.Session()
+    session.headers["Accept-Encoding"] = "br, gzip"
+    login(session, url, args.username, args.password)
+    count = errors = received = 0
+    latencies = []
+    index = 0
+    while time.perf_counter() < deadline:
+        path = paths[index % len(paths)]
+        index += 1
+        start = time.perf_counter()
+        try:
+            response = session.get(url + path, stream=True)
+            # Count the bytes on the wire , not the decompressed size
+            received += sum(len(chunk) for chunk in response.raw.stream(64 * 1024, decode_content=False))
+            if response.status_code >= 400:
+                errors += 1
+        except requests.RequestException:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+        count += 1
+    with lock:
+        stats["count"] += count
+        stats["errors"] += errors
+        stats["bytes"] += received
+        stats["latencies"] += latencies
+
+def run(url : str, paths : list, args) -> dict:
+    stats = {"count": 0, "errors": 0, "bytes": 0, "latencies": []}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=worker, args=(url, paths, deadline, args, stats, lock))
+               for _ in range(args.clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats["time"] = time.perf_counter() - start
+    return stats
+
+def report(name : str, stats : dict) -> None:
+    latencies = sorted(stats["latencies"]) or [0]
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    print(f"{name:8} : {stats['count'] / stats['time']:8.1f} req/s , p50 {p50:.1f} ms , p95 {p95:.1f} ms , "
+          f"{stats['bytes'] / stats['time'] / 1024 / 1024:.2f} MiB/s , {stats['errors']} errors")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin")
+    args = parser.parse_args()
+    url = args.url.rstrip("/")
+
+    session = requests.Session()
+    login(session, url, args.username, args.password)
+    static = set()
+    for page in PAGES:
+        static.update(STATIC.findall(session.get(url + page).text))
+    print(f"{args.clients} clients , {args.duration}s each , {len(PAGES)} pages , {len(static)} static files")
+
+    report("pages", run(url, PAGES, args))
+    if static:
+        report("static", run(url, sorted(static), args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# V-curve autofocus.
+# The focuser steps through the positions in its final direction , the
+# HFD of every frame is measured in a worker process while the next
+# frame is exposing. After every measure the curve is fitted again :
+#     hyperbola : hfd^2 = a^2 + (a/b)^2 * (x - c)^2
+#     parabola : hfd = A * x^2 + B * x + C
+# both are linear least squares , so a new point costs a 3x3 solve. The sweep stops as soon as the minimum is bracketed by
+# rising points on both sides and its uncertainty is small enough ,
+# instead of always taking every frame of a fixed sweep.
+# #################################################################
+
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from math import sqrt
+import threading
+from time import monotonic
+
+import numpy as np
+
+from utils.image import calc_stars_hfd
+from utils.i18n import _
+from utils.lightlog import lightlog
+log = lightlog(__name__)
+
+MODELS = ("hyperbola","parabola")
+
+# Points needed before the sweep may stop
+MIN_POINTS = 5
+# The outer points must be this much above the minimum to bracket it
+MIN_RISE = 0.25
+# Uncertainty of the best position which is good enough , in steps
+TOLERANCE = 0.5
+# Points added past the end of the sweep when the minimum is outside of it
+MAX_EXTEND = 3
+# Points this much above the lowest HFD are left out of the fit
+MAX_RATIO = 3.0
+
+class AutoFocusError(Exception):
+    """The autofocus could not find the best position"""
+
+class AutoFocusAborted(AutoFocusError):
+    """The autofocus was aborted"""
+
+# #################################################################
+# Curve fitting
+# #################################################################
+
+class FocusCurve(object):
+    """
+        Points of a V-curve , fitted after every new point
+    """
+
+    def __init__(self, reference : float = 0.0, scale : float = 1.0, max_ratio : float = MAX_RATIO) -> None:
+        """
+            Args :
+                reference : float # position mapped to 0 , keeps the normal equations well conditioned
+                scale : float # positions are divided by it , usually the step
+                max_ratio : float # points above max_ratio * lowest HFD are not fitted
+        """
+        self.reference = reference
+        self.scale = scale or 1.0
+        self.max_ratio = max_ratio
+        self.points = []
+
+    def add(self, position : float, hfd : float, weight : float = 1.0) -> None:
+        """
+            Add a measured point
+            Args :
+                position : float # focuser position
+                hfd : float
+                weight : float # e.g. the number of stars
+            Returns : None
+        """
+        self.points.append((position,hfd,weight))
+
+    def _solve(self, model : str, u : np.ndarray, hfd : np.ndarray, w : np.ndarray) -> dict:
+        """
+            Weighted least squares of one model
+            Returns : dict or None if the points have no minimum
+        """
+        y = hfd * hfd if model == "hyperbola" else hfd
+        # Unknowns are A , B , C of A * u^2 + B * u + C
+        design = np.stack((u * u,u,np.ones_like(u)),axis=1)
+        normal = design.T @ (w[:,None] * design)
+        try:
+            inverse = np.linalg.inv(normal)
+        except np.linalg.LinAlgError:
+            return None
+        a , b , c = coefficients = inverse @ (design.T @ (w * y))
+        if a <= 0:
+            return None
+        vertex = -b / (2 * a)
+        bottom = c - b * b / (4 * a)
+        if model == "hyperbola":
+            if bottom <= 0:
+                return None
+            bottom = sqrt(bottom)
+        # Uncertainty of the vertex from the covariance of the coefficients
+        variance = 0.0
+        if len(u) > 3:
+            variance = float(w @ (y - design @ coefficients) ** 2) / (len(u) - 3) / (w.mean() or 1.0)
+        gradient = np.array([b / (2 * a * a),-1 / (2 * a),0.0])
+        sigma = sqrt(max(gradient @ (variance * inverse * w.mean()) @ gradient,0.0))
+        return {
+            "model" : model,
+            "position" : float(self.reference + vertex * self.scale),
+            "hfd" : float(bottom),
+            "sigma" : float(sigma * self.scale),
+            "coefficients" : [float(x) for x in coefficients],
+        }
+
+    def predict(self, fit : dict, position : float) -> float:
+        """HFD of a fitted model at a position"""
+        a , b , c = fit["coefficients"]
+        u = (position - self.reference) / self.scale
+        y = a * u * u + b * u + c
+        if fit["model"] == "hyperbola":
+            return sqrt(max(y,0.0))
+        return y
+
+    def fit(self) -> dict:
+        """
+            Fit all of the models and keep the one closest to the points
+            Returns : dict or None
+                model : str
+                position : float # best focus
+                hfd : float # HFD at the best focus
+                sigma : float # uncertainty of the best focus , in positions
+                rms : float # residual of the HFD
+                used : int # points fitted
+        """
+        if len(self.points) < 3:
+            return None
+        data = np.array(self.points,dtype=np.float64)
+        # Far from focus the stars are larger than the measuring box and the curve flattens
+        data = data[data[:,1] <= self.max_ratio * data[:,1].min()]
+        if len(data) < 3:
+            return None
+        u = (data[:,0] - self.reference) / self.scale
+        best = None
+        for model in MODELS:
+            fit = self._solve(model,u,data[:,1],data[:,2])
+            if fit is None:
+                continue
+            predicted = np.array([self.predict(fit,p) for p in data[:,0]])
+            fit["rms"] = float(sqrt(data[:,2] @ (data[:,1] - predicted) ** 2 / data[:,2].sum()))
+            fit["used"] = int(len(data))
+            if best is None or fit["rms"] < best["rms"]:
+                best = fit
+        return best
+
+    def sides(self, fit : dict, min_rise : float = MIN_RISE) -> tuple:
+        """
+            Whether each side of the minimum has enough rising points
+            Args :
+                fit : dict # result of fit
+                min_rise : float # the outermost point of a side must be above (1 + min_rise) * minimum
+            Returns : (bool , bool) # below and above the minimum
+        """
+        if fit is None:
+            return False , False
+        limit = (1 + min_rise) * fit["hfd"]
+        result = []
+        for side in (-1,1):
+            points = sorted((p,h) for p , h , _w in self.points if side * (p - fit["position"]) > 0)
+            outer = points[0 if side < 0 else -1][1] if points else None
+            result.append(len(points) >= 2 and outer >= limit)
+        return tuple(result)
+
+    def is_bracketed(self, fit : dict, min_points : int = MIN_POINTS, min_rise : float = MIN_RISE) -> bool:
+        """
+            Whether the minimum is surrounded by enough rising points
+            Args :
+                fit : dict # result of fit
+                min_points : int
+                min_rise : float # see sides
+            Returns : bool
+        """
+        if fit is None or len(self.points) < min_points:
+            return False
+        return all(self.sides(fit,min_rise))
+
+    def get_dict(self) -> dict:
+        return {
+            "points" : [{"position" : p, "hfd" : round(h,3), "weight" : w} for p , h , w in self.points],
+            "fit" : self.fit()
+        }
+
+# #################################################################
+# HFD measure in the worker processes
+# #################################################################
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool(workers : int = 1):
+    """
+        Get the shared process pool of the measures , created on the first use
+        Args :
+            workers : int # number of processes
+        Returns : ProcessPoolExecutor
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        return _pool
+
+def shutdown() -> None:
+    """Stop the worker processes , for example when the server stops"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+
+def measure(image : np.ndarray, max_stars : int, radius : int) -> dict:
+    """Run in a worker process , see utils.image.calc_stars_hfd"""
+    return calc_stars_hfd(image,max_stars,radius)
+
+# #################################################################
+# Autofocus engine
+# #################################################################
+
+class AutoFocus(object):
+    """
+        Run one autofocus with a focuser motion engine and a camera
+    """
+
+    def __init__(self, motion, expose, step : int = 100, points : int = 9, exposure : float = 2.0,
+                    tolerance : float = TOLERANCE, min_points : int = MIN_POINTS, min_rise : float = MIN_RISE,
+                    max_extend : int = MAX_EXTEND, max_stars : int = 50, radius : int = 12,
+                    workers : int = 1, check = None, on_point = None) -> None:
+        """
+            Args :
+                motion : server.driver.focuser.motion.FocuserMotion
+                expose : callable # called with the exposure time , blocks and returns the image as np.ndarray
+                step : int # focuser steps between two points
+                points : int # points of the full sweep , centered on the current position
+                exposure : float # seconds
+                tolerance : float # uncertainty of the best position allowed to stop early , in steps
+                min_points : int # points needed before stopping early
+                min_rise : float # how much the outer points must be above the minimum
+                max_extend : int # points added when the minimum is past the end of the sweep
+                max_stars : int # stars measured per frame
+                radius : int # half size of the box of a star , pixels
+                workers : int # measuring processes , 0 to measure in this thread
+                check : callable # called often , raises to stop the autofocus , e.g. StepContext.check
+                on_point : callable # called with the curve dict after every measure
+        """
+        self.motion = motion
+        self.expose = expose
+        self.step = max(int(step),1)
+        self.points = max(int(points),3)
+        self.exposure = exposure
+        self.tolerance = tolerance
+        self.min_points = min_points
+        self.min_rise = min_rise
+        self.max_extend = max_extend
+        self.max_stars = max_stars
+        self.radius = radius
+        self.workers = workers
+        self.check = check
+        self.on_point = on_point
+
+        self.curve = None
+        self.frames = 0
+        self._aborted = threading.Event()
+
+    def abort(self) -> None:
+        """Stop after the current frame , the focuser goes back to where it started"""
+        self._aborted.set()
+
+    def _check(self) -> None:
+        if self._aborted.is_set():
+            raise AutoFocusAborted(_("Autofocus is aborted"))
+        if self.check is not None:
+            self.check()
+
+    def _submit(self, image : np.ndarray) -> Future:
+        if self.workers <= 0:
+            future = Future()
+            future.set_result(measure(image,self.max_stars,self.radius))
+            return future
+        return get_pool(self.workers).submit(measure,image,self.max_stars,self.radius)
+
+    def _collect(self, pending : dict, block : bool) -> dict:
+        """
+            Add the finished measures to the curve
+            Args :
+                pending : dict # future -> position
+                block : bool # wait for at least one measure
+            Returns : dict # the new fit , None if nothing changed
+        """
+        if not pending:
+            return None
+        done , _running = wait(list(pending),timeout=None if block else 0,return_when=FIRST_COMPLETED)
+        if not done:
+            return None
+        for future in done:
+            position = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                log.loge(_("Failed to measure the frame at {} : {}").format(position,str(e)))
+                continue
+            if result["hfd"] is None:
+                log.logw(_("No star found at {}").format(position))
+                continue
+            log.logd(_("Autofocus {} : HFD {:.2f} with {} stars").format(position,result["hfd"],result["stars"]))
+            self.curve.add(position,result["hfd"],max(result["stars"],1))
+        fit = self.curve.fit()
+        if self.on_point is not None:
+            try:
+                self.on_point(self.curve.get_dict())
+            except Exception as e:
+                log.loge(_("Autofocus subscriber failed : {}").format(str(e)))
+        return fit
+
+    def _done(self, fit : dict) -> bool:
+        return fit is not None and fit["sigma"] <= self.tolerance * self.step \
+                and self.curve.is_bracketed(fit,self.min_points,self.min_rise)
+
+    def _move(self, position : int) -> int:
+        self.motion.move_to(position)
+        return self.motion.wait()
+
+    def run(self, center : int = None) -> dict:
+        """
+            Run the autofocus , blocks until the focuser is at the best position
+            Args :
+                center : int # center of the sweep , None for the current position
+            Returns : dict
+                position : int # best focus , where the focuser is now
+                hfd : float # fitted HFD at the best focus
+                model : str # hyperbola or parabola
+                sigma : float # uncertainty of the position
+                frames : int # frames taken
+                early : bool # stopped before the end of the sweep
+                elapsed : float # seconds
+                curve : dict
+            Raises : AutoFocusError , the focuser is moved back to where it started
+        """
+        started = monotonic()
+        self.motion.sample()
+        start = self.motion.position
+        if center is None:
+            center = start if start is not None else 0
+        direction = self.motion.final_direction
+        half = (self.points - 1) / 2
+        # Every move after the first one goes in the final direction , no backlash to take up
+        queue = [int(round(center + direction * (i - half) * self.step)) for i in range(self.points)]
+        self.curve = FocusCurve(center,self.step)
+        self.frames = 0
+        pending = {}
+        fit = None
+        early = False
+        extended = 0
+        try:
+            while queue:
+                self._check()
+                position = queue.pop(0)
+                self._move(position)
+                # The last frame was measured while the focuser moved , it may be enough
+                fit = self._collect(pending,False) or fit
+                if self._done(fit):
+                    early = True
+                    break
+                self._check()
+                image = self.expose(self.exposure)
+                self.frames += 1
+                pending[self._submit(image)] = position
+                if not queue:
+                    while pending:
+                        fit = self._collect(pending,True) or fit
+                    if self._done(fit):
+                        break
+                    # The minimum is too close to the end or past it , go on in the same direction
+                    lowest = min(self.curve.points,key=lambda point: point[1])[0] if self.curve.points else None
+                    if extended < self.max_extend and (lowest == position if fit is None
+                            else not self.curve.sides(fit,self.min_rise)[0 if direction < 0 else 1]):
+                        queue.append(position + direction * self.step)
+                        extended += 1
+            while pending:
+                fit = self._collect(pending,True) or fit
+            if fit is None or not self.curve.is_bracketed(fit,3,0.0):
+                raise AutoFocusError(_("The minimum of the V-curve was not found"))
+            best = int(round(fit["position"]))
+            self._move(best)
+        except Exception:
+            if start is not None:
+                try:
+                    self._move(start)
+                except Exception as e:
+                    log.loge(_("Failed to move the focuser back to {} : {}").format(start,str(e)))
+            raise
+        elapsed = monotonic() - started
+        log.log(_("Autofocus found {} with HFD {:.2f} in {} frames , {:.1f}s").format(best,fit["hfd"],self.frames,elapsed))
+        return {
+            "position" : best,
+            "hfd" : round(fit["hfd"],3),
+            "model" : fit["model"],
+            "sigma" : round(fit["sigma"],1),
+            "frames" : self.frames,
+            "early" : early,
+            "elapsed" : round(elapsed,3),
+            "curve" : self.curve.get_dict()
+        }
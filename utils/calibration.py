@@ -0,0 +1,427 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# Calibration frame library.
+# The dark , flat and offset (bias) frames of the sequences are saved as
+# .npy files and indexed by camera , gain , offset , binning , temperature
+# and exposure. A master is the sigma clipped median of the matching frames ,
+# computed a block of rows at a time on memory mapped inputs , so the memory
+# used does not depend on the number of frames. The masters in use are kept
+# in memory as float32 , with the inverse of the flat , so calibrating a
+# preview is one subtraction and one multiplication.
+# #################################################################
+
+from collections import OrderedDict
+import json
+import os
+import threading
+from time import time
+from uuid import uuid4
+
+import numpy as np
+
+from utils.i18n import _
+from utils.lightlog import lightlog
+log = lightlog(__name__)
+
+CALIBRATION_PATH = os.path.join("data","calibration")
+
+KINDS = ("dark","flat","offset")
+# Frames are matched on these exactly , temperature and exposure are matched with a tolerance
+KEYS = ("camera","gain","offset","binning")
+
+# Degrees between the temperature of the frames and of the image
+TEMPERATURE_TOLERANCE = 2.0
+# Memory used by the stack of one block of rows while building a master
+BLOCK_MEMORY = 64 * 1024 * 1024
+# Masters kept in memory
+CACHE_SIZE = 8
+
+class CalibrationError(Exception):
+    """No frames or masters match"""
+
+# #################################################################
+# Stacking
+# #################################################################
+
+def sigma_clipped_median(frames : list, sigma : float = 3.0, scales : list = None, bias : np.ndarray = None,
+                            block_memory : int = BLOCK_MEMORY, out : np.ndarray = None) -> np.ndarray:
+    """
+        Median of the frames after rejecting the pixels more than sigma away from the median
+        Args :
+            frames : list # arrays of the same shape , np.memmap are read one block at a time
+            sigma : float # rejection threshold in units of the robust standard deviation
+            scales : list # every frame is multiplied by its scale first , e.g. to normalize the flats
+            bias : np.ndarray # subtracted from every frame before the scale
+            block_memory : int # bytes of the stack of one block of rows , the rejection needs about twice more
+            out : np.ndarray # result , float32 array of the shape of the frames
+        Returns : np.ndarray # float32
+    """
+    if not frames:
+        raise CalibrationError(_("No frames to stack"))
+    shape = frames[0].shape
+    for frame in frames:
+        if frame.shape != shape:
+            raise CalibrationError(_("Frames have different shapes {} and {}").format(shape,frame.shape))
+    if out is None:
+        out = np.empty(shape,dtype=np.float32)
+    row_bytes = 4 * len(frames) * int(np.prod(shape[1:],dtype=np.int64))
+    rows = max(int(block_memory // max(row_bytes,1)),1)
+    stack = np.empty((len(frames),min(rows,shape[0])) + tuple(shape[1:]),dtype=np.float32)
+    for start in range(0,shape[0],rows):
+        stop = min(start + rows,shape[0])
+        block = stack[:,:stop - start]
+        for i , frame in enumerate(frames):
+            block[i] = frame[start:stop]
+            if bias is not None:
+                block[i] -= bias[start:stop]
+            if scales is not None:
+                block[i] *= scales[i]
+        if len(frames) < 3:
+            np.mean(block,axis=0,out=out[start:stop])
+            continue
+        median = np.median(block,axis=0)
+        distance = np.abs(block - median)
+        deviation = 1.4826 * np.median(distance,axis=0)
+        rejected = distance > sigma * deviation
+        # Identical pixels have no deviation , nothing to reject there
+        rejected &= deviation > 0
+        out[start:stop] = median
+        # The median again , only on the few pixels which had a frame rejected
+        pixels = rejected.any(axis=0)
+        if pixels.any():
+            values = block[:,pixels]
+            values[rejected[:,pixels]] = np.nan
+            out[start:stop][pixels] = np.nanmedian(values,axis=0)
+    return out
+
+# #################################################################
+# Library
+# #################################################################
+
+class CalibrationLibrary(object):
+    """
+        Index of the calibration frames and cache of the masters
+    """
+
+    def __init__(self, path : str = CALIBRATION_PATH, cache_size : int = CACHE_SIZE) -> None:
+        """
+            Args :
+                path : str # folder of the frames , the masters and the index
+                cache_size : int # masters kept in memory
+        """
+        self.path = path
+        self.cache_size = cache_size
+        self._index = None
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()
+
+    # #################################################################
+    # Index
+    # #################################################################
+
+    def _load(self) -> dict:
+        if self._index is None:
+            try:
+                with open(os.path.join(self.path,"index.json"),encoding="utf-8") as f:
+                    self._index = json.load(f)
+            except FileNotFoundError:
+                self._index = {"frames" : [], "masters" : []}
+            except (OSError,ValueError) as e:
+                log.loge(_("Failed to load the calibration index : {}").format(str(e)))
+                self._index = {"frames" : [], "masters" : []}
+        return self._index
+
+    def _save(self) -> None:
+        os.makedirs(self.path,exist_ok=True)
+        path = os.path.join(self.path,"index.json")
+        # Replace the index at once , a crash never leaves half of it
+        with open(path + ".tmp","w",encoding="utf-8") as f:
+            json.dump(self._index,f,indent=1)
+        os.replace(path + ".tmp",path)
+
+    @staticmethod
+    def make_info(kind : str, camera : str = None, gain : int = None, offset : int = None, binning : int = None,
+                    temperature : float = None, exposure : float = None) -> dict:
+        """
+            Description of a frame or of an image to calibrate
+            Returns : dict
+        """
+        if kind not in KINDS + ("light",):
+            raise CalibrationError(_("Unknown frame type {}").format(kind))
+        if isinstance(binning,(list,tuple)):
+            binning = binning[0] if binning else None
+        return {
+            "kind" : kind,
+            "camera" : camera,
+            "gain" : gain,
+            "offset" : offset,
+            "binning" : binning or 1,
+            "temperature" : None if temperature is None or temperature <= -256 else round(float(temperature),1),
+            "exposure" : None if exposure is None else float(exposure),
+        }
+
+    def add_frame(self, image : np.ndarray, info : dict) -> dict:
+        """
+            Save a calibration frame and index it
+            Args :
+                image : np.ndarray
+                info : dict # see make_info
+            Returns : dict # the index entry
+        """
+        if info.get("kind") not in KINDS:
+            raise CalibrationError(_("Unknown frame type {}").format(info.get("kind")))
+        folder = os.path.join(self.path,"frames",info["kind"])
+        os.makedirs(folder,exist_ok=True)
+        name = uuid4().hex + ".npy"
+        np.save(os.path.join(folder,name),np.asarray(image))
+        entry = dict(info)
+        entry["file"] = os.path.join("frames",info["kind"],name)
+        entry["time"] = time()
+        with self._lock:
+            self._load()["frames"].append(entry)
+            self._save()
+        log.logd(_("Added a {} frame to the calibration library").format(info["kind"]))
+        return entry
+
+    def _matches(self, entry : dict, info : dict, kind : str, tolerance : float, exposure : bool) -> bool:
+        if entry["kind"] != kind:
+            return False
+        for key in KEYS:
+            if info.get(key) is not None and entry.get(key) != info.get(key):
+                return False
+        if tolerance is not None and info.get("temperature") is not None and entry.get("temperature") is not None \
+                and abs(entry["temperature"] - info["temperature"]) > tolerance:
+            return False
+        if exposure and info.get("exposure") is not None and entry.get("exposure") != info.get("exposure"):
+            return False
+        return True
+
+    def find_frames(self, kind : str, info : dict, tolerance : float = TEMPERATURE_TOLERANCE) -> list:
+        """
+            Get the frames matching an image
+            Args :
+                kind : str # dark , flat or offset
+                info : dict # see make_info , None values match everything
+                tolerance : float # degrees , None to ignore the temperature
+            Returns : list of index entries
+        """
+        # Only the darks depend on the exposure , flats are normalized and offsets have none
+        exposure = kind == "dark"
+        with self._lock:
+            return [entry for entry in self._load()["frames"] if self._matches(entry,info,kind,tolerance,exposure)]
+
+    def list(self) -> dict:
+        """
+            Get the whole index
+            Returns : dict # frames and masters
+        """
+        with self._lock:
+            index = self._load()
+            return {"frames" : list(index["frames"]), "masters" : list(index["masters"])}
+
+    # #################################################################
+    # Masters
+    # #################################################################
+
+    def _open(self, entry : dict) -> np.ndarray:
+        # Memory mapped , only the rows of the current block are read
+        return np.load(os.path.join(self.path,entry["file"]),mmap_mode="r")
+
+    def build_master(self, kind : str, info : dict, sigma : float = 3.0,
+                        tolerance : float = TEMPERATURE_TOLERANCE, block_memory : int = BLOCK_MEMORY) -> dict:
+        """
+            Stack the matching frames into a master and index it
+            Args :
+                kind : str # dark , flat or offset
+                info : dict # see make_info
+                sigma : float # rejection threshold
+                tolerance : float # degrees
+                block_memory : int # bytes of the stack of one block of rows
+            Returns : dict # the index entry of the master
+            NOTE : Flats are corrected with the offset master if there is one and normalized to a mean of 1
+        """
+        entries = self.find_frames(kind,info,tolerance)
+        if not entries:
+            raise CalibrationError(_("No {} frames match").format(kind))
+        # A None setting matches everything , but frames of different settings must not be stacked together ,
+        # e.g. the darks of every exposure when the exposure is not given
+        keys = KEYS + ("exposure",) if kind == "dark" else KEYS
+        for key in keys:
+            values = {entry.get(key) for entry in entries}
+            if len(values) > 1:
+                raise CalibrationError(_("{} frames of different {} match : {} , please specify it").format(
+                                            kind,key,", ".join(str(value) for value in sorted(values,key=str))))
+        frames = [self._open(entry) for entry in entries]
+        scales = None
+        bias = None
+        if kind == "flat":
+            try:
+                bias = self.get_master("offset",info)
+            except CalibrationError:
+                log.logw(_("No offset master , flats are not corrected for the offset"))
+            # Every flat is scaled to the same level , from a sample of its pixels
+            levels = [float(np.median(frame[::8,::8])) - (float(np.median(bias[::8,::8])) if bias is not None else 0.0)
+                        for frame in frames]
+            scales = [1.0 / level if level > 0 else 1.0 for level in levels]
+        started = time()
+        master = sigma_clipped_median(frames,sigma,scales,bias,block_memory)
+        if kind == "flat":
+            mean = float(master.mean())
+            if mean > 0:
+                master /= np.float32(mean)
+        log.log(_("Built the {} master of {} frames in {:.2f}s").format(kind,len(frames),time() - started))
+
+        entry = dict(info)
+        entry["kind"] = kind
+        entry["frames"] = len(frames)
+        entry["temperature"] = entry.get("temperature")
+        # The settings really stacked , the same for all of the frames
+        for key in keys:
+            entry[key] = entries[0].get(key)
+        if kind != "dark":
+            entry["exposure"] = None
+        folder = os.path.join(self.path,"masters")
+        os.makedirs(folder,exist_ok=True)
+        name = "{}_{}.npy".format(kind,uuid4().hex)
+        np.save(os.path.join(folder,name),master)
+        entry["file"] = os.path.join("masters",name)
+        entry["time"] = time()
+        with self._lock:
+            index = self._load()
+            # The new master replaces the one with the same settings
+            index["masters"] = [m for m in index["masters"] if not self._same_master(m,entry)]
+            index["masters"].append(entry)
+            self._save()
+            self._cache.pop(entry["file"],None)
+            self._cache[entry["file"]] = (master,None)
+            self._trim()
+        return entry
+
+    def _same_master(self, a : dict, b : dict) -> bool:
+        return all(a.get(key) == b.get(key) for key in ("kind","exposure","temperature") + KEYS)
+
+    def _trim(self) -> None:
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def find_master(self, kind : str, info : dict, tolerance : float = TEMPERATURE_TOLERANCE) -> dict:
+        """
+            Get the best master for an image
+            Args :
+                kind : str
+                info : dict # see make_info
+                tolerance : float # degrees
+            Returns : dict # the index entry , the closest exposure and temperature first
+        """
+        with self._lock:
+            masters = [m for m in self._load()["masters"] if self._matches(m,info,kind,tolerance,False)]
+        if not masters:
+            raise CalibrationError(_("No {} master matches").format(kind))
+
+        def distance(master : dict) -> tuple:
+            exposure = 0.0
+            if kind == "dark" and info.get("exposure") is not None and master.get("exposure") is not None:
+                exposure = abs(master["exposure"] - info["exposure"])
+            temperature = 0.0
+            if info.get("temperature") is not None and master.get("temperature") is not None:
+                temperature = abs(master["temperature"] - info["temperature"])
+            return exposure , temperature , -master["time"]
+
+        return min(masters,key=distance)
+
+    def _cached(self, entry : dict) -> tuple:
+        """Get (master , inverse or None) of an index entry , loaded on the first use"""
+        with self._lock:
+            cached = self._cache.get(entry["file"])
+            if cached is not None:
+                self._cache.move_to_end(entry["file"])
+                return cached
+        master = np.load(os.path.join(self.path,entry["file"])).astype(np.float32,copy=False)
+        with self._lock:
+            cached = self._cache.setdefault(entry["file"],(master,None))
+            self._trim()
+        return cached
+
+    def get_master(self, kind : str, info : dict, tolerance : float = TEMPERATURE_TOLERANCE) -> np.ndarray:
+        """
+            Get the best master for an image as a float32 array
+            Raises : CalibrationError if no master matches
+        """
+        return self._cached(self.find_master(kind,info,tolerance))[0]
+
+    def _inverse_flat(self, entry : dict) -> np.ndarray:
+        master , inverse = self._cached(entry)
+        if inverse is None:
+            # Dead pixels of the flat are left as they are
+            inverse = np.where(master > 0.01,1.0 / np.maximum(master,0.01),1.0).astype(np.float32)
+            with self._lock:
+                self._cache[entry["file"]] = (master,inverse)
+        return inverse
+
+    def calibrate(self, image : np.ndarray, info : dict, dark : bool = True, flat : bool = True,
+                    out : np.ndarray = None) -> np.ndarray:
+        """
+            Subtract the dark and divide by the flat , the masters which are not found are skipped
+            Args :
+                image : np.ndarray
+                info : dict # see make_info , the light frame
+                dark : bool # subtract the dark , or the offset if there is no dark
+                flat : bool # divide by the flat
+                out : np.ndarray # float32 result , may be reused between previews
+            Returns : np.ndarray # float32
+        """
+        if out is None:
+            out = np.empty(np.shape(image),dtype=np.float32)
+        np.copyto(out,image,casting="unsafe")
+        if dark:
+            try:
+                entry = self.find_master("dark",info)
+            except CalibrationError:
+                entry = None
+            if entry is not None:
+                master = self._cached(entry)[0]
+                bias = None
+                if info.get("exposure") and entry.get("exposure") and entry["exposure"] != info["exposure"]:
+                    try:
+                        bias = self.get_master("offset",info)
+                    except CalibrationError:
+                        log.logw(_("No offset master , the dark of {}s is not scaled").format(entry["exposure"]))
+                if bias is not None:
+                    # Scale the thermal signal of the closest dark to the exposure of the image
+                    out -= bias
+                    out -= (master - bias) * np.float32(info["exposure"] / entry["exposure"])
+                else:
+                    out -= master
+            else:
+                try:
+                    out -= self.get_master("offset",info)
+                except CalibrationError:
+                    pass
+        if flat:
+            try:
+                out *= self._inverse_flat(self.find_master("flat",info))
+            except CalibrationError:
+                pass
+        return out
+
+# The calibration library shared by all of the cameras
+library = CalibrationLibrary()
@@ -0,0 +1,479 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# Coordinates : sexagesimal strings , sidereal time and the transforms between
+# J2000 , JNow (apparent place , what ASCOM calls topocentric) and alt/az.
+# Every transform accepts numpy arrays , so the pointing of the telescope ,
+# the catalog overlays and the night planning use the same code.
+# Precession (IAU 1976) and nutation (main terms of IAU 1980) are rotation
+# matrices which change very slowly , they are computed once per epoch
+# bucket and cached. The accuracy is better than one arcsecond.
+# #################################################################
+
+from collections import OrderedDict
+import threading
+import time
+
+import numpy as np
+
+from utils.i18n import _
+
+J2000 = 2451545.0
+ARCSEC = np.pi / (180.0 * 3600.0)
+# Constant of aberration in radians
+ABERRATION = 20.49552 * ARCSEC
+# Width of the epoch buckets in days , the matrices move less than 0.2 arcsecond in one day
+EPOCH_BUCKET = 1.0
+# Number of epoch buckets kept in the cache
+MATRIX_CACHE_SIZE = 256
+
+# #################################################################
+# Sexagesimal strings
+# #################################################################
+
+# Every separator becomes a space , then a single split is enough
+_SEPARATORS = str.maketrans({c : " " for c in ":hHmMsSdD°'\"′″"})
+
+def parse_sexagesimal(value) -> float:
+    """
+        Parse a sexagesimal string like 12:30:45.5 , -05 30 00 , 12h30m45s or 41°16'09"
+        Numbers and plain decimal strings are returned as they are.
+        Args :
+            value : str or float
+        Returns : float # in the unit of the first field (hours or degrees)
+        Raises : ValueError if the value is not a valid sexagesimal string
+    """
+    if isinstance(value,(int,float,np.number)) and not isinstance(value,bool):
+        return float(value)
+    if not isinstance(value,str):
+        raise ValueError(_("Invalid sexagesimal value {}").format(value))
+    fields = value.translate(_SEPARATORS).split()
+    if not 1 <= len(fields) <= 3:
+        raise ValueError(_("Invalid sexagesimal value {}").format(value))
+    first = fields[0]
+    negative = first.startswith("-")
+    try:
+        numbers = [abs(float(field)) for field in fields]
+    except ValueError:
+        raise ValueError(_("Invalid sexagesimal value {}").format(value)) from None
+    # Only the first field may have a sign , minutes and seconds must be under 60
+    if any(field[0] in "+-" for field in fields[1:]) or any(n >= 60 for n in numbers[1:]):
+        raise ValueError(_("Invalid sexagesimal value {}").format(value))
+    result = numbers[0]
+    if len(numbers) > 1:
+        result += numbers[1] / 60.0
+    if len(numbers) > 2:
+        result += numbers[2] / 3600.0
+    return -result if negative else result
+
+def parse_ra(value) -> float:
+    """
+        Parse a right ascension in hours , e.g. 05:35:17.3
+        Args :
+            value : str or float # hours
+        Returns : float # degrees in [0,360)
+        Raises : ValueError
+    """
+    hours = parse_sexagesimal(value)
+    if not 0 <= hours <= 24:
+        raise ValueError(_("Right ascension {} is out of range").format(value))
+    return (hours * 15.0) % 360.0
+
+def parse_dec(value) -> float:
+    """
+        Parse a declination in degrees , e.g. -05:23:28
+        Args :
+            value : str or float # degrees
+        Returns : float # degrees in [-90,90]
+        Raises : ValueError
+    """
+    degrees = parse_sexagesimal(value)
+    if not -90 <= degrees <= 90:
+        raise ValueError(_("Declination {} is out of range").format(value))
+    return degrees
+
+def parse_many(values , hours : bool = False) -> np.ndarray:
+    """
+        Parse a list of sexagesimal strings , invalid values become nan
+        Args :
+            values : list # strings or numbers
+            hours : bool # the values are hours , the result is converted into degrees
+        Returns : np.ndarray # degrees
+    """
+    result = np.empty(len(values),dtype=np.float64)
+    for i , value in enumerate(values):
+        try:
+            result[i] = parse_sexagesimal(value)
+        except (ValueError,TypeError):
+            result[i] = np.nan
+    if hours:
+        result *= 15.0
+    return result
+
+def format_sexagesimal(value : float , precision : int = 1 , sign : bool = False , wrap : int = None) -> str:
+    """
+        Format a value as DD:MM:SS.s
+        Args :
+            value : float # hours or degrees
+            precision : int # digits of the seconds
+            sign : bool # always write the sign
+            wrap : int # the first field is taken modulo this value , e.g. 24 for hours
+        Returns : str
+    """
+    negative = value < 0
+    # Round once on the smallest unit so 59.99 seconds never becomes 60.0
+    scale = 10 ** precision
+    units = int(round(abs(value) * 3600 * scale))
+    if wrap:
+        units %= wrap * 3600 * scale
+    whole , fraction = divmod(units,scale)
+    minutes , seconds = divmod(whole,60)
+    degrees , minutes = divmod(minutes,60)
+    text = "{:02d}:{:02d}:{:02d}".format(degrees,minutes,seconds)
+    if precision > 0:
+        text += ".{:0{}d}".format(fraction,precision)
+    if negative and units:
+        return "-" + text
+    return ("+" + text) if sign else text
+
+def format_ra(ra : float , precision : int = 2) -> str:
+    """
+        Format a right ascension in degrees as HH:MM:SS.ss
+    """
+    return format_sexagesimal((ra % 360.0) / 15.0,precision,wrap=24)
+
+def format_dec(dec : float , precision : int = 1) -> str:
+    """
+        Format a declination in degrees as +DD:MM:SS.s
+    """
+    return format_sexagesimal(dec,precision,True)
+
+# #################################################################
+# Time
+# #################################################################
+
+def julian_date(timestamp) -> np.ndarray:
+    """
+        Convert unix timestamps (UTC) into julian dates
+        Args :
+            timestamp : float or np.ndarray
+        Returns : np.ndarray
+    """
+    return np.asarray(timestamp,dtype=np.float64) / 86400.0 + 2440587.5
+
+def now() -> float:
+    """
+        Julian date of now
+    """
+    return float(julian_date(time.time()))
+
+def gmst(jd) -> np.ndarray:
+    """
+        Greenwich mean sidereal time
+        Args :
+            jd : float or np.ndarray # julian dates
+        Returns : np.ndarray # degrees in [0,360)
+    """
+    d = np.asarray(jd,dtype=np.float64) - J2000
+    t = d / 36525.0
+    return np.mod(280.46061837 + 360.98564736629 * d + 0.000387933 * t * t, 360.0)
+
+def local_sidereal_time(jd , lon : float) -> np.ndarray:
+    """
+        Local mean sidereal time
+        Args :
+            jd : float or np.ndarray # julian dates
+            lon : float # longitude of the site in degrees , east is positive
+        Returns : np.ndarray # degrees in [0,360)
+    """
+    return np.mod(gmst(jd) + lon, 360.0)
+
+# #################################################################
+# Precession , nutation and aberration
+# #################################################################
+
+def _rotation(axis : int , angle : np.ndarray) -> np.ndarray:
+    """
+        Rotations of the frame around one axis
+        Args :
+            axis : int # 0 , 1 or 2 for x , y and z
+            angle : np.ndarray # radians , shape (n,)
+        Returns : np.ndarray # shape (n,3,3)
+    """
+    c , s = np.cos(angle) , np.sin(angle)
+    m = np.zeros(angle.shape + (3,3))
+    i , j = [k for k in range(3) if k != axis]
+    m[:,axis,axis] = 1.0
+    m[:,i,i] = c
+    m[:,j,j] = c
+    # The sign of the sine changes for the y axis
+    if axis == 1:
+        m[:,i,j] = -s
+        m[:,j,i] = s
+    else:
+        m[:,i,j] = s
+        m[:,j,i] = -s
+    return m
+
+def _compute_epochs(jd : np.ndarray) -> tuple:
+    """
+        Compute the precession-nutation matrices and the earth velocity for some epochs
+        Args :
+            jd : np.ndarray # julian dates , shape (n,)
+        Returns : (matrices , velocities) # shapes (n,3,3) and (n,3)
+    """
+    t = (jd - J2000) / 36525.0
+    # Precession angles of Lieske (1977)
+    zeta = (2306.2181 * t + 0.30188 * t ** 2 + 0.017998 * t ** 3) * ARCSEC
+    z = (2306.2181 * t + 1.09468 * t ** 2 + 0.018203 * t ** 3) * ARCSEC
+    theta = (2004.3109 * t - 0.42665 * t ** 2 - 0.041833 * t ** 3) * ARCSEC
+    precession = _rotation(2,-z) @ _rotation(1,theta) @ _rotation(2,-zeta)
+
+    # Nutation , the four main terms of IAU 1980
+    omega = np.radians(125.04452 - 1934.136261 * t)
+    l_sun = np.radians(280.4665 + 36000.7698 * t)
+    l_moon = np.radians(218.3165 + 481267.8813 * t)
+    dpsi = (-17.20 * np.sin(omega) - 1.32 * np.sin(2 * l_sun) - 0.23 * np.sin(2 * l_moon) + 0.21 * np.sin(2 * omega)) * ARCSEC
+    deps = (9.20 * np.cos(omega) + 0.57 * np.cos(2 * l_sun) + 0.10 * np.cos(2 * l_moon) - 0.09 * np.cos(2 * omega)) * ARCSEC
+    eps = (84381.448 - 46.8150 * t - 0.00059 * t ** 2 + 0.001813 * t ** 3) * ARCSEC
+    nutation = _rotation(0,-(eps + deps)) @ _rotation(2,-dpsi) @ _rotation(0,eps)
+
+    # Velocity of the earth in units of c , from the longitude of the sun
+    n = jd - J2000
+    g = np.radians(357.528 + 0.9856003 * n)
+    lam = np.radians(280.460 + 0.9856474 * n + 1.915 * np.sin(g) + 0.020 * np.sin(2 * g))
+    eps0 = 84381.448 * ARCSEC
+    velocity = ABERRATION * np.stack([np.sin(lam), -np.cos(lam) * np.cos(eps0), -np.cos(lam) * np.sin(eps0)],axis=-1)
+    return nutation @ precession , velocity
+
+_epoch_cache = OrderedDict()
+_epoch_lock = threading.Lock()
+
+def epoch_matrices(jd) -> tuple:
+    """
+        Get the precession-nutation matrices and the earth velocities , cached per epoch bucket
+        Args :
+            jd : float or np.ndarray # julian dates
+        Returns : (matrices , velocities , index) # matrices[index[k]] is the matrix of jd[k]
+    """
+    buckets = np.floor((np.atleast_1d(np.asarray(jd,dtype=np.float64)) - J2000) / EPOCH_BUCKET).astype(np.int64)
+    keys , index = np.unique(buckets,return_inverse=True)
+    matrices = np.empty((len(keys),3,3))
+    velocities = np.empty((len(keys),3))
+    missing = []
+    with _epoch_lock:
+        for i , key in enumerate(keys.tolist()):
+            cached = _epoch_cache.get(key)
+            if cached is None:
+                missing.append(i)
+            else:
+                _epoch_cache.move_to_end(key)
+                matrices[i] , velocities[i] = cached
+    if missing:
+        # All of the missing epochs in one vectorized call , at the middle of their bucket
+        centers = J2000 + (keys[missing] + 0.5) * EPOCH_BUCKET
+        new_matrices , new_velocities = _compute_epochs(centers)
+        matrices[missing] = new_matrices
+        velocities[missing] = new_velocities
+        with _epoch_lock:
+            for i , m , v in zip(missing,new_matrices,new_velocities):
+                _epoch_cache[int(keys[i])] = (m,v)
+            while len(_epoch_cache) > MATRIX_CACHE_SIZE:
+                _epoch_cache.popitem(last=False)
+    return matrices , velocities , index.reshape(-1)
+
+def precession_nutation_matrix(jd : float) -> np.ndarray:
+    """
+        Rotation from J2000 to the true equator and equinox of the date
+        Args :
+            jd : float # julian date
+        Returns : np.ndarray # shape (3,3)
+    """
+    matrices , _velocities , _index = epoch_matrices(jd)
+    return matrices[0]
+
+# #################################################################
+# Transforms
+# #################################################################
+
+def to_vector(ra , dec) -> np.ndarray:
+    """
+        Convert spherical coordinates in degrees into unit vectors of shape (n,3)
+    """
+    ra = np.radians(np.atleast_1d(np.asarray(ra,dtype=np.float64)))
+    dec = np.radians(np.atleast_1d(np.asarray(dec,dtype=np.float64)))
+    cos_dec = np.cos(dec)
+    return np.stack(np.broadcast_arrays(cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)),axis=-1)
+
+def from_vector(v : np.ndarray) -> tuple:
+    """
+        Convert vectors of shape (n,3) into (ra , dec) in degrees , ra in [0,360)
+    """
+    x , y , z = v[...,0] , v[...,1] , v[...,2]
+    ra = np.mod(np.degrees(np.arctan2(y,x)),360.0)
+    dec = np.degrees(np.arctan2(z,np.hypot(x,y)))
+    return ra , dec
+
+def _shape(ra , dec) -> tuple:
+    return np.broadcast(np.asarray(ra),np.asarray(dec)).shape
+
+def _rotate(matrices : np.ndarray , index : np.ndarray , v : np.ndarray , transpose : bool = False) -> np.ndarray:
+    """
+        Apply the matrix of every vector , one matrix multiply if there is only one epoch
+    """
+    if transpose:
+        matrices = matrices.transpose(0,2,1)
+    if len(matrices) == 1:
+        return v @ matrices[0].T
+    if len(index) == 1:
+        index = np.zeros(len(v),dtype=np.int64)
+    return np.einsum("nij,nj->ni",matrices[index],v)
+
+def j2000_to_jnow(ra , dec , jd = None , aberration : bool = True) -> tuple:
+    """
+        Convert J2000 coordinates into the apparent coordinates of the date (JNow)
+        Args :
+            ra : float or np.ndarray # degrees
+            dec : float or np.ndarray # degrees
+            jd : float or np.ndarray # julian dates , default is now
+            aberration : bool # apply the annual aberration , ASCOM topocentric coordinates include it
+        Returns : (ra , dec) # degrees , same shape as the inputs
+    """
+    shape = _shape(ra,dec)
+    v = to_vector(ra,dec)
+    matrices , velocities , index = epoch_matrices(now() if jd is None else jd)
+    if aberration:
+        v = v + (velocities[0] if len(velocities) == 1 else velocities[index])
+        v /= np.linalg.norm(v,axis=-1,keepdims=True)
+    ra , dec = from_vector(_rotate(matrices,index,v))
+    return ra.reshape(shape) , dec.reshape(shape)
+
+def jnow_to_j2000(ra , dec , jd = None , aberration : bool = True) -> tuple:
+    """
+        Convert the apparent coordinates of the date (JNow) into J2000 coordinates
+        Args :
+            ra : float or np.ndarray # degrees
+            dec : float or np.ndarray # degrees
+            jd : float or np.ndarray # julian dates , default is now
+            aberration : bool # remove the annual aberration
+        Returns : (ra , dec) # degrees , same shape as the inputs
+    """
+    shape = _shape(ra,dec)
+    matrices , velocities , index = epoch_matrices(now() if jd is None else jd)
+    v = _rotate(matrices,index,to_vector(ra,dec),True)
+    if aberration:
+        v = v - (velocities[0] if len(velocities) == 1 else velocities[index])
+        v /= np.linalg.norm(v,axis=-1,keepdims=True)
+    ra , dec = from_vector(v)
+    return ra.reshape(shape) , dec.reshape(shape)
+
+def altaz(ra , dec , lst , lat : float) -> tuple:
+    """
+        Convert equatorial coordinates into horizontal coordinates.
+        All of the arguments are broadcast together , so ra[:,None] and lst[None,:]
+        give the (objects , times) grid in one call.
+        Args :
+            ra : np.ndarray # right ascension in degrees
+            dec : np.ndarray # declination in degrees
+            lst : np.ndarray # local sidereal time in degrees
+            lat : float # latitude of the site in degrees
+        Returns : (alt , az) # degrees , azimuth is from north to east
+    """
+    ha = np.radians(lst - ra)
+    dec = np.radians(dec)
+    phi = np.radians(lat)
+    sin_dec , cos_dec = np.sin(dec) , np.cos(dec)
+    cos_ha = np.cos(ha)
+    sin_alt = sin_dec * np.sin(phi) + cos_dec * np.cos(phi) * cos_ha
+    alt = np.degrees(np.arcsin(np.clip(sin_alt, -1.0, 1.0)))
+    az = np.degrees(np.arctan2(-cos_dec * np.sin(ha), sin_dec * np.cos(phi) - cos_dec * np.sin(phi) * cos_ha))
+    return alt , np.mod(az, 360.0)
+
+def refraction(alt , pressure : float = 1010.0 , temperature : float = 10.0) -> np.ndarray:
+    """
+        Atmospheric refraction of Saemundsson , to add to the true altitude
+        Args :
+            alt : np.ndarray # true altitude in degrees
+            pressure : float # hPa
+            temperature : float # Celsius
+        Returns : np.ndarray # degrees , 0 below -1 degree
+    """
+    alt = np.asarray(alt,dtype=np.float64)
+    h = np.maximum(alt,-1.0)
+    r = 1.02 / np.tan(np.radians(h + 10.3 / (h + 5.11))) / 60.0
+    r *= (pressure / 1010.0) * (283.0 / (273.0 + temperature))
+    return np.where(alt < -1.0, 0.0, r)
+
+def equatorial_to_horizontal(ra , dec , lat : float , lon : float , jd = None , refract : bool = False) -> tuple:
+    """
+        Convert apparent (JNow) coordinates into the alt/az seen from the site
+        Args :
+            ra : float or np.ndarray # degrees
+            dec : float or np.ndarray # degrees
+            lat : float # latitude of the site in degrees
+            lon : float # longitude of the site in degrees , east is positive
+            jd : float or np.ndarray # julian dates , default is now
+            refract : bool # add the atmospheric refraction
+        Returns : (alt , az) # degrees
+    """
+    lst = local_sidereal_time(now() if jd is None else jd,lon)
+    alt , az = altaz(np.asarray(ra,dtype=np.float64),np.asarray(dec,dtype=np.float64),lst,lat)
+    if refract:
+        alt = alt + refraction(alt)
+    return alt , az
+
+def horizontal_to_equatorial(alt , az , lat : float , lon : float , jd = None , refract : bool = False) -> tuple:
+    """
+        Convert the alt/az seen from the site into apparent (JNow) coordinates
+        Args :
+            alt : float or np.ndarray # degrees
+            az : float or np.ndarray # degrees , from north to east
+            lat : float # latitude of the site in degrees
+            lon : float # longitude of the site in degrees , east is positive
+            jd : float or np.ndarray # julian dates , default is now
+            refract : bool # the altitude includes the refraction
+        Returns : (ra , dec) # degrees
+    """
+    alt = np.asarray(alt,dtype=np.float64)
+    if refract:
+        # The correction of the true altitude is close enough at the apparent one after one iteration
+        alt = alt - refraction(alt - refraction(alt))
+    a , h , phi = np.radians(az) , np.radians(alt) , np.radians(lat)
+    sin_dec = np.sin(h) * np.sin(phi) + np.cos(h) * np.cos(phi) * np.cos(a)
+    dec = np.arcsin(np.clip(sin_dec,-1.0,1.0))
+    ha = np.arctan2(-np.sin(a) * np.cos(h), np.sin(h) * np.cos(phi) - np.cos(h) * np.sin(phi) * np.cos(a))
+    lst = local_sidereal_time(now() if jd is None else jd,lon)
+    return np.mod(lst - np.degrees(ha),360.0) , np.degrees(dec)
+
+def separation(ra1 , dec1 , ra2 , dec2) -> np.ndarray:
+    """
+        Angular distance between two positions , accurate at every distance
+        Args :
+            ra1 , dec1 , ra2 , dec2 : float or np.ndarray # degrees
+        Returns : np.ndarray # degrees
+    """
+    ra1 , dec1 , ra2 , dec2 = (np.radians(np.asarray(x,dtype=np.float64)) for x in (ra1,dec1,ra2,dec2))
+    dra = ra2 - ra1
+    sin_d1 , cos_d1 = np.sin(dec1) , np.cos(dec1)
+    sin_d2 , cos_d2 = np.sin(dec2) , np.cos(dec2)
+    num = np.hypot(cos_d2 * np.sin(dra), cos_d1 * sin_d2 - sin_d1 * cos_d2 * np.cos(dra))
+    den = sin_d1 * sin_d2 + cos_d1 * cos_d2 * np.cos(dra)
+    return np.degrees(np.arctan2(num,den))
@@ -0,0 +1,153 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# Message dispatch table
+# Handlers are marked with @handler(...) and collected once by
+# Dispatcher.bind() , every message is then routed with a single
+# dictionary lookup instead of a chain of switch cases
+# #################################################################
+
+import inspect
+from time import perf_counter
+
+from utils.lightlog import lightlog
+log = lightlog(__name__)
+
+def handler(*key : str):
+    """
+        Mark a method as the handler of a message , a method can handle several keys
+        Args :
+            key : str # e.g. @handler("RemoteConnect") or @handler("server","RemoteDashboardSetup")
+        Returns : decorator
+    """
+    def decorator(func):
+        func.__dispatch_keys__ = getattr(func,"__dispatch_keys__",()) + (key,)
+        return func
+    return decorator
+
+class HandlerStats(object):
+    """
+        Counters of a handler
+    """
+
+    __slots__ = ("calls","errors","total_time","max_time")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def get_dict(self) -> dict:
+        return {
+            "calls" : self.calls,
+            "errors" : self.errors,
+            "total_time" : self.total_time,
+            "avg_time" : self.total_time / self.calls if self.calls else 0.0,
+            "max_time" : self.max_time,
+        }
+
+class Dispatcher(object):
+    """
+        Route the messages to the handlers with an O(1) lookup
+    """
+
+    def __init__(self, name : str) -> None:
+        """
+            Args :
+                name : str # name used in the log
+        """
+        self.name = name
+        # key -> (func , whether the func takes the params , stats)
+        self._table = {}
+        self.unknown = 0
+
+    def add(self, key : tuple, func) -> None:
+        """
+            Register a handler
+            Args :
+                key : tuple
+                func : callable # called with the params if it accepts an argument
+            Returns : None
+        """
+        try:
+            takes_params = len(inspect.signature(func).parameters) > 0
+        except (TypeError,ValueError):
+            takes_params = True
+        if key in self._table:
+            log.logw("{} : handler of {} is replaced".format(self.name,key))
+        self._table[key] = (func,takes_params,HandlerStats())
+
+    def bind(self, obj : object, prefix : tuple = ()) -> None:
+        """
+            Register all of the methods of the object marked with @handler
+            Args :
+                obj : object
+                prefix : tuple # prepended to the keys of the handlers , e.g. ("camera",)
+            Returns : None
+        """
+        for name,member in inspect.getmembers(type(obj),callable):
+            for key in getattr(member,"__dispatch_keys__",()):
+                self.add(tuple(prefix) + key,getattr(obj,name))
+
+    def __contains__(self, key : tuple) -> bool:
+        return key in self._table
+
+    def dispatch(self, key : tuple, params = None) -> bool:
+        """
+            Call the handler of the key , the exceptions are counted and raised again
+            Args :
+                key : tuple
+                params : any # passed to the handler
+            Returns : bool # False if no handler is registered
+        """
+        entry = self._table.get(key)
+        if entry is None:
+            self.unknown += 1
+            return False
+        func,takes_params,stats = entry
+        start = perf_counter()
+        try:
+            if takes_params:
+                func(params)
+            else:
+                func()
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            used_time = perf_counter() - start
+            stats.calls += 1
+            stats.total_time += used_time
+            if used_time > stats.max_time:
+                stats.max_time = used_time
+        return True
+
+    def get_metrics(self) -> dict:
+        """
+            Get the counters of all of the handlers
+            Args : None
+            Returns : dict # {"handlers" : {"type.event" : {...}} , "unknown" : int}
+        """
+        return {
+            "handlers" : {".".join(key) : stats.get_dict() for key,(_func,_takes,stats) in self._table.items()},
+            "unknown" : self.unknown,
+        }
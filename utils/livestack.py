@@ -0,0 +1,393 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# Live stacking.
+# Every new light is calibrated , debayered if it is a colour mosaic ,
+# aligned on the first one and added to
+# running per pixel buffers : mean , sum of the squared deviations (M2)
+# and weight , all float32. A pixel far from the running mean (satellite ,
+# plane , cosmic ray) is not added once a few frames are in , so the
+# stack never needs the earlier frames and the memory is three frames
+# whatever the number of subs.
+# The alignment is a phase correlation : first on a downsampled copy for
+# the coarse shift , then on a crop of the center at full resolution ,
+# the FFT of the reference is computed once.
+# #################################################################
+
+from collections import deque
+import threading
+from time import perf_counter, time
+
+import numpy as np
+
+from utils.i18n import _
+from utils.preview import debayer_bilinear, debayer_superpixel
+from utils.lightlog import lightlog
+log = lightlog(__name__)
+
+# Factor of the downsampled copy used for the coarse alignment
+DOWNSAMPLE = 4
+# Size of the crop used to refine the shift at full resolution
+REFINE_SIZE = 512
+# Rejection threshold in standard deviations , and frames needed before rejecting
+SIGMA = 3.0
+MIN_FRAMES = 3
+# Width in pixels of the gaussian smoothing the correlation peak , so that the gaussian
+# fitted on its top does not lock the shift to whole pixels
+PEAK_SIGMA = 1.0
+# Frames with a weaker correlation peak are not stacked , e.g. clouds.
+# The peak of pure noise is about 12 / sqrt(pixels of the correlation) , the threshold stays above it
+MIN_PEAK = 0.02
+PEAK_NOISE = 18.0
+# Timings of the last frames kept for the statistics
+HISTORY_SIZE = 50
+
+def luminance(image : np.ndarray) -> np.ndarray:
+    """Mono copy of an image , float32"""
+    if image.ndim == 3:
+        return image.mean(axis=2,dtype=np.float32)
+    return image.astype(np.float32,copy=False)
+
+def downsample(image : np.ndarray, factor : int) -> np.ndarray:
+    """Mean of factor x factor blocks"""
+    if factor <= 1:
+        return image
+    h , w = image.shape[0] // factor * factor , image.shape[1] // factor * factor
+    return image[:h,:w].reshape(h // factor,factor,w // factor,factor).mean(axis=(1,3),dtype=np.float32)
+
+def _prepare(image : np.ndarray) -> np.ndarray:
+    """Background removed and windowed , ready for the FFT"""
+    data = image - np.median(image)
+    # Only the stars matter , the noise and the gradients would blur the peak
+    np.clip(data,0,None,out=data)
+    window = np.outer(np.hanning(image.shape[0]),np.hanning(image.shape[1])).astype(np.float32)
+    return data * window
+
+def _peak(correlation : np.ndarray) -> tuple:
+    """Subpixel position of the maximum of a correlation , with a gaussian on each axis"""
+    h , w = correlation.shape
+    y , x = np.unravel_index(np.argmax(correlation),correlation.shape)
+    peak = float(correlation[y,x])
+
+    def refine(c_m , c_0 , c_p) -> float:
+        # The smoothed peak is a gaussian , a parabola on its logarithm has no bias toward the whole pixels
+        if c_m > 0 and c_p > 0:
+            c_m , c_0 , c_p = np.log(c_m) , np.log(c_0) , np.log(c_p)
+        denominator = c_m - 2 * c_0 + c_p
+        return 0.0 if denominator == 0 else 0.5 * (c_m - c_p) / denominator
+
+    dy = refine(correlation[(y - 1) % h,x],peak,correlation[(y + 1) % h,x])
+    dx = refine(correlation[y,(x - 1) % w],peak,correlation[y,(x + 1) % w])
+    # The FFT wraps around , the upper half is a negative shift
+    sy = y + dy if y <= h // 2 else y + dy - h
+    sx = x + dx if x <= w // 2 else x + dx - w
+    return sy , sx , peak
+
+_filters = {}
+
+def _peak_filter(shape : tuple) -> tuple:
+    """Gaussian low pass of the cross power spectrum and the height of its own peak , cached per shape"""
+    if shape not in _filters:
+        fy = np.fft.fftfreq(shape[0])[:,None]
+        fx = np.fft.rfftfreq(shape[1])[None,:]
+        gauss = np.exp(-2 * np.pi ** 2 * PEAK_SIGMA ** 2 * (fy * fy + fx * fx)).astype(np.float32)
+        _filters[shape] = (gauss,float(np.fft.irfft2(gauss,s=shape)[0,0]))
+    return _filters[shape]
+
+def phase_correlation(reference_fft : np.ndarray, image : np.ndarray) -> tuple:
+    """
+        Shift of an image relatively to the reference
+        Args :
+            reference_fft : np.ndarray # conjugate FFT of the prepared reference
+            image : np.ndarray # prepared image of the same shape
+        Returns : (dy , dx , peak) # the image is the reference moved by (dy , dx)
+    """
+    spectrum = np.fft.rfft2(image) * reference_fft
+    spectrum /= np.abs(spectrum) + 1e-12
+    gauss , height = _peak_filter(image.shape)
+    spectrum *= gauss
+    dy , dx , peak = _peak(np.fft.irfft2(spectrum,s=image.shape))
+    # The peak of a perfect match is 1 , like without the filter
+    return dy , dx , peak / height
+
+def shift_image(image : np.ndarray, dy : float, dx : float, out : np.ndarray = None) -> tuple:
+    """
+        Move an image by (-dy , -dx) with a bilinear interpolation , to put it back on the reference
+        Args :
+            image : np.ndarray # (h,w) or (h,w,c)
+            dy , dx : float # shift measured by phase_correlation
+            out : np.ndarray # float32 result , reused between the frames
+        Returns : (np.ndarray , np.ndarray) # shifted image and coverage mask (h,w)
+    """
+    h , w = image.shape[:2]
+    if out is None:
+        out = np.zeros(image.shape,dtype=np.float32)
+    else:
+        out.fill(0)
+    iy , ix = int(np.floor(dy)) , int(np.floor(dx))
+    fy , fx = np.float32(dy - iy) , np.float32(dx - ix)
+    mask = np.zeros((h,w),dtype=bool)
+    # out[y , x] = image[y + dy , x + dx] , on the rows and columns where all of the 4 pixels exist
+    y0 , y1 = max(0,-iy) , min(h,h - iy - 1)
+    x0 , x1 = max(0,-ix) , min(w,w - ix - 1)
+    if y1 <= y0 or x1 <= x0:
+        return out , mask
+    source = image.astype(np.float32,copy=False)
+    a = source[y0 + iy:y1 + iy,x0 + ix:x1 + ix]
+    b = source[y0 + iy:y1 + iy,x0 + ix + 1:x1 + ix + 1]
+    c = source[y0 + iy + 1:y1 + iy + 1,x0 + ix:x1 + ix]
+    d = source[y0 + iy + 1:y1 + iy + 1,x0 + ix + 1:x1 + ix + 1]
+    target = out[y0:y1,x0:x1]
+    np.multiply(a,(1 - fy) * (1 - fx),out=target)
+    target += b * ((1 - fy) * fx)
+    target += c * (fy * (1 - fx))
+    target += d * (fy * fx)
+    mask[y0:y1,x0:x1] = True
+    return out , mask
+
+class LiveStack(object):
+    """
+        Running stack of the lights of one target
+    """
+
+    def __init__(self, calibrate = None, factor : int = DOWNSAMPLE, sigma : float = SIGMA,
+                    min_frames : int = MIN_FRAMES, min_peak : float = MIN_PEAK, max_shift : float = None,
+                    pattern : str = None, debayer : str = "superpixel") -> None:
+        """
+            Args :
+                calibrate : callable # called with the raw frame and its info , returns the calibrated float32 frame , None to skip
+                pattern : str # bayer pattern of a colour camera , None for mono , see utils.preview.PATTERNS
+                debayer : str # superpixel (half of the resolution) or bilinear
+                factor : int # downsampling of the coarse alignment
+                sigma : float # rejection threshold , 0 to add every pixel
+                min_frames : int # frames stacked before the rejection starts
+                min_peak : float # weakest correlation peak accepted , raised above the noise of small frames
+                max_shift : float # pixels , frames moved more are not stacked , None for no limit
+        """
+        self.calibrate = calibrate
+        self.factor = max(int(factor),1)
+        self.sigma = sigma
+        self.min_frames = min_frames
+        self.min_peak = min_peak
+        self.max_shift = max_shift
+        if debayer not in ("superpixel","bilinear"):
+            raise ValueError(_("Unknown debayer method {}").format(debayer))
+        self.pattern = pattern
+        self.debayer = debayer
+
+        self.shape = None
+        self.mean = None
+        self.m2 = None
+        self.weight = None
+        self.frames = 0
+        self.rejected_frames = 0
+        self.started = time()
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self._reference = None
+        self._refine = None
+        self._min_peak = min_peak
+        self._buffer = None
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        """Forget all of the frames , the next one is the new reference"""
+        with self._lock:
+            self.shape = None
+            self.mean = self.m2 = self.weight = None
+            self._reference = self._refine = self._buffer = None
+            self.frames = 0
+            self.rejected_frames = 0
+            self.started = time()
+            self.history.clear()
+
+    # #################################################################
+    # Alignment
+    # #################################################################
+
+    def _crop(self, image : np.ndarray) -> tuple:
+        """Slices of the central crop used to refine the shift"""
+        h , w = image.shape
+        # A margin is kept , otherwise the crop of a shifted small frame would be out of the frame and never refined
+        size = min(REFINE_SIZE,h * 3 // 4,w * 3 // 4)
+        y , x = (h - size) // 2 , (w - size) // 2
+        return slice(y,y + size) , slice(x,x + size)
+
+    def _set_reference(self, mono : np.ndarray) -> None:
+        small = _prepare(downsample(mono,self.factor))
+        self._reference = np.conj(np.fft.rfft2(small))
+        self._min_peak = max(self.min_peak,PEAK_NOISE / np.sqrt(small.size))
+        crop = self._crop(mono)
+        self._refine = (crop,np.conj(np.fft.rfft2(_prepare(mono[crop].copy()))))
+
+    def align(self, mono : np.ndarray) -> tuple:
+        """
+            Shift of a frame relatively to the reference
+            Args :
+                mono : np.ndarray # float32 luminance of the calibrated frame
+            Returns : (dy , dx , peak)
+        """
+        small = _prepare(downsample(mono,self.factor))
+        dy , dx , peak = phase_correlation(self._reference,small)
+        dy , dx = dy * self.factor , dx * self.factor
+        # The crop of the frame is taken where the crop of the reference moved
+        (ys , xs) , reference = self._refine
+        h , w = mono.shape
+        iy , ix = int(round(dy)) , int(round(dx))
+        if 0 <= ys.start + iy and ys.stop + iy <= h and 0 <= xs.start + ix and xs.stop + ix <= w:
+            crop = _prepare(mono[ys.start + iy:ys.stop + iy,xs.start + ix:xs.stop + ix].copy())
+            fine_y , fine_x , fine_peak = phase_correlation(reference,crop)
+            # The fine shift must agree with the coarse one , otherwise the crop has no star
+            if abs(fine_y) <= self.factor and abs(fine_x) <= self.factor:
+                dy , dx = iy + fine_y , ix + fine_x
+        return dy , dx , peak
+
+    # #################################################################
+    # Stacking
+    # #################################################################
+
+    def add(self, image : np.ndarray, info : dict = None, weight : float = 1.0) -> dict:
+        """
+            Calibrate , align and stack a new light
+            Args :
+                image : np.ndarray # (h,w) or (h,w,c) , every frame of the same shape , a raw mosaic with a pattern
+                info : dict # settings of the frame , passed to calibrate
+                weight : float # e.g. the exposure time
+            Returns : dict # statistics of the frame , see the history
+        """
+        with self._lock:
+            started = perf_counter()
+            # The masters are mosaics too , so the frame is calibrated before it is debayered
+            if self.calibrate is not None:
+                frame = self.calibrate(image,info)
+            else:
+                frame = image.astype(np.float32)
+            # A shifted mosaic would mix the colours , the frame is aligned and stacked in RGB
+            mono , scale = None , 1
+            if self.pattern is not None and frame.ndim == 2:
+                if self.debayer == "superpixel":
+                    frame = debayer_superpixel(frame,self.pattern)
+                else:
+                    # The interpolated red and blue pull the shift to the pixels of the sensor ,
+                    # the alignment uses the 2x2 cells of the mosaic instead
+                    mono , scale = downsample(frame,2) , 2
+                    frame = debayer_bilinear(frame,self.pattern)
+            calibrated = perf_counter()
+            if self.shape is not None and frame.shape != self.shape:
+                raise ValueError(_("Frame of shape {} can not be stacked on {}").format(frame.shape,self.shape))
+            if mono is None:
+                mono = luminance(frame)
+            stats = {"frame" : self.frames + self.rejected_frames + 1, "dy" : 0.0, "dx" : 0.0,
+                        "peak" : None, "stacked" : True, "rejected_pixels" : 0.0}
+            if self._reference is None:
+                self._set_reference(mono)
+                self.shape = frame.shape
+                self.mean = np.zeros(frame.shape,dtype=np.float32)
+                self.m2 = np.zeros(frame.shape,dtype=np.float32)
+                self.weight = np.zeros(frame.shape[:2],dtype=np.float32)
+                aligned , mask = frame.astype(np.float32,copy=False) , np.ones(frame.shape[:2],dtype=bool)
+                aligned_time = perf_counter()
+            else:
+                dy , dx , peak = self.align(mono)
+                dy , dx = dy * scale , dx * scale
+                stats.update({"dy" : round(dy,2), "dx" : round(dx,2), "peak" : round(peak,4)})
+                aligned_time = perf_counter()
+                if peak < self._min_peak or (self.max_shift is not None and np.hypot(dy,dx) > self.max_shift):
+                    stats["stacked"] = False
+                else:
+                    self._buffer , mask = shift_image(frame,dy,dx,self._buffer)
+                    aligned = self._buffer
+                    aligned_time = perf_counter()
+            if stats["stacked"]:
+                stats["rejected_pixels"] = self._accumulate(aligned,mask,np.float32(weight))
+                self.frames += 1
+            else:
+                self.rejected_frames += 1
+                log.logw(_("Frame {} is not stacked , correlation {}").format(stats["frame"],stats["peak"]))
+            finished = perf_counter()
+            stats["time"] = {
+                # With the debayer
+                "calibrate" : round((calibrated - started) * 1000,2),
+                "align" : round((aligned_time - calibrated) * 1000,2),
+                "stack" : round((finished - aligned_time) * 1000,2),
+                "total" : round((finished - started) * 1000,2)
+            }
+            self.history.append(stats)
+            log.logd(_("Live stack frame {} in {:.1f}ms").format(stats["frame"],stats["time"]["total"]))
+            return stats
+
+    def _accumulate(self, frame : np.ndarray, mask : np.ndarray, weight : np.float32) -> float:
+        """
+            Add an aligned frame to the running buffers , weighted Welford update
+            Returns : float # fraction of the covered pixels rejected
+        """
+        use = mask.copy()
+        if self.sigma and self.frames >= self.min_frames:
+            # Per pixel sample variance of what is already stacked
+            n = self.frames
+            variance = self.m2 / np.maximum(self.weight,1e-6)[(...,) + (None,) * (frame.ndim - 2)] * np.float32(n / (n - 1))
+            # A few frames give a poor variance , never below the noise of the background
+            np.maximum(variance,np.float32(np.median(variance[::8,::8])),out=variance)
+            deviation = np.abs(frame - self.mean)
+            outlier = deviation * deviation > (self.sigma * self.sigma) * variance
+            if frame.ndim == 3:
+                outlier = outlier.any(axis=2)
+            # Pixels covered by too few frames have no reliable deviation yet
+            outlier &= self.weight >= self.min_frames * weight
+            use &= ~outlier
+        covered = np.count_nonzero(mask)
+        rejected = covered - np.count_nonzero(use)
+        w = np.where(use,weight,np.float32(0))
+        total = self.weight + w
+        if frame.ndim == 3:
+            w , total = w[...,None] , total[...,None]
+        delta = frame - self.mean
+        # mean += w / total * delta , m2 += w * delta * (frame - new mean)
+        ratio = np.divide(w,total,out=np.zeros_like(total),where=total > 0)
+        self.mean += ratio * delta
+        self.m2 += w * delta * (frame - self.mean)
+        self.weight += w if frame.ndim == 2 else w[...,0]
+        return round(rejected / covered,5) if covered else 0.0
+
+    def image(self) -> np.ndarray:
+        """
+            Get the current stack
+            Returns : np.ndarray # float32 copy , None before the first frame
+        """
+        with self._lock:
+            return None if self.mean is None else self.mean.copy()
+
+    def get_dict(self) -> dict:
+        """
+            Statistics of the stack , the per frame timings are averaged on the last frames
+        """
+        with self._lock:
+            timings = [s["time"] for s in self.history if s["stacked"]]
+            average = {key : round(sum(t[key] for t in timings) / len(timings),2) for key in timings[0]} if timings else None
+            return {
+                "frames" : self.frames,
+                "rejected_frames" : self.rejected_frames,
+                "shape" : list(self.shape) if self.shape is not None else None,
+                "pattern" : self.pattern,
+                "elapsed" : round(time() - self.started,1),
+                "memory" : sum(a.nbytes for a in (self.mean,self.m2,self.weight,self._buffer) if a is not None),
+                "last" : self.history[-1] if self.history else None,
+                "average" : average
+            }
@@ -0,0 +1,328 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# Long device operations (park , home , focuser moves ...)
+# The driver starts the motion and submits an operation with a check
+# function , the call returns the operation id at once. One scheduler
+# thread polls the checks of all of the operations , a small pool runs
+# them so a slow device does not delay the others. Finished , failed ,
+# cancelled and timed out operations are sent to the subscribers.
+# #################################################################
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+from itertools import count
+import threading
+from time import monotonic, time
+
+from utils.i18n import _
+from utils.lightlog import lightlog
+log = lightlog(__name__)
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMEOUT = "timeout"
+
+FINISHED = (DONE,FAILED,CANCELLED,TIMEOUT)
+
+# Seconds between two checks of an operation
+POLL_INTERVAL = 0.1
+# Finished operations kept for the status queries
+HISTORY_SIZE = 64
+
+class Operation(object):
+    """
+        A motion started on a device , finished when its check returns True
+    """
+
+    def __init__(self, id : int, name : str, check, cancel = None, finish = None, progress = None,
+                    timeout : float = None, interval : float = POLL_INTERVAL, owner : str = None) -> None:
+        """
+            Args :
+                id : int
+                name : str # e.g. telescope.home
+                check : callable # returns True when the motion is over , may raise
+                cancel : callable # stops the motion , None if it can not be cancelled
+                finish : callable # called once after check returned True , its return value is the result
+                progress : callable # returns the progress in [0,1] or None
+                timeout : float # seconds , None to wait forever
+                interval : float # seconds between two checks
+                owner : str # device of the operation , e.g. telescope
+        """
+        self.id = id
+        self.name = name
+        self.check = check
+        self.cancel = cancel
+        self.finish = finish
+        self.progress = progress
+        self.timeout = timeout
+        self.interval = interval
+        self.owner = owner
+
+        self.status = RUNNING
+        self.error = None
+        self.result = None
+        self.percent = None
+        self.start_time = time()
+        self.end_time = None
+        self._start = monotonic()
+        self._done = threading.Event()
+        # Set by the one who ends the operation , so cancel and finish never both run
+        self._closing = False
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in FINISHED
+
+    def elapsed(self) -> float:
+        return (self.end_time or time()) - self.start_time
+
+    def wait(self, timeout : float = None) -> bool:
+        """
+            Block until the operation is finished , for the callers which need the result
+            Args :
+                timeout : float # seconds , None to wait forever
+            Returns : bool # False if still running
+        """
+        return self._done.wait(timeout)
+
+    def get_dict(self) -> dict:
+        return {
+            "id" : self.id,
+            "name" : self.name,
+            "owner" : self.owner,
+            "status" : self.status,
+            "progress" : self.percent,
+            "elapsed" : round(self.elapsed(),3),
+            "cancelable" : self.cancel is not None,
+            "result" : self.result,
+            "error" : self.error
+        }
+
+class OperationManager(object):
+    """
+        Shared scheduler of the running operations
+    """
+
+    def __init__(self, max_workers : int = 4, history : int = HISTORY_SIZE) -> None:
+        self._ids = count(1)
+        self._running = {}
+        self._history = OrderedDict()
+        self._history_size = history
+        self._queue = []
+        self._sequence = count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers,thread_name_prefix="operation")
+        self._thread = None
+        self._subscribers = []
+
+    def subscribe(self, callback) -> None:
+        """
+            Get the events of all of the operations
+            Args :
+                callback : callable # called with (event , operation dict) , event is started , progress or the final status
+            Returns : None
+        """
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback) -> None:
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def _emit(self, event : str, operation : Operation) -> None:
+        info = operation.get_dict()
+        for callback in list(self._subscribers):
+            try:
+                callback(event,info)
+            except Exception as e:
+                log.loge(_("Operation subscriber failed : {}").format(str(e)))
+
+    def submit(self, name : str, check, cancel = None, finish = None, progress = None,
+                timeout : float = None, interval : float = POLL_INTERVAL, owner : str = None) -> Operation:
+        """
+            Track a motion which was just started , returns at once
+            Args : see Operation
+            Returns : Operation
+        """
+        operation = Operation(next(self._ids),name,check,cancel,finish,progress,timeout,interval,owner)
+        log.logd(_("Operation {} {} started").format(operation.id,name))
+        # Before the first check , so the subscribers always see started first
+        self._emit("started",operation)
+        with self._cond:
+            self._running[operation.id] = operation
+            self._schedule(operation,0)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,name="operation-scheduler",daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return operation
+
+    def get(self, id : int) -> Operation:
+        with self._cond:
+            return self._running.get(id) or self._history.get(id)
+
+    def list(self, owner : str = None, finished : bool = False) -> list:
+        """
+            Get the operations , the running ones by default
+            Args :
+                owner : str # only the operations of this device
+                finished : bool # include the finished operations
+            Returns : list of Operation
+        """
+        with self._cond:
+            operations = list(self._running.values())
+            if finished:
+                operations += list(self._history.values())
+        return [op for op in operations if owner is None or op.owner == owner]
+
+    def cancel(self, id : int) -> bool:
+        """
+            Stop the motion of an operation
+            Args :
+                id : int
+            Returns : bool # False if the operation is not running or can not be cancelled
+        """
+        operation = self.get(id)
+        if operation is None or operation.cancel is None or not self._close(operation):
+            return False
+        try:
+            operation.cancel()
+        except Exception as e:
+            log.loge(_("Failed to cancel operation {} : {}").format(operation.name,str(e)))
+            # Still running , the checks go on
+            with self._cond:
+                operation._closing = False
+            return False
+        self._finish(operation,CANCELLED)
+        return True
+
+    def cancel_all(self, owner : str = None) -> int:
+        """
+            Cancel the running operations , for example before disconnecting a device
+            Returns : int # number of the operations cancelled
+        """
+        return sum(1 for op in self.list(owner) if self.cancel(op.id))
+
+    def _close(self, operation : Operation) -> bool:
+        """
+            Claim the end of an operation
+            Returns : bool # False if it is already finished or being finished
+        """
+        with self._cond:
+            if operation.is_finished or operation._closing:
+                return False
+            operation._closing = True
+            return True
+
+    def _schedule(self, operation : Operation, delay : float) -> None:
+        heapq.heappush(self._queue,(monotonic() + delay,next(self._sequence),operation))
+
+    def _finish(self, operation : Operation, status : str, error : str = None) -> None:
+        with self._cond:
+            if operation.is_finished:
+                return
+            operation.status = status
+            operation.error = error
+            operation.end_time = time()
+            self._running.pop(operation.id,None)
+            self._history[operation.id] = operation
+            while len(self._history) > self._history_size:
+                self._history.popitem(last=False)
+        operation._done.set()
+        if status == DONE:
+            log.log(_("Operation {} finished in {:.2f}s").format(operation.name,operation.elapsed()))
+        else:
+            log.logw(_("Operation {} is {} : {}").format(operation.name,status,error or ""))
+        self._emit(status,operation)
+
+    def _poll(self, operation : Operation) -> None:
+        """
+            Run the check of an operation , in the pool
+        """
+        if operation.is_finished:
+            return
+        try:
+            finished = operation.check()
+        except Exception as e:
+            if self._close(operation):
+                self._finish(operation,FAILED,str(e))
+                return
+            finished = False
+        expired = not finished and operation.timeout is not None and monotonic() - operation._start > operation.timeout
+        if (finished or expired) and not self._close(operation):
+            # Cancelled while the check was running , checked again if the cancel fails
+            finished = expired = False
+        if operation.is_finished:
+            return
+        if finished:
+            try:
+                if operation.finish is not None:
+                    operation.result = operation.finish()
+            except Exception as e:
+                self._finish(operation,FAILED,str(e))
+                return
+            self._finish(operation,DONE)
+            return
+        if expired:
+            if operation.cancel is not None:
+                try:
+                    operation.cancel()
+                except Exception as e:
+                    log.loge(_("Failed to stop operation {} after timeout : {}").format(operation.name,str(e)))
+            self._finish(operation,TIMEOUT,_("No result after {} seconds").format(operation.timeout))
+            return
+        if operation.progress is not None:
+            try:
+                percent = operation.progress()
+            except Exception:
+                percent = None
+            if percent is not None and percent != operation.percent:
+                operation.percent = percent
+                self._emit("progress",operation)
+        with self._cond:
+            self._schedule(operation,operation.interval)
+            self._cond.notify()
+
+    def _run(self) -> None:
+        """
+            Hand the due checks to the pool
+        """
+        while True:
+            with self._cond:
+                while True:
+                    if not self._queue:
+                        self._cond.wait()
+                        continue
+                    due , _sequence , operation = self._queue[0]
+                    delay = due - monotonic()
+                    if delay <= 0:
+                        heapq.heappop(self._queue)
+                        break
+                    self._cond.wait(delay)
+            if not operation.is_finished:
+                self._pool.submit(self._poll,operation)
+
+# The operation manager shared by all of the devices
+operations = OperationManager()
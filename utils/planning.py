@@ -0,0 +1,375 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# Night planning : which objects are visible from the site tonight
+# All of the objects are computed at once on a time grid , there is no loop over Dso objects
+# #################################################################
+
+from collections import OrderedDict
+from datetime import date as Date, datetime, timedelta, timezone
+import threading
+
+import numpy as np
+
+from utils.coordinates import altaz, j2000_to_jnow, julian_date, local_sidereal_time
+from utils.i18n import _
+from utils.lightlog import lightlog
+logger = lightlog(__name__)
+
+# Altitude of the sun at the astronomical dusk and dawn
+ASTRONOMICAL_TWILIGHT = -18.0
+# Objects computed in one broadcast , this limits the memory used by the (objects , times) grids
+CHUNK_SIZE = 2048
+# Number of nights kept in the cache
+CACHE_SIZE = 16
+
+# #################################################################
+# Basic astronomical functions , all of them accept numpy arrays
+# julian_date , local_sidereal_time and altaz are shared with utils.coordinates
+# #################################################################
+
+def sun_position(jd) -> tuple:
+    """
+        Low precision position of the sun (about 0.01 degree) , good enough for twilight
+        Args :
+            jd : float or np.ndarray # julian dates
+        Returns : (ra , dec) # degrees
+    """
+    n = np.asarray(jd,dtype=np.float64) - 2451545.0
+    l = np.mod(280.460 + 0.9856474 * n, 360.0)
+    g = np.radians(np.mod(357.528 + 0.9856003 * n, 360.0))
+    lam = np.radians(l + 1.915 * np.sin(g) + 0.020 * np.sin(2 * g))
+    eps = np.radians(23.439 - 0.0000004 * n)
+    ra = np.degrees(np.arctan2(np.cos(eps) * np.sin(lam), np.cos(lam)))
+    dec = np.degrees(np.arcsin(np.sin(eps) * np.sin(lam)))
+    return np.mod(ra, 360.0) , dec
+
+# #################################################################
+# Site and horizon
+# #################################################################
+
+class Site(object):
+    """
+        Observing site
+    """
+
+    def __init__(self, lat : float, lon : float, horizon = None) -> None:
+        """
+            Initialize a new site
+            Args :
+                lat : float # latitude in degrees , north is positive
+                lon : float # longitude in degrees , east is positive
+                horizon : list # optional horizon mask , [(az , alt) , ...] in degrees
+            Returns : None
+        """
+        if not -90 <= lat <= 90:
+            raise ValueError(_("Invalid latitude"))
+        if not -180 <= lon <= 360:
+            raise ValueError(_("Invalid longitude"))
+        self.lat = float(lat)
+        self.lon = float(lon)
+        if horizon:
+            points = sorted((float(az) % 360, float(alt)) for az , alt in horizon)
+            self.horizon = tuple(points)
+            self._horizon_az = np.array([p[0] for p in points])
+            self._horizon_alt = np.array([p[1] for p in points])
+        else:
+            self.horizon = ()
+            self._horizon_az = None
+            self._horizon_alt = None
+
+    def horizon_altitude(self, az : np.ndarray) -> np.ndarray:
+        """
+            Get the altitude of the horizon mask at the given azimuth
+            Args :
+                az : np.ndarray # azimuth in degrees
+            Returns : np.ndarray # altitude in degrees , 0 if there is no mask
+        """
+        if self._horizon_az is None:
+            return np.zeros_like(az)
+        return np.interp(az, self._horizon_az, self._horizon_alt, period=360.0)
+
+    def key(self) -> tuple:
+        """
+            Key of the site used by the caches
+        """
+        return (round(self.lat, 4), round(self.lon, 4), self.horizon)
+
+def night_window(site : Site, night : Date, twilight : float = ASTRONOMICAL_TWILIGHT) -> tuple:
+    """
+        Find the dusk and dawn of the night starting in the evening of the given date
+        Args :
+            site : Site
+            night : datetime.date # local date of the evening
+            twilight : float # altitude of the sun in degrees , default is astronomical twilight
+        Returns : (dusk , dawn) # unix timestamps , (None , None) if the sun never goes down enough
+    """
+    # Start from the local solar noon , then search the whole day with one minute step
+    noon = datetime(night.year, night.month, night.day, 12, tzinfo=timezone.utc) - timedelta(hours = site.lon / 15)
+    grid = noon.timestamp() + np.arange(0, 86400 + 60, 60, dtype=np.float64)
+    jd = julian_date(grid)
+    sun_ra , sun_dec = sun_position(jd)
+    sun_alt , _az = altaz(sun_ra, sun_dec, local_sidereal_time(jd, site.lon), site.lat)
+    dark = np.flatnonzero(sun_alt < twilight)
+    if dark.size == 0:
+        return None , None
+    return float(grid[dark[0]]) , float(grid[dark[-1]])
+
+# #################################################################
+# Catalog
+# #################################################################
+
+class Targets(object):
+    """
+        Columns of the objects to plan , stored as numpy arrays
+    """
+
+    def __init__(self, names : list, ra : np.ndarray, dec : np.ndarray, types : list = None, mag : np.ndarray = None) -> None:
+        """
+            Initialize a new targets container
+            Args :
+                names : list # names of the objects
+                ra : np.ndarray # right ascension in degrees
+                dec : np.ndarray # declination in degrees
+                types : list # type of the objects , optional
+                mag : np.ndarray # magnitude of the objects (nan if unknown) , optional
+            Returns : None
+        """
+        self.names = list(names)
+        self.ra = np.asarray(ra,dtype=np.float64)
+        self.dec = np.asarray(dec,dtype=np.float64)
+        self.types = list(types) if types is not None else [""] * len(self.names)
+        self.mag = np.asarray(mag,dtype=np.float64) if mag is not None else np.full(len(self.names), np.nan)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def from_dso(cls, objects : list) -> "Targets":
+        """
+            Build the targets from a list of pyongc Dso objects , objects without coordinates are skipped
+            Args :
+                objects : list # [Dso , ...]
+            Returns : Targets
+        """
+        objects = [obj for obj in objects if obj.rad_coords is not None]
+        return cls([obj.name for obj in objects],
+                    np.degrees([obj.rad_coords[0] for obj in objects]),
+                    np.degrees([obj.rad_coords[1] for obj in objects]),
+                    [obj.type for obj in objects],
+                    [_first_magnitude(obj.magnitudes) for obj in objects])
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def load_catalog() -> Targets:
+    """
+        Load all of the objects with coordinates from the OpenNGC database in one query.
+        The catalog is loaded only once.
+        Args : None
+        Returns : Targets
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            from libs.pyongc.ongc import DSO_TABLES, _queryFetchAll
+            rows = _queryFetchAll("objects.name, ra, dec, objTypes.typedesc, vmag, bmag",DSO_TABLES,
+                                    'ra IS NOT NULL AND dec IS NOT NULL AND objects.type != "Dup"')
+            _catalog = Targets([row[0] for row in rows],
+                                np.degrees([row[1] for row in rows]),
+                                np.degrees([row[2] for row in rows]),
+                                [row[3] for row in rows],
+                                [_first_magnitude(row[4:6]) for row in rows])
+            logger.log(_("Loaded {} objects for night planning").format(len(_catalog)))
+        return _catalog
+
+def _first_magnitude(magnitudes) -> float:
+    """
+        Return the first available magnitude or nan
+    """
+    for mag in magnitudes:
+        if mag is not None:
+            return mag
+    return np.nan
+
+# #################################################################
+# Planner
+# #################################################################
+
+class NightPlan(object):
+    """
+        Visibility of the targets during one night , every attribute is an array with one value per target
+    """
+
+    def __init__(self, targets : Targets, dusk : float, dawn : float, min_alt : float, step : float) -> None:
+        n = len(targets)
+        self.targets = targets
+        self.dusk = dusk
+        self.dawn = dawn
+        self.min_alt = min_alt
+        self.step = step
+        # Highest altitude reached between dusk and dawn
+        self.max_alt = np.full(n, np.nan)
+        # Time (unix timestamp) of the transit closest to the middle of the night and altitude at the transit
+        self.transit = np.full(n, np.nan)
+        self.transit_alt = np.full(n, np.nan)
+        # Minutes above the horizon mask and above min_alt
+        self.minutes_above = np.zeros(n)
+        # First and last time above the limit (unix timestamps , nan if never)
+        self.first_above = np.full(n, np.nan)
+        self.last_above = np.full(n, np.nan)
+
+    def visible(self, min_minutes : float = 0, limit : int = None, max_mag : float = None, types : list = None) -> list:
+        """
+            Get the objects visible at least min_minutes , the longest visible first
+            Args :
+                min_minutes : float # minimum time above the limit in minutes
+                limit : int # maximum number of objects returned
+                max_mag : float # only objects brighter than this magnitude
+                types : list # only these types of objects
+            Returns : list of dict
+        """
+        mask = self.minutes_above > max(min_minutes, 0)
+        if max_mag is not None:
+            mask &= self.targets.mag <= max_mag
+        if types:
+            mask &= np.isin(np.array(self.targets.types, dtype=object), types)
+        index = np.flatnonzero(mask)
+        # Sort by time above the limit , then by the transit altitude
+        index = index[np.lexsort((-self.transit_alt[index], -self.minutes_above[index]))]
+        if limit is not None:
+            index = index[:limit]
+        return [self.get(int(i)) for i in index]
+
+    def get(self, i : int) -> dict:
+        """
+            Get the visibility of one target as a JSON serializable dict
+            Args :
+                i : int # index of the target
+            Returns : dict
+        """
+        def _value(x):
+            return None if np.isnan(x) else float(x)
+        t = self.targets
+        return {
+            "name" : t.names[i],
+            "type" : t.types[i],
+            "ra" : float(t.ra[i]),
+            "dec" : float(t.dec[i]),
+            "mag" : _value(t.mag[i]),
+            "max_alt" : _value(self.max_alt[i]),
+            "transit" : _value(self.transit[i]),
+            "transit_alt" : _value(self.transit_alt[i]),
+            "minutes_above" : float(self.minutes_above[i]),
+            "first_above" : _value(self.first_above[i]),
+            "last_above" : _value(self.last_above[i])
+        }
+
+class NightPlanner(object):
+    """
+        Compute alt/az , transit and time above the horizon mask for many objects at once.
+        Plans are cached per site , night and parameters.
+    """
+
+    def __init__(self, cache_size : int = CACHE_SIZE) -> None:
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def plan(self, site : Site, night : Date, min_alt : float = 30.0, step : float = 5.0,
+                targets : Targets = None, twilight : float = ASTRONOMICAL_TWILIGHT) -> NightPlan:
+        """
+            Plan the night
+            Args :
+                site : Site
+                night : datetime.date # local date of the evening
+                min_alt : float # minimum altitude in degrees , the horizon mask is also applied
+                step : float # time step of the grid in minutes
+                targets : Targets # objects to plan , default is the whole OpenNGC catalog
+                twilight : float # altitude of the sun at dusk and dawn
+            Returns : NightPlan
+        """
+        if step <= 0:
+            raise ValueError(_("Invalid time step"))
+        if targets is None:
+            targets = load_catalog()
+        key = (site.key(), night.isoformat(), float(min_alt), float(step), float(twilight), id(targets))
+        with self._lock:
+            plan = self._cache.get(key)
+            if plan is not None and plan.targets is targets:
+                self._cache.move_to_end(key)
+                return plan
+        plan = self._compute(site, night, min_alt, step, targets, twilight)
+        with self._lock:
+            self._cache[key] = plan
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return plan
+
+    def clear(self) -> None:
+        """
+            Clear the cache , for example after the site was changed
+        """
+        with self._lock:
+            self._cache.clear()
+
+    def _compute(self, site : Site, night : Date, min_alt : float, step : float,
+                    targets : Targets, twilight : float) -> NightPlan:
+        """
+            Compute the plan without cache
+        """
+        dusk , dawn = night_window(site, night, twilight)
+        plan = NightPlan(targets, dusk, dawn, min_alt, step)
+        if dusk is None or len(targets) == 0:
+            return plan
+
+        times = np.arange(dusk, dawn + 1, step * 60.0, dtype=np.float64)
+        jd = julian_date(times)
+        lst = local_sidereal_time(jd, site.lon)
+
+        # The catalog is J2000 , move every object to the equinox of the night in one rotation
+        middle = (dusk + dawn) / 2
+        ra , dec = j2000_to_jnow(targets.ra, targets.dec, julian_date(middle))
+
+        # Transit is computed analytically from the hour angle at the middle of the night
+        lst_middle = local_sidereal_time(julian_date(middle), site.lon)
+        ha = np.mod(lst_middle - ra + 180.0, 360.0) - 180.0
+        plan.transit[:] = middle - ha / (15.0 * 1.00273790935) * 3600.0
+        plan.transit_alt[:] = 90.0 - np.abs(site.lat - dec)
+
+        for start in range(0, len(targets), CHUNK_SIZE):
+            end = min(start + CHUNK_SIZE, len(targets))
+            alt , az = altaz(ra[start:end, None], dec[start:end, None], lst[None, :], site.lat)
+            limit = np.maximum(site.horizon_altitude(az), min_alt)
+            above = alt >= limit
+            count = above.sum(axis=1)
+            plan.max_alt[start:end] = alt.max(axis=1)
+            plan.minutes_above[start:end] = count * step
+            seen = count > 0
+            first = np.argmax(above, axis=1)
+            last = above.shape[1] - 1 - np.argmax(above[:, ::-1], axis=1)
+            plan.first_above[start:end] = np.where(seen, times[first], np.nan)
+            plan.last_above[start:end] = np.where(seen, times[last], np.nan)
+        logger.logd(_("Planned {} objects on {} time steps").format(len(targets), len(times)))
+        return plan
+
+# The planner shared by the web server
+planner = NightPlanner()
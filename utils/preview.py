@@ -0,0 +1,361 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# Previews of the camera frames.
+# A raw frame is debayered (superpixel when the preview is at most half
+# of the sensor , bilinear otherwise) , binned to the display size ,
+# stretched with a midtones transfer function and encoded. All of the
+# steps are numpy array operations , most of them on the binned image.
+# JPEG and WebP need Pillow , without it the preview is a PNG written
+# with zlib. The previews are made in a small thread pool , numpy
+# releases the GIL , and the encoded bytes of the last frames are cached
+# so every client asking for the same preview gets it at once.
+# #################################################################
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import struct
+import threading
+from time import perf_counter
+import zlib
+
+import numpy as np
+
+from utils.i18n import _
+from utils.lightlog import lightlog
+log = lightlog(__name__)
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Longest side of a preview
+MAX_SIZE = 1024
+JPEG_QUALITY = 85
+# Background level of the stretched image and the shadows clipping , in MAD
+TARGET_BACKGROUND = 0.25
+SHADOWS_CLIP = -2.8
+# Pixels per channel used for the statistics of the stretch
+SAMPLE_SIZE = 250000
+# Encoded previews kept in the cache
+CACHE_SIZE = 16
+
+# Position of the red pixel in the 2x2 cell of every pattern
+PATTERNS = {"RGGB" : (0,0), "GRBG" : (0,1), "GBRG" : (1,0), "BGGR" : (1,1)}
+
+def bayer_pattern(sensor_type : str, offset_x : int = 0, offset_y : int = 0) -> str:
+    """
+        Bayer pattern of the frames of a camera | 拜耳阵列
+        Args :
+            sensor_type : str # sensor type of the camera , e.g. rggb or monochrome
+            offset_x , offset_y : int # BayerOffsetX/Y of ASCOM , the first pixel of the frame in the RGGB cell
+        Returns : str # RGGB , GRBG , GBRG or BGGR , None if the frames are not a bayer mosaic
+    """
+    if not sensor_type or str(sensor_type).upper() != "RGGB":
+        return None
+    # The red pixel moves the other way when the frame starts further in the cell
+    return {(0,0) : "RGGB", (1,0) : "GRBG", (0,1) : "GBRG", (1,1) : "BGGR"}[(int(offset_x or 0) % 2,int(offset_y or 0) % 2)]
+
+# #################################################################
+# Debayer
+# #################################################################
+
+def _planes(raw : np.ndarray, pattern : str) -> tuple:
+    """Offsets (row , column) of the red , the two green and the blue pixels in the 2x2 cell"""
+    if pattern not in PATTERNS:
+        raise ValueError(_("Unknown bayer pattern {}").format(pattern))
+    ry , rx = PATTERNS[pattern]
+    return (ry,rx) , (ry,1 - rx) , (1 - ry,rx) , (1 - ry,1 - rx)
+
+def debayer_superpixel(raw : np.ndarray, pattern : str, factor : int = 1) -> np.ndarray:
+    """
+        One RGB pixel per 2x2 cell , half of the resolution and no interpolation
+        Args :
+            raw : np.ndarray # (h,w) bayer mosaic
+            pattern : str # see PATTERNS
+            factor : int # the cells are also binned by this factor , in the same pass
+        Returns : np.ndarray # (h/2/factor,w/2/factor,3) float32
+    """
+    (ry,rx) , (g1y,g1x) , (g2y,g2x) , (by,bx) = _planes(raw,pattern)
+    h , w = raw.shape[0] // 2 * 2 , raw.shape[1] // 2 * 2
+    red = bin_image(raw[ry:h:2,rx:w:2],factor)
+    green = bin_image(raw[g1y:h:2,g1x:w:2],factor)
+    green += bin_image(raw[g2y:h:2,g2x:w:2],factor)
+    green *= 0.5
+    blue = bin_image(raw[by:h:2,bx:w:2],factor)
+    return np.stack((red,green,blue),axis=2)
+
+def debayer_bilinear(raw : np.ndarray, pattern : str) -> np.ndarray:
+    """
+        Full resolution RGB , the missing colours are the mean of the nearest pixels of that colour
+        Args :
+            raw : np.ndarray # (h,w) bayer mosaic
+            pattern : str # see PATTERNS
+        Returns : np.ndarray # (h,w,3) float32
+    """
+    (ry,rx) , (g1y,g1x) , (g2y,g2x) , (by,bx) = _planes(raw,pattern)
+    h , w = raw.shape
+    padded = np.pad(raw.astype(np.float32,copy=False),1,mode="reflect")
+    out = np.empty((h,w,3),dtype=np.float32)
+
+    def shifted(dy : int, dx : int) -> np.ndarray:
+        return padded[1 + dy:1 + dy + h,1 + dx:1 + dx + w]
+
+    # Sums of the neighbours , every missing colour is one of them
+    cross = shifted(-1,0) + shifted(1,0) + shifted(0,-1) + shifted(0,1)
+    diagonal = shifted(-1,-1) + shifted(-1,1) + shifted(1,-1) + shifted(1,1)
+    vertical = shifted(-1,0) + shifted(1,0)
+    horizontal = shifted(0,-1) + shifted(0,1)
+    center = shifted(0,0)
+    for channel , (cy,cx) in ((0,(ry,rx)),(2,(by,bx))):
+        plane = out[...,channel]
+        # On its own pixels , at the diagonal of the opposite colour , and on the greens of its row or column
+        plane[cy::2,cx::2] = center[cy::2,cx::2]
+        plane[1 - cy::2,1 - cx::2] = diagonal[1 - cy::2,1 - cx::2] * 0.25
+        plane[cy::2,1 - cx::2] = horizontal[cy::2,1 - cx::2] * 0.5
+        plane[1 - cy::2,cx::2] = vertical[1 - cy::2,cx::2] * 0.5
+    green = out[...,1]
+    green[...] = cross * 0.25
+    green[g1y::2,g1x::2] = center[g1y::2,g1x::2]
+    green[g2y::2,g2x::2] = center[g2y::2,g2x::2]
+    return out
+
+# #################################################################
+# Size and stretch
+# #################################################################
+
+def bin_image(image : np.ndarray, factor : int) -> np.ndarray:
+    """
+        Mean of factor x factor blocks , the last rows and columns which do not fill a block are dropped
+        Args :
+            image : np.ndarray # (h,w) or (h,w,c)
+            factor : int
+        Returns : np.ndarray # float32
+    """
+    if factor <= 1:
+        return image.astype(np.float32,copy=False)
+    h , w = image.shape[0] // factor , image.shape[1] // factor
+    out = np.zeros((h,w) + image.shape[2:],dtype=np.float32)
+    # factor^2 additions of strided views are much faster than a reshaped mean
+    for i in range(factor):
+        for j in range(factor):
+            out += image[i:h * factor:factor,j:w * factor:factor]
+    out *= np.float32(1.0 / (factor * factor))
+    return out
+
+def _mtf(midtones : float, x : np.ndarray) -> np.ndarray:
+    """Midtones transfer function , maps midtones to 0.5 and keeps 0 and 1"""
+    return (midtones - 1) * x / ((2 * midtones - 1) * x - midtones)
+
+def auto_stretch(image : np.ndarray, linked : bool = False, target : float = TARGET_BACKGROUND,
+                    shadows : float = SHADOWS_CLIP) -> np.ndarray:
+    """
+        Stretch a linear image so that its background is at the target level | 自动拉伸
+        Args :
+            image : np.ndarray # (h,w) or (h,w,c)
+            linked : bool # same stretch for all of the channels , False also balances the background colour
+            target : float # background level in [0,1]
+            shadows : float # black point , in MAD from the median
+        Returns : np.ndarray # uint8 of the same shape
+    """
+    data = image.astype(np.float32,copy=False)
+    channels = data if data.ndim == 3 else data[...,None]
+    # The statistics of a sample are enough and much faster on a large frame
+    pixels = channels.shape[0] * channels.shape[1]
+    step = max(1,-(-pixels // SAMPLE_SIZE))
+    # One contiguous row per channel for the partitions of the medians
+    sample = np.ascontiguousarray(channels.reshape(pixels,-1)[::step].T)
+    low = sample.min(axis=1)
+    high = sample.max(axis=1)
+    if linked:
+        low , high = np.full_like(low,low.min()) , np.full_like(high,high.max())
+    scale = np.where(high > low,high - low,1).astype(np.float32)
+    normalized = (sample - low[:,None]) / scale[:,None]
+    median = np.median(normalized,axis=1)
+    mad = np.median(np.abs(normalized - median[:,None]),axis=1) * 1.4826
+    if linked:
+        median , mad = np.full_like(median,median.mean()) , np.full_like(mad,mad.mean())
+    black = np.clip(median + shadows * mad,0,1)
+    # Midtones which bring the median to the target after the black point
+    x = np.clip((median - black) / np.maximum(1 - black,1e-6),1e-6,1)
+    midtones = _mtf(target,x)
+    # Broadcast over the last axis and in place , a loop over strided channels is several times slower
+    offset = (low + black * scale).astype(np.float32)
+    gain = (1 / np.maximum(scale * (1 - black),1e-12)).astype(np.float32)
+    plane = channels - offset
+    plane *= gain
+    np.clip(plane,0,1,out=plane)
+    # mtf(m,x) = (m - 1) x / ((2m - 1) x - m) , scaled to 255 with the rounding offset
+    denominator = plane * (2 * midtones - 1).astype(np.float32)
+    denominator -= midtones.astype(np.float32)
+    plane *= ((midtones - 1) * 255).astype(np.float32)
+    plane /= denominator
+    plane += 0.5
+    out = plane.astype(np.uint8)
+    return out if data.ndim == 3 else out[...,0]
+
+# #################################################################
+# Encoding
+# #################################################################
+
+def encode_png(image : np.ndarray, level : int = 6) -> bytes:
+    """
+        PNG of an 8 bit image , only zlib is needed
+        Args :
+            image : np.ndarray # (h,w) gray or (h,w,3) RGB , uint8
+            level : int # zlib compression level
+        Returns : bytes
+    """
+    h , w = image.shape[:2]
+    color = 2 if image.ndim == 3 else 0
+    # Every row starts with its filter type , 0 is none
+    rows = np.zeros((h,1 + w * (3 if color else 1)),dtype=np.uint8)
+    rows[:,1:] = image.reshape(h,-1)
+
+    def chunk(kind : bytes, data : bytes) -> bytes:
+        return struct.pack(">I",len(data)) + kind + data + struct.pack(">I",zlib.crc32(kind + data) & 0xffffffff)
+
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR",struct.pack(">IIBBBBB",w,h,8,color,0,0,0)) \
+        + chunk(b"IDAT",zlib.compress(rows.tobytes(),level)) + chunk(b"IEND",b"")
+
+def encode(image : np.ndarray, fmt : str = "jpeg", quality : int = JPEG_QUALITY) -> tuple:
+    """
+        Encode an 8 bit image
+        Args :
+            image : np.ndarray # uint8
+            fmt : str # jpeg , webp or png
+            quality : int # for jpeg and webp
+        Returns : (bytes , str) # data and the format really used , png without Pillow
+    """
+    fmt = (fmt or "jpeg").lower()
+    if fmt in ("jpeg","jpg","webp") and Image is not None:
+        from io import BytesIO
+        buffer = BytesIO()
+        Image.fromarray(image).save(buffer,format="JPEG" if fmt != "webp" else "WEBP",quality=int(quality))
+        return buffer.getvalue() , "jpeg" if fmt != "webp" else "webp"
+    return encode_png(image) , "png"
+
+# #################################################################
+# Preview
+# #################################################################
+
+def make_preview(image : np.ndarray, pattern : str = None, max_size : int = MAX_SIZE, fmt : str = "jpeg",
+                    quality : int = JPEG_QUALITY, linked : bool = False, debayer : str = None) -> dict:
+    """
+        Make the preview of a frame | 生成预览
+        Args :
+            image : np.ndarray # raw frame (h,w) , or (h,w,c)
+            pattern : str # bayer pattern of a raw colour frame , None for mono
+            max_size : int # longest side of the preview
+            fmt : str # jpeg , webp or png
+            quality : int
+            linked : bool # see auto_stretch
+            debayer : str # superpixel or bilinear , None to choose from the size
+        Returns : dict
+            data : bytes
+            format : str
+            width , height : int
+            time : dict # milliseconds of every step
+    """
+    started = perf_counter()
+    longest = max(image.shape[:2])
+    max_size = max(int(max_size),1)
+    data = image
+    factor = max(1,-(-longest // max_size))
+    if pattern is not None and image.ndim == 2:
+        if debayer is None:
+            debayer = "superpixel" if max_size * 2 <= longest else "bilinear"
+        if debayer == "superpixel":
+            # Debayered and binned at once , straight from the mosaic
+            factor = max(1,-(-longest // 2 // max_size))
+            data = debayer_superpixel(image,pattern,factor)
+            factor = 1
+        else:
+            data = debayer_bilinear(image,pattern)
+    debayered = perf_counter()
+    data = bin_image(data,factor)
+    binned = perf_counter()
+    stretched = auto_stretch(data,linked)
+    stretch_time = perf_counter()
+    encoded , fmt = encode(stretched,fmt,quality)
+    finished = perf_counter()
+    return {
+        "data" : encoded,
+        "format" : fmt,
+        "width" : int(stretched.shape[1]),
+        "height" : int(stretched.shape[0]),
+        "time" : {
+            "debayer" : round((debayered - started) * 1000,2),
+            "bin" : round((binned - debayered) * 1000,2),
+            "stretch" : round((stretch_time - binned) * 1000,2),
+            "encode" : round((finished - stretch_time) * 1000,2),
+            "total" : round((finished - started) * 1000,2)
+        }
+    }
+
+class PreviewGenerator(object):
+    """
+        Make the previews in a thread pool and cache them per frame
+    """
+
+    def __init__(self, workers : int = 2, cache_size : int = CACHE_SIZE) -> None:
+        self._pool = ThreadPoolExecutor(workers,thread_name_prefix="preview")
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def submit(self, frame_id, image : np.ndarray, **options) -> Future:
+        """
+            Get the preview of a frame , made once per frame and options
+            Args :
+                frame_id : any hashable # e.g. the number of the exposure
+                image : np.ndarray
+                options : see make_preview
+            Returns : Future # its result is the dict of make_preview
+        """
+        key = (frame_id,tuple(sorted(options.items())))
+        with self._lock:
+            future = self._cache.get(key)
+            if future is not None:
+                self._cache.move_to_end(key)
+                return future
+            future = self._pool.submit(make_preview,image,**options)
+            self._cache[key] = future
+            # A failed preview is made again the next time
+            future.add_done_callback(lambda done: done.exception() is not None and self._drop(key,done))
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return future
+
+    def _drop(self, key, future : Future) -> None:
+        with self._lock:
+            if self._cache.get(key) is future:
+                del self._cache[key]
+
+    def forget(self, frame_id) -> None:
+        """Drop the previews of a frame"""
+        with self._lock:
+            for key in [key for key in self._cache if key[0] == frame_id]:
+                del self._cache[key]
+
+# The preview generator shared by all of the cameras
+previews = PreviewGenerator()
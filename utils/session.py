@@ -0,0 +1,364 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# Session engine
+# A session is a DAG of steps , a step starts as soon as all of the
+# steps it requires are finished , so independent steps like cooling
+# the camera and slewing the mount run at the same time.
+# Every step has its own timeout and the start and end time of the
+# steps are kept as a timing trace.
+# #################################################################
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import threading
+from time import monotonic, time
+
+from utils.i18n import _
+from utils.lightlog import lightlog
+log = lightlog(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+TIMEOUT = "timeout"
+SKIPPED = "skipped"
+ABORTED = "aborted"
+
+FINISHED = (DONE,FAILED,TIMEOUT,SKIPPED,ABORTED)
+
+class SessionError(Exception):
+    """Invalid session , e.g. unknown requirement or a cycle"""
+
+class StepTimeout(Exception):
+    """The step is over its timeout"""
+
+class SessionAborted(Exception):
+    """The session is aborted"""
+
+class StepContext(object):
+    """
+        Passed to the action of a step
+    """
+
+    def __init__(self, step, session) -> None:
+        self.step = step
+        self.session = session
+        self.params = step.params
+        self.deadline = monotonic() + step.timeout if step.timeout else None
+        self.cancelled = threading.Event()
+
+    def result(self, name : str):
+        """
+            Get the result of a finished step
+            Args :
+                name : str
+            Returns : any
+        """
+        return self.session.steps[name].result
+
+    def check(self) -> None:
+        """
+            Raise if the step should stop now , long actions should call this often
+            Args : None
+            Returns : None
+        """
+        if self.session.aborted.is_set():
+            raise SessionAborted(_("Session is aborted"))
+        if self.cancelled.is_set() or (self.deadline is not None and monotonic() >= self.deadline):
+            raise StepTimeout(_("Step {} is timeout").format(self.step.name))
+
+    def wait(self, seconds : float) -> None:
+        """
+            Sleep , but wake up at once if the session is aborted or the step is timeout
+            Args :
+                seconds : float
+            Returns : None
+        """
+        if self.deadline is not None:
+            seconds = min(seconds,max(self.deadline - monotonic(),0))
+        self.session.aborted.wait(seconds)
+        self.check()
+
+    def wait_until(self, condition, interval : float = 0.5) -> None:
+        """
+            Poll the condition until it is true
+            Args :
+                condition : callable # -> bool
+                interval : float # seconds between two polls
+            Returns : None
+        """
+        self.check()
+        while not condition():
+            self.wait(interval)
+
+class Step(object):
+    """
+        A step of a session
+    """
+
+    def __init__(self, name : str, action, params : dict = None, requires = (), timeout : float = None) -> None:
+        """
+            Args :
+                name : str # unique in the session
+                action : callable # called with a StepContext , the return value is the result
+                params : dict
+                requires : list # names of the steps which must be done before
+                timeout : float # seconds , None for no timeout
+        """
+        self.name = name
+        self.action = action
+        self.params = params or {}
+        self.requires = tuple(requires)
+        self.timeout = timeout
+
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.start_time = None
+        self.end_time = None
+        self.context = None
+
+    def get_dict(self, origin : float = 0) -> dict:
+        return {
+            "name" : self.name,
+            "status" : self.status,
+            "requires" : list(self.requires),
+            "start" : self.start_time - origin if self.start_time is not None else None,
+            "end" : self.end_time - origin if self.end_time is not None else None,
+            "duration" : self.end_time - self.start_time if self.end_time is not None and self.start_time is not None else None,
+            "error" : self.error,
+        }
+
+class Session(object):
+    """
+        Run the steps of a DAG with as much concurrency as the requirements allow
+    """
+
+    def __init__(self, name : str, steps : list, max_workers : int = 4, on_event = None) -> None:
+        """
+            Args :
+                name : str
+                steps : list # list of Step
+                max_workers : int # number of steps running at the same time
+                on_event : callable # called with (session , step) when a step starts or finishes
+        """
+        self.name = name
+        self.steps = {}
+        for step in steps:
+            if step.name in self.steps:
+                raise SessionError(_("Duplicate step {}").format(step.name))
+            self.steps[step.name] = step
+        self.max_workers = max_workers
+        self.on_event = on_event
+
+        self.aborted = threading.Event()
+        self.start_time = None
+        self.end_time = None
+        self.wall_start = None
+        self._thread = None
+
+        self.validate()
+
+    def validate(self) -> list:
+        """
+            Check the requirements and get the topological order
+            Args : None
+            Returns : list # names of the steps
+            Raises : SessionError
+        """
+        remaining = {}
+        for step in self.steps.values():
+            for name in step.requires:
+                if name not in self.steps:
+                    raise SessionError(_("Step {} requires unknown step {}").format(step.name,name))
+            remaining[step.name] = len(set(step.requires))
+        order = [name for name,count in remaining.items() if count == 0]
+        for name in order:
+            for step in self.steps.values():
+                if name in step.requires:
+                    remaining[step.name] -= 1
+                    if remaining[step.name] == 0:
+                        order.append(step.name)
+        if len(order) != len(self.steps):
+            raise SessionError(_("Steps {} form a cycle").format(sorted(set(self.steps) - set(order))))
+        return order
+
+    @property
+    def is_running(self) -> bool:
+        return self.start_time is not None and self.end_time is None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.end_time is not None
+
+    @property
+    def status(self) -> str:
+        if self.start_time is None:
+            return PENDING
+        if self.end_time is None:
+            return RUNNING
+        if self.aborted.is_set():
+            return ABORTED
+        if all(step.status == DONE for step in self.steps.values()):
+            return DONE
+        return FAILED
+
+    def _emit(self, step) -> None:
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(self,step)
+        except Exception as e:
+            log.loge(_("Session event callback failed : {}").format(str(e)))
+
+    def _run_step(self, step):
+        context = step.context
+        context.check()
+        return step.action(context)
+
+    def _finish(self, step, status : str, error : str = None) -> None:
+        step.status = status
+        step.error = error
+        step.end_time = monotonic()
+        if status != DONE:
+            log.logw(_("Step {} of session {} is {} : {}").format(step.name,self.name,status,error))
+        self._emit(step)
+
+    def _skip_blocked(self) -> None:
+        """Skip the steps whose requirements can never be done"""
+        changed = True
+        while changed:
+            changed = False
+            for step in self.steps.values():
+                if step.status != PENDING:
+                    continue
+                failed = [name for name in step.requires if self.steps[name].status in FINISHED and self.steps[name].status != DONE]
+                if failed:
+                    step.start_time = step.end_time = monotonic()
+                    self._finish(step,SKIPPED,_("Required step {} is not done").format(",".join(failed)))
+                    changed = True
+
+    def run(self) -> str:
+        """
+            Run the session and block until all of the steps are finished
+            Args : None
+            Returns : str # status of the session
+        """
+        self.start_time = monotonic()
+        self.wall_start = time()
+        log.log(_("Session {} started with {} steps").format(self.name,len(self.steps)))
+        executor = ThreadPoolExecutor(max_workers=self.max_workers,thread_name_prefix="session-{}".format(self.name))
+        running = {}
+        try:
+            while True:
+                if self.aborted.is_set():
+                    for step in self.steps.values():
+                        if step.status == PENDING:
+                            step.start_time = monotonic()
+                            self._finish(step,ABORTED,_("Session is aborted"))
+                # Start every step whose requirements are done
+                if not self.aborted.is_set():
+                    for step in self.steps.values():
+                        if step.status == PENDING and all(self.steps[name].status == DONE for name in step.requires):
+                            step.status = RUNNING
+                            step.start_time = monotonic()
+                            step.context = StepContext(step,self)
+                            running[executor.submit(self._run_step,step)] = step
+                            self._emit(step)
+                if not running:
+                    break
+                # Wake up for the first finished step or the nearest deadline
+                deadlines = [step.context.deadline for step in running.values() if step.context.deadline is not None]
+                timeout = max(min(deadlines) - monotonic(),0) if deadlines else None
+                done,_pending = wait(running,timeout=timeout,return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    if step.status != RUNNING:
+                        continue
+                    try:
+                        step.result = future.result()
+                        self._finish(step,DONE)
+                    except StepTimeout as e:
+                        self._finish(step,TIMEOUT,str(e))
+                    except SessionAborted as e:
+                        self._finish(step,ABORTED,str(e))
+                    except Exception as e:
+                        self._finish(step,FAILED,str(e))
+                # The action may be stuck in a device call , do not wait for it
+                now = monotonic()
+                for future,step in list(running.items()):
+                    if step.context.deadline is not None and now >= step.context.deadline:
+                        step.context.cancelled.set()
+                        running.pop(future)
+                        self._finish(step,TIMEOUT,_("Step {} is timeout").format(step.name))
+                self._skip_blocked()
+        finally:
+            executor.shutdown(wait=False)
+            self.end_time = monotonic()
+        log.log(_("Session {} finished in {:.3f}s , status {}").format(self.name,self.end_time - self.start_time,self.status))
+        return self.status
+
+    def start(self) -> None:
+        """
+            Run the session in a background thread
+            Args : None
+            Returns : None
+        """
+        self._thread = threading.Thread(target=self.run,name="session-{}".format(self.name),daemon=True)
+        self._thread.start()
+
+    def abort(self) -> None:
+        """
+            Abort the session , the running steps stop at their next check
+            Args : None
+            Returns : None
+        """
+        self.aborted.set()
+
+    def join(self, timeout : float = None) -> None:
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def get_trace(self) -> dict:
+        """
+            Get the timing trace of the session
+            Args : None
+            Returns : dict
+                steps : list # start and end are seconds since the session started
+                total : float # wall time of the session
+                serial : float # time if the steps were run one by one
+                saved : float # serial - total
+        """
+        origin = self.start_time or 0
+        steps = [step.get_dict(origin) for step in self.steps.values()]
+        end = self.end_time if self.end_time is not None else monotonic()
+        total = end - self.start_time if self.start_time is not None else 0
+        serial = sum(step["duration"] or 0 for step in steps)
+        return {
+            "name" : self.name,
+            "status" : self.status,
+            "started_at" : self.wall_start,
+            "steps" : steps,
+            "total" : total,
+            "serial" : serial,
+            "saved" : max(serial - total,0),
+        }
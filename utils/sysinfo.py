@@ -0,0 +1,204 @@
+# coding=utf-8
+
+"""
+
+Copyright(c) 2022-2023 Max Qian  <astroair.cn>
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Library General Public
+License version 3 as published by the Free Software Foundation.
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Library General Public License for more details.
+You should have received a copy of the GNU Library General Public License
+along with this library; see the file COPYING.LIB.  If not, write to
+the Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+Boston, MA 02110-1301, USA.
+
+"""
+
+# #################################################################
+# Background sampler of the system status.
+# The web pages only read the latest samples from memory , so opening
+# the system page does not walk every process again.
+# #################################################################
+
+from collections import deque
+import threading
+import time
+
+import psutil
+
+from utils.lightlog import lightlog
+log = lightlog(__name__)
+
+PROCESS_ATTRS = ["pid","name","username","status","create_time","cpu_percent","memory_percent","memory_info"]
+
+class SystemSampler(object):
+    """
+        Collect the CPU , memory , disk and process status at a fixed cadence
+    """
+
+    def __init__(self, interval : float = 2, history : int = 300, top : int = 50,
+                    process_every : int = 5, disk_every : int = 30) -> None:
+        """
+            Args :
+                interval : float # seconds between two samples of CPU and memory
+                history : int # number of the samples kept in the ring buffer
+                top : int # number of the processes kept , sorted by CPU usage
+                process_every : int # sample the processes every N intervals
+                disk_every : int # sample the disks every N intervals
+        """
+        self.interval = interval
+        self.top = top
+        self.process_every = process_every
+        self.disk_every = disk_every
+
+        self._lock = threading.Lock()
+        # Held by start until the first samples are taken
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._ticks = 0
+
+        self._times = deque(maxlen=history)
+        self._cpu = deque(maxlen=history)
+        self._memory = deque(maxlen=history)
+        self.cpu_percent = 0.0
+        self.memory = None
+        self.disks = []
+        self.processes = []
+
+    def start(self) -> None:
+        """
+            Start the sampler thread if it is not running , the first sample is taken now
+            Args : None
+            Returns : None
+        """
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            # The first cpu_percent call only sets the reference point
+            psutil.cpu_percent(None)
+            # A caller seeing the thread alive must also see the first samples
+            self.sample_memory()
+            self.sample_disks()
+            self.sample_processes()
+            self._thread = threading.Thread(target=self._run,name="system-sampler",daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+            Stop the sampler thread
+            Args : None
+            Returns : None
+        """
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._ticks += 1
+            try:
+                self.sample_cpu()
+                self.sample_memory()
+                if self._ticks % self.disk_every == 0:
+                    self.sample_disks()
+                if self._ticks % self.process_every == 0:
+                    self.sample_processes()
+            except Exception as e:
+                log.loge("Failed to sample the system status : {}".format(str(e)))
+
+    def sample_cpu(self) -> None:
+        """Record the CPU usage since the last sample"""
+        cpu = psutil.cpu_percent(None)
+        with self._lock:
+            self.cpu_percent = cpu
+            self._times.append(time.time())
+            self._cpu.append(cpu)
+            self._memory.append(self.memory.percent if self.memory else 0.0)
+
+    def sample_memory(self) -> None:
+        memory = psutil.virtual_memory()
+        with self._lock:
+            self.memory = memory
+            if self._memory:
+                self._memory[-1] = memory.percent
+
+    def sample_disks(self) -> None:
+        disks = []
+        for partition in psutil.disk_partitions():
+            try:
+                usage = psutil.disk_usage(partition.mountpoint)
+            except OSError:
+                continue
+            disks.append({
+                'device': partition.device,
+                'mount_point': partition.mountpoint,
+                'type': partition.fstype,
+                'options': partition.opts,
+                'space_total': usage.total,
+                'space_used': usage.used,
+                'used_percent': usage.percent,
+                'space_free': usage.free
+            })
+        with self._lock:
+            self.disks = disks
+
+    def sample_processes(self) -> None:
+        """
+            Read the processes with a single pass , process_iter keeps the Process objects
+            between the calls so cpu_percent is measured since the previous sample
+        """
+        processes = []
+        for p in psutil.process_iter(attrs=PROCESS_ATTRS,ad_value=None):
+            info = p.info
+            memory_info = info["memory_info"]
+            processes.append({
+                'name': info["name"],
+                'pid': info["pid"],
+                'username': info["username"],
+                'cpu': info["cpu_percent"] or 0.0,
+                'memory': info["memory_percent"] or 0.0,
+                'memory_rss': memory_info.rss if memory_info else 0,
+                'memory_vms': memory_info.vms if memory_info else 0,
+                'status': info["status"],
+                'created_time': info["create_time"],
+            })
+        processes.sort(key=lambda proc: proc['cpu'],reverse=True)
+        with self._lock:
+            self.processes = processes[:self.top]
+
+    def snapshot(self) -> dict:
+        """
+            Get the latest samples
+            Args : None
+            Returns : dict
+        """
+        self.start()
+        with self._lock:
+            return {
+                "cpu": self.cpu_percent,
+                "memory": self.memory,
+                "disks": list(self.disks),
+                "processes": list(self.processes),
+            }
+
+    def history(self, seconds : float = None) -> dict:
+        """
+            Get the history of the CPU and memory usage
+            Args :
+                seconds : float # only the samples of the last N seconds , None for all
+            Returns : dict # {"time" : [...] , "cpu" : [...] , "memory" : [...]}
+        """
+        self.start()
+        with self._lock:
+            times,cpu,memory = list(self._times),list(self._cpu),list(self._memory)
+        if seconds is not None:
+            begin = time.time() - seconds
+            index = next((i for i,t in enumerate(times) if t >= begin),len(times))
+            times,cpu,memory = times[index:],cpu[index:],memory[index:]
+        return {"time": times,"cpu": cpu,"memory": memory}
+
+sampler = SystemSampler()